@@ -131,3 +131,126 @@ OPENSEARCH_HOST = 'opensearch'
 OPENSEARCH_PORT = 9200
 OPENSEARCH_USERNAME = 'admin'
 OPENSEARCH_PASSWORD = os.environ.get('OPENSEARCH_INITIAL_ADMIN_PASSWORD')
+OPENSEARCH_TIMEOUT = 30
+# ベンチマーク用のローカルサーバー（geodistance.fake_opensearch）などHTTPで接続する場合はfalse
+OPENSEARCH_USE_SSL = os.environ.get('OPENSEARCH_USE_SSL', 'true').lower() == 'true'
+# プロセス内で共有するOpenSearchクライアントのkeep-aliveコネクション数（ホストごと）
+OPENSEARCH_POOL_MAXSIZE = int(os.environ.get('OPENSEARCH_POOL_MAXSIZE', 10))
+# リクエスト・レスポンスのJSONのエンコード・デコード（auto: orjsonがあればorjson, json, orjson）
+OPENSEARCH_JSON_SERIALIZER = os.environ.get('OPENSEARCH_JSON_SERIALIZER', 'auto')
+# 複数ノードに接続する場合のノード一覧（"node1:9200,node2:9200"の形式。空の場合はOPENSEARCH_HOST/OPENSEARCH_PORT）
+OPENSEARCH_HOSTS = [
+    {'host': host, 'port': int(port)}
+    for host, port in (
+        item.strip().rsplit(':', 1) for item in os.environ.get('OPENSEARCH_HOSTS', '').split(',') if item.strip()
+    )
+]
+# ノードの選択方法（round_robin, random, least_outstanding）
+OPENSEARCH_NODE_SELECTOR = os.environ.get('OPENSEARCH_NODE_SELECTOR', 'least_outstanding')
+# 失敗したノードを振り分けから外す秒数（連続した失敗ごとに倍、最大でOPENSEARCH_DEAD_TIMEOUT_CUTOFF回まで倍にする）
+OPENSEARCH_DEAD_TIMEOUT = float(os.environ.get('OPENSEARCH_DEAD_TIMEOUT', 60))
+OPENSEARCH_DEAD_TIMEOUT_CUTOFF = int(os.environ.get('OPENSEARCH_DEAD_TIMEOUT_CUTOFF', 5))
+# ノードのスニッフィング: 起動時、接続失敗時、定期的（秒、0で無効）に行うかどうかと、スニッフィングのタイムアウト（秒）
+OPENSEARCH_SNIFF_ON_START = os.environ.get('OPENSEARCH_SNIFF_ON_START', 'false').lower() == 'true'
+OPENSEARCH_SNIFF_ON_CONNECTION_FAIL = os.environ.get('OPENSEARCH_SNIFF_ON_CONNECTION_FAIL', 'false').lower() == 'true'
+OPENSEARCH_SNIFFER_INTERVAL = float(os.environ.get('OPENSEARCH_SNIFFER_INTERVAL', 0))
+OPENSEARCH_SNIFF_TIMEOUT = float(os.environ.get('OPENSEARCH_SNIFF_TIMEOUT', 0.5))
+# OpenSearch呼び出しの期限（秒、再試行を含む）。APIごとの期限は "search=2,bulk=30" の形式で上書きする
+GEO_DISTANCE_OPENSEARCH_DEADLINE = float(os.environ.get('GEO_DISTANCE_OPENSEARCH_DEADLINE', 5.0))
+GEO_DISTANCE_OPENSEARCH_DEADLINES = {
+    api: float(seconds)
+    for api, seconds in (
+        item.split('=', 1)
+        for item in os.environ.get(
+            'GEO_DISTANCE_OPENSEARCH_DEADLINES', 'bulk=30,delete_by_query=30,indices.refresh=30'
+        ).split(',')
+        if item
+    )
+}
+# 冪等な呼び出しの試行回数（初回を含む）と、ジッター付きバックオフの基準・上限（秒）
+GEO_DISTANCE_RETRY_ATTEMPTS = int(os.environ.get('GEO_DISTANCE_RETRY_ATTEMPTS', 3))
+GEO_DISTANCE_RETRY_BASE_DELAY = float(os.environ.get('GEO_DISTANCE_RETRY_BASE_DELAY', 0.05))
+GEO_DISTANCE_RETRY_MAX_DELAY = float(os.environ.get('GEO_DISTANCE_RETRY_MAX_DELAY', 1.0))
+# サーキットブレーカーを開く連続失敗回数と、開いてから1回だけ試行するまでの秒数
+GEO_DISTANCE_BREAKER_FAILURE_THRESHOLD = int(os.environ.get('GEO_DISTANCE_BREAKER_FAILURE_THRESHOLD', 5))
+GEO_DISTANCE_BREAKER_RESET_TIMEOUT = float(os.environ.get('GEO_DISTANCE_BREAKER_RESET_TIMEOUT', 10.0))
+# 検索がこの時間（ミリ秒）内に応答しない場合に同じ検索を重複して送る（0でヘッジしない）
+GEO_DISTANCE_HEDGE_DELAY_MS = float(os.environ.get('GEO_DISTANCE_HEDGE_DELAY_MS', 0))
+# 距離の計算モード: "execute"はリクエストごとの書き込みなし（arcとplaneのPainless executeを同時に2回）、
+# "indexed"はpoint_aを書き込んで（refresh=True）検索する2往復（同じpoint_aを書き込み済みの一時ドキュメントがあれば検索のみ）、
+# "local"はOpenSearchと同じ計算式を再現したローカルエンジン（geodistance.engine）で計算
+GEO_DISTANCE_CALCULATION_MODE = os.environ.get('GEO_DISTANCE_CALCULATION_MODE', 'execute')
+# インデックス存在確認結果のキャッシュ期間（秒）
+GEO_INDEX_EXISTS_CACHE_TTL = int(os.environ.get('GEO_INDEX_EXISTS_CACHE_TTL', 300))
+# 距離計算用インデックスのエイリアス（アプリケーションはこの名前で読み書きする）と、使用する定義のバージョン
+# （geodistance.index_management.INDEX_DEFINITIONS。変えた場合はmanage.py migrate_geo_indexで切り替える）
+GEO_DISTANCE_INDEX_ALIAS = os.environ.get('GEO_DISTANCE_INDEX_ALIAS', 'geo_distance_test')
+GEO_DISTANCE_INDEX_VERSION = int(os.environ.get('GEO_DISTANCE_INDEX_VERSION', 2))
+# 距離計算用インデックスのシャード数・レプリカ数・定期的なrefreshの間隔
+GEO_DISTANCE_INDEX_SHARDS = int(os.environ.get('GEO_DISTANCE_INDEX_SHARDS', 1))
+GEO_DISTANCE_INDEX_REPLICAS = int(os.environ.get('GEO_DISTANCE_INDEX_REPLICAS', 1))
+GEO_DISTANCE_INDEX_REFRESH_INTERVAL = os.environ.get('GEO_DISTANCE_INDEX_REFRESH_INTERVAL', '30s')
+# indexedモードでリクエストごとに貸し出す一時ドキュメントIDのワーカーあたりの数と、
+# プールが空のときに貸し出した使い捨てのドキュメントをまとめて削除する件数
+GEO_DISTANCE_SCRATCH_POOL_SIZE = int(os.environ.get('GEO_DISTANCE_SCRATCH_POOL_SIZE', 32))
+GEO_DISTANCE_SCRATCH_CLEANUP_BATCH_SIZE = int(os.environ.get('GEO_DISTANCE_SCRATCH_CLEANUP_BATCH_SIZE', 100))
+# 起動時（AppConfig.ready）にインデックスを作成してキャッシュするかどうか。有効にした場合も、
+# manage.pyはrunserverのときだけ作成する（migrateやtest、ワーカーなどの管理コマンドでは接続しない）
+GEO_DISTANCE_BOOTSTRAP_INDEX = os.environ.get('GEO_DISTANCE_BOOTSTRAP_INDEX', 'false').lower() == 'true'
+# 一括計算で1回の_bulk/_msearchにまとめる件数（chunk_sizeパラメータで指定できる上限）と、1リクエストで受け付ける最大件数
+GEO_DISTANCE_BATCH_CHUNK_SIZE = int(os.environ.get('GEO_DISTANCE_BATCH_CHUNK_SIZE', 1000))
+GEO_DISTANCE_BATCH_MAX_CHUNK_SIZE = int(os.environ.get('GEO_DISTANCE_BATCH_MAX_CHUNK_SIZE', 10000))
+GEO_DISTANCE_BATCH_MAX_PAIRS = int(os.environ.get('GEO_DISTANCE_BATCH_MAX_PAIRS', 500000))
+# エクスポートで並行に計算するチャンクの数（計算中のチャンクはこの数までに抑える）
+GEO_DISTANCE_EXPORT_CONCURRENCY = int(os.environ.get('GEO_DISTANCE_EXPORT_CONCURRENCY', 2))
+# バックグラウンドジョブ: run_distance_workersのプロセス数、未計算のチャンクがない場合に待つ秒数、
+# チャンクの計算を試みる回数と、失敗したチャンクを再試行するまでの秒数（失敗するたびに倍にし、上限で止める）、
+# 1つのジョブで受け付ける最大件数
+GEO_DISTANCE_JOB_WORKERS = int(os.environ.get('GEO_DISTANCE_JOB_WORKERS', 2))
+GEO_DISTANCE_JOB_POLL_INTERVAL = float(os.environ.get('GEO_DISTANCE_JOB_POLL_INTERVAL', 1.0))
+GEO_DISTANCE_JOB_MAX_ATTEMPTS = int(os.environ.get('GEO_DISTANCE_JOB_MAX_ATTEMPTS', 3))
+GEO_DISTANCE_JOB_RETRY_BACKOFF = float(os.environ.get('GEO_DISTANCE_JOB_RETRY_BACKOFF', 5.0))
+GEO_DISTANCE_JOB_RETRY_BACKOFF_MAX = float(os.environ.get('GEO_DISTANCE_JOB_RETRY_BACKOFF_MAX', 300.0))
+GEO_DISTANCE_JOB_MAX_PAIRS = int(os.environ.get('GEO_DISTANCE_JOB_MAX_PAIRS', 50000000))
+# 計算結果の履歴: 記録するかどうか、まとめて登録する件数と間隔（秒）、登録待ちの最大件数（超えた分は古いものから破棄）、
+# 集計に使う緯度帯の幅（度）
+GEO_DISTANCE_HISTORY_ENABLED = os.environ.get('GEO_DISTANCE_HISTORY_ENABLED', 'true').lower() == 'true'
+GEO_DISTANCE_HISTORY_BATCH_SIZE = int(os.environ.get('GEO_DISTANCE_HISTORY_BATCH_SIZE', 500))
+GEO_DISTANCE_HISTORY_FLUSH_INTERVAL = float(os.environ.get('GEO_DISTANCE_HISTORY_FLUSH_INTERVAL', 1.0))
+GEO_DISTANCE_HISTORY_MAX_BUFFER = int(os.environ.get('GEO_DISTANCE_HISTORY_MAX_BUFFER', 100000))
+GEO_DISTANCE_HISTORY_LATITUDE_BAND = int(os.environ.get('GEO_DISTANCE_HISTORY_LATITUDE_BAND', 10))
+# 距離行列で並行に実行する出発地点ごとの検索数、1回の検索で取得する件数、受け付ける最大要素数
+GEO_DISTANCE_MATRIX_CONCURRENCY = int(os.environ.get('GEO_DISTANCE_MATRIX_CONCURRENCY', 4))
+GEO_DISTANCE_MATRIX_PAGE_SIZE = int(os.environ.get('GEO_DISTANCE_MATRIX_PAGE_SIZE', 10000))
+GEO_DISTANCE_MATRIX_MAX_CELLS = int(os.environ.get('GEO_DISTANCE_MATRIX_MAX_CELLS', 10000000))
+# 同じ地点の組の計算結果キャッシュ: 座標を丸める単位（度）、プロセス内LRUの最大件数（0で無効）、
+# 有効期間（秒）、2段目に使うDjangoキャッシュのエイリアス（CACHESのキー。空の場合はプロセス内のみ）
+GEO_DISTANCE_CACHE_PRECISION = float(os.environ.get('GEO_DISTANCE_CACHE_PRECISION', 0.0001))
+GEO_DISTANCE_CACHE_MAX_ENTRIES = int(os.environ.get('GEO_DISTANCE_CACHE_MAX_ENTRIES', 10000))
+GEO_DISTANCE_CACHE_TTL = int(os.environ.get('GEO_DISTANCE_CACHE_TTL', 3600))
+GEO_DISTANCE_CACHE_BACKEND = os.environ.get('GEO_DISTANCE_CACHE_BACKEND', '')
+# 計測結果の出力先（logging, prometheus, ring_bufferまたはシンククラスのドットパス。カンマ区切り、空で計測しない）
+# prometheusを指定すると /metrics/ でPrometheusのテキスト形式を返す
+GEO_DISTANCE_INSTRUMENTATION_SINKS = [
+    sink for sink in os.environ.get('GEO_DISTANCE_INSTRUMENTATION_SINKS', 'prometheus,ring_buffer').split(',') if sink
+]
+GEO_DISTANCE_INSTRUMENTATION_BUFFER_SIZE = int(os.environ.get('GEO_DISTANCE_INSTRUMENTATION_BUFFER_SIZE', 1000))
+# 一括計算・エクスポート・ジョブの登録・距離行列のPOSTのAPIで受け付けるトークン（カンマ区切り）。
+# 設定した場合は "Authorization: Bearer <トークン>" を要求し、設定しない場合はフォームと同じくCSRFトークンを要求する
+GEO_DISTANCE_API_TOKENS = [
+    token for token in os.environ.get('GEO_DISTANCE_API_TOKENS', '').split(',') if token
+]
+# 参照地点（manage.py load_geo_pointsで登録する駅・店舗など）のインデックス名
+GEO_REFERENCE_INDEX = os.environ.get('GEO_REFERENCE_INDEX', 'geo_reference_points')
+# 近傍の参照地点検索の実行先: "opensearch"はOpenSearchの検索、"local"は参照地点のインデックスから
+# 初回に構築するプロセス内の空間インデックス（geodistance.spatial_index）
+GEO_REFERENCE_BACKEND = os.environ.get('GEO_REFERENCE_BACKEND', 'opensearch')
+# localの空間インデックスを構築し直す間隔（秒）。load_geo_pointsで追加した地点はこの間隔で反映される（0で構築し直さない）
+GEO_REFERENCE_LOCAL_INDEX_TTL = int(os.environ.get('GEO_REFERENCE_LOCAL_INDEX_TTL', 300))
+# 近傍の参照地点検索（/nearest/）で1ページに取得できる最大件数
+GEO_DISTANCE_KNN_MAX_K = int(os.environ.get('GEO_DISTANCE_KNN_MAX_K', 1000))
+# 距離の分布の集計（/distribution/）で距離帯ごとに返すgeohash_gridのセルの最大数
+GEO_DISTANCE_DISTRIBUTION_MAX_CELLS = int(os.environ.get('GEO_DISTANCE_DISTRIBUTION_MAX_CELLS', 1000))
+# 事前計算した誤差マップ（manage.py build_geo_error_mapで作成）のパス。起動時にメモリマップし、
+# calculate_distances(exact=False)の近似値に使う（空の場合は近似値を使わない）
+GEO_DISTANCE_ERROR_MAP_PATH = os.environ.get('GEO_DISTANCE_ERROR_MAP_PATH', '')
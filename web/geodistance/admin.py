@@ -1 +1,10 @@
-# Register your models here.
+from django.contrib import admin
+
+from .models import DistanceJob
+
+
+@admin.register(DistanceJob)
+class DistanceJobAdmin(admin.ModelAdmin):
+    list_display = ("id", "status", "processed_pairs", "total_pairs", "error_rows", "created_at", "finished_at")
+    list_filter = ("status",)
+    readonly_fields = [field.name for field in DistanceJob._meta.fields]
@@ -1,6 +1,44 @@
+import os
+import sys
+import threading
+
 from django.apps import AppConfig
+from django.conf import settings
+
+
+# 起動時のインデックス作成を行う管理コマンド（サーバー以外のmigrateやtest、ワーカーなどでは行わない）
+BOOTSTRAP_COMMANDS = ('runserver',)
+
+
+def bootstrap_enabled(argv=None) -> bool:
+    """
+    起動時にインデックスを作成するかどうか
+    GEO_DISTANCE_BOOTSTRAP_INDEXが有効で、manage.pyの場合はBOOTSTRAP_COMMANDSのときだけ作成する
+    """
+    if not settings.GEO_DISTANCE_BOOTSTRAP_INDEX:
+        return False
+    argv = sys.argv if argv is None else argv
+    if argv and os.path.basename(argv[0]) in ('manage.py', 'django-admin'):
+        return len(argv) > 1 and argv[1] in BOOTSTRAP_COMMANDS
+    return True
 
 
 class GeodistanceConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'geodistance'
+
+    def ready(self):
+        """起動時に誤差マップをメモリマップし、インデックスを作成して存在確認の結果をキャッシュする"""
+        from .error_map import error_map_store
+
+        error_map_store.get()
+
+        if not bootstrap_enabled():
+            return
+
+        from .services import bootstrap_index
+
+        # OpenSearchの応答待ちで起動をブロックしないようバックグラウンドで実行する
+        threading.Thread(
+            target=bootstrap_index, name='geodistance-bootstrap-index', daemon=True
+        ).start()
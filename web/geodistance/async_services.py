@@ -0,0 +1,257 @@
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+from django.conf import settings
+from . import engine
+from .cache import distance_result_cache
+from .clients import get_async_client
+from .history import history_recorder
+from .index_management import ensure_index_async
+from .instrumentation import instrumentation
+from .scratch import scratch_pool
+from .services import (
+    DISTANCE_SCRIPTS,
+    SORT_FILTER_PATH,
+    _geo_distance_sort,
+    _hits,
+    _is_index_not_found,
+    _summarize_distances,
+    approximate_distances,
+    index_existence_cache,
+)
+
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncGeoDistanceService:
+    """
+    AsyncOpenSearchを使用してgeo distance計算を行う非同期サービスクラス
+    arcとplaneの計算をasyncio.gatherで同時に実行し、ASGIワーカーのスレッドを占有しない
+    """
+
+    def __init__(self):
+        """実行中のイベントループの共有AsyncOpenSearchクライアントを取得"""
+        try:
+            self.index_name = settings.GEO_DISTANCE_INDEX_ALIAS
+            self.calculation_mode = settings.GEO_DISTANCE_CALCULATION_MODE
+            self.client = get_async_client()
+        except Exception as e:
+            logger.error(f"OpenSearchクライアントの初期化に失敗しました: {e}")
+            self.client = None
+
+    async def _ensure_index_exists(self) -> bool:
+        """
+        距離計算用インデックスのエイリアスが存在することを確認し、なければ作成する
+        確認結果は同期サービスと同じキャッシュを共有する
+        """
+        try:
+            if not self.client:
+                return False
+
+            if index_existence_cache.is_known(self.index_name):
+                return True
+
+            await ensure_index_async(self.client)
+            index_existence_cache.mark_exists(self.index_name)
+            return True
+        except Exception as e:
+            logger.error(f"インデックスの作成に失敗しました: {e}")
+            return False
+
+    async def calculate_distances(
+        self, a_lat: float, a_lon: float, b_lat: float, b_lon: float, exact: bool = True
+    ) -> Dict:
+        """
+        A地点とB地点間の距離をarc（球面距離）とplane（平面距離）で計算
+
+        Args:
+            a_lat: A地点の緯度
+            a_lon: A地点の経度
+            b_lat: B地点の緯度
+            b_lon: B地点の経度
+            exact: Falseの場合は誤差マップから推定した近似値を返す（範囲外の場合はOpenSearchで計算）
+
+        Returns:
+            Dict: GeoDistanceService.calculate_distancesと同じ形式の計算結果
+        """
+        result = {
+            "success": False,
+            "arc_distance_km": None,
+            "plane_distance_km": None,
+            "difference_km": None,
+            "difference_percentage": None,
+            "error_message": None,
+        }
+
+        if not exact:
+            approximate = approximate_distances(a_lat, a_lon, b_lat, b_lon)
+            if approximate is not None:
+                return approximate
+
+        with instrumentation.span("service.calculate_distances", mode=self.calculation_mode) as span:
+            cache_key = None
+            if distance_result_cache.enabled:
+                cache_key = distance_result_cache.make_key(
+                    self.calculation_mode, a_lat, a_lon, b_lat, b_lon
+                )
+                with instrumentation.span("service.cache_lookup"):
+                    cached = await distance_result_cache.aget(cache_key)
+                if cached is not None:
+                    span.set(cache_hit=True)
+                    return cached
+
+            try:
+                if self.calculation_mode != "local":
+                    if not self.client:
+                        result["error_message"] = "OpenSearchクライアントが初期化されていません"
+                        span.set(error="client_unavailable")
+                        return result
+
+                    with instrumentation.span("service.ensure_index_exists"):
+                        index_ready = await self._ensure_index_exists()
+                    if not index_ready:
+                        result["error_message"] = "インデックスの作成に失敗しました"
+                        span.set(error="index_unavailable")
+                        return result
+
+                distances = await self._calculate_arc_and_plane(a_lat, a_lon, b_lat, b_lon)
+                if distances is None:
+                    result["error_message"] = "arc/plane距離の計算に失敗しました"
+                    span.set(error="calculation_failed")
+                    return result
+
+                result.update(_summarize_distances(*distances))
+                result["success"] = True
+
+                if cache_key is not None:
+                    await distance_result_cache.aset(cache_key, result)
+                history_recorder.record(self.calculation_mode, a_lat, a_lon, b_lat, b_lon, result)
+
+            except Exception as e:
+                logger.error(f"距離計算中にエラーが発生しました: {e}")
+                result["error_message"] = f"計算エラー: {str(e)}"
+                span.set(error=type(e).__name__)
+
+        return result
+
+    async def _calculate_arc_and_plane(
+        self, a_lat: float, a_lon: float, b_lat: float, b_lon: float
+    ) -> Optional[Tuple[float, float]]:
+        """
+        計算モードに応じてarc距離とplane距離を計算
+
+        Returns:
+            Optional[Tuple[float, float]]: (arc距離, plane距離)（km）、エラーの場合はNone
+        """
+        if self.calculation_mode == "local":
+            with instrumentation.span("service.local_engine"):
+                distances = engine.compare_distances(a_lat, a_lon, b_lat, b_lon)
+            return float(distances["arc"]), float(distances["plane"])
+
+        if self.calculation_mode == "indexed":
+            return await self._search_arc_and_plane(a_lat, a_lon, b_lat, b_lon)
+
+        try:
+            arc_distance, plane_distance = await asyncio.gather(
+                self._execute_distance(a_lat, a_lon, b_lat, b_lon, "arc"),
+                self._execute_distance(a_lat, a_lon, b_lat, b_lon, "plane"),
+            )
+            return arc_distance, plane_distance
+        except Exception as e:
+            if _is_index_not_found(e):
+                index_existence_cache.invalidate(self.index_name)
+            logger.error(f"距離計算スクリプトでエラーが発生しました: {e}")
+            return None
+
+    async def _execute_distance(
+        self, a_lat: float, a_lon: float, b_lat: float, b_lon: float, distance_type: str
+    ) -> float:
+        """Painless execute APIでA地点をインメモリのドキュメントとして評価し、距離を計算"""
+        body = {
+            "script": {
+                "source": DISTANCE_SCRIPTS[distance_type],
+                "params": {"lat": b_lat, "lon": b_lon},
+            },
+            "context": "score",
+            "context_setup": {
+                "index": self.index_name,
+                "document": {"location": {"lat": a_lat, "lon": a_lon}},
+            },
+        }
+        with instrumentation.span(f"service.execute_{distance_type}"):
+            response = await self.client.scripts_painless_execute(body=body)
+        return float(response["result"])
+
+    async def _search_arc_and_plane(
+        self, a_lat: float, a_lon: float, b_lat: float, b_lon: float
+    ) -> Optional[Tuple[float, float]]:
+        """
+        A地点をプールから借りたIDで書き込み、arcとplaneの2つのソート句を持つ1回の検索で計算
+        同じA地点を書き込み済みのIDを借りられた場合は書き込みを省く
+        """
+        location = (a_lat, a_lon)
+        lease = scratch_pool.acquire(location)
+        try:
+            reused = lease.location == location
+            if not reused:
+                await self._write_scratch_document(lease, a_lat, a_lon)
+
+            query = {
+                "_source": False,
+                "track_total_hits": False,
+                "query": {"ids": {"values": [lease.doc_id]}},
+                "sort": [
+                    _geo_distance_sort(b_lat, b_lon, "arc"),
+                    _geo_distance_sort(b_lat, b_lon, "plane"),
+                ],
+            }
+            with instrumentation.span("service.search_arc_and_plane"):
+                response = await self.client.search(
+                    index=self.index_name, body=query, size=1, routing=lease.routing, filter_path=SORT_FILTER_PATH
+                )
+
+            hits = _hits(response)
+            if not hits and reused:
+                # 書き込み済みのドキュメントが削除されていた場合は書き込み直す
+                await self._write_scratch_document(lease, a_lat, a_lon)
+                with instrumentation.span("service.search_arc_and_plane"):
+                    response = await self.client.search(
+                        index=self.index_name, body=query, size=1, routing=lease.routing, filter_path=SORT_FILTER_PATH
+                    )
+                hits = _hits(response)
+            if hits:
+                arc_distance, plane_distance = hits[0]["sort"][:2]
+                return float(arc_distance), float(plane_distance)
+
+            return None
+
+        except Exception as e:
+            if _is_index_not_found(e):
+                index_existence_cache.invalidate(self.index_name)
+            logger.error(f"距離計算クエリでエラーが発生しました: {e}")
+            return None
+
+        finally:
+            expired = scratch_pool.release(lease)
+            if expired:
+                await self._delete_scratch_documents(expired)
+
+    async def _write_scratch_document(self, lease, a_lat: float, a_lon: float) -> None:
+        """借りた一時ドキュメントにA地点を書き込み、書き込んだ地点を記録する"""
+        lease.location = None
+        doc = {"location": {"lat": a_lat, "lon": a_lon}, "name": "test_point"}
+        with instrumentation.span("service.create_test_document"):
+            await self.client.index(index=self.index_name, id=lease.doc_id, body=doc, refresh=True)
+        lease.location = (a_lat, a_lon)
+
+    async def _delete_scratch_documents(self, doc_ids: List[str]) -> None:
+        """返却された使い捨ての一時ドキュメントをまとめて削除する"""
+        try:
+            operations = [
+                {"delete": {"_index": self.index_name, "_id": doc_id}} for doc_id in doc_ids
+            ]
+            await self.client.bulk(body=operations, filter_path="took,errors")
+        except Exception as e:
+            logger.error(f"一時ドキュメントの削除に失敗しました: {e}")
+
@@ -0,0 +1,267 @@
+import platform
+import subprocess
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+from django.test import Client, override_settings
+from django.urls import reverse
+
+from .cache import distance_result_cache
+from .clients import client_registry
+from .fake_opensearch import FakeOpenSearchServer
+from .serializers import get_serializer
+from .services import GeoDistanceService, index_existence_cache
+
+
+BENCHMARK_TARGETS = ("service", "view")
+
+
+def random_pairs(count: int, seed: int = 0) -> List[Tuple[float, float, float, float]]:
+    """ベンチマーク用の(A緯度, A経度, B緯度, B経度)をシードから再現可能に生成"""
+    rng = np.random.default_rng(seed)
+    return list(
+        zip(
+            rng.uniform(-90, 90, count).round(6).tolist(),
+            rng.uniform(-180, 180, count).round(6).tolist(),
+            rng.uniform(-90, 90, count).round(6).tolist(),
+            rng.uniform(-180, 180, count).round(6).tolist(),
+        )
+    )
+
+
+def summarize_latencies(latencies: Sequence[float]) -> Dict[str, float]:
+    """
+    レイテンシ（秒）の分布をミリ秒で要約する
+
+    Returns:
+        Dict[str, float]: p50, p95, p99, mean, max
+    """
+    if not len(latencies):
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "mean": 0.0, "max": 0.0}
+
+    values = np.asarray(latencies, dtype=np.float64) * 1000.0
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "p50": round(float(p50), 3),
+        "p95": round(float(p95), 3),
+        "p99": round(float(p99), 3),
+        "mean": round(float(values.mean()), 3),
+        "max": round(float(values.max()), 3),
+    }
+
+
+def _run_timed(
+    call: Callable[[Tuple[float, float, float, float]], bool],
+    pairs: Sequence[Tuple[float, float, float, float]],
+    concurrency: int,
+) -> Tuple[List[Tuple[float, bool]], float]:
+    """各組についてcallを実行し、(レイテンシ, 成否)のリストと全体の経過時間を返す"""
+
+    def timed(pair):
+        started = time.perf_counter()
+        success = call(pair)
+        return time.perf_counter() - started, success
+
+    started = time.perf_counter()
+    if concurrency > 1:
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(timed, pairs))
+    else:
+        outcomes = [timed(pair) for pair in pairs]
+    return outcomes, time.perf_counter() - started
+
+
+def parse_seconds_per_response(payloads: Sequence[bytes]) -> float:
+    """クライアントのシリアライザーでレスポンスボディをデコードする平均時間（秒）"""
+    if not payloads:
+        return 0.0
+    serializer = get_serializer()
+    started = time.perf_counter()
+    for payload in payloads:
+        serializer.loads(payload.decode("utf-8"))
+    return (time.perf_counter() - started) / len(payloads)
+
+
+def _service_call():
+    service = GeoDistanceService()
+    return lambda pair: service.calculate_distances(*pair)["success"]
+
+
+def _view_call():
+    """geo_distance_viewにフォームをPOSTし、結果ページが表示されたかを返す"""
+    url = reverse("geodistance:geo_distance")
+    result_title = "<title>距離計算結果".encode("utf-8")
+
+    def call(pair):
+        # Clientはスレッド間で共有できないため、リクエストごとに生成する
+        response = Client().post(
+            url,
+            {"a_latitude": pair[0], "a_longitude": pair[1], "b_latitude": pair[2], "b_longitude": pair[3]},
+        )
+        return response.status_code == 200 and result_title in response.content
+
+    return call
+
+
+def run_scenario(
+    server: FakeOpenSearchServer,
+    target: str,
+    mode: str,
+    pairs: Sequence[Tuple[float, float, float, float]],
+    concurrency: int = 1,
+) -> Dict:
+    """
+    ローカルのOpenSearch代替サーバーに接続して1つのシナリオを計測する
+
+    Args:
+        server: 接続先のFakeOpenSearchServer
+        target: "service"（GeoDistanceService.calculate_distances）または"view"（geo_distance_view）
+        mode: GEO_DISTANCE_CALCULATION_MODE
+        pairs: 計算する地点の組
+        concurrency: 同時に実行するリクエスト数
+
+    Returns:
+        Dict: レイテンシ分布、スループット、1リクエストあたりのOpenSearch呼び出し数・送受信バイト数・
+            レスポンスのデコード時間
+    """
+    overrides = {
+        "OPENSEARCH_HOST": server.host,
+        "OPENSEARCH_PORT": server.port,
+        "OPENSEARCH_USE_SSL": False,
+        "GEO_DISTANCE_CALCULATION_MODE": mode,
+        # 合成した地点の組を計算履歴・誤差レポートに残さず、履歴の書き込みを計測に含めない
+        "GEO_DISTANCE_HISTORY_ENABLED": False,
+        "ALLOWED_HOSTS": [*settings.ALLOWED_HOSTS, "testserver"],
+    }
+    with override_settings(**overrides):
+        # 接続先とキャッシュの状態をシナリオごとに初期化する
+        client_registry.close()
+        index_existence_cache.invalidate()
+        distance_result_cache.clear()
+        server.reset_calls()
+        try:
+            call = _service_call() if target == "service" else _view_call()
+            outcomes, elapsed = _run_timed(call, pairs, concurrency)
+        finally:
+            client_registry.close()
+
+    calls = server.calls()
+    total_calls = sum(calls.values())
+    traffic = server.traffic()
+    parse_seconds = parse_seconds_per_response(server.recent_responses()) * total_calls
+
+    def per_request(value):
+        return round(value / len(outcomes), 3) if outcomes else 0.0
+
+    return {
+        "target": target,
+        "mode": mode,
+        "requests": len(outcomes),
+        "concurrency": concurrency,
+        "errors": sum(1 for _, success in outcomes if not success),
+        "elapsed_seconds": round(elapsed, 4),
+        "requests_per_second": round(len(outcomes) / elapsed, 2) if elapsed > 0 else 0.0,
+        "latency_ms": summarize_latencies([latency for latency, _ in outcomes]),
+        "opensearch_calls_per_request": per_request(total_calls),
+        "opensearch_calls": calls,
+        "request_bytes_per_request": per_request(traffic["request_bytes"]),
+        "response_bytes_per_request": per_request(traffic["response_bytes"]),
+        "parse_ms_per_request": per_request(parse_seconds * 1000.0),
+    }
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=settings.BASE_DIR,
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+def run_benchmarks(
+    requests: int = 200,
+    concurrency: int = 1,
+    modes: Sequence[str] = ("execute", "indexed"),
+    targets: Sequence[str] = BENCHMARK_TARGETS,
+    latency_ms: float = 1.0,
+    jitter_ms: float = 0.0,
+    seed: int = 0,
+) -> Dict:
+    """
+    ローカルのOpenSearch代替サーバーを起動し、計算モードと計測対象の全組み合わせを計測する
+
+    Returns:
+        Dict: meta（実行条件）とresults（シナリオごとの計測結果）。JSONとして保存し、コミット間で比較する
+    """
+    pairs = random_pairs(requests, seed)
+    results = []
+    with FakeOpenSearchServer(latency_ms=latency_ms, jitter_ms=jitter_ms) as server:
+        for mode in modes:
+            for target in targets:
+                results.append(run_scenario(server, target, mode, pairs, concurrency))
+
+    return {
+        "meta": {
+            "created_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "git_commit": _git_commit(),
+            "python": platform.python_version(),
+            "requests": requests,
+            "concurrency": concurrency,
+            "latency_ms": latency_ms,
+            "jitter_ms": jitter_ms,
+            "seed": seed,
+            "json_serializer": type(get_serializer()).__name__,
+        },
+        "results": results,
+    }
+
+
+def compare_results(current: Dict, baseline: Dict) -> List[Dict]:
+    """
+    2つのベンチマーク結果の同じシナリオ同士を比較する
+
+    Returns:
+        List[Dict]: シナリオごとのp50/p95/p99・スループット・レスポンスのバイト数とデコード時間の変化率（%）と
+            呼び出し数の変化
+    """
+    baseline_by_key = {(r["target"], r["mode"]): r for r in baseline.get("results", [])}
+    comparisons = []
+    for result in current.get("results", []):
+        previous = baseline_by_key.get((result["target"], result["mode"]))
+        if previous is None:
+            continue
+
+        def change(now, before):
+            return round((now - before) / before * 100, 2) if before and now is not None else None
+
+        comparisons.append(
+            {
+                "target": result["target"],
+                "mode": result["mode"],
+                **{
+                    f"{key}_change_pct": change(result["latency_ms"][key], previous["latency_ms"][key])
+                    for key in ("p50", "p95", "p99")
+                },
+                "requests_per_second_change_pct": change(
+                    result["requests_per_second"], previous["requests_per_second"]
+                ),
+                # 送受信バイト数を記録する前の結果との比較ではNone
+                **{
+                    f"{key}_change_pct": change(result.get(key), previous.get(key))
+                    for key in ("response_bytes_per_request", "parse_ms_per_request")
+                },
+                "opensearch_calls_per_request_change": round(
+                    result["opensearch_calls_per_request"] - previous["opensearch_calls_per_request"], 3
+                ),
+            }
+        )
+    return comparisons
@@ -0,0 +1,194 @@
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Sequence
+
+from django.conf import settings
+from django.core.cache import caches
+
+
+logger = logging.getLogger(__name__)
+
+# calculate_distancesが計算する距離タイプ
+DISTANCE_TYPES = ("arc", "plane")
+
+
+def quantize(value: float, precision: float) -> int:
+    """座標をprecision単位の整数に丸める（precision未満の差は同じ地点として扱う）"""
+    return int(round(value / precision))
+
+
+class DistanceResultCache:
+    """
+    同じ地点の組の計算結果を保持するキャッシュ
+    プロセス内の上限付きLRUを1段目に、設定されていればDjangoのキャッシュバックエンドを
+    2段目に使い、ヒットした場合はOpenSearchへの問い合わせを行わない
+    """
+
+    def __init__(
+        self,
+        max_entries: Optional[int] = None,
+        ttl: Optional[float] = None,
+        precision: Optional[float] = None,
+        backend_alias: Optional[str] = None,
+    ):
+        self.max_entries = (
+            max_entries if max_entries is not None else settings.GEO_DISTANCE_CACHE_MAX_ENTRIES
+        )
+        self.ttl = ttl if ttl is not None else settings.GEO_DISTANCE_CACHE_TTL
+        self.precision = precision if precision is not None else settings.GEO_DISTANCE_CACHE_PRECISION
+        self.backend_alias = (
+            backend_alias if backend_alias is not None else settings.GEO_DISTANCE_CACHE_BACKEND
+        )
+        self._lock = threading.Lock()
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        self._reset_stats()
+
+    def _reset_stats(self) -> None:
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.backend_hits = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_entries > 0 or bool(self.backend_alias)
+
+    def make_key(
+        self,
+        mode: str,
+        a_lat: float,
+        a_lon: float,
+        b_lat: float,
+        b_lon: float,
+        distance_types: Sequence[str] = DISTANCE_TYPES,
+    ) -> str:
+        """
+        計算モード・距離タイプ・量子化した座標からキャッシュキーを生成
+
+        Returns:
+            str: 例 "geo_distance:execute:arc,plane:356762:1396503:346937:1355023"
+        """
+        coordinates = ":".join(
+            str(quantize(value, self.precision)) for value in (a_lat, a_lon, b_lat, b_lon)
+        )
+        return f"geo_distance:{mode}:{','.join(distance_types)}:{coordinates}"
+
+    def _get_local(self, key: str) -> Optional[Dict]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+
+            expires_at, value = entry
+            if time.monotonic() >= expires_at:
+                del self._entries[key]
+                self.expirations += 1
+                return None
+
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return dict(value)
+
+    def _set_local(self, key: str, value: Dict) -> None:
+        if self.max_entries <= 0:
+            return
+
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, dict(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _record_backend_hit(self, key: str, value: Optional[Dict]) -> Optional[Dict]:
+        with self._lock:
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self.backend_hits += 1
+
+        self._set_local(key, value)
+        return dict(value)
+
+    def get(self, key: str) -> Optional[Dict]:
+        """
+        キャッシュされた計算結果を取得する
+
+        Returns:
+            Optional[Dict]: 計算結果。キャッシュにない、または期限切れの場合はNone
+        """
+        value = self._get_local(key)
+        if value is not None:
+            return value
+
+        value = None
+        if self.backend_alias:
+            try:
+                value = caches[self.backend_alias].get(key)
+            except Exception as e:
+                logger.error(f"キャッシュバックエンドからの取得に失敗しました: {e}")
+
+        return self._record_backend_hit(key, value)
+
+    def set(self, key: str, value: Dict) -> None:
+        """計算結果をキャッシュに保存する"""
+        self._set_local(key, value)
+        if self.backend_alias:
+            try:
+                caches[self.backend_alias].set(key, value, timeout=self.ttl)
+            except Exception as e:
+                logger.error(f"キャッシュバックエンドへの保存に失敗しました: {e}")
+
+    async def aget(self, key: str) -> Optional[Dict]:
+        """getの非同期版（キャッシュバックエンドへの問い合わせでイベントループを止めない）"""
+        value = self._get_local(key)
+        if value is not None:
+            return value
+
+        value = None
+        if self.backend_alias:
+            try:
+                value = await caches[self.backend_alias].aget(key)
+            except Exception as e:
+                logger.error(f"キャッシュバックエンドからの取得に失敗しました: {e}")
+
+        return self._record_backend_hit(key, value)
+
+    async def aset(self, key: str, value: Dict) -> None:
+        """setの非同期版"""
+        self._set_local(key, value)
+        if self.backend_alias:
+            try:
+                await caches[self.backend_alias].aset(key, value, timeout=self.ttl)
+            except Exception as e:
+                logger.error(f"キャッシュバックエンドへの保存に失敗しました: {e}")
+
+    def clear(self) -> None:
+        """プロセス内のキャッシュと統計を破棄する（キャッシュバックエンドは変更しない）"""
+        with self._lock:
+            self._entries.clear()
+            self._reset_stats()
+
+    def stats(self) -> Dict[str, int]:
+        """
+        キャッシュの統計を返す
+
+        Returns:
+            Dict[str, int]: hits, misses, evictions, expirations, backend_hits, size
+        """
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "expirations": self.expirations,
+                "backend_hits": self.backend_hits,
+                "size": len(self._entries),
+            }
+
+
+distance_result_cache = DistanceResultCache()
@@ -0,0 +1,247 @@
+import asyncio
+import atexit
+import logging
+import os
+import threading
+import weakref
+from typing import Dict, Optional
+
+from django.conf import settings
+from opensearchpy import OpenSearch
+
+from .resilience import ResilientTransport, resilient_async_transport_class
+from .routing import (
+    TrackedHttpConnection,
+    routing_options,
+    seed_hosts,
+    sniff_on_start,
+    tracked_async_connection_class,
+)
+from .serializers import get_serializer
+
+
+logger = logging.getLogger(__name__)
+
+
+def _client_options() -> Dict:
+    """同期・非同期クライアントで共通の接続設定"""
+    return {
+        "hosts": seed_hosts(),
+        "http_auth": (settings.OPENSEARCH_USERNAME, settings.OPENSEARCH_PASSWORD),
+        "use_ssl": settings.OPENSEARCH_USE_SSL,
+        "verify_certs": False,
+        "ssl_assert_hostname": False,
+        "ssl_show_warn": False,
+        "timeout": settings.OPENSEARCH_TIMEOUT,
+        # 再試行はgeodistance.resilienceで期限内に行うため、opensearch-py自身の再試行は無効にする
+        "max_retries": 0,
+        "serializer": get_serializer(),
+        **routing_options(),
+    }
+
+
+class OpenSearchClientRegistry:
+    """
+    プロセス内で共有するOpenSearchクライアントのレジストリ
+    keep-aliveの固定サイズコネクションプールを持つクライアントを1つだけ生成し、
+    リクエストをまたいで再利用することでTLSハンドシェイクと接続確立のコストをなくす
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients: Dict[str, OpenSearch] = {}
+        self._pid = os.getpid()
+        self.hits = 0
+        self.misses = 0
+
+    def get_client(self, alias: str = "default") -> OpenSearch:
+        """
+        共有クライアントを取得する。未生成の場合のみ生成する
+
+        Args:
+            alias: クライアントの識別名
+
+        Returns:
+            OpenSearch: 共有クライアント
+        """
+        self._reset_if_forked()
+
+        with self._lock:
+            client = self._clients.get(alias)
+            if client is not None:
+                self.hits += 1
+                return client
+
+            client = self._create_client()
+            self._clients[alias] = client
+            self.misses += 1
+            logger.info(
+                f"OpenSearchクライアント '{alias}' を生成しました"
+                f"（pool_maxsize={settings.OPENSEARCH_POOL_MAXSIZE}）"
+            )
+            return client
+
+    def _create_client(self) -> OpenSearch:
+        """keep-aliveの固定サイズコネクションプールを持つクライアントを生成"""
+        client = OpenSearch(
+            **_client_options(),
+            pool_maxsize=settings.OPENSEARCH_POOL_MAXSIZE,
+            transport_class=ResilientTransport,
+            connection_class=TrackedHttpConnection,
+        )
+        sniff_on_start(client)
+        return client
+
+    def _reset_if_forked(self) -> None:
+        """
+        fork後の子プロセスでは親プロセスのソケットを共有しないよう、クライアントを破棄する
+        （os.register_at_forkが使えない環境向けのPIDチェック）
+        """
+        if self._pid != os.getpid():
+            self._after_fork_in_child()
+
+    def _after_fork_in_child(self) -> None:
+        # 親プロセスのロック状態とソケットは引き継がず、子プロセスで作り直す
+        self._lock = threading.Lock()
+        self._clients = {}
+        self._pid = os.getpid()
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self) -> Dict[str, int]:
+        """
+        プールのヒット/ミスと、実際に確立されたHTTP接続数を返す
+
+        Returns:
+            Dict[str, int]: hits, misses, connections_opened, requests_sent
+        """
+        connections_opened = 0
+        requests_sent = 0
+        with self._lock:
+            clients = list(self._clients.values())
+            hits, misses = self.hits, self.misses
+
+        for client in clients:
+            for connection in client.transport.connection_pool.connections:
+                pool = getattr(connection, "pool", None)
+                if pool is None:
+                    continue
+                connections_opened += getattr(pool, "num_connections", 0)
+                requests_sent += getattr(pool, "num_requests", 0)
+
+        return {
+            "hits": hits,
+            "misses": misses,
+            "connections_opened": connections_opened,
+            "requests_sent": requests_sent,
+        }
+
+    def close(self, alias: Optional[str] = None) -> None:
+        """
+        クライアントのコネクションプールを閉じる
+
+        Args:
+            alias: 閉じるクライアントの識別名。Noneの場合はすべて閉じる
+        """
+        with self._lock:
+            if alias is None:
+                clients = list(self._clients.values())
+                self._clients = {}
+            else:
+                client = self._clients.pop(alias, None)
+                clients = [client] if client is not None else []
+
+        for client in clients:
+            try:
+                client.close()
+            except Exception as e:
+                logger.error(f"OpenSearchクライアントのクローズに失敗しました: {e}")
+
+
+client_registry = OpenSearchClientRegistry()
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=client_registry._after_fork_in_child)
+
+atexit.register(client_registry.close)
+
+
+def get_client(alias: str = "default") -> OpenSearch:
+    """共有レジストリからOpenSearchクライアントを取得する"""
+    return client_registry.get_client(alias)
+
+
+class AsyncOpenSearchClientRegistry:
+    """
+    AsyncOpenSearchクライアントをイベントループごとに共有するレジストリ
+    aiohttpのセッションは生成したイベントループに紐づくため、ループ単位で1つだけ生成する
+
+    クライアントはループへの参照を持つため、ループが終了してもclose()を呼ぶまで解放されない。
+    リクエストごとにループを作り直すWSGIのasync_to_syncからは使わない
+    （geo_distance_async_viewはASGI以外では同期サービスで計算する）
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._clients = weakref.WeakKeyDictionary()
+        self.hits = 0
+        self.misses = 0
+
+    def get_client(self):
+        """
+        実行中のイベントループの共有クライアントを取得する。未生成の場合のみ生成する
+
+        Returns:
+            AsyncOpenSearch: 共有クライアント
+        """
+        loop = asyncio.get_running_loop()
+
+        with self._lock:
+            client = self._clients.get(loop)
+            if client is not None:
+                self.hits += 1
+                return client
+
+            client = self._create_client()
+            self._clients[loop] = client
+            self.misses += 1
+            return client
+
+    def _create_client(self):
+        """aiohttpのコネクションプールを持つ非同期クライアントを生成"""
+        # aiohttpはasync extraでのみ必要なため、同期のみの利用では読み込まない
+        from opensearchpy import AsyncOpenSearch
+
+        return AsyncOpenSearch(
+            **_client_options(),
+            maxsize=settings.OPENSEARCH_POOL_MAXSIZE,
+            transport_class=resilient_async_transport_class(),
+            connection_class=tracked_async_connection_class(),
+            # 非同期版のスニッフィングは最初のリクエストの前に行われるため、起動を遅らせない
+            sniff_on_start=settings.OPENSEARCH_SNIFF_ON_START,
+        )
+
+    def stats(self) -> Dict[str, int]:
+        """プールのヒット/ミスを返す"""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses}
+
+    async def close(self) -> None:
+        """実行中のイベントループのクライアントを閉じる"""
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._clients.pop(loop, None)
+
+        if client is not None:
+            try:
+                await client.close()
+            except Exception as e:
+                logger.error(f"OpenSearchクライアントのクローズに失敗しました: {e}")
+
+
+async_client_registry = AsyncOpenSearchClientRegistry()
+
+
+def get_async_client():
+    """共有レジストリから実行中のイベントループのAsyncOpenSearchクライアントを取得する"""
+    return async_client_registry.get_client()
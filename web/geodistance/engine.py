@@ -0,0 +1,433 @@
+"""
+OpenSearchのGeoDistance（arc/plane）をNumPyで再現するローカル計算エンジン
+
+OpenSearchの_geo_distanceソートは次の手順で距離を求める。
+
+1. インデックスされた地点はgeo_pointのdoc valuesとして緯度経度それぞれ32bitに量子化される
+2. arcはLuceneのSloppyMath.haversinMeters（テーブル参照のcos/asin）で計算される
+3. planeはGeoUtils.planeDistance（Math.cos/Math.sqrt）で計算される
+4. メートルからunitへの変換は distance * 1.0 / unitのメートル数 で行われる
+
+このモジュールは上記をJavaと同じ演算順序で配列に対して実行する。
+SloppyMathのテーブルはJavaと同じくStrictMath（fdlibm）の計算で生成する（libmとは1ulp異なる値がある）。
+geodistance/fixtures/opensearch_parity.jsonの記録値とビット単位で一致することをテストで確認している。
+"""
+
+import math
+import struct
+from typing import Dict
+
+import numpy as np
+
+
+EARTH_MEAN_RADIUS = 6371008.7714
+
+# メートルから各単位への変換に使う、各単位の1単位あたりのメートル数（DistanceUnit）
+UNIT_METERS = {
+    "m": 1.0,
+    "km": 1000.0,
+}
+
+
+def _from_bits(bits: int) -> float:
+    return struct.unpack(">d", struct.pack(">Q", bits))[0]
+
+
+# geo_pointのdoc values量子化（GeoEncodingUtils）
+_LAT_DECODE = 1 / ((1 << 32) / 180.0)
+_LON_DECODE = 1 / ((1 << 32) / 360.0)
+
+# SloppyMath.cos
+_ONE_DIV_F2 = 1 / 2.0
+_ONE_DIV_F3 = 1 / 6.0
+_ONE_DIV_F4 = 1 / 24.0
+_PIO2_HI = _from_bits(0x3FF921FB54400000)
+_PIO2_LO = _from_bits(0x3DD0B4611A626331)
+_TWOPI_HI = 4 * _PIO2_HI
+_TWOPI_LO = 4 * _PIO2_LO
+_SIN_COS_TABS_SIZE = (1 << 11) + 1
+_SIN_COS_DELTA_HI = _TWOPI_HI / (_SIN_COS_TABS_SIZE - 1)
+_SIN_COS_DELTA_LO = _TWOPI_LO / (_SIN_COS_TABS_SIZE - 1)
+_SIN_COS_INDEXER = 1 / (_SIN_COS_DELTA_HI + _SIN_COS_DELTA_LO)
+_SIN_COS_MAX_VALUE_FOR_INT_MODULO = (((2**31 - 1) >> 9) / _SIN_COS_INDEXER) * 0.99
+
+# SloppyMath.asin
+_ASIN_MAX_VALUE_FOR_TABS = math.sin(math.radians(73.0))
+_ASIN_TABS_SIZE = (1 << 13) + 1
+_ASIN_DELTA = _ASIN_MAX_VALUE_FOR_TABS / (_ASIN_TABS_SIZE - 1)
+_ASIN_INDEXER = 1 / _ASIN_DELTA
+_ASIN_PIO2_HI = _from_bits(0x3FF921FB54442D18)
+_ASIN_PIO2_LO = _from_bits(0x3C91A62633145C07)
+_ASIN_PS0 = _from_bits(0x3FC5555555555555)
+_ASIN_PS1 = _from_bits(0xBFD4D61203EB6F7D)
+_ASIN_PS2 = _from_bits(0x3FC9C1550E884455)
+_ASIN_PS3 = _from_bits(0xBFA48228B5688F3B)
+_ASIN_PS4 = _from_bits(0x3F49EFE07501B288)
+_ASIN_PS5 = _from_bits(0x3F023DE10DFDF709)
+_ASIN_QS1 = _from_bits(0xC0033A271C8A2D4B)
+_ASIN_QS2 = _from_bits(0x40002AE59C598AC8)
+_ASIN_QS3 = _from_bits(0xBFE6066C1B8D0159)
+_ASIN_QS4 = _from_bits(0x3FB3B8C5B12E9282)
+
+
+# SloppyMathのテーブルを生成するStrictMath（fdlibm）のsin/cos/asin。テーブルの範囲（0〜2π、0〜sin(73°)）で
+# 使う分岐だけを移植する
+_FDLIBM_S1 = _from_bits(0xBFC5555555555549)
+_FDLIBM_S2 = _from_bits(0x3F8111111110F8A6)
+_FDLIBM_S3 = _from_bits(0xBF2A01A019C161D5)
+_FDLIBM_S4 = _from_bits(0x3EC71DE357B1FE7D)
+_FDLIBM_S5 = _from_bits(0xBE5AE5E68A2B9CEB)
+_FDLIBM_S6 = _from_bits(0x3DE5D93A5ACFD57C)
+_FDLIBM_C1 = _from_bits(0x3FA555555555554C)
+_FDLIBM_C2 = _from_bits(0xBF56C16C16C15177)
+_FDLIBM_C3 = _from_bits(0x3EFA01A019CB1590)
+_FDLIBM_C4 = _from_bits(0xBE927E4F809C52AD)
+_FDLIBM_C5 = _from_bits(0x3E21EE9EBDB4B1C4)
+_FDLIBM_C6 = _from_bits(0xBDA8FAE9BE8838D4)
+_FDLIBM_INVPIO2 = _from_bits(0x3FE45F306DC9C883)
+_FDLIBM_PIO2_1 = _from_bits(0x3FF921FB54400000)
+_FDLIBM_PIO2_1T = _from_bits(0x3DD0B4611A626331)
+_FDLIBM_PIO2_2 = _from_bits(0x3DD0B4611A600000)
+_FDLIBM_PIO2_2T = _from_bits(0x3BA3198A2E037073)
+_FDLIBM_PIO2_3 = _from_bits(0x3BA3198A2E000000)
+_FDLIBM_PIO2_3T = _from_bits(0x397B839A252049C1)
+_FDLIBM_PIO4_HI = _from_bits(0x3FE921FB54442D18)
+# n*π/2の上位32bit（n = 1〜32）
+_FDLIBM_NPIO2_HW = (
+    0x3FF921FB, 0x400921FB, 0x4012D97C, 0x401921FB, 0x401F6A7A, 0x4022D97C,
+    0x4025FDBB, 0x402921FB, 0x402C463A, 0x402F6A7A, 0x4031475C, 0x4032D97C,
+    0x40346A1C, 0x4035FDBB, 0x40378F5C, 0x403921FB, 0x403AB39A, 0x403C463A,
+    0x403DD8D9, 0x403F6A7A, 0x40407E0C, 0x4041475C, 0x404210AB, 0x4042D97C,
+    0x4043A24B, 0x40446A1C, 0x404532EA, 0x4045FDBB, 0x4046C68A, 0x40478F5C,
+    0x4048585B, 0x404921FB,
+)
+
+
+def _high_word(x: float) -> int:
+    return struct.unpack(">Q", struct.pack(">d", x))[0] >> 32
+
+
+def _from_words(high: int, low: int) -> float:
+    return _from_bits(((high & 0xFFFFFFFF) << 32) | (low & 0xFFFFFFFF))
+
+
+def _fdlibm_kernel_sin(x: float, y: float, iy: int) -> float:
+    if _high_word(x) & 0x7FFFFFFF < 0x3E400000 and int(x) == 0:
+        return x
+    z = x * x
+    v = z * x
+    r = _FDLIBM_S2 + z * (_FDLIBM_S3 + z * (_FDLIBM_S4 + z * (_FDLIBM_S5 + z * _FDLIBM_S6)))
+    if iy == 0:
+        return x + v * (_FDLIBM_S1 + z * r)
+    return x - ((z * (0.5 * y - v * r) - y) - v * _FDLIBM_S1)
+
+
+def _fdlibm_kernel_cos(x: float, y: float) -> float:
+    ix = _high_word(x) & 0x7FFFFFFF
+    if ix < 0x3E400000 and int(x) == 0:
+        return 1.0
+    z = x * x
+    r = z * (_FDLIBM_C1 + z * (_FDLIBM_C2 + z * (_FDLIBM_C3 + z * (_FDLIBM_C4 + z * (_FDLIBM_C5 + z * _FDLIBM_C6)))))
+    if ix < 0x3FD33333:
+        return 1.0 - (0.5 * z - (z * r - x * y))
+    qx = 0.28125 if ix > 0x3FE90000 else _from_words(ix - 0x00200000, 0)
+    hz = 0.5 * z - qx
+    a = 1.0 - qx
+    return a - (hz - (z * r - x * y))
+
+
+def _fdlibm_rem_pio2(x: float):
+    """xをπ/2で割った余り(y0, y1)と商nを返す（|x| <= 2^19*π/2の範囲のみ）"""
+    hx = _high_word(x)
+    ix = hx & 0x7FFFFFFF
+    negative = x < 0
+    if ix <= 0x3FE921FB:
+        return 0, x, 0.0
+    if ix < 0x4002D97C:
+        sign = -1.0 if negative else 1.0
+        z = x - sign * _FDLIBM_PIO2_1
+        if ix != 0x3FF921FB:
+            y0 = z - sign * _FDLIBM_PIO2_1T
+            return int(sign), y0, (z - y0) - sign * _FDLIBM_PIO2_1T
+        z -= sign * _FDLIBM_PIO2_2
+        y0 = z - sign * _FDLIBM_PIO2_2T
+        return int(sign), y0, (z - y0) - sign * _FDLIBM_PIO2_2T
+    if ix > 0x413921FB:
+        raise ValueError(f"範囲外の角度です: {x}")
+
+    t = abs(x)
+    n = int(t * _FDLIBM_INVPIO2 + 0.5)
+    fn = float(n)
+    r = t - fn * _FDLIBM_PIO2_1
+    w = fn * _FDLIBM_PIO2_1T
+    y0 = r - w
+    if not (n < 32 and ix != _FDLIBM_NPIO2_HW[n - 1]):
+        j = ix >> 20
+        i = j - ((_high_word(y0) >> 20) & 0x7FF)
+        if i > 16:
+            t = r
+            w = fn * _FDLIBM_PIO2_2
+            r = t - w
+            w = fn * _FDLIBM_PIO2_2T - ((t - r) - w)
+            y0 = r - w
+            i = j - ((_high_word(y0) >> 20) & 0x7FF)
+            if i > 49:
+                t = r
+                w = fn * _FDLIBM_PIO2_3
+                r = t - w
+                w = fn * _FDLIBM_PIO2_3T - ((t - r) - w)
+                y0 = r - w
+    y1 = (r - y0) - w
+    if negative:
+        return -n, -y0, -y1
+    return n, y0, y1
+
+
+def _fdlibm_sin(x: float) -> float:
+    n, y0, y1 = _fdlibm_rem_pio2(x)
+    if _high_word(x) & 0x7FFFFFFF <= 0x3FE921FB:
+        return _fdlibm_kernel_sin(x, 0.0, 0)
+    return (
+        _fdlibm_kernel_sin(y0, y1, 1),
+        _fdlibm_kernel_cos(y0, y1),
+        -_fdlibm_kernel_sin(y0, y1, 1),
+        -_fdlibm_kernel_cos(y0, y1),
+    )[n & 3]
+
+
+def _fdlibm_cos(x: float) -> float:
+    n, y0, y1 = _fdlibm_rem_pio2(x)
+    if _high_word(x) & 0x7FFFFFFF <= 0x3FE921FB:
+        return _fdlibm_kernel_cos(x, 0.0)
+    return (
+        _fdlibm_kernel_cos(y0, y1),
+        -_fdlibm_kernel_sin(y0, y1, 1),
+        -_fdlibm_kernel_cos(y0, y1),
+        _fdlibm_kernel_sin(y0, y1, 1),
+    )[n & 3]
+
+
+def _fdlibm_asin(x: float) -> float:
+    """0 <= x < 1のasin"""
+    ix = _high_word(x) & 0x7FFFFFFF
+    if ix < 0x3FE00000:
+        if ix < 0x3E400000:
+            return x
+        t = x * x
+        p = t * (_ASIN_PS0 + t * (_ASIN_PS1 + t * (_ASIN_PS2 + t * (_ASIN_PS3 + t * (_ASIN_PS4 + t * _ASIN_PS5)))))
+        q = 1.0 + t * (_ASIN_QS1 + t * (_ASIN_QS2 + t * (_ASIN_QS3 + t * _ASIN_QS4)))
+        return x + x * (p / q)
+
+    w = 1.0 - x
+    t = w * 0.5
+    p = t * (_ASIN_PS0 + t * (_ASIN_PS1 + t * (_ASIN_PS2 + t * (_ASIN_PS3 + t * (_ASIN_PS4 + t * _ASIN_PS5)))))
+    q = 1.0 + t * (_ASIN_QS1 + t * (_ASIN_QS2 + t * (_ASIN_QS3 + t * _ASIN_QS4)))
+    s = math.sqrt(t)
+    if ix >= 0x3FEF3333:
+        return _ASIN_PIO2_HI - (2.0 * (s + s * (p / q)) - _ASIN_PIO2_LO)
+    w = _from_words(_high_word(s), 0)
+    c = (t - w * w) / (s + w)
+    r = p / q
+    p = 2.0 * s * r - (_ASIN_PIO2_LO - 2.0 * c)
+    q = _FDLIBM_PIO4_HI - 2.0 * w
+    return _FDLIBM_PIO4_HI - (p - q)
+
+
+def _build_sin_cos_tables():
+    index = np.arange(_SIN_COS_TABS_SIZE)
+    angle = index * _SIN_COS_DELTA_HI + index * _SIN_COS_DELTA_LO
+    # JavaのStrictMathと同じfdlibmの計算で生成する
+    sin_tab = np.array([_fdlibm_sin(float(value)) for value in angle])
+    cos_tab = np.array([_fdlibm_cos(float(value)) for value in angle])
+    # sin/cosが0になる点はイプシロンではなく0にする
+    pi_index = (_SIN_COS_TABS_SIZE - 1) // 2
+    sin_tab[pi_index] = 0.0
+    sin_tab[2 * pi_index] = 0.0
+    cos_tab[pi_index // 2] = 0.0
+    cos_tab[3 * pi_index // 2] = 0.0
+    return sin_tab, cos_tab
+
+
+def _build_asin_tables():
+    x = np.arange(_ASIN_TABS_SIZE) * _ASIN_DELTA
+    one_minus_x_sq_inv = 1.0 / (1 - x * x)
+    one_minus_x_sq_inv_0_5 = np.sqrt(one_minus_x_sq_inv)
+    one_minus_x_sq_inv_1_5 = one_minus_x_sq_inv_0_5 * one_minus_x_sq_inv
+    one_minus_x_sq_inv_2_5 = one_minus_x_sq_inv_1_5 * one_minus_x_sq_inv
+    one_minus_x_sq_inv_3_5 = one_minus_x_sq_inv_2_5 * one_minus_x_sq_inv
+    return (
+        np.array([_fdlibm_asin(float(value)) for value in x]),
+        one_minus_x_sq_inv_0_5,
+        (x * one_minus_x_sq_inv_1_5) * _ONE_DIV_F2,
+        ((1 + 2 * x * x) * one_minus_x_sq_inv_2_5) * _ONE_DIV_F3,
+        ((5 + 2 * x * (2 + x * (5 - 2 * x))) * one_minus_x_sq_inv_3_5) * _ONE_DIV_F4,
+    )
+
+
+_SIN_TAB, _COS_TAB = _build_sin_cos_tables()
+(
+    _ASIN_TAB,
+    _ASIN_DER1_DIV_F1_TAB,
+    _ASIN_DER2_DIV_F2_TAB,
+    _ASIN_DER3_DIV_F3_TAB,
+    _ASIN_DER4_DIV_F4_TAB,
+) = _build_asin_tables()
+
+
+def sloppy_cos(a: np.ndarray) -> np.ndarray:
+    """LuceneのSloppyMath.cosと同じテーブル参照のcos"""
+    a = np.abs(np.asarray(a, dtype=np.float64))
+    large = a > _SIN_COS_MAX_VALUE_FOR_INT_MODULO
+    a_in_range = np.where(large, 0.0, a)
+
+    index = (a_in_range * _SIN_COS_INDEXER + 0.5).astype(np.int64)
+    delta = (a_in_range - index * _SIN_COS_DELTA_HI) - index * _SIN_COS_DELTA_LO
+    index &= _SIN_COS_TABS_SIZE - 2
+    index_cos = _COS_TAB[index]
+    index_sin = _SIN_TAB[index]
+    result = index_cos + delta * (
+        -index_sin
+        + delta
+        * (
+            -index_cos * _ONE_DIV_F2
+            + delta * (index_sin * _ONE_DIV_F3 + delta * index_cos * _ONE_DIV_F4)
+        )
+    )
+    return np.where(large, np.cos(a), result)
+
+
+def sloppy_asin(a: np.ndarray) -> np.ndarray:
+    """LuceneのSloppyMath.asinと同じテーブル参照のasin"""
+    a = np.asarray(a, dtype=np.float64)
+    negate = a < 0.0
+    a = np.abs(a)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        in_tabs = a <= _ASIN_MAX_VALUE_FOR_TABS
+        index = (np.where(in_tabs, a, 0.0) * _ASIN_INDEXER + 0.5).astype(np.int64)
+        delta = a - index * _ASIN_DELTA
+        tab_result = _ASIN_TAB[index] + delta * (
+            _ASIN_DER1_DIV_F1_TAB[index]
+            + delta
+            * (
+                _ASIN_DER2_DIV_F2_TAB[index]
+                + delta
+                * (_ASIN_DER3_DIV_F3_TAB[index] + delta * _ASIN_DER4_DIV_F4_TAB[index])
+            )
+        )
+
+        # テーブル範囲外はfdlibm由来の計算式
+        t = (1.0 - a) * 0.5
+        p = t * (
+            _ASIN_PS0
+            + t * (_ASIN_PS1 + t * (_ASIN_PS2 + t * (_ASIN_PS3 + t * (_ASIN_PS4 + t * _ASIN_PS5))))
+        )
+        q = 1.0 + t * (_ASIN_QS1 + t * (_ASIN_QS2 + t * (_ASIN_QS3 + t * _ASIN_QS4)))
+        s = np.sqrt(t)
+        z = s + s * (p / q)
+        fdlibm_result = _ASIN_PIO2_HI - ((z + z) - _ASIN_PIO2_LO)
+
+    result = np.where(
+        in_tabs,
+        tab_result,
+        np.where(a < 1.0, fdlibm_result, np.where(a == 1.0, np.pi / 2, np.nan)),
+    )
+    return np.where(negate, -result, result)
+
+
+def quantize_point(lat: np.ndarray, lon: np.ndarray):
+    """
+    geo_pointのdoc valuesと同じ32bit量子化を行う（GeoEncodingUtils）
+
+    Returns:
+        Tuple[np.ndarray, np.ndarray]: 量子化後の(緯度, 経度)
+    """
+    lat = np.asarray(lat, dtype=np.float64)
+    lon = np.asarray(lon, dtype=np.float64)
+    # 最大値はそのままではオーバーフローするため1ulp小さい値にする
+    lat = np.where(lat == 90.0, np.nextafter(90.0, 0.0), lat)
+    lon = np.where(lon == 180.0, np.nextafter(180.0, 0.0), lon)
+    encoded_lat = np.floor(lat / _LAT_DECODE).astype(np.int64)
+    encoded_lon = np.floor(lon / _LON_DECODE).astype(np.int64)
+    return encoded_lat * _LAT_DECODE, encoded_lon * _LON_DECODE
+
+
+def arc_distance(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    OpenSearchのarc距離（メートル）。SloppyMath.haversinMetersと同じ計算
+
+    Returns:
+        np.ndarray: 距離（メートル）
+    """
+    lat1 = np.asarray(lat1, dtype=np.float64)
+    lon1 = np.asarray(lon1, dtype=np.float64)
+    lat2 = np.asarray(lat2, dtype=np.float64)
+    lon2 = np.asarray(lon2, dtype=np.float64)
+
+    x1 = lat1 * (np.pi / 180.0)
+    x2 = lat2 * (np.pi / 180.0)
+    h1 = 1 - sloppy_cos(x1 - x2)
+    h2 = 1 - sloppy_cos((lon1 - lon2) * (np.pi / 180.0))
+    h = h1 + sloppy_cos(x1) * sloppy_cos(x2) * h2
+    # 丸めによる同値を避けるため下位3bitを落とす（haversinSortKey）
+    sort_key = (h.view(np.int64) & ~np.int64(7)).view(np.float64)
+
+    return EARTH_MEAN_RADIUS * 2 * sloppy_asin(
+        np.minimum(1.0, np.sqrt(sort_key * 0.5))
+    )
+
+
+def plane_distance(lat1, lon1, lat2, lon2) -> np.ndarray:
+    """
+    OpenSearchのplane距離（メートル）。GeoUtils.planeDistanceと同じ計算
+
+    Returns:
+        np.ndarray: 距離（メートル）
+    """
+    lat1 = np.asarray(lat1, dtype=np.float64)
+    lon1 = np.asarray(lon1, dtype=np.float64)
+    lat2 = np.asarray(lat2, dtype=np.float64)
+    lon2 = np.asarray(lon2, dtype=np.float64)
+
+    x = ((lon2 - lon1) * (np.pi / 180.0)) * np.cos(((lat2 + lat1) / 2.0) * (np.pi / 180.0))
+    y = (lat2 - lat1) * (np.pi / 180.0)
+    return np.sqrt(x * x + y * y) * EARTH_MEAN_RADIUS
+
+
+def compare_distances(
+    a_lat, a_lon, b_lat, b_lon, unit: str = "km", quantize_a: bool = True
+) -> Dict[str, np.ndarray]:
+    """
+    A地点配列とB地点配列の間のarc距離・plane距離とその差を計算
+
+    A地点はインデックスされたドキュメント、B地点はソートの基準点として扱う。
+    そのため quantize_a=True の場合はA地点のみdoc valuesと同じ量子化を行う
+
+    Args:
+        a_lat: A地点の緯度（スカラーまたは配列）
+        a_lon: A地点の経度
+        b_lat: B地点の緯度
+        b_lon: B地点の経度
+        unit: 距離の単位（"km" または "m"）
+        quantize_a: A地点をdoc valuesと同じく量子化するかどうか
+
+    Returns:
+        Dict[str, np.ndarray]: arc, plane, difference, difference_percentage
+    """
+    if quantize_a:
+        a_lat, a_lon = quantize_point(a_lat, a_lon)
+
+    unit_meters = UNIT_METERS[unit]
+    arc = arc_distance(b_lat, b_lon, a_lat, a_lon) * 1.0 / unit_meters
+    plane = plane_distance(b_lat, b_lon, a_lat, a_lon) * 1.0 / unit_meters
+
+    difference = np.abs(arc - plane)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        difference_percentage = np.where(arc > 0, difference / arc * 100, 0.0)
+
+    return {
+        "arc": arc,
+        "plane": plane,
+        "difference": difference,
+        "difference_percentage": difference_percentage,
+    }
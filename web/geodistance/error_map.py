@@ -0,0 +1,295 @@
+"""
+arcとplaneの差（plane距離の誤差率）を緯度経度のグリッドと距離帯ごとに事前計算した誤差マップ
+
+グリッドの各セルの中心をA地点とし、距離帯ごとに数段階の距離と方位の区画（bearings等分）ごとに
+数本の方位へB地点を置いてローカルエンジン（geodistance.engine）でarc/planeを計算し、
+plane誤差率の平均（符号付き）と最大（絶対値）をfloat32で保存する。
+planeの誤差は同じ地点・距離でも方位（東西か南北か）で符号と大きさが変わるため、方位の区画ごとに分けて持つ。
+
+近似値はセル・距離帯・方位の区画内の標本の平均から求めるため、正確な値ではなく粗い推定である。
+保存した最大誤差率が、その区画内で近似値がarcから離れうる幅の目安になる。
+
+ファイルは次のレイアウトで、データ部分はnp.memmapでそのままメモリマップできる。
+
+    MAGIC（8バイト） | ヘッダー長（uint32 LE） | ヘッダー（JSON） | 16バイト境界までのパディング |
+    float32 LE配列 [緯度セル, 経度セル, 距離帯, 方位の区画, (平均誤差率, 最大誤差率)]
+"""
+
+import json
+import logging
+import math
+import os
+import struct
+import threading
+from bisect import bisect_right
+from typing import Callable, Dict, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from . import engine
+
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"GEOERR01"
+# ヘッダーのversion。2から方位の区画の次元を持つ
+FORMAT_VERSION = 2
+# 方位の区画ごとに計算する方位の数（区画を等分した各区間の中央）
+_BEARING_SAMPLES = 3
+_HEADER_LENGTH = struct.Struct("<I")
+_DATA_ALIGNMENT = 16
+_DTYPE = np.dtype("<f4")
+
+DEFAULT_BAND_EDGES_KM = (0.0, 1.0, 10.0, 100.0, 500.0, 1000.0, 5000.0, 20000.0)
+
+
+def _destination(lat: np.ndarray, lon: np.ndarray, bearing: np.ndarray, distance_km: np.ndarray):
+    """球面上で地点から方位・距離だけ進んだ地点（経度は-180〜180度に正規化）"""
+    phi1 = np.radians(lat)
+    theta = np.radians(bearing)
+    delta = distance_km * 1000.0 / engine.EARTH_MEAN_RADIUS
+
+    sin_phi2 = np.sin(phi1) * np.cos(delta) + np.cos(phi1) * np.sin(delta) * np.cos(theta)
+    phi2 = np.arcsin(np.clip(sin_phi2, -1.0, 1.0))
+    lambda2 = np.radians(lon) + np.arctan2(
+        np.sin(theta) * np.sin(delta) * np.cos(phi1), np.cos(delta) - np.sin(phi1) * sin_phi2
+    )
+    lon2 = (np.degrees(lambda2) + 180.0) % 360.0 - 180.0
+    return np.degrees(phi2), lon2
+
+
+def _band_sample_distances(band_edges_km: Sequence[float], samples_per_band: int) -> np.ndarray:
+    """距離帯ごとに、帯の内側を対数等間隔に分けた代表距離を求める"""
+    distances = []
+    for lower, upper in zip(band_edges_km[:-1], band_edges_km[1:]):
+        lower = max(lower, upper / 1000.0)
+        # 帯の端を避けるため、samples_per_band + 1個の区間の中点を使う
+        edges = np.geomspace(lower, upper, samples_per_band + 1)
+        distances.append(np.sqrt(edges[:-1] * edges[1:]))
+    return np.array(distances)
+
+
+def build_error_map(
+    path: str,
+    resolution: float = 1.0,
+    band_edges_km: Sequence[float] = DEFAULT_BAND_EDGES_KM,
+    bearings: int = 8,
+    samples_per_band: int = 3,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> Dict:
+    """
+    誤差マップを計算してファイルに書き出す
+
+    緯度1行ずつ計算してメモリマップしたファイルに書き込むため、グリッド全体を
+    メモリに載せることはない。書き込みは一時ファイルに行い、完了後に置き換える
+
+    Args:
+        path: 出力先のファイル
+        resolution: グリッドのセルの大きさ（度）
+        band_edges_km: 距離帯の境界（km、昇順）
+        bearings: 方位の区画の数（区画kは方位k×360/bearings度を中心とする）
+        samples_per_band: 距離帯ごとに計算する距離の数
+        on_progress: (計算済みの緯度行数, 全行数)を受け取るコールバック
+
+    Returns:
+        Dict: ファイルに書き込んだヘッダー
+    """
+    band_edges_km = [float(edge) for edge in band_edges_km]
+    if len(band_edges_km) < 2 or any(b <= a for a, b in zip(band_edges_km, band_edges_km[1:])):
+        raise ValueError("距離帯の境界は2つ以上の昇順の値を指定してください")
+    if not 0 < resolution <= 90 or abs(180.0 / resolution - round(180.0 / resolution)) > 1e-9:
+        raise ValueError("resolutionは180を割り切る正の値を指定してください")
+    if bearings < 1:
+        raise ValueError("bearingsは1以上を指定してください")
+
+    n_lat = int(round(180.0 / resolution))
+    n_lon = int(round(360.0 / resolution))
+    n_bands = len(band_edges_km) - 1
+    header = {
+        "version": FORMAT_VERSION,
+        "resolution": resolution,
+        "band_edges_km": band_edges_km,
+        "bearings": bearings,
+        "samples_per_band": samples_per_band,
+        "shape": [n_lat, n_lon, n_bands, bearings, 2],
+    }
+    header_bytes = json.dumps(header).encode("utf-8")
+    prefix_length = len(MAGIC) + _HEADER_LENGTH.size + len(header_bytes)
+    data_offset = -(-prefix_length // _DATA_ALIGNMENT) * _DATA_ALIGNMENT
+
+    # 1行分の標本 [経度セル, 距離帯, 距離, 方位の区画, 区画内の方位]
+    lon_centers = -180.0 + (np.arange(n_lon) + 0.5) * resolution
+    sample_distances = _band_sample_distances(band_edges_km, samples_per_band)
+    sector_width = 360.0 / bearings
+    offsets = ((np.arange(_BEARING_SAMPLES) + 0.5) / _BEARING_SAMPLES - 0.5) * sector_width
+    bearing_angles = np.arange(bearings)[:, None] * sector_width + offsets[None, :]
+    lon_grid, distance_grid, bearing_grid = np.meshgrid(
+        lon_centers, sample_distances.ravel(), bearing_angles.ravel(), indexing="ij"
+    )
+    sample_shape = (n_lon, n_bands, samples_per_band, bearings, _BEARING_SAMPLES)
+
+    temporary_path = f"{path}.tmp"
+    with open(temporary_path, "wb") as f:
+        f.write(MAGIC)
+        f.write(_HEADER_LENGTH.pack(len(header_bytes)))
+        f.write(header_bytes)
+        f.write(b"\0" * (data_offset - prefix_length))
+        f.truncate(data_offset + n_lat * n_lon * n_bands * bearings * 2 * _DTYPE.itemsize)
+
+    try:
+        data = np.memmap(
+            temporary_path, dtype=_DTYPE, mode="r+", offset=data_offset, shape=tuple(header["shape"])
+        )
+        for row in range(n_lat):
+            lat = -90.0 + (row + 0.5) * resolution
+            b_lat, b_lon = _destination(lat, lon_grid, bearing_grid, distance_grid)
+            distances = engine.compare_distances(
+                np.full(lon_grid.shape, lat), lon_grid, b_lat, b_lon, quantize_a=False
+            )
+            arc = distances["arc"].reshape(sample_shape)
+            plane = distances["plane"].reshape(sample_shape)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                error_percentage = np.where(arc > 0, (plane - arc) / arc * 100, 0.0)
+            data[row, :, :, :, 0] = error_percentage.mean(axis=(2, 4))
+            data[row, :, :, :, 1] = np.abs(error_percentage).max(axis=(2, 4))
+
+            if on_progress is not None:
+                on_progress(row + 1, n_lat)
+        data.flush()
+        del data
+        os.replace(temporary_path, path)
+    except BaseException:
+        os.remove(temporary_path)
+        raise
+
+    logger.info(
+        f"誤差マップを '{path}' に書き出しました（{n_lat}x{n_lon}セル、{n_bands}距離帯、{bearings}方位）"
+    )
+    return header
+
+
+def _haversine_km(a_lat: float, a_lon: float, b_lat: float, b_lon: float) -> float:
+    """標準ライブラリのmathによるhaversine距離（km）"""
+    phi1 = math.radians(a_lat)
+    phi2 = math.radians(b_lat)
+    h = (
+        math.sin((phi2 - phi1) / 2) ** 2
+        + math.cos(phi1) * math.cos(phi2) * math.sin(math.radians(b_lon - a_lon) / 2) ** 2
+    )
+    return 2 * engine.EARTH_MEAN_RADIUS * math.asin(min(1.0, math.sqrt(h))) / 1000.0
+
+
+def _initial_bearing(a_lat: float, a_lon: float, b_lat: float, b_lon: float) -> float:
+    """A地点からB地点への初期方位（度、北を0とした時計回りの0〜360）"""
+    phi1 = math.radians(a_lat)
+    phi2 = math.radians(b_lat)
+    delta_lambda = math.radians(b_lon - a_lon)
+    y = math.sin(delta_lambda) * math.cos(phi2)
+    x = math.cos(phi1) * math.sin(phi2) - math.sin(phi1) * math.cos(phi2) * math.cos(delta_lambda)
+    return math.degrees(math.atan2(y, x)) % 360.0
+
+
+class ErrorMap:
+    """メモリマップした誤差マップ"""
+
+    def __init__(self, path: str):
+        with open(path, "rb") as f:
+            if f.read(len(MAGIC)) != MAGIC:
+                raise ValueError(f"誤差マップのファイルではありません: {path}")
+            (header_length,) = _HEADER_LENGTH.unpack(f.read(_HEADER_LENGTH.size))
+            self.header = json.loads(f.read(header_length).decode("utf-8"))
+        if self.header.get("version") != FORMAT_VERSION:
+            raise ValueError(
+                f"誤差マップの形式が古いため、build_geo_error_mapで作り直してください: {path}"
+            )
+
+        prefix_length = len(MAGIC) + _HEADER_LENGTH.size + header_length
+        data_offset = -(-prefix_length // _DATA_ALIGNMENT) * _DATA_ALIGNMENT
+        self.path = path
+        self.resolution = self.header["resolution"]
+        self.band_edges_km = self.header["band_edges_km"]
+        self.data = np.memmap(
+            path, dtype=_DTYPE, mode="r", offset=data_offset, shape=tuple(self.header["shape"])
+        )
+        self._n_lat, self._n_lon, _, self._n_bearings = self.data.shape[:4]
+
+    def lookup(
+        self, lat: float, lon: float, distance_km: float, bearing: Optional[float] = None
+    ) -> Optional[Tuple[float, float]]:
+        """
+        地点のセル・距離の距離帯・方位の区画から、plane誤差率の平均（符号付き）と最大（絶対値）を返す
+        bearingがNoneの場合はすべての方位をまとめた値（平均の平均と、最大の最大）を返す
+
+        Returns:
+            Optional[Tuple[float, float]]: (平均誤差率, 最大誤差率)（%）、距離帯の範囲外の場合はNone
+        """
+        band = bisect_right(self.band_edges_km, distance_km) - 1
+        if band < 0 or band >= len(self.band_edges_km) - 1:
+            return None
+        row = min(int((lat + 90.0) / self.resolution), self._n_lat - 1)
+        column = min(int((lon + 180.0) / self.resolution), self._n_lon - 1)
+        sectors = self.data[row, column, band]
+        if bearing is None:
+            return float(sectors[:, 0].mean()), float(sectors[:, 1].max())
+        sector = int(round(bearing * self._n_bearings / 360.0)) % self._n_bearings
+        mean_error, max_error = sectors[sector]
+        return float(mean_error), float(max_error)
+
+    def approximate(
+        self, a_lat: float, a_lon: float, b_lat: float, b_lon: float
+    ) -> Optional[Tuple[float, float, float]]:
+        """
+        A地点とB地点間のarc距離と、誤差マップから推定したplane距離を求める
+        arc距離はhaversine、plane距離はarc距離に、A地点のセル・距離帯・B地点への方位の区画の
+        平均誤差率を掛けた値（区画内の粗い推定で、ずれの目安は最大誤差率）
+
+        Returns:
+            Optional[Tuple[float, float, float]]: (arc距離, plane距離, 最大誤差率)、範囲外の場合はNone
+        """
+        arc_km = _haversine_km(a_lat, a_lon, b_lat, b_lon)
+        errors = self.lookup(a_lat, a_lon, arc_km, _initial_bearing(a_lat, a_lon, b_lat, b_lon))
+        if errors is None:
+            return None
+        mean_error, max_error = errors
+        return arc_km, arc_km * (1 + mean_error / 100), max_error
+
+
+class ErrorMapStore:
+    """
+    GEO_DISTANCE_ERROR_MAP_PATHの誤差マップを一度だけメモリマップして共有する
+    パスが未設定、または読み込みに失敗した場合はNoneを返す
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._error_map: Optional[ErrorMap] = None
+
+    def get(self) -> Optional[ErrorMap]:
+        if not self._loaded:
+            with self._lock:
+                if not self._loaded:
+                    self._error_map = self._load(settings.GEO_DISTANCE_ERROR_MAP_PATH)
+                    self._loaded = True
+        return self._error_map
+
+    def _load(self, path: str) -> Optional[ErrorMap]:
+        if not path:
+            return None
+        try:
+            error_map = ErrorMap(path)
+            logger.info(f"誤差マップ '{path}' を読み込みました（{error_map.header['shape']}）")
+            return error_map
+        except Exception as e:
+            logger.error(f"誤差マップ '{path}' の読み込みに失敗しました: {e}")
+            return None
+
+    def reset(self) -> None:
+        """次のget()で設定から読み込み直す"""
+        with self._lock:
+            self._loaded = False
+            self._error_map = None
+
+
+error_map_store = ErrorMapStore()
@@ -0,0 +1,713 @@
+import fnmatch
+import json
+import random
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from . import engine
+from .instrumentation import api_name
+
+
+class FakeOpenSearchServer:
+    """
+    ベンチマークとテスト用に、OpenSearchの一部のAPIを再現するローカルのHTTPサーバー
+    インデックスの作成・存在確認・設定、インデックステンプレート、エイリアス、_reindex、ドキュメントの登録、_bulk、_search（ids/term/geo_distance/boolと
+    _geo_distanceソート、search_after、script_fields、geo_distance/geohash_grid集計）、_msearch、
+    painless execute APIに応答する。
+    距離はgeodistance.engineで計算するため、OpenSearchと同じ値を返す。
+    各リクエストにはlatency_ms（±jitter_ms）の遅延を加え、API別の呼び出し回数と送受信したバイト数を記録する。
+    filter_pathとtrack_total_hits: falseはOpenSearchと同じく応答を絞り込む。
+    inject_faultでAPIごとにエラー応答や遅延を注入できる
+    """
+
+    def __init__(
+        self,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self._lock = threading.Lock()
+        self._calls: Counter = Counter()
+        self._traffic: Counter = Counter()
+        self._responses: "deque[bytes]" = deque(maxlen=1000)
+        self._indices: Dict[str, Dict[str, Dict]] = {}
+        self._settings: Dict[str, Dict[str, str]] = {}
+        self._mappings: Dict[str, Dict] = {}
+        self._templates: Dict[str, Dict] = {}
+        self._aliases: Dict[str, set] = {}
+        self._faults: List[Dict] = []
+        self.health_status = "green"
+        # _nodes/httpで返すノードの "host:port"（Noneの場合はこのサーバーだけ）
+        self.cluster_nodes: Optional[List[str]] = None
+        self._httpd = ThreadingHTTPServer((host, port), _make_handler(self))
+        self._httpd.daemon_threads = True
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def host(self) -> str:
+        return self._httpd.server_address[0]
+
+    @property
+    def port(self) -> int:
+        return self._httpd.server_address[1]
+
+    @property
+    def url(self) -> str:
+        return f"http://{self.host}:{self.port}"
+
+    def start(self) -> "FakeOpenSearchServer":
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self) -> "FakeOpenSearchServer":
+        return self.start()
+
+    def __exit__(self, *exc_info) -> None:
+        self.stop()
+
+    def calls(self) -> Dict[str, int]:
+        """API別の呼び出し回数を返す"""
+        with self._lock:
+            return dict(self._calls)
+
+    def total_calls(self) -> int:
+        with self._lock:
+            return sum(self._calls.values())
+
+    def reset_calls(self) -> None:
+        with self._lock:
+            self._calls.clear()
+            self._traffic.clear()
+            self._responses.clear()
+
+    def traffic(self) -> Dict[str, int]:
+        """受信したリクエストボディと送信したレスポンスボディの合計バイト数を返す"""
+        with self._lock:
+            return {"request_bytes": self._traffic["request_bytes"], "response_bytes": self._traffic["response_bytes"]}
+
+    def recent_responses(self) -> List[bytes]:
+        """直近に送信したレスポンスボディ（最大1000件）を返す"""
+        with self._lock:
+            return list(self._responses)
+
+    def _record_traffic(self, request: bytes, response: bytes) -> None:
+        with self._lock:
+            self._traffic["request_bytes"] += len(request)
+            self._traffic["response_bytes"] += len(response)
+            if response:
+                self._responses.append(response)
+
+    def _record(self, api: str) -> None:
+        with self._lock:
+            self._calls[api] += 1
+
+    def documents(self, index: str) -> Dict[str, Dict]:
+        """インデックス（またはエイリアスが指すインデックス）に登録されているドキュメントを返す"""
+        with self._lock:
+            return dict(self._indices.get(self._resolve(index), {}))
+
+    def index_settings(self, index: str) -> Dict[str, str]:
+        """インデックスの設定（refresh_interval・number_of_replicas・number_of_shards）を返す"""
+        with self._lock:
+            return dict(self._settings.get(self._resolve(index), {"number_of_replicas": "1"}))
+
+    def index_mappings(self, index: str) -> Dict:
+        """インデックスの作成時に指定された（テンプレートを含む）マッピングを返す"""
+        with self._lock:
+            return dict(self._mappings.get(self._resolve(index), {}))
+
+    def aliases(self) -> Dict[str, List[str]]:
+        """エイリアスごとに指しているインデックスを返す"""
+        with self._lock:
+            return {alias: sorted(indices) for alias, indices in self._aliases.items() if indices}
+
+    def _resolve(self, name: Optional[str]) -> Optional[str]:
+        """インデックス名かエイリアス名から、1つのインデックス名を求める（ロックを保持して呼ぶ）"""
+        if name in self._indices:
+            return name
+        indices = self._aliases.get(name)
+        if indices and len(indices) == 1:
+            return next(iter(indices))
+        return name
+
+    def inject_fault(
+        self, api: Optional[str] = None, status: Optional[int] = 503, delay_ms: float = 0.0, count: int = 1
+    ) -> None:
+        """
+        次のcount回の呼び出し（apiを指定した場合はそのAPIのみ）にdelay_msの遅延を加え、
+        statusのエラーを返す（statusがNoneの場合は遅延のみで通常どおり応答する）
+        """
+        with self._lock:
+            self._faults.append({"api": api, "status": status, "delay_ms": delay_ms, "remaining": count})
+
+    def _take_fault(self, api: str) -> Optional[Dict]:
+        with self._lock:
+            for fault in self._faults:
+                if fault["api"] in (None, api) and fault["remaining"] > 0:
+                    fault["remaining"] -= 1
+                    return fault
+        return None
+
+    def _sleep(self) -> float:
+        """設定された遅延を加え、遅延した時間（ミリ秒）を返す"""
+        delay = self.latency_ms
+        if self.jitter_ms:
+            delay = max(0.0, delay + random.uniform(-self.jitter_ms, self.jitter_ms))
+        if delay > 0:
+            time.sleep(delay / 1000.0)
+        return delay
+
+    # --- API ---
+
+    def handle(self, method: str, path: str, params: Dict, body: bytes) -> Tuple[int, Optional[Dict]]:
+        """リクエストをAPIに振り分け、(ステータス, レスポンスボディ)を返す"""
+        started = time.perf_counter()
+        self._sleep()
+        fault = self._take_fault(api_name(method, path))
+        if fault is not None:
+            time.sleep(fault["delay_ms"] / 1000.0)
+            if fault["status"] is not None:
+                self._record(api_name(method, path))
+                return fault["status"], {
+                    "error": {"type": "injected_fault", "reason": "injected fault"}, "status": fault["status"],
+                }
+        parts = [part for part in path.split("/") if part]
+
+        if not parts:
+            self._record("info")
+            return 200, {"version": {"number": "2.19.0", "distribution": "opensearch"}}
+
+        if parts[0] == "_nodes":
+            self._record("nodes.info")
+            addresses = self.cluster_nodes or [f"{self.host}:{self.port}"]
+            return 200, {
+                "nodes": {
+                    f"node-{i}": {"name": f"node-{i}", "roles": ["data", "ingest"], "http": {"publish_address": address}}
+                    for i, address in enumerate(addresses)
+                }
+            }
+
+        if parts == ["_cluster", "health"]:
+            self._record("cluster.health")
+            return 200, {"status": self.health_status}
+
+        if parts == ["_scripts", "painless", "_execute"]:
+            self._record("scripts_painless_execute")
+            return 200, self._painless_execute(json.loads(body))
+
+        if parts[0] == "_index_template" and len(parts) == 2:
+            name = parts[1]
+            if method == "PUT":
+                self._record("indices.put_index_template")
+                with self._lock:
+                    self._templates[name] = json.loads(body)
+                return 200, {"acknowledged": True}
+            self._record("indices.get_index_template")
+            with self._lock:
+                template = self._templates.get(name)
+            if template is None:
+                return 404, _error("resource_not_found_exception", name)
+            return 200, {"index_templates": [{"name": name, "index_template": template}]}
+
+        if parts[0] == "_alias" and len(parts) == 2:
+            self._record("indices.get_alias")
+            with self._lock:
+                indices = sorted(self._aliases.get(parts[1], ()))
+            if not indices:
+                return 404, {"error": f"alias [{parts[1]}] missing", "status": 404}
+            return 200, {index: {"aliases": {parts[1]: {}}} for index in indices}
+
+        if parts == ["_aliases"]:
+            self._record("indices.update_aliases")
+            return self._update_aliases(json.loads(body)["actions"])
+
+        if parts == ["_reindex"]:
+            self._record("reindex")
+            return self._reindex(json.loads(body), started)
+
+        if parts[-1] == "_bulk":
+            self._record("bulk")
+            default_index = parts[0] if len(parts) > 1 else None
+            return 200, self._bulk(default_index, body, started)
+
+        if parts[-1] == "_msearch":
+            self._record("msearch")
+            default_index = parts[0] if len(parts) > 1 else None
+            return 200, self._msearch(default_index, body, started)
+
+        index = parts[0]
+        if len(parts) == 1:
+            if method == "HEAD":
+                self._record("indices.exists")
+                with self._lock:
+                    exists = index in self._indices or bool(self._aliases.get(index))
+                return (200 if exists else 404), None
+            if method == "PUT":
+                self._record("indices.create")
+                return self._create_index(index, json.loads(body) if body else {})
+            if method == "DELETE":
+                self._record("indices.delete")
+                with self._lock:
+                    self._indices.pop(index, None)
+                    for indices in self._aliases.values():
+                        indices.discard(index)
+                return 200, {"acknowledged": True}
+
+        with self._lock:
+            index = self._resolve(index)
+
+        if index not in self._indices:
+            self._record(parts[1].lstrip("_") if len(parts) > 1 else "unknown")
+            return 404, _error("index_not_found_exception", index)
+
+        api = parts[1]
+        if api == "_search":
+            self._record("search")
+            query = json.loads(body) if body else {}
+            if "size" in params:
+                query["size"] = int(params["size"])
+            return 200, self._search(index, query, started)
+        if api == "_settings":
+            self._record("indices.put_settings" if method == "PUT" else "indices.get_settings")
+            with self._lock:
+                index_settings = self._settings.setdefault(index, {"number_of_replicas": "1"})
+                if method != "PUT":
+                    return 200, {index: {"settings": {"index": dict(index_settings)}}}
+                for key, value in json.loads(body).get("index", {}).items():
+                    if value is None:
+                        index_settings.pop(key, None)
+                    else:
+                        index_settings[key] = str(value)
+            return 200, {"acknowledged": True}
+        if api == "_refresh":
+            self._record("indices.refresh")
+            return 200, {"_shards": {"total": 1, "successful": 1, "failed": 0}}
+        if api == "_delete_by_query":
+            self._record("delete_by_query")
+            return 200, self._delete_by_query(index, json.loads(body))
+        if api == "_doc" and len(parts) == 3:
+            doc_id = parts[2]
+            if method == "DELETE":
+                self._record("delete")
+                with self._lock:
+                    found = self._indices[index].pop(doc_id, None) is not None
+                return (200 if found else 404), {"_id": doc_id, "result": "deleted" if found else "not_found"}
+            self._record("index")
+            with self._lock:
+                self._indices[index][doc_id] = json.loads(body)
+            return 201, {"_index": index, "_id": doc_id, "result": "created"}
+
+        self._record("unknown")
+        return 400, _error("illegal_argument_exception", path)
+
+    def _create_index(self, index: str, body: Dict) -> Tuple[int, Dict]:
+        """一致するインデックステンプレートのうち優先度が最も高いものと、ボディの設定を合わせて作成する"""
+        with self._lock:
+            if index in self._indices:
+                return 400, _error("resource_already_exists_exception", index)
+            if self._aliases.get(index):
+                return 400, _error("invalid_index_name_exception", index)
+            templates = [
+                template
+                for template in self._templates.values()
+                if any(fnmatch.fnmatchcase(index, pattern) for pattern in template.get("index_patterns", []))
+            ]
+            template = max(templates, key=lambda t: t.get("priority", 0))["template"] if templates else {}
+
+            index_settings = {"number_of_replicas": "1"}
+            for source in (template, body):
+                for key, value in source.get("settings", {}).get("index", {}).items():
+                    index_settings[key] = str(value)
+            self._indices[index] = {}
+            self._settings[index] = index_settings
+            self._mappings[index] = body.get("mappings") or template.get("mappings") or {}
+            for alias in {**template.get("aliases", {}), **body.get("aliases", {})}:
+                self._aliases.setdefault(alias, set()).add(index)
+        return 200, {"acknowledged": True, "index": index}
+
+    def _update_aliases(self, actions: List[Dict]) -> Tuple[int, Dict]:
+        """add・remove・remove_indexをまとめて（途中の状態が見えないように）適用する"""
+        with self._lock:
+            for action in actions:
+                (name, options), = action.items()
+                if options["index"] not in self._indices:
+                    return 404, _error("index_not_found_exception", options["index"])
+            for action in actions:
+                (name, options), = action.items()
+                if name == "add":
+                    self._aliases.setdefault(options["alias"], set()).add(options["index"])
+                elif name == "remove":
+                    self._aliases.get(options["alias"], set()).discard(options["index"])
+                elif name == "remove_index":
+                    self._indices.pop(options["index"], None)
+                    for indices in self._aliases.values():
+                        indices.discard(options["index"])
+        return 200, {"acknowledged": True}
+
+    def _reindex(self, body: Dict, started: float) -> Tuple[int, Dict]:
+        with self._lock:
+            source = self._resolve(body["source"]["index"])
+            dest = self._resolve(body["dest"]["index"])
+            if source not in self._indices:
+                return 404, _error("index_not_found_exception", body["source"]["index"])
+            documents = dict(self._indices[source])
+            self._indices.setdefault(dest, {}).update(documents)
+        return 200, {"took": _took(started), "total": len(documents), "created": len(documents), "failures": []}
+
+    def _painless_execute(self, body: Dict) -> Dict:
+        script = body["script"]
+        document = body["context_setup"]["document"]["location"]
+        params = script["params"]
+        distances = engine.compare_distances(
+            document["lat"], document["lon"], params["lat"], params["lon"], unit="m"
+        )
+        distance_type = "arc" if "arcDistance" in script["source"] else "plane"
+        # DISTANCE_SCRIPTSと同じくメートルを1000.0で割ってkmで返す
+        return {"result": float(distances[distance_type]) / 1000.0}
+
+    def _bulk(self, default_index: Optional[str], body: bytes, started: float) -> Dict:
+        lines = [json.loads(line) for line in body.splitlines() if line.strip()]
+        items = []
+        position = 0
+        with self._lock:
+            while position < len(lines):
+                action, meta = next(iter(lines[position].items()))
+                position += 1
+                index = self._resolve(meta.get("_index", default_index))
+                documents = self._indices.setdefault(index, {})
+                if action == "delete":
+                    found = documents.pop(meta["_id"], None) is not None
+                    items.append({"delete": {"_id": meta["_id"], "status": 200 if found else 404}})
+                    continue
+                doc_id = meta.get("_id") or uuid.uuid4().hex
+                documents[doc_id] = lines[position]
+                position += 1
+                items.append({action: {"_id": doc_id, "status": 201, "result": "created"}})
+
+        return {"took": _took(started), "errors": False, "items": items}
+
+    def _msearch(self, default_index: Optional[str], body: bytes, started: float) -> Dict:
+        lines = [json.loads(line) for line in body.splitlines() if line.strip()]
+        responses = []
+        for header, query in zip(lines[0::2], lines[1::2]):
+            with self._lock:
+                index = self._resolve(header.get("index", default_index))
+            if index not in self._indices:
+                responses.append({**_error("index_not_found_exception", index), "status": 404})
+                continue
+            responses.append({**self._search(index, query, started), "status": 200})
+        return {"took": _took(started), "responses": responses}
+
+    def _delete_by_query(self, index: str, body: Dict) -> Dict:
+        with self._lock:
+            documents = self._indices[index]
+            doc_ids = [doc_id for doc_id, source in documents.items() if _matches(doc_id, source, body.get("query"))]
+            for doc_id in doc_ids:
+                del documents[doc_id]
+        return {"deleted": len(doc_ids), "failures": []}
+
+    def _search(self, index: str, query: Dict, started: float) -> Dict:
+        with self._lock:
+            candidates = [
+                (doc_id, source)
+                for doc_id, source in self._indices[index].items()
+                if _matches(doc_id, source, query.get("query"))
+            ]
+
+        sort_columns = [_sort_values(clause, candidates) for clause in query.get("sort", [])]
+        rows = [
+            (tuple(column[i] for column in sort_columns), doc_id, source)
+            for i, (doc_id, source) in enumerate(candidates)
+        ]
+        rows.sort(key=lambda row: row[0])
+        if "search_after" in query:
+            after = tuple(query["search_after"])
+            rows = [row for row in rows if row[0] > after]
+
+        size = query.get("size", 10)
+        source_filter = query.get("_source", True)
+        include_source = source_filter is not False
+        hits = []
+        for sort, doc_id, source in rows[:size]:
+            hit = {"_index": index, "_id": doc_id, "_score": None}
+            if include_source:
+                if isinstance(source_filter, list):
+                    hit["_source"] = {key: value for key, value in source.items() if key in source_filter}
+                else:
+                    hit["_source"] = source
+            if "script_fields" in query:
+                hit["fields"] = _script_fields(query["script_fields"], source)
+            if sort_columns:
+                hit["sort"] = list(sort)
+            hits.append(hit)
+
+        response = {
+            "took": _took(started),
+            "timed_out": False,
+            "_shards": {"total": 1, "successful": 1, "skipped": 0, "failed": 0},
+            "hits": {"total": {"value": len(candidates), "relation": "eq"}, "max_score": None, "hits": hits},
+        }
+        if query.get("track_total_hits") is False:
+            del response["hits"]["total"]
+        if "aggs" in query:
+            response["aggregations"] = _aggregations(query["aggs"], [source for _, source in candidates])
+        return response
+
+
+def _took(started: float) -> int:
+    """OpenSearchのtookと同じくサーバー側の処理時間をミリ秒の整数で返す"""
+    return int((time.perf_counter() - started) * 1000)
+
+
+def _error(error_type: str, index: str) -> Dict:
+    return {
+        "error": {"root_cause": [{"type": error_type, "reason": index}], "type": error_type, "reason": index},
+        "status": 404 if error_type == "index_not_found_exception" else 400,
+    }
+
+
+def _matches(doc_id: str, source: Dict, query: Optional[Dict]) -> bool:
+    """ids・term・prefix（_idのみ）・geo_distance・bool（filter/must）・match_allクエリを評価する"""
+    if not query or "match_all" in query:
+        return True
+    if "ids" in query:
+        return doc_id in query["ids"]["values"]
+    if "prefix" in query and "_id" in query["prefix"]:
+        value = query["prefix"]["_id"]
+        if isinstance(value, dict):
+            value = value["value"]
+        return doc_id.startswith(value)
+    if "term" in query:
+        field, value = next(iter(query["term"].items()))
+        if isinstance(value, dict):
+            value = value["value"]
+        return source.get(field) == value
+    if "geo_distance" in query:
+        options = query["geo_distance"]
+        point = options["location"]
+        distance = float(
+            engine.arc_distance(point["lat"], point["lon"], *_quantized_location(source))
+        )
+        return distance <= _parse_distance(options["distance"])
+    if "bool" in query:
+        clauses = []
+        for occur in ("filter", "must"):
+            value = query["bool"].get(occur, [])
+            clauses.extend(value if isinstance(value, list) else [value])
+        return all(_matches(doc_id, source, clause) for clause in clauses)
+    raise ValueError(f"未対応のクエリです: {query}")
+
+
+def _quantized_location(source: Dict) -> Tuple[float, float]:
+    lat, lon = engine.quantize_point(source["location"]["lat"], source["location"]["lon"])
+    return float(lat), float(lon)
+
+
+def _parse_distance(distance: str) -> float:
+    """"10km"・"500m"などの距離をメートルにする"""
+    for unit in sorted(engine.UNIT_METERS, key=len, reverse=True):
+        if distance.endswith(unit):
+            return float(distance[: -len(unit)]) * engine.UNIT_METERS[unit]
+    return float(distance)
+
+
+def _script_fields(script_fields: Dict, source: Dict) -> Dict:
+    """DISTANCE_SCRIPTSと同じarcDistance/planeDistanceのスクリプトを評価する"""
+    fields = {}
+    lat, lon = _quantized_location(source)
+    for name, options in script_fields.items():
+        script = options["script"]
+        params = script["params"]
+        if "arcDistance" in script["source"]:
+            distance = engine.arc_distance(params["lat"], params["lon"], lat, lon)
+        elif "planeDistance" in script["source"]:
+            distance = engine.plane_distance(params["lat"], params["lon"], lat, lon)
+        else:
+            raise ValueError(f"未対応のスクリプトです: {script['source']}")
+        fields[name] = [float(distance) / 1000.0]
+    return fields
+
+
+def _sort_values(clause, candidates: List[Tuple[str, Dict]]) -> List:
+    """ソート句ごとに各ドキュメントのソート値を求める"""
+    if isinstance(clause, dict) and "_geo_distance" in clause:
+        options = clause["_geo_distance"]
+        point = options["location"]
+        if not candidates:
+            return []
+        lat = np.array([source["location"]["lat"] for _, source in candidates], dtype=np.float64)
+        lon = np.array([source["location"]["lon"] for _, source in candidates], dtype=np.float64)
+        distances = engine.compare_distances(
+            lat, lon, point["lat"], point["lon"], unit=options.get("unit", "m")
+        )
+        return distances[options.get("distance_type", "arc")].tolist()
+
+    field = clause if isinstance(clause, str) else next(iter(clause))
+    return [source.get(field) for _, source in candidates]
+
+
+_MISSING = object()
+
+
+def _filter_path(value, patterns: List[List[str]]):
+    """
+    filter_pathの各パス（"."区切り、"*"は任意のキー）に一致する部分だけを残す
+    OpenSearchと同じく、一致する部分のないオブジェクトは配列からも省く
+    """
+    if any(not pattern for pattern in patterns):
+        return value
+    if isinstance(value, list):
+        items = [_filter_path(item, patterns) for item in value]
+        items = [item for item in items if item is not _MISSING]
+        return items or _MISSING
+    if isinstance(value, dict):
+        result = {}
+        for key, child in value.items():
+            rest = [pattern[1:] for pattern in patterns if pattern[0] in ("*", key)]
+            if rest:
+                filtered = _filter_path(child, rest)
+                if filtered is not _MISSING:
+                    result[key] = filtered
+        return result or _MISSING
+    return _MISSING
+
+
+def _aggregations(aggs: Dict, sources: List[Dict]) -> Dict:
+    """geo_distance（範囲）とgeohash_grid集計を、入れ子の集計を含めて評価する"""
+    results = {}
+    for name, options in aggs.items():
+        if "geo_distance" in options:
+            results[name] = {"buckets": _geo_distance_buckets(options["geo_distance"], options.get("aggs"), sources)}
+        elif "geohash_grid" in options:
+            results[name] = {"buckets": _geohash_grid_buckets(options["geohash_grid"], options.get("aggs"), sources)}
+        else:
+            raise ValueError(f"未対応の集計です: {options}")
+    return results
+
+
+def _geo_distance_buckets(options: Dict, sub_aggs: Optional[Dict], sources: List[Dict]) -> List[Dict]:
+    """OpenSearchと同じくfromを含みtoを含まない範囲ごとにドキュメントを数える"""
+    origin = options["origin"]
+    distances = []
+    for source in sources:
+        lat, lon = _quantized_location(source)
+        if options.get("distance_type", "arc") == "plane":
+            distance = engine.plane_distance(origin["lat"], origin["lon"], lat, lon)
+        else:
+            distance = engine.arc_distance(origin["lat"], origin["lon"], lat, lon)
+        distances.append(float(distance) / engine.UNIT_METERS[options.get("unit", "m")])
+
+    buckets = []
+    for bounds in options["ranges"]:
+        start, end = bounds.get("from"), bounds.get("to")
+        members = [
+            source
+            for source, distance in zip(sources, distances)
+            if (start is None or distance >= start) and (end is None or distance < end)
+        ]
+        bucket = {"key": f"{'*' if start is None else start}-{'*' if end is None else end}", "doc_count": len(members)}
+        if start is not None:
+            bucket["from"] = start
+        if end is not None:
+            bucket["to"] = end
+        if sub_aggs:
+            bucket.update(_aggregations(sub_aggs, members))
+        buckets.append(bucket)
+    return buckets
+
+
+def _geohash_grid_buckets(options: Dict, sub_aggs: Optional[Dict], sources: List[Dict]) -> List[Dict]:
+    """geohashのセルごとにドキュメントを数え、件数の多い順にsize件を返す"""
+    cells: Dict[str, List[Dict]] = {}
+    for source in sources:
+        cells.setdefault(_geohash(*_quantized_location(source), options.get("precision", 5)), []).append(source)
+
+    buckets = []
+    for key, members in sorted(cells.items(), key=lambda item: (-len(item[1]), item[0]))[: options.get("size", 10000)]:
+        bucket = {"key": key, "doc_count": len(members)}
+        if sub_aggs:
+            bucket.update(_aggregations(sub_aggs, members))
+        buckets.append(bucket)
+    return buckets
+
+
+_GEOHASH_ALPHABET = "0123456789bcdefghjkmnpqrstuvwxyz"
+
+
+def _geohash(lat: float, lon: float, precision: int) -> str:
+    """緯度経度をprecision文字のgeohashにする"""
+    lat_range, lon_range = [-90.0, 90.0], [-180.0, 180.0]
+    characters = []
+    bits, value, even = 0, 0, True
+    while len(characters) < precision:
+        bounds, coordinate = (lon_range, lon) if even else (lat_range, lat)
+        middle = (bounds[0] + bounds[1]) / 2
+        value <<= 1
+        if coordinate >= middle:
+            value |= 1
+            bounds[0] = middle
+        else:
+            bounds[1] = middle
+        even = not even
+        bits += 1
+        if bits == 5:
+            characters.append(_GEOHASH_ALPHABET[value])
+            bits, value = 0, 0
+    return "".join(characters)
+
+
+def _make_handler(server: FakeOpenSearchServer):
+    class Handler(BaseHTTPRequestHandler):
+        # opensearch-pyのkeep-alive接続をそのまま使えるようにHTTP/1.1で応答する
+        protocol_version = "HTTP/1.1"
+        # ヘッダーとボディを別々に書き込むため、Nagleアルゴリズムによる遅延を避ける
+        disable_nagle_algorithm = True
+
+        def _dispatch(self):
+            url = urlsplit(self.path)
+            params = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length) if length else b""
+
+            try:
+                status, response = server.handle(self.command, url.path, params, body)
+            except Exception as e:
+                status, response = 500, {"error": {"type": "exception", "reason": str(e)}, "status": 500}
+
+            if response is not None and status < 300 and params.get("filter_path"):
+                patterns = [path.split(".") for path in params["filter_path"].split(",")]
+                filtered = _filter_path(response, patterns)
+                response = {} if filtered is _MISSING else filtered
+
+            payload = b"" if response is None else json.dumps(response).encode("utf-8")
+            server._record_traffic(body, payload)
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json; charset=UTF-8")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            if self.command != "HEAD":
+                self.wfile.write(payload)
+
+        do_GET = do_POST = do_PUT = do_DELETE = do_HEAD = _dispatch
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
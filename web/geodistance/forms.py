@@ -55,6 +55,15 @@ class GeoDistanceForm(forms.Form):
         help_text="経度は-180度から180度の範囲で入力してください",
     )
 
+    approximate = forms.BooleanField(
+        label="誤差マップの近似値で計算する",
+        required=False,
+        help_text=(
+            "OpenSearchに問い合わせず、事前計算した誤差マップから粗い近似値を求めます"
+            "（誤差マップがない場合や距離帯の範囲外の場合はOpenSearchで計算します）"
+        ),
+    )
+
     def clean(self):
         cleaned_data = super().clean()
         a_lat = cleaned_data.get("a_latitude")
@@ -0,0 +1,230 @@
+"""
+計算結果の履歴と、誤差の集計
+
+GeoDistanceServiceの計算結果はHistoryRecorderのバッファに追加するだけで、リクエストの処理中には
+データベースに書き込まない。バックグラウンドのスレッドがbatch_size件ごと（またはflush_interval秒ごと）に
+bulk_createでまとめて登録し、同じトランザクションで日付・距離帯・緯度帯ごとの集計
+（DistanceErrorRollup）に加算する
+"""
+
+import atexit
+import bisect
+import logging
+import math
+import os
+import threading
+from collections import deque
+from datetime import date
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import F, Max, Sum
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .error_map import DEFAULT_BAND_EDGES_KM
+from .models import DistanceCalculation, DistanceErrorRollup
+
+
+logger = logging.getLogger(__name__)
+
+
+def distance_band(arc_distance_km: float) -> float:
+    """arc距離が属する距離帯の下限（km）"""
+    index = bisect.bisect_right(DEFAULT_BAND_EDGES_KM, arc_distance_km) - 1
+    return DEFAULT_BAND_EDGES_KM[min(max(index, 0), len(DEFAULT_BAND_EDGES_KM) - 1)]
+
+
+def latitude_band(a_lat: float, b_lat: float) -> int:
+    """2地点の中間緯度が属する緯度帯の下限（度）"""
+    width = settings.GEO_DISTANCE_HISTORY_LATITUDE_BAND
+    band = int(math.floor((a_lat + b_lat) / 2 / width) * width)
+    # 北緯90度ちょうどは最も北の緯度帯に含める
+    return min(band, int(90 - width))
+
+
+class HistoryRecorder:
+    """計算結果をバッファに溜め、バックグラウンドのスレッドでまとめて登録する"""
+
+    def __init__(
+        self,
+        batch_size: Optional[int] = None,
+        flush_interval: Optional[float] = None,
+        max_buffer: Optional[int] = None,
+        background: bool = True,
+    ):
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._max_buffer = max_buffer
+        self._background = background
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._buffer: "deque[DistanceCalculation]" = deque()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._pid: Optional[int] = None
+        self.dropped = 0
+
+    @property
+    def batch_size(self) -> int:
+        return self._batch_size or settings.GEO_DISTANCE_HISTORY_BATCH_SIZE
+
+    @property
+    def flush_interval(self) -> float:
+        return self._flush_interval or settings.GEO_DISTANCE_HISTORY_FLUSH_INTERVAL
+
+    @property
+    def max_buffer(self) -> int:
+        return self._max_buffer or settings.GEO_DISTANCE_HISTORY_MAX_BUFFER
+
+    def record(self, mode: str, a_lat: float, a_lon: float, b_lat: float, b_lon: float, result: Dict) -> None:
+        """計算結果をバッファに追加する（データベースには書き込まない）"""
+        if not settings.GEO_DISTANCE_HISTORY_ENABLED:
+            return
+        entry = DistanceCalculation(
+            created_at=timezone.now(),
+            mode=mode,
+            a_lat=a_lat,
+            a_lon=a_lon,
+            b_lat=b_lat,
+            b_lon=b_lon,
+            arc_distance_km=result["arc_distance_km"],
+            plane_distance_km=result["plane_distance_km"],
+            difference_km=result["difference_km"],
+            difference_percentage=result["difference_percentage"],
+            distance_band_km=distance_band(result["arc_distance_km"]),
+            latitude_band=latitude_band(a_lat, b_lat),
+        )
+        with self._lock:
+            self._ensure_worker()
+            if len(self._buffer) >= self.max_buffer:
+                # データベースに書き込めない状態が続いてもメモリを使い続けないよう、古いものから捨てる
+                self._buffer.popleft()
+                self.dropped += 1
+            self._buffer.append(entry)
+            if len(self._buffer) >= self.batch_size:
+                self._wake.set()
+
+    def _ensure_worker(self) -> None:
+        """fork後の子プロセスでは親のバッファを捨て、スレッドを起動し直す（ロックを保持して呼ぶ）"""
+        pid = os.getpid()
+        if self._pid != pid:
+            self._buffer.clear()
+            self._thread = None
+            self._pid = pid
+        if self._background and self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="geodistance-history", daemon=True)
+            self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def pending(self) -> int:
+        with self._lock:
+            return len(self._buffer)
+
+    def flush(self) -> int:
+        """
+        バッファの計算結果を登録し、集計に加算する
+
+        Returns:
+            int: 登録した件数（失敗した場合は0）
+        """
+        with self._flush_lock:
+            with self._lock:
+                entries, self._buffer = list(self._buffer), deque()
+            if not entries:
+                return 0
+
+            close_old_connections()
+            try:
+                with transaction.atomic():
+                    DistanceCalculation.objects.bulk_create(entries, batch_size=self.batch_size)
+                    _apply_rollups(entries)
+            except Exception as e:
+                self.dropped += len(entries)
+                logger.error(f"計算結果の履歴を登録できませんでした（{len(entries)}件を破棄）: {e}")
+                return 0
+
+            logger.debug(f"計算結果の履歴を{len(entries)}件登録しました")
+            return len(entries)
+
+
+def _apply_rollups(entries: List[DistanceCalculation]) -> None:
+    """登録した計算結果を日付・距離帯・緯度帯ごとの集計に加算する（トランザクション内で呼ぶ）"""
+    deltas: Dict[Tuple[date, float, int], Dict[str, float]] = {}
+    for entry in entries:
+        key = (timezone.localdate(entry.created_at), entry.distance_band_km, entry.latitude_band)
+        delta = deltas.setdefault(
+            key, {"count": 0, "difference_km": 0.0, "percentage": 0.0, "max_percentage": 0.0}
+        )
+        delta["count"] += 1
+        delta["difference_km"] += entry.difference_km
+        delta["percentage"] += entry.difference_percentage
+        delta["max_percentage"] = max(delta["max_percentage"], entry.difference_percentage)
+
+    # 未登録のキーを先に作り、加算は行単位の更新で行う（並行に登録しても加算が失われない）
+    DistanceErrorRollup.objects.bulk_create(
+        [
+            DistanceErrorRollup(date=day, distance_band_km=d_band, latitude_band=l_band)
+            for day, d_band, l_band in deltas
+        ],
+        ignore_conflicts=True,
+    )
+    # デッドロックを避けるため、どのプロセスも同じ順に更新する
+    for (day, d_band, l_band), delta in sorted(deltas.items()):
+        DistanceErrorRollup.objects.filter(date=day, distance_band_km=d_band, latitude_band=l_band).update(
+            count=F("count") + delta["count"],
+            sum_difference_km=F("sum_difference_km") + delta["difference_km"],
+            sum_difference_percentage=F("sum_difference_percentage") + delta["percentage"],
+            max_difference_percentage=Greatest("max_difference_percentage", delta["max_percentage"]),
+        )
+
+
+def error_report(since: Optional[date] = None, until: Optional[date] = None) -> List[Dict]:
+    """
+    距離帯・緯度帯ごとのplaneのarcに対する誤差を、集計テーブルから求める
+
+    Args:
+        since: 集計に含める最初の日付
+        until: 集計に含める最後の日付
+
+    Returns:
+        List[Dict]: 距離帯・緯度帯ごとの件数、平均誤差（km）、平均誤差率、最大誤差率
+    """
+    rollups = DistanceErrorRollup.objects.all()
+    if since is not None:
+        rollups = rollups.filter(date__gte=since)
+    if until is not None:
+        rollups = rollups.filter(date__lte=until)
+
+    rows = (
+        rollups.values("distance_band_km", "latitude_band")
+        .annotate(
+            total=Sum("count"),
+            difference_km=Sum("sum_difference_km"),
+            percentage=Sum("sum_difference_percentage"),
+            max_percentage=Max("max_difference_percentage"),
+        )
+        .order_by("distance_band_km", "latitude_band")
+    )
+    return [
+        {
+            "distance_band_km": row["distance_band_km"],
+            "latitude_band": row["latitude_band"],
+            "count": row["total"],
+            "mean_difference_km": round(row["difference_km"] / row["total"], 6),
+            "mean_difference_percentage": round(row["percentage"] / row["total"], 6),
+            "max_difference_percentage": round(row["max_percentage"], 6),
+        }
+        for row in rows
+        if row["total"]
+    ]
+
+
+history_recorder = HistoryRecorder()
+atexit.register(history_recorder.flush)
@@ -0,0 +1,241 @@
+"""
+距離計算用インデックスの定義のバージョン管理
+
+インデックスはバージョンごとに "<エイリアス>_v<バージョン>" の名前で作成し、アプリケーションは常に
+エイリアス（GEO_DISTANCE_INDEX_ALIAS）で読み書きする。定義はインデックステンプレートとして登録するため、
+同じ名前のインデックスはどのように作成しても同じ設定になる。
+
+定義を変える場合は新しいバージョンを追加してGEO_DISTANCE_INDEX_VERSIONを上げ、
+manage.py migrate_geo_indexを実行する。新しいバージョンのインデックスを作成してreindexした後、
+エイリアスを1回の_aliases呼び出しで付け替えるため、切り替えの間も検索は止まらない
+"""
+
+import logging
+import time
+from typing import Callable, Dict, List, Optional
+
+from django.conf import settings
+from opensearchpy.exceptions import NotFoundError, RequestError
+
+
+logger = logging.getLogger(__name__)
+
+
+def _definition_v1() -> Dict:
+    """最初の定義（シャード・レプリカ・refresh_intervalはデフォルト、nameは解析するtext）"""
+    return {
+        "mappings": {
+            "properties": {
+                "location": {"type": "geo_point"},
+                "name": {"type": "text"},
+                "dataset": {"type": "keyword"},
+                "ordinal": {"type": "long"},
+            }
+        }
+    }
+
+
+def _definition_v2() -> Dict:
+    """
+    距離のソート向けに調整した定義
+    書き込みは必要なときにrefresh=Trueで反映するため、定期的なrefreshは間隔を空ける。
+    ordinalはソートにしか使わないためdoc valuesだけを持ち、nameは検索しないためインデックスしない
+    """
+    return {
+        "settings": {
+            "index": {
+                "number_of_shards": settings.GEO_DISTANCE_INDEX_SHARDS,
+                "number_of_replicas": settings.GEO_DISTANCE_INDEX_REPLICAS,
+                "refresh_interval": settings.GEO_DISTANCE_INDEX_REFRESH_INTERVAL,
+            }
+        },
+        "mappings": {
+            "dynamic": "strict",
+            "properties": {
+                "location": {"type": "geo_point"},
+                "name": {"type": "keyword", "index": False, "doc_values": False},
+                "dataset": {"type": "keyword"},
+                "ordinal": {"type": "long", "index": False},
+            },
+        },
+    }
+
+
+INDEX_DEFINITIONS: Dict[int, Callable[[], Dict]] = {
+    1: _definition_v1,
+    2: _definition_v2,
+}
+
+
+def index_alias() -> str:
+    return settings.GEO_DISTANCE_INDEX_ALIAS
+
+
+def versioned_index_name(version: int) -> str:
+    return f"{index_alias()}_v{version}"
+
+
+def index_definition(version: Optional[int] = None) -> Dict:
+    """バージョンの定義（settingsとmappings）を返す。Noneの場合はGEO_DISTANCE_INDEX_VERSION"""
+    version = settings.GEO_DISTANCE_INDEX_VERSION if version is None else version
+    if version not in INDEX_DEFINITIONS:
+        raise ValueError(f"未定義のインデックスのバージョンです: {version}（{', '.join(map(str, INDEX_DEFINITIONS))}）")
+    return INDEX_DEFINITIONS[version]()
+
+
+def index_template(version: Optional[int] = None) -> Dict:
+    """バージョンの定義を "<エイリアス>_v*" に適用するインデックステンプレート"""
+    version = settings.GEO_DISTANCE_INDEX_VERSION if version is None else version
+    return {
+        "index_patterns": [f"{index_alias()}_v*"],
+        "version": version,
+        "priority": 100,
+        "template": index_definition(version),
+        "_meta": {"managed_by": "geodistance"},
+    }
+
+
+def put_index_template(client, version: Optional[int] = None) -> None:
+    """インデックステンプレートを登録する（同じ名前のテンプレートは置き換える）"""
+    client.indices.put_index_template(name=index_alias(), body=index_template(version))
+
+
+def aliased_indices(client) -> List[str]:
+    """エイリアスが指しているインデックス（エイリアスがない場合は空）"""
+    try:
+        return sorted(client.indices.get_alias(name=index_alias()))
+    except NotFoundError:
+        return []
+
+
+def ensure_index(client) -> None:
+    """
+    エイリアスがなければ、現在のバージョンのインデックスをエイリアス付きで作成する
+    エイリアスと同じ名前のインデックス（バージョン管理の前に作成したもの）がある場合はそのまま使う
+    """
+    if client.indices.exists(index=index_alias()):
+        return
+
+    put_index_template(client)
+    try:
+        client.indices.create(
+            index=versioned_index_name(settings.GEO_DISTANCE_INDEX_VERSION),
+            body={"aliases": {index_alias(): {}}},
+        )
+        logger.info(
+            f"インデックス '{versioned_index_name(settings.GEO_DISTANCE_INDEX_VERSION)}' を"
+            f"エイリアス '{index_alias()}' 付きで作成しました"
+        )
+    except RequestError as e:
+        # 他のワーカーが先に作成した場合は作成済みとして扱う
+        if e.error != "resource_already_exists_exception":
+            raise
+
+
+async def ensure_index_async(client) -> None:
+    """ensure_indexの非同期版"""
+    if await client.indices.exists(index=index_alias()):
+        return
+
+    await client.indices.put_index_template(name=index_alias(), body=index_template())
+    try:
+        await client.indices.create(
+            index=versioned_index_name(settings.GEO_DISTANCE_INDEX_VERSION),
+            body={"aliases": {index_alias(): {}}},
+        )
+    except RequestError as e:
+        if e.error != "resource_already_exists_exception":
+            raise
+
+
+class MigrationResult:
+    """migrate_indexの結果"""
+
+    def __init__(self, source: Optional[str], target: str):
+        self.source = source
+        self.target = target
+        self.copied = 0
+        self.elapsed = 0.0
+        self.migrated = False
+
+
+def migrate_index(
+    client,
+    version: Optional[int] = None,
+    delete_old: bool = False,
+    timeout: float = 3600.0,
+) -> MigrationResult:
+    """
+    エイリアスを指定したバージョンのインデックスに切り替える
+
+    テンプレートを登録して新しいインデックスを作成し、reindexの間はrefreshとレプリカを無効にする。
+    コピーが終わったら定義の設定に戻し、エイリアスの付け替え（バージョン管理の前のインデックスの場合は
+    削除とエイリアスの追加）を1回の_aliases呼び出しで行う。すでに切り替わっている場合は何もしない
+
+    Args:
+        client: OpenSearchクライアント
+        version: 切り替え先のバージョン（Noneの場合はGEO_DISTANCE_INDEX_VERSION）
+        delete_old: 切り替え後に元のインデックスを削除するか（Falseの場合は切り戻しに使える）
+        timeout: reindexの期限（秒）
+
+    Returns:
+        MigrationResult: 元と切り替え先のインデックス、コピーした件数
+    """
+    version = settings.GEO_DISTANCE_INDEX_VERSION if version is None else version
+    definition = index_definition(version)
+    alias = index_alias()
+    target = versioned_index_name(version)
+
+    sources = aliased_indices(client)
+    legacy = not sources and client.indices.exists(index=alias)
+    source = alias if legacy else (sources[0] if sources else None)
+    result = MigrationResult(source, target)
+    if sources == [target]:
+        logger.info(f"エイリアス '{alias}' はすでに '{target}' を指しています")
+        return result
+
+    started = time.perf_counter()
+    put_index_template(client, version)
+    if not client.indices.exists(index=target):
+        client.indices.create(
+            index=target, body={"settings": {"index": {"refresh_interval": "-1", "number_of_replicas": 0}}}
+        )
+    if source is not None:
+        response = client.reindex(
+            body={"source": {"index": source}, "dest": {"index": target}},
+            refresh=True,
+            slices="auto",
+            request_timeout=timeout,
+        )
+        if response.get("failures"):
+            raise RuntimeError(f"reindexに失敗しました: {response['failures'][:3]}")
+        result.copied = response.get("total", 0)
+
+    index_settings = definition.get("settings", {}).get("index", {})
+    client.indices.put_settings(
+        index=target,
+        body={
+            "index": {
+                "refresh_interval": index_settings.get("refresh_interval"),
+                "number_of_replicas": index_settings.get("number_of_replicas", 1),
+            }
+        },
+    )
+    client.indices.refresh(index=target)
+
+    actions = [{"add": {"index": target, "alias": alias}}]
+    if legacy:
+        actions.append({"remove_index": {"index": alias}})
+    else:
+        actions.extend({"remove": {"index": index, "alias": alias}} for index in sources)
+    client.indices.update_aliases(body={"actions": actions})
+    logger.info(f"エイリアス '{alias}' を '{source}' から '{target}' に切り替えました（{result.copied}件）")
+
+    if delete_old and not legacy:
+        for index in sources:
+            client.indices.delete(index=index)
+            logger.info(f"インデックス '{index}' を削除しました")
+
+    result.elapsed = time.perf_counter() - started
+    result.migrated = True
+    return result
@@ -0,0 +1,474 @@
+import bisect
+import functools
+import logging
+import threading
+import time
+from collections import deque
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+from opensearchpy import Transport
+
+
+logger = logging.getLogger(__name__)
+
+# ヒストグラムのバケット（秒）
+DURATION_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+class SpanRecord:
+    """計測した1つの区間"""
+
+    __slots__ = ("name", "duration", "error", "attributes")
+
+    def __init__(self, name: str, duration: float, error: Optional[str], attributes: Dict):
+        self.name = name
+        self.duration = duration
+        self.error = error
+        self.attributes = attributes
+
+    def to_dict(self) -> Dict:
+        return {
+            "type": "span",
+            "name": self.name,
+            "duration_ms": round(self.duration * 1000.0, 3),
+            "error": self.error,
+            **self.attributes,
+        }
+
+
+class OpenSearchCallRecord:
+    """OpenSearchへの1回の呼び出し。tookはOpenSearch側の処理時間、durationはクライアント側の所要時間"""
+
+    __slots__ = ("api", "duration", "took", "status", "error")
+
+    def __init__(
+        self, api: str, duration: float, took: Optional[float], status: Optional[int], error: Optional[str]
+    ):
+        self.api = api
+        self.duration = duration
+        self.took = took
+        self.status = status
+        self.error = error
+
+    def to_dict(self) -> Dict:
+        return {
+            "type": "opensearch_call",
+            "api": self.api,
+            "duration_ms": round(self.duration * 1000.0, 3),
+            "took_ms": None if self.took is None else round(self.took * 1000.0, 3),
+            "status": self.status,
+            "error": self.error,
+        }
+
+
+class LoggingSink:
+    """計測結果をログに出力するシンク"""
+
+    def __init__(self, level: int = logging.INFO):
+        self.level = level
+
+    def record_span(self, span: SpanRecord) -> None:
+        if logger.isEnabledFor(self.level):
+            logger.log(
+                self.level,
+                f"span {span.name}: {span.duration * 1000.0:.3f}ms"
+                + (f" error={span.error}" if span.error else ""),
+            )
+
+    def record_call(self, call: OpenSearchCallRecord) -> None:
+        if logger.isEnabledFor(self.level):
+            took = "-" if call.took is None else f"{call.took * 1000.0:.3f}ms"
+            logger.log(
+                self.level,
+                f"opensearch {call.api}: client={call.duration * 1000.0:.3f}ms took={took}"
+                + (f" error={call.error}" if call.error else ""),
+            )
+
+
+class RingBufferSink:
+    """直近の計測結果をメモリ上に保持するシンク"""
+
+    def __init__(self, size: Optional[int] = None):
+        self._records = deque(maxlen=size or settings.GEO_DISTANCE_INSTRUMENTATION_BUFFER_SIZE)
+
+    def record_span(self, span: SpanRecord) -> None:
+        self._records.append(span)
+
+    def record_call(self, call: OpenSearchCallRecord) -> None:
+        self._records.append(call)
+
+    def records(self) -> List[Dict]:
+        """保持している計測結果を古い順に返す"""
+        return [record.to_dict() for record in list(self._records)]
+
+    def clear(self) -> None:
+        self._records.clear()
+
+
+class _Histogram:
+    __slots__ = ("buckets", "sum", "count")
+
+    def __init__(self):
+        self.buckets = [0] * len(DURATION_BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        index = bisect.bisect_left(DURATION_BUCKETS, value)
+        if index < len(self.buckets):
+            self.buckets[index] += 1
+        self.sum += value
+        self.count += 1
+
+
+class PrometheusSink:
+    """計測結果をヒストグラムとカウンターに集計し、Prometheusのテキスト形式で出力するシンク"""
+
+    METRICS = (
+        ("geo_distance_span_duration_seconds", "histogram", "区間ごとの所要時間"),
+        ("geo_distance_span_errors_total", "counter", "区間ごとのエラー数"),
+        ("geo_distance_opensearch_request_duration_seconds", "histogram", "OpenSearch呼び出しのクライアント側の所要時間"),
+        ("geo_distance_opensearch_took_seconds", "histogram", "OpenSearchが応答したtook"),
+        ("geo_distance_opensearch_errors_total", "counter", "OpenSearch呼び出しのエラー数"),
+        ("geo_distance_opensearch_retries_total", "counter", "OpenSearch呼び出しの再試行数"),
+        ("geo_distance_opensearch_hedged_requests_total", "counter", "応答が遅いときに重複して送った検索の数"),
+        ("geo_distance_circuit_breaker_rejections_total", "counter", "サーキットブレーカーが遮断した呼び出し数"),
+        ("geo_distance_circuit_breaker_state", "gauge", "サーキットブレーカーの状態（0: closed, 1: half_open, 2: open）"),
+    )
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms: Dict[Tuple[str, Tuple], _Histogram] = {}
+        self._counters: Dict[Tuple[str, Tuple], int] = {}
+        self._gauges: Dict[Tuple[str, Tuple], float] = {}
+
+    def _observe(self, metric: str, labels: Tuple, value: float) -> None:
+        key = (metric, labels)
+        histogram = self._histograms.get(key)
+        if histogram is None:
+            histogram = self._histograms.setdefault(key, _Histogram())
+        histogram.observe(value)
+
+    def _increment(self, metric: str, labels: Tuple) -> None:
+        key = (metric, labels)
+        self._counters[key] = self._counters.get(key, 0) + 1
+
+    def record_span(self, span: SpanRecord) -> None:
+        with self._lock:
+            self._observe("geo_distance_span_duration_seconds", (("span", span.name),), span.duration)
+            if span.error:
+                self._increment("geo_distance_span_errors_total", (("span", span.name), ("error", span.error)))
+
+    def record_call(self, call: OpenSearchCallRecord) -> None:
+        labels = (("api", call.api),)
+        with self._lock:
+            self._observe("geo_distance_opensearch_request_duration_seconds", labels, call.duration)
+            if call.took is not None:
+                self._observe("geo_distance_opensearch_took_seconds", labels, call.took)
+            if call.error:
+                self._increment("geo_distance_opensearch_errors_total", labels + (("error", call.error),))
+
+    def increment(self, metric: str, labels: Tuple) -> None:
+        with self._lock:
+            self._increment(metric, labels)
+
+    def set_gauge(self, metric: str, labels: Tuple, value: float) -> None:
+        with self._lock:
+            self._gauges[(metric, labels)] = value
+
+    def render(self) -> str:
+        """Prometheusのテキスト形式（version 0.0.4）で出力する"""
+        with self._lock:
+            histograms = {key: (list(h.buckets), h.sum, h.count) for key, h in self._histograms.items()}
+            values = {"counter": dict(self._counters), "gauge": dict(self._gauges)}
+
+        lines = []
+        for metric, metric_type, description in self.METRICS:
+            lines.append(f"# HELP {metric} {description}")
+            lines.append(f"# TYPE {metric} {metric_type}")
+            if metric_type in values:
+                for (name, labels), value in sorted(values[metric_type].items()):
+                    if name == metric:
+                        lines.append(f"{metric}{_format_labels(labels)} {value}")
+                continue
+
+            for (name, labels), (buckets, total, count) in sorted(histograms.items()):
+                if name != metric:
+                    continue
+                cumulative = 0
+                for bound, bucket_count in zip(DURATION_BUCKETS, buckets):
+                    cumulative += bucket_count
+                    lines.append(f"{metric}_bucket{_format_labels(labels + (('le', repr(bound)),))} {cumulative}")
+                lines.append(f"{metric}_bucket{_format_labels(labels + (('le', '+Inf'),))} {count}")
+                lines.append(f"{metric}_sum{_format_labels(labels)} {total}")
+                lines.append(f"{metric}_count{_format_labels(labels)} {count}")
+
+        return "\n".join(lines) + "\n"
+
+    def clear(self) -> None:
+        with self._lock:
+            self._histograms.clear()
+            self._counters.clear()
+            self._gauges.clear()
+
+
+def _escape_label_value(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels: Iterable[Tuple[str, str]]) -> str:
+    escaped = [f'{key}="{_escape_label_value(value)}"' for key, value in labels]
+    return "{" + ",".join(escaped) + "}" if escaped else ""
+
+
+# GEO_DISTANCE_INSTRUMENTATION_SINKSで指定できるシンクの短縮名
+SINK_ALIASES = {
+    "logging": LoggingSink,
+    "prometheus": PrometheusSink,
+    "ring_buffer": RingBufferSink,
+}
+
+
+class _Span:
+    """Instrumentation.spanが返すコンテキストマネージャ"""
+
+    __slots__ = ("_instrumentation", "_name", "_attributes", "_started")
+
+    def __init__(self, instrumentation: "Instrumentation", name: str, attributes: Dict):
+        self._instrumentation = instrumentation
+        self._name = name
+        self._attributes = attributes
+
+    def __enter__(self) -> "_Span":
+        self._started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> bool:
+        duration = time.perf_counter() - self._started
+        error = _error_type(exc) if exc is not None else self._attributes.pop("error", None)
+        self._instrumentation.record_span(SpanRecord(self._name, duration, error, self._attributes))
+        return False
+
+    def set(self, **attributes) -> None:
+        """区間に属性を追加する。error=...を指定すると例外がなくてもエラーとして記録する"""
+        self._attributes.update(attributes)
+
+
+class _NullSpan:
+    """シンクが設定されていない場合のコンテキストマネージャ（計測しない）"""
+
+    __slots__ = ()
+
+    def __enter__(self) -> "_NullSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, traceback) -> bool:
+        return False
+
+    def set(self, **attributes) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Instrumentation:
+    """
+    区間の所要時間とOpenSearchの呼び出しを計測し、設定されたシンクに渡す
+    シンクはGEO_DISTANCE_INSTRUMENTATION_SINKSから初回の計測時に生成する
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._sinks: Optional[List] = None
+
+    @property
+    def sinks(self) -> List:
+        if self._sinks is None:
+            with self._lock:
+                if self._sinks is None:
+                    self._sinks = self._load_sinks(settings.GEO_DISTANCE_INSTRUMENTATION_SINKS)
+        return self._sinks
+
+    def _load_sinks(self, names: Iterable[str]) -> List:
+        sinks = []
+        for name in names:
+            try:
+                sink_class = SINK_ALIASES.get(name) or import_string(name)
+                sinks.append(sink_class())
+            except Exception as e:
+                logger.error(f"計測のシンク '{name}' を生成できませんでした: {e}")
+        return sinks
+
+    def configure(self, sinks: List) -> None:
+        """シンクを差し替える"""
+        with self._lock:
+            self._sinks = list(sinks)
+
+    def get_sink(self, sink_class):
+        """指定したクラスのシンクを返す。設定されていなければNone"""
+        for sink in self.sinks:
+            if isinstance(sink, sink_class):
+                return sink
+        return None
+
+    def span(self, name: str, **attributes):
+        """
+        with文で囲んだ区間の所要時間を計測する
+
+        Args:
+            name: 区間名（例: "service.ensure_index_exists"）
+            attributes: 区間に付与する属性
+        """
+        if not self.sinks:
+            return _NULL_SPAN
+        return _Span(self, name, attributes)
+
+    def timed(self, name: str):
+        """関数全体を1つの区間として計測するデコレータ"""
+
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return func(*args, **kwargs)
+
+            return wrapper
+
+        return decorator
+
+    def record_span(self, span: SpanRecord) -> None:
+        for sink in self.sinks:
+            try:
+                sink.record_span(span)
+            except Exception as e:
+                logger.error(f"区間の記録に失敗しました: {e}")
+
+    def record_call(self, call: OpenSearchCallRecord) -> None:
+        for sink in self.sinks:
+            try:
+                sink.record_call(call)
+            except Exception as e:
+                logger.error(f"OpenSearch呼び出しの記録に失敗しました: {e}")
+
+    def increment(self, metric: str, **labels) -> None:
+        """カウンターを1増やす（カウンターを集計できるシンクのみ）"""
+        for sink in self.sinks:
+            if hasattr(sink, "increment"):
+                sink.increment(metric, tuple(labels.items()))
+
+    def set_gauge(self, metric: str, value: float, **labels) -> None:
+        """ゲージの値を設定する（ゲージを集計できるシンクのみ）"""
+        for sink in self.sinks:
+            if hasattr(sink, "set_gauge"):
+                sink.set_gauge(metric, tuple(labels.items()), value)
+
+
+instrumentation = Instrumentation()
+
+
+def _error_type(error: BaseException) -> str:
+    """OpenSearchのエラーはエラー種別（index_not_found_exceptionなど）、それ以外は例外クラス名"""
+    error_type = getattr(error, "error", None)
+    if isinstance(error_type, str) and error_type:
+        return error_type
+    return type(error).__name__
+
+
+def api_name(method: str, url: str) -> str:
+    """
+    HTTPメソッドとURLからOpenSearchのAPI名を求める
+
+    Returns:
+        str: 例 "search", "msearch", "scripts_painless_execute", "indices.exists"
+    """
+    parts = [part for part in url.split("?", 1)[0].split("/") if part]
+    if not parts:
+        return "info"
+    if parts[0] == "_scripts" and parts[-1] == "_execute":
+        return "scripts_painless_execute"
+    if parts[0] == "_nodes":
+        return "nodes.info"
+    if parts[0] == "_index_template":
+        return "indices.put_index_template" if method == "PUT" else "indices.get_index_template"
+    if parts[0] == "_aliases":
+        return "indices.update_aliases"
+    if "_alias" in parts:
+        return "indices.get_alias" if method in ("GET", "HEAD") else "indices.put_alias"
+    if parts[0].startswith("_"):
+        return ".".join(part.lstrip("_") for part in parts)
+    if len(parts) == 1:
+        return {"HEAD": "indices.exists", "PUT": "indices.create", "DELETE": "indices.delete"}.get(
+            method, "indices.get"
+        )
+    if parts[1] == "_doc":
+        return "delete" if method == "DELETE" else ("get" if method in ("GET", "HEAD") else "index")
+    return parts[1].lstrip("_")
+
+
+def _took_seconds(response) -> Optional[float]:
+    if isinstance(response, dict):
+        took = response.get("took")
+        if isinstance(took, (int, float)):
+            return took / 1000.0
+    return None
+
+
+def _record_call(method: str, url: str, started: float, response=None, error: Optional[Exception] = None) -> None:
+    instrumentation.record_call(
+        OpenSearchCallRecord(
+            api_name(method, url),
+            time.perf_counter() - started,
+            _took_seconds(response),
+            getattr(error, "status_code", None),
+            _error_type(error) if error is not None else None,
+        )
+    )
+
+
+class InstrumentedTransport(Transport):
+    """OpenSearchへの呼び出しごとにクライアント側の所要時間とtookを記録するTransport"""
+
+    def perform_request(self, method, url, *args, **kwargs):
+        if not instrumentation.sinks:
+            return super().perform_request(method, url, *args, **kwargs)
+
+        started = time.perf_counter()
+        try:
+            response = super().perform_request(method, url, *args, **kwargs)
+        except Exception as e:
+            _record_call(method, url, started, error=e)
+            raise
+        _record_call(method, url, started, response=response)
+        return response
+
+
+_instrumented_async_transport_class = None
+
+
+def instrumented_async_transport_class():
+    """InstrumentedTransportの非同期版のクラスを返す（aiohttpを必要とするため初回に生成する）"""
+    global _instrumented_async_transport_class
+    if _instrumented_async_transport_class is not None:
+        return _instrumented_async_transport_class
+
+    from opensearchpy import AsyncTransport
+
+    class InstrumentedAsyncTransport(AsyncTransport):
+        async def perform_request(self, method, url, *args, **kwargs):
+            if not instrumentation.sinks:
+                return await super().perform_request(method, url, *args, **kwargs)
+
+            started = time.perf_counter()
+            try:
+                response = await super().perform_request(method, url, *args, **kwargs)
+            except Exception as e:
+                _record_call(method, url, started, error=e)
+                raise
+            _record_call(method, url, started, response=response)
+            return response
+
+    _instrumented_async_transport_class = InstrumentedAsyncTransport
+    return _instrumented_async_transport_class
@@ -0,0 +1,201 @@
+"""
+PostgreSQLだけで動くバックグラウンドジョブ
+
+ジョブの入力はチャンクに分けてDistanceJobChunkに保存する。ワーカーは
+SELECT ... FOR UPDATE SKIP LOCKED で未計算のチャンクを1つずつ取り出し、同じトランザクションで
+計算結果を書き込んでコミットする。ワーカーが途中で停止した場合はトランザクションが
+ロールバックされてチャンクが未計算に戻るため、別のワーカーが続きから計算する。
+OpenSearchに接続できないなどチャンク全体の計算に失敗した場合は、next_attempt_atまで間隔を空けて
+再試行し、GEO_DISTANCE_JOB_MAX_ATTEMPTS回失敗したらジョブを失敗にする
+"""
+
+import logging
+import threading
+from datetime import timedelta
+from typing import Iterable, Optional, Tuple
+
+from django.conf import settings
+from django.db import DatabaseError, close_old_connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import DistanceJob, DistanceJobChunk
+from .services import GeoDistanceService, _chunked
+
+
+logger = logging.getLogger(__name__)
+
+# submit_jobで1回のINSERTにまとめるチャンク数
+_INSERT_BATCH_SIZE = 50
+
+
+def submit_job(
+    pairs: Iterable[Tuple[float, float, float, float]], chunk_size: Optional[int] = None
+) -> DistanceJob:
+    """
+    地点の組をチャンクに分けて保存し、ジョブを登録する
+
+    入力はチャンク単位で読み進めるため、ファイル全体をメモリに載せない。
+    入力の読み込みでエラーになった場合はジョブを登録しない
+
+    Raises:
+        ValueError: 入力の形式が正しくない場合、または件数が上限を超えた場合
+    """
+    chunk_size = chunk_size or settings.GEO_DISTANCE_BATCH_CHUNK_SIZE
+    max_pairs = settings.GEO_DISTANCE_JOB_MAX_PAIRS
+
+    with transaction.atomic():
+        job = DistanceJob.objects.create()
+        batch = []
+        total_pairs = total_chunks = 0
+        for number, chunk in enumerate(_chunked(pairs, chunk_size)):
+            total_pairs += len(chunk)
+            if total_pairs > max_pairs:
+                raise ValueError(f"1つのジョブで計算できる地点の組は{max_pairs}件までです")
+            batch.append(DistanceJobChunk(job=job, number=number, pairs=[list(pair) for pair in chunk]))
+            total_chunks += 1
+            if len(batch) >= _INSERT_BATCH_SIZE:
+                DistanceJobChunk.objects.bulk_create(batch)
+                batch = []
+        DistanceJobChunk.objects.bulk_create(batch)
+
+        job.total_pairs = total_pairs
+        job.total_chunks = total_chunks
+        if not total_chunks:
+            job.status = DistanceJob.Status.SUCCEEDED
+            job.finished_at = timezone.now()
+        job.save(update_fields=["total_pairs", "total_chunks", "status", "finished_at"])
+
+    logger.info(f"ジョブ {job.id} を登録しました（{total_pairs}件、{total_chunks}チャンク）")
+    return job
+
+
+def run_next_chunk(service: Optional[GeoDistanceService] = None) -> bool:
+    """
+    未計算のチャンクを1つ取り出して計算し、結果をコミットする
+
+    Returns:
+        bool: チャンクを処理した場合はTrue、未計算のチャンクがなければFalse
+    """
+    service = service or GeoDistanceService()
+
+    with transaction.atomic():
+        now = timezone.now()
+        chunk = (
+            DistanceJobChunk.objects.select_for_update(skip_locked=True, of=("self",))
+            .filter(
+                Q(next_attempt_at__isnull=True) | Q(next_attempt_at__lte=now),
+                status=DistanceJobChunk.Status.PENDING,
+                job__status__in=[DistanceJob.Status.QUEUED, DistanceJob.Status.RUNNING],
+            )
+            .order_by("id")
+            .first()
+        )
+        if chunk is None:
+            return False
+
+        DistanceJob.objects.filter(pk=chunk.job_id, status=DistanceJob.Status.QUEUED).update(
+            status=DistanceJob.Status.RUNNING, started_at=now
+        )
+
+        try:
+            # 接続・インデックスのエラーは例外で受け取り、行ごとのエラーとして完了にしない
+            rows = service._calculate_batch_chunk(
+                [tuple(pair) for pair in chunk.pairs], raise_on_failure=True
+            )
+        except Exception as e:
+            _record_chunk_failure(chunk, e)
+            return True
+
+        chunk.rows = rows
+        chunk.status = DistanceJobChunk.Status.DONE
+        chunk.completed_at = timezone.now()
+        chunk.save(update_fields=["rows", "status", "completed_at"])
+
+        DistanceJob.objects.filter(pk=chunk.job_id).update(
+            completed_chunks=F("completed_chunks") + 1,
+            processed_pairs=F("processed_pairs") + len(rows),
+            error_rows=F("error_rows") + sum(1 for row in rows if row["error_message"]),
+        )
+        DistanceJob.objects.filter(
+            pk=chunk.job_id, status=DistanceJob.Status.RUNNING, completed_chunks=F("total_chunks")
+        ).update(status=DistanceJob.Status.SUCCEEDED, finished_at=chunk.completed_at)
+
+    return True
+
+
+def _record_chunk_failure(chunk: DistanceJobChunk, error: Exception) -> None:
+    """
+    チャンクの計算に失敗した回数を記録し、次に試みる時刻を遅らせる。
+    上限に達した場合はジョブを失敗にする（トランザクション内で呼ぶ）
+    """
+    chunk.attempts += 1
+    chunk.error_message = str(error)
+    if chunk.attempts < settings.GEO_DISTANCE_JOB_MAX_ATTEMPTS:
+        delay = retry_delay(chunk.attempts)
+        chunk.next_attempt_at = timezone.now() + timedelta(seconds=delay)
+        logger.warning(
+            f"ジョブ {chunk.job_id} のチャンク {chunk.number} の計算に失敗しました"
+            f"（{chunk.attempts}回目、{delay:.0f}秒後に再試行）: {error}"
+        )
+        chunk.save(update_fields=["attempts", "error_message", "next_attempt_at"])
+        return
+
+    logger.error(
+        f"ジョブ {chunk.job_id} のチャンク {chunk.number} の計算に{chunk.attempts}回失敗したため、"
+        f"ジョブを失敗にします: {error}"
+    )
+    chunk.status = DistanceJobChunk.Status.FAILED
+    chunk.save(update_fields=["attempts", "error_message", "status"])
+    DistanceJob.objects.filter(pk=chunk.job_id).update(
+        status=DistanceJob.Status.FAILED,
+        error_message=f"チャンク {chunk.number} の計算に失敗しました: {error}",
+        finished_at=timezone.now(),
+    )
+
+
+def retry_delay(attempts: int) -> float:
+    """attempts回失敗したチャンクを次に試みるまでの秒数（GEO_DISTANCE_JOB_RETRY_BACKOFFから倍ずつ延ばす）"""
+    return min(
+        settings.GEO_DISTANCE_JOB_RETRY_BACKOFF * 2 ** (attempts - 1),
+        settings.GEO_DISTANCE_JOB_RETRY_BACKOFF_MAX,
+    )
+
+
+def run_worker(
+    stop_event: Optional[threading.Event] = None,
+    poll_interval: Optional[float] = None,
+    burst: bool = False,
+) -> int:
+    """
+    未計算のチャンクを取り出して計算し続けるワーカーのループ
+
+    Args:
+        stop_event: セットされると処理中のチャンクを終えてから停止する
+        poll_interval: 未計算のチャンクがない場合に待つ秒数（省略時は設定値）
+        burst: Trueの場合は未計算のチャンクがなくなった時点で終了する
+
+    Returns:
+        int: 処理したチャンクの数
+    """
+    stop_event = stop_event or threading.Event()
+    if poll_interval is None:
+        poll_interval = settings.GEO_DISTANCE_JOB_POLL_INTERVAL
+    service = GeoDistanceService()
+    processed = 0
+
+    while not stop_event.is_set():
+        try:
+            claimed = run_next_chunk(service)
+        except DatabaseError as e:
+            logger.error(f"ジョブのチャンクを取り出せませんでした: {e}")
+            close_old_connections()
+            claimed = False
+        if claimed:
+            processed += 1
+            continue
+        if burst:
+            break
+        stop_event.wait(poll_interval)
+
+    return processed
@@ -0,0 +1,179 @@
+import hashlib
+import json
+import logging
+import time
+from typing import Callable, Dict, Iterable, Iterator, Optional
+
+from opensearchpy import helpers
+from opensearchpy.exceptions import RequestError
+
+from .services import REFERENCE_INDEX_MAPPING
+from .spatial_index import reference_index_store
+
+
+logger = logging.getLogger(__name__)
+
+
+class LoadResult:
+    """参照地点の登録結果"""
+
+    def __init__(self):
+        self.indexed = 0
+        self.failed = 0
+        self.elapsed = 0.0
+        self.errors = []
+
+    @property
+    def docs_per_second(self) -> float:
+        return (self.indexed + self.failed) / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def ensure_reference_index(client, index_name: str) -> None:
+    """参照地点のインデックスがなければ作成する"""
+    if client.indices.exists(index=index_name):
+        return
+    try:
+        client.indices.create(index=index_name, body=REFERENCE_INDEX_MAPPING)
+        logger.info(f"インデックス '{index_name}' を作成しました")
+    except RequestError as e:
+        if e.error != "resource_already_exists_exception":
+            raise
+
+
+def point_id_for(point: Dict) -> str:
+    """
+    IDがない参照地点のID（座標と名称のハッシュ）を返す
+
+    同じファイルを登録し直しても同じIDになるため、地点は重複せずに上書きされる
+    （座標と名称が同じ地点は1件にまとめられる）
+    """
+    key = json.dumps([point["lat"], point["lon"], point.get("name")], ensure_ascii=False)
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def _bulk_actions(index_name: str, points: Iterable[Dict]) -> Iterator[Dict]:
+    """参照地点を_bulkのindexアクションに変換する"""
+    for point in points:
+        # IDがない地点にもpoint_id（search_afterのタイブレーカー）を持たせるため、ここで採番する
+        point_id = point.get("id") or point_id_for(point)
+        yield {
+            "_index": index_name,
+            "_id": point_id,
+            "_source": {
+                "location": {"lat": point["lat"], "lon": point["lon"]},
+                "name": point.get("name"),
+                "point_id": point_id,
+                "properties": point.get("properties") or {},
+            },
+        }
+
+
+# ensure_reference_indexで作成したインデックスの設定（refresh_intervalはNoneでデフォルトに戻る）
+_DEFAULT_INDEX_SETTINGS = {"refresh_interval": None, "number_of_replicas": "1"}
+
+
+class _BulkLoadSettings:
+    """
+    登録中はrefreshとレプリカを無効にし、終了時（失敗時を含む）に元の設定へ戻すコンテキストマネージャ
+
+    開始時にrefreshがすでに無効であれば、別の登録の途中（または中断された登録の後）の設定のため、
+    それを元の設定とはせずインデックス作成時の設定に戻す。登録が重なっても、無効にした設定のまま
+    残らないようにするため
+    """
+
+    def __init__(self, client, index_name: str):
+        self.client = client
+        self.index_name = index_name
+        self.original = None
+
+    def __enter__(self):
+        current = self.client.indices.get_settings(
+            index=self.index_name, name="index.refresh_interval,index.number_of_replicas"
+        )
+        index_settings = current.get(self.index_name, {}).get("settings", {}).get("index", {})
+        if str(index_settings.get("refresh_interval")) == "-1":
+            self.original = dict(_DEFAULT_INDEX_SETTINGS)
+        else:
+            # refresh_intervalが未設定の場合はNoneで戻すとデフォルトに戻る
+            self.original = {
+                "refresh_interval": index_settings.get("refresh_interval"),
+                "number_of_replicas": index_settings.get("number_of_replicas", "1"),
+            }
+        self.client.indices.put_settings(
+            index=self.index_name,
+            body={"index": {"refresh_interval": "-1", "number_of_replicas": 0}},
+        )
+        logger.info(f"インデックス '{self.index_name}' のrefreshとレプリカを無効にしました（元の設定: {self.original}）")
+        return self
+
+    def __exit__(self, *exc_info):
+        try:
+            self.client.indices.put_settings(index=self.index_name, body={"index": self.original})
+            self.client.indices.refresh(index=self.index_name)
+            logger.info(f"インデックス '{self.index_name}' の設定を元に戻しました")
+        except Exception as e:
+            logger.error(f"インデックス '{self.index_name}' の設定を元に戻せませんでした: {e}")
+        return False
+
+
+def load_reference_points(
+    client,
+    index_name: str,
+    points: Iterable[Dict],
+    chunk_size: int = 5000,
+    thread_count: int = 4,
+    queue_size: int = 4,
+    progress_every: int = 10000,
+    on_progress: Optional[Callable[[int, float], None]] = None,
+    max_errors: int = 100,
+) -> LoadResult:
+    """
+    参照地点をhelpers.parallel_bulkで並列に登録する
+
+    pointsはイテレータのまま消費し、同時にメモリに載るのはqueue_size + thread_count個の
+    チャンクまでに抑える。登録中はrefreshとレプリカを無効にし、終了後に元の設定へ戻す
+
+    Args:
+        client: OpenSearchクライアント
+        index_name: 登録先のインデックス名
+        points: readers.iter_reference_pointsが返す参照地点のiterable
+        chunk_size: 1回の_bulkで送る件数
+        thread_count: _bulkを並列に実行するスレッド数
+        queue_size: スレッドに渡す前に待機させるチャンク数
+        progress_every: on_progressを呼ぶ間隔（件数）
+        on_progress: (処理件数, 経過秒数)を受け取るコールバック
+        max_errors: LoadResult.errorsに保持するエラーの最大件数
+
+    Returns:
+        LoadResult: 登録件数・失敗件数・経過時間
+    """
+    result = LoadResult()
+    ensure_reference_index(client, index_name)
+
+    started = time.perf_counter()
+    with _BulkLoadSettings(client, index_name):
+        responses = helpers.parallel_bulk(
+            client,
+            _bulk_actions(index_name, points),
+            thread_count=thread_count,
+            chunk_size=chunk_size,
+            queue_size=queue_size,
+            raise_on_error=False,
+            raise_on_exception=False,
+        )
+        for ok, item in responses:
+            if ok:
+                result.indexed += 1
+            else:
+                result.failed += 1
+                if len(result.errors) < max_errors:
+                    result.errors.append(item)
+
+            processed = result.indexed + result.failed
+            if on_progress is not None and processed % progress_every == 0:
+                on_progress(processed, time.perf_counter() - started)
+
+    result.elapsed = time.perf_counter() - started
+    # このプロセスの空間インデックスに登録した地点を反映する（他のプロセスにはTTL後に反映される）
+    reference_index_store.invalidate()
+    return result
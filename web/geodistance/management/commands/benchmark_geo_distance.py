@@ -0,0 +1,75 @@
+import json
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from geodistance.benchmark import BENCHMARK_TARGETS, compare_results, run_benchmarks
+
+
+DEFAULT_OUTPUT_DIR = Path(settings.BASE_DIR) / "benchmark_results"
+
+
+class Command(BaseCommand):
+    help = (
+        "ローカルのOpenSearch代替サーバーに対してGeoDistanceServiceとgeo_distance_viewを計測し、"
+        "p50/p95/p99・スループット・1リクエストあたりのOpenSearch呼び出し数・送受信バイト数・デコード時間を"
+        "JSONで保存します"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200, help="シナリオごとのリクエスト数")
+        parser.add_argument("--concurrency", type=int, default=1, help="同時に実行するリクエスト数")
+        parser.add_argument("--latency-ms", type=float, default=1.0, help="代替サーバーが各APIに加える遅延（ミリ秒）")
+        parser.add_argument("--jitter-ms", type=float, default=0.0, help="遅延のゆらぎ（±ミリ秒）")
+        parser.add_argument("--modes", default="execute,indexed", help="計測する計算モード（カンマ区切り）")
+        parser.add_argument(
+            "--targets", default=",".join(BENCHMARK_TARGETS), help="計測対象（service, view。カンマ区切り）"
+        )
+        parser.add_argument("--seed", type=int, default=0, help="地点の組を生成する乱数シード")
+        parser.add_argument(
+            "--output", help="結果を保存するJSONファイル（省略時はbenchmark_results/<コミット>.json）"
+        )
+        parser.add_argument("--baseline", help="比較対象の過去の結果JSON")
+
+    def handle(self, *args, **options):
+        modes = [mode for mode in options["modes"].split(",") if mode]
+        targets = [target for target in options["targets"].split(",") if target]
+        unknown = set(targets) - set(BENCHMARK_TARGETS)
+        if unknown:
+            raise CommandError(f"未対応の計測対象です: {', '.join(sorted(unknown))}")
+
+        report = run_benchmarks(
+            requests=options["requests"],
+            concurrency=options["concurrency"],
+            modes=modes,
+            targets=targets,
+            latency_ms=options["latency_ms"],
+            jitter_ms=options["jitter_ms"],
+            seed=options["seed"],
+        )
+
+        if options["baseline"]:
+            baseline = json.loads(Path(options["baseline"]).read_text())
+            report["comparison"] = {
+                "baseline_commit": baseline.get("meta", {}).get("git_commit"),
+                "results": compare_results(report, baseline),
+            }
+
+        for result in report["results"]:
+            latency = result["latency_ms"]
+            self.stdout.write(
+                f"[{result['target']}/{result['mode']}] {result['requests_per_second']} req/s "
+                f"p50: {latency['p50']}ms p95: {latency['p95']}ms p99: {latency['p99']}ms "
+                f"OpenSearch呼び出し: {result['opensearch_calls_per_request']}回/リクエスト "
+                f"レスポンス: {result['response_bytes_per_request']}バイト/リクエスト "
+                f"デコード: {result['parse_ms_per_request']}ms/リクエスト "
+                f"エラー: {result['errors']}件"
+            )
+
+        output = Path(
+            options["output"] or DEFAULT_OUTPUT_DIR / f"{report['meta']['git_commit'] or 'working'}.json"
+        )
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(report, indent=2, ensure_ascii=False))
+        self.stdout.write(self.style.SUCCESS(f"結果を {output} に保存しました"))
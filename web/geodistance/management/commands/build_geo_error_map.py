@@ -0,0 +1,61 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from geodistance.error_map import DEFAULT_BAND_EDGES_KM, build_error_map
+
+
+class Command(BaseCommand):
+    help = (
+        "緯度経度のグリッドと距離帯ごとに、planeのarcに対する誤差率をローカルエンジンで事前計算し、"
+        "メモリマップできる誤差マップのファイルに書き出します"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output", default=None, help="出力先のファイル（省略時はGEO_DISTANCE_ERROR_MAP_PATH）"
+        )
+        parser.add_argument("--resolution", type=float, default=1.0, help="グリッドのセルの大きさ（度）")
+        parser.add_argument(
+            "--bands",
+            default=",".join(f"{edge:g}" for edge in DEFAULT_BAND_EDGES_KM),
+            help="距離帯の境界（km、カンマ区切りの昇順）",
+        )
+        parser.add_argument("--bearings", type=int, default=8, help="方位の区画の数（区画ごとに誤差率を保存する）")
+        parser.add_argument("--samples-per-band", type=int, default=3, help="距離帯ごとに計算する距離の数")
+
+    def handle(self, *args, **options):
+        output = options["output"] or settings.GEO_DISTANCE_ERROR_MAP_PATH
+        if not output:
+            raise CommandError("--outputまたはGEO_DISTANCE_ERROR_MAP_PATHを指定してください")
+
+        try:
+            band_edges_km = [float(edge) for edge in options["bands"].split(",") if edge]
+        except ValueError:
+            raise CommandError(f"距離帯の境界が不正です: {options['bands']}")
+
+        started = time.perf_counter()
+        try:
+            header = build_error_map(
+                output,
+                resolution=options["resolution"],
+                band_edges_km=band_edges_km,
+                bearings=options["bearings"],
+                samples_per_band=options["samples_per_band"],
+                on_progress=self._report_progress,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        n_lat, n_lon, n_bands, n_bearings, _ = header["shape"]
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{output}: {n_lat}x{n_lon}セル、{n_bands}距離帯、{n_bearings}方位の誤差マップを書き出しました"
+                f"（{time.perf_counter() - started:.1f}秒）"
+            )
+        )
+
+    def _report_progress(self, rows: int, total: int) -> None:
+        if rows % max(total // 10, 1) == 0:
+            self.stdout.write(f"  {rows}/{total}行")
@@ -0,0 +1,77 @@
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from geodistance.clients import get_client
+from geodistance.loader import load_reference_points
+from geodistance.readers import POINT_FORMATS, detect_point_format, iter_reference_points
+
+
+class Command(BaseCommand):
+    help = (
+        "CSV・GeoJSON・NDJSONの参照地点（駅・店舗など）をストリーミングで読み込み、"
+        "helpers.parallel_bulkで参照地点のインデックスに登録します"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("paths", nargs="+", help="参照地点のファイル")
+        parser.add_argument("--format", choices=POINT_FORMATS, help="入力形式（省略時は拡張子から判定）")
+        parser.add_argument("--index", default=None, help="登録先のインデックス（省略時はGEO_REFERENCE_INDEX）")
+        parser.add_argument("--chunk-size", type=int, default=5000, help="1回の_bulkで送る件数")
+        parser.add_argument("--threads", type=int, default=4, help="_bulkを並列に実行するスレッド数")
+        parser.add_argument("--queue-size", type=int, default=4, help="スレッドに渡す前に待機させるチャンク数")
+        parser.add_argument("--progress-every", type=int, default=50000, help="進捗を表示する間隔（件数）")
+
+    def handle(self, *args, **options):
+        index_name = options["index"] or settings.GEO_REFERENCE_INDEX
+        if options["threads"] > settings.OPENSEARCH_POOL_MAXSIZE:
+            self.stderr.write(
+                self.style.WARNING(
+                    f"--threads（{options['threads']}）がOPENSEARCH_POOL_MAXSIZE"
+                    f"（{settings.OPENSEARCH_POOL_MAXSIZE}）を超えているため、接続を使い回せません"
+                )
+            )
+
+        client = get_client()
+        total_indexed = total_failed = 0
+        for path in options["paths"]:
+            path = Path(path)
+            try:
+                fmt = options["format"] or detect_point_format(path.name)
+            except ValueError as e:
+                raise CommandError(f"{path}: {e}")
+
+            self.stdout.write(f"{path}（{fmt}）を '{index_name}' に登録します")
+            with path.open("rb") as stream:
+                try:
+                    result = load_reference_points(
+                        client,
+                        index_name,
+                        iter_reference_points(stream, fmt),
+                        chunk_size=options["chunk_size"],
+                        thread_count=options["threads"],
+                        queue_size=options["queue_size"],
+                        progress_every=options["progress_every"],
+                        on_progress=self._report_progress,
+                    )
+                except ValueError as e:
+                    raise CommandError(f"{path}: {e}")
+
+            for error in result.errors[:10]:
+                self.stderr.write(f"登録に失敗しました: {error}")
+            self.stdout.write(
+                self.style.SUCCESS(
+                    f"{path}: {result.indexed}件を登録しました（失敗 {result.failed}件、"
+                    f"{result.elapsed:.1f}秒、{result.docs_per_second:.0f} docs/sec）"
+                )
+            )
+            total_indexed += result.indexed
+            total_failed += result.failed
+
+        if total_failed:
+            raise CommandError(f"{total_failed}件の登録に失敗しました（成功 {total_indexed}件）")
+
+    def _report_progress(self, processed: int, elapsed: float) -> None:
+        rate = processed / elapsed if elapsed > 0 else 0.0
+        self.stdout.write(f"  {processed}件 {elapsed:.1f}秒 {rate:.0f} docs/sec")
@@ -0,0 +1,93 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+
+from geodistance.async_services import AsyncGeoDistanceService
+from geodistance.clients import async_client_registry
+from geodistance.services import GeoDistanceService
+
+
+class Command(BaseCommand):
+    help = "同期サービス（スレッドプール）と非同期サービス（asyncio）で同じ負荷をかけ、スループットとレイテンシを比較します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200, help="各経路で実行する計算の回数")
+        parser.add_argument("--concurrency", type=int, default=16, help="同時に実行する計算の数")
+        parser.add_argument("--seed", type=int, default=0, help="乱数シード")
+        parser.add_argument(
+            "--path",
+            choices=["both", "sync", "async"],
+            default="both",
+            help="計測する経路",
+        )
+
+    def handle(self, *args, **options):
+        # 合成した地点の組を計算履歴・誤差レポートに残さず、履歴の書き込みを計測に含めない
+        with override_settings(GEO_DISTANCE_HISTORY_ENABLED=False):
+            self._handle(**options)
+
+    def _handle(self, **options):
+        rng = np.random.default_rng(options["seed"])
+        count = options["requests"]
+        pairs = list(
+            zip(
+                rng.uniform(-90, 90, count).tolist(),
+                rng.uniform(-180, 180, count).tolist(),
+                rng.uniform(-90, 90, count).tolist(),
+                rng.uniform(-180, 180, count).tolist(),
+            )
+        )
+        concurrency = options["concurrency"]
+
+        if options["path"] in ("both", "sync"):
+            self._report("sync", *self._run_sync(pairs, concurrency))
+        if options["path"] in ("both", "async"):
+            self._report("async", *asyncio.run(self._run_async(pairs, concurrency)))
+
+    def _run_sync(self, pairs, concurrency):
+        """スレッドプールから共有クライアントで同期サービスを呼び出す"""
+        service = GeoDistanceService()
+
+        def timed(pair):
+            started = time.perf_counter()
+            result = service.calculate_distances(*pair)
+            return time.perf_counter() - started, result["success"]
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            outcomes = list(executor.map(timed, pairs))
+        return outcomes, time.perf_counter() - started
+
+    async def _run_async(self, pairs, concurrency):
+        """1つのイベントループ上でセマフォにより同時実行数を制限して非同期サービスを呼び出す"""
+        service = AsyncGeoDistanceService()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def timed(pair):
+            async with semaphore:
+                started = time.perf_counter()
+                result = await service.calculate_distances(*pair)
+                return time.perf_counter() - started, result["success"]
+
+        started = time.perf_counter()
+        try:
+            outcomes = await asyncio.gather(*(timed(pair) for pair in pairs))
+        finally:
+            await async_client_registry.close()
+        return outcomes, time.perf_counter() - started
+
+    def _report(self, label, outcomes, elapsed):
+        latencies = np.array([latency for latency, _ in outcomes]) * 1000.0
+        errors = sum(1 for _, success in outcomes if not success)
+        p50, p95, p99 = np.percentile(latencies, [50, 95, 99]) if len(latencies) else (0, 0, 0)
+        throughput = len(outcomes) / elapsed if elapsed > 0 else 0.0
+
+        self.stdout.write(
+            f"[{label}] {len(outcomes)}件 / {elapsed:.2f}秒 "
+            f"スループット: {throughput:.1f} req/s "
+            f"p50: {p50:.1f}ms p95: {p95:.1f}ms p99: {p99:.1f}ms エラー: {errors}件"
+        )
@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from geodistance.clients import get_client
+from geodistance.index_management import (
+    INDEX_DEFINITIONS,
+    aliased_indices,
+    index_alias,
+    migrate_index,
+    versioned_index_name,
+)
+from geodistance.services import delete_stale_scratch_documents, index_existence_cache
+
+
+class Command(BaseCommand):
+    help = (
+        "距離計算用インデックスの定義のバージョンを切り替えます。新しいバージョンのインデックスを"
+        "テンプレートから作成してreindexし、エイリアスを1回の_aliases呼び出しで付け替えます"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--to-version", type=int, default=None, help="切り替え先のバージョン（省略時はGEO_DISTANCE_INDEX_VERSION）"
+        )
+        parser.add_argument("--delete-old", action="store_true", help="切り替え後に元のインデックスを削除する")
+        parser.add_argument("--timeout", type=float, default=3600.0, help="reindexの期限（秒）")
+        parser.add_argument("--dry-run", action="store_true", help="現在の状態と切り替え先を表示するだけで変更しない")
+        parser.add_argument(
+            "--purge-scratch",
+            action="store_true",
+            help="切り替え後にindexedモードの一時ドキュメント（reindexでコピーされたものを含む）をすべて削除する",
+        )
+
+    def handle(self, *args, **options):
+        version = options["to_version"] or settings.GEO_DISTANCE_INDEX_VERSION
+        if version not in INDEX_DEFINITIONS:
+            raise CommandError(
+                f"未定義のバージョンです: {version}（{', '.join(map(str, INDEX_DEFINITIONS))}）"
+            )
+
+        client = get_client()
+        current = aliased_indices(client)
+        self.stdout.write(
+            f"エイリアス '{index_alias()}': {', '.join(current) or '（なし）'} → {versioned_index_name(version)}"
+        )
+        if options["dry_run"]:
+            return
+
+        try:
+            result = migrate_index(
+                client, version=version, delete_old=options["delete_old"], timeout=options["timeout"]
+            )
+        except Exception as e:
+            raise CommandError(f"インデックスを切り替えられませんでした: {e}")
+        index_existence_cache.invalidate()
+        if options["purge_scratch"]:
+            deleted = delete_stale_scratch_documents(client, all_workers=True)
+            self.stdout.write(f"一時ドキュメントを{deleted}件削除しました")
+
+        if not result.migrated:
+            self.stdout.write(self.style.SUCCESS(f"'{result.target}' に切り替え済みです"))
+            return
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"'{result.source or '（なし）'}' から '{result.target}' に切り替えました"
+                f"（{result.copied}件、{result.elapsed:.1f}秒）"
+            )
+        )
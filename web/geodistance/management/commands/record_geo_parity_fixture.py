@@ -0,0 +1,118 @@
+import json
+from pathlib import Path
+
+import numpy as np
+from django.core.management.base import BaseCommand, CommandError
+
+from geodistance.engine import EARTH_MEAN_RADIUS
+from geodistance.services import GeoDistanceService
+
+try:
+    import jpype
+except ImportError:
+    jpype = None
+
+
+DEFAULT_OUTPUT = Path(__file__).resolve().parents[2] / "fixtures" / "opensearch_parity.json"
+
+# 同一地点・対蹠点・極・日付変更線など、計算式の境界になる地点の組
+EDGE_CASES = [
+    (35.6762, 139.6503, 35.6762, 139.6503),
+    (35.6762, 139.6503, 34.6937, 135.5023),
+    (0.0, 0.0, 0.0, 180.0),
+    (90.0, 0.0, -90.0, 0.0),
+    (89.9999, 45.0, 89.9999, -135.0),
+    (10.0, 179.9999, 10.0, -179.9999),
+    (-33.8688, 151.2093, 51.5074, -0.1278),
+]
+
+
+class _JvmDistances:
+    """
+    OpenSearchのスクリプトが呼び出すJavaの実装（GeoEncodingUtilsの量子化、SloppyMath.haversinMeters、
+    GeoUtils.planeDistanceと同じMathの演算）をJPypeでJVM上で実行して距離を求める
+
+    OpenSearchに接続できない環境で、同じLuceneのjarとJVMからフィクスチャを記録するために使う
+    """
+
+    def __init__(self, lucene_jar: str):
+        if jpype is None:
+            raise CommandError("--lucene-jarを使うにはJPype1をインストールしてください")
+        if not jpype.isJVMStarted():
+            jpype.startJVM(jpype.getDefaultJVMPath(), classpath=[lucene_jar])
+        self.encoding = jpype.JClass("org.apache.lucene.geo.GeoEncodingUtils")
+        self.sloppy_math = jpype.JClass("org.apache.lucene.util.SloppyMath")
+        self.math = jpype.JClass("java.lang.Math")
+        system = jpype.JClass("java.lang.System")
+        self.source = (
+            f"lucene-core {jpype.JClass('org.apache.lucene.util.Version').LATEST} "
+            f"(java {system.getProperty('java.version')})"
+        )
+
+    def __call__(self, a_lat: float, a_lon: float, b_lat: float, b_lon: float):
+        # A地点はdoc valuesとして量子化され、B地点はスクリプトのパラメータとしてそのまま渡される
+        lat = float(self.encoding.decodeLatitude(self.encoding.encodeLatitude(a_lat)))
+        lon = float(self.encoding.decodeLongitude(self.encoding.encodeLongitude(a_lon)))
+        arc = float(self.sloppy_math.haversinMeters(lat, lon, b_lat, b_lon)) / 1000.0
+        x = float(self.math.toRadians(b_lon - lon)) * float(
+            self.math.cos(self.math.toRadians((b_lat + lat) / 2.0))
+        )
+        y = float(self.math.toRadians(b_lat - lat))
+        plane = float(self.math.sqrt(x * x + y * y)) * EARTH_MEAN_RADIUS / 1000.0
+        return arc, plane
+
+
+class Command(BaseCommand):
+    help = "OpenSearchで計算したarc/plane距離を記録し、ローカルエンジンのパリティテスト用フィクスチャを作成します"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--count", type=int, default=500, help="ランダムに生成する地点の組の数")
+        parser.add_argument("--seed", type=int, default=0, help="乱数シード")
+        parser.add_argument("--output", default=str(DEFAULT_OUTPUT), help="出力先のJSONファイル")
+        parser.add_argument(
+            "--lucene-jar",
+            help="OpenSearchに接続せず、このLuceneのjarとJVM（JAVA_HOME）で同じJavaの実装を実行して記録する",
+        )
+
+    def handle(self, *args, **options):
+        if options["lucene_jar"]:
+            calculate = _JvmDistances(options["lucene_jar"])
+            opensearch_version, source = None, calculate.source
+        else:
+            service = GeoDistanceService()
+            if not service.client or not service._ensure_index_exists():
+                raise CommandError("OpenSearchに接続できません")
+            calculate = service._execute_arc_and_plane
+            opensearch_version = service.client.info().get("version", {}).get("number")
+            source = f"opensearch {opensearch_version}"
+
+        rng = np.random.default_rng(options["seed"])
+        pairs = list(EDGE_CASES)
+        pairs.extend(
+            zip(
+                rng.uniform(-90, 90, options["count"]).tolist(),
+                rng.uniform(-180, 180, options["count"]).tolist(),
+                rng.uniform(-90, 90, options["count"]).tolist(),
+                rng.uniform(-180, 180, options["count"]).tolist(),
+            )
+        )
+
+        records = []
+        for a_lat, a_lon, b_lat, b_lon in pairs:
+            distances = calculate(a_lat, a_lon, b_lat, b_lon)
+            if distances is None:
+                raise CommandError(f"距離の計算に失敗しました: {(a_lat, a_lon, b_lat, b_lon)}")
+            records.append([a_lat, a_lon, b_lat, b_lon, distances[0], distances[1]])
+
+        fixture = {
+            "opensearch_version": opensearch_version,
+            "source": source,
+            "unit": "km",
+            "columns": ["a_lat", "a_lon", "b_lat", "b_lon", "arc", "plane"],
+            "records": records,
+        }
+        output = Path(options["output"])
+        output.parent.mkdir(parents=True, exist_ok=True)
+        output.write_text(json.dumps(fixture, indent=1))
+
+        self.stdout.write(self.style.SUCCESS(f"{len(records)}件を {output} に記録しました"))
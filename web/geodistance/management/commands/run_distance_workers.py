@@ -0,0 +1,80 @@
+import multiprocessing
+import signal
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+
+from geodistance.jobs import run_worker
+
+
+def _worker_main(stop_event, poll_interval: float, burst: bool) -> None:
+    """子プロセスのエントリーポイント（fork後に親のDB接続を使い回さない）"""
+    connections.close_all()
+    run_worker(stop_event, poll_interval=poll_interval, burst=burst)
+
+
+class Command(BaseCommand):
+    help = (
+        "バックグラウンドジョブのワーカーを起動します。"
+        "PostgreSQLのSELECT ... FOR UPDATE SKIP LOCKEDで未計算のチャンクを取り出して計算します"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--processes", type=int, default=None, help="ワーカープロセスの数（省略時はGEO_DISTANCE_JOB_WORKERS）"
+        )
+        parser.add_argument(
+            "--poll-interval",
+            type=float,
+            default=None,
+            help="未計算のチャンクがない場合に待つ秒数（省略時はGEO_DISTANCE_JOB_POLL_INTERVAL）",
+        )
+        parser.add_argument("--burst", action="store_true", help="未計算のチャンクがなくなったら終了する")
+
+    def handle(self, *args, **options):
+        processes = options["processes"] or settings.GEO_DISTANCE_JOB_WORKERS
+        poll_interval = options["poll_interval"]
+        if poll_interval is None:
+            poll_interval = settings.GEO_DISTANCE_JOB_POLL_INTERVAL
+        if processes < 1:
+            raise CommandError("--processesは1以上にしてください")
+
+        context = multiprocessing.get_context("fork")
+        stop_event = context.Event()
+
+        def stop(signum, frame):
+            self.stdout.write("停止要求を受け付けました。処理中のチャンクを終えてから停止します")
+            stop_event.set()
+
+        previous_handlers = {sig: signal.signal(sig, stop) for sig in (signal.SIGTERM, signal.SIGINT)}
+        try:
+            self._run(context, stop_event, processes, poll_interval, options["burst"])
+        finally:
+            for sig, handler in previous_handlers.items():
+                signal.signal(sig, handler)
+
+    def _run(self, context, stop_event, processes: int, poll_interval: float, burst: bool) -> None:
+        self.stdout.write(f"ワーカーを{processes}プロセスで起動します")
+        if processes == 1:
+            processed = run_worker(stop_event, poll_interval=poll_interval, burst=burst)
+            self.stdout.write(self.style.SUCCESS(f"{processed}チャンクを処理しました"))
+            return
+
+        # 子プロセスが親のDB接続を引き継がないよう、fork前に閉じる
+        connections.close_all()
+        workers = [
+            context.Process(
+                target=_worker_main, args=(stop_event, poll_interval, burst), name=f"distance-worker-{i}"
+            )
+            for i in range(processes)
+        ]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+
+        failed = [worker.name for worker in workers if worker.exitcode]
+        if failed:
+            raise CommandError(f"異常終了したワーカーがあります: {', '.join(failed)}")
+        self.stdout.write(self.style.SUCCESS("すべてのワーカーが停止しました"))
@@ -0,0 +1,104 @@
+import json
+import os
+import time
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from geodistance.error_map import DEFAULT_BAND_EDGES_KM
+from geodistance.precision_sweep import BACKENDS, run_sweep
+
+
+class Command(BaseCommand):
+    help = (
+        "緯度帯と距離帯ごとに地点の組を生成し、arc/plane距離とWGS84楕円体上の測地線距離（Vincenty、収束しない組はKarney）との"
+        "誤差の統計を出力します。地点の組の生成と計算はプロセスプールで並列に行います"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--pairs", type=int, default=1000000, help="地点の組の数")
+        parser.add_argument("--latitude-band", type=float, default=10.0, help="緯度帯の幅（度）")
+        parser.add_argument(
+            "--bands",
+            default=",".join(f"{edge:g}" for edge in DEFAULT_BAND_EDGES_KM),
+            help="距離帯の境界（km、カンマ区切りの昇順）",
+        )
+        parser.add_argument(
+            "--backend",
+            choices=BACKENDS,
+            default="local",
+            help="arc/planeの計算先（localはローカルエンジン、opensearchは_bulk/_msearch）",
+        )
+        parser.add_argument(
+            "--processes", type=int, default=None, help="プロセス数（省略時はCPUの数）"
+        )
+        parser.add_argument("--chunk-size", type=int, default=None, help="1タスクで計算する組の数")
+        parser.add_argument("--seed", type=int, default=0, help="地点の組を生成する乱数のシード")
+        parser.add_argument("--output", help="緯度帯×距離帯ごとの統計を保存するJSONファイル")
+
+    def handle(self, *args, **options):
+        try:
+            band_edges_km = [float(edge) for edge in options["bands"].split(",") if edge]
+        except ValueError:
+            raise CommandError(f"距離帯の境界が不正です: {options['bands']}")
+        processes = options["processes"] or os.cpu_count() or 1
+
+        self.stdout.write(
+            f"{options['pairs']}件の組を{processes}プロセスで計算します（計算先: {options['backend']}）"
+        )
+        started = time.perf_counter()
+        try:
+            statistics = run_sweep(
+                options["pairs"],
+                latitude_band=options["latitude_band"],
+                band_edges_km=band_edges_km,
+                backend=options["backend"],
+                processes=processes,
+                chunk_size=options["chunk_size"],
+                seed=options["seed"],
+                on_progress=self._report_progress,
+            )
+        except ValueError as e:
+            raise CommandError(str(e))
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write("距離帯  件数  arc 平均/RMS/最大誤差(m)  plane 平均/RMS/最大誤差(m)  planeが近い割合")
+        for row in statistics.by_distance_band().rows():
+            if not row["count"]:
+                continue
+            self.stdout.write(
+                f"  {row['from_km']:g}-{row['to_km']:g}km  {row['count']}"
+                f"  arc {row['arc_mean_error_m']:.3f}/{row['arc_rms_error_m']:.3f}/{row['arc_max_abs_error_m']:.3f}"
+                f" ({row['arc_mean_abs_error_pct']:.4f}%)"
+                f"  plane {row['plane_mean_error_m']:.3f}/{row['plane_rms_error_m']:.3f}"
+                f"/{row['plane_max_abs_error_m']:.3f} ({row['plane_mean_abs_error_pct']:.4f}%)"
+                f"  {row['plane_closer_ratio']:.1%}"
+                + (f"  計算できなかった組: {row['failures']}" if row["failures"] else "")
+            )
+
+        if options["output"]:
+            report = {
+                "meta": {
+                    "pairs": options["pairs"],
+                    "latitude_band": options["latitude_band"],
+                    "band_edges_km": band_edges_km,
+                    "backend": options["backend"],
+                    "processes": processes,
+                    "seed": options["seed"],
+                    "elapsed_seconds": elapsed,
+                },
+                "bands": statistics.by_distance_band().rows(),
+                "cells": statistics.rows(),
+            }
+            Path(options["output"]).write_text(json.dumps(report, indent=2, ensure_ascii=False))
+            self.stdout.write(f"統計を {options['output']} に保存しました")
+
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"{options['pairs']}件の精度スイープが完了しました（{elapsed:.1f}秒、"
+                f"{options['pairs'] / elapsed:.0f}件/秒）"
+            )
+        )
+
+    def _report_progress(self, done: int, total: int) -> None:
+        self.stdout.write(f"  {done}/{total}件")
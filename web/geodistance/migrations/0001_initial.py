@@ -0,0 +1,54 @@
+# Generated by Django 5.1.4 on 2026-10-17 21:06
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DistanceJob',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False)),
+                ('status', models.CharField(choices=[('queued', '待機中'), ('running', '実行中'), ('succeeded', '完了'), ('failed', '失敗')], default='queued', max_length=16)),
+                ('total_pairs', models.PositiveBigIntegerField(default=0)),
+                ('processed_pairs', models.PositiveBigIntegerField(default=0)),
+                ('error_rows', models.PositiveBigIntegerField(default=0)),
+                ('total_chunks', models.PositiveIntegerField(default=0)),
+                ('completed_chunks', models.PositiveIntegerField(default=0)),
+                ('error_message', models.TextField(blank=True, default='')),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'ordering': ['-created_at'],
+            },
+        ),
+        migrations.CreateModel(
+            name='DistanceJobChunk',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('status', models.CharField(choices=[('pending', '未計算'), ('done', '計算済み'), ('failed', '失敗')], default='pending', max_length=16)),
+                ('pairs', models.JSONField()),
+                ('rows', models.JSONField(blank=True, null=True)),
+                ('attempts', models.PositiveSmallIntegerField(default=0)),
+                ('error_message', models.TextField(blank=True, default='')),
+                ('completed_at', models.DateTimeField(blank=True, null=True)),
+                ('job', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='chunks', to='geodistance.distancejob')),
+            ],
+            options={
+                'ordering': ['job', 'number'],
+                'indexes': [models.Index(condition=models.Q(('status', 'pending')), fields=['id'], name='geodistance_pending_chunks')],
+                'constraints': [models.UniqueConstraint(fields=('job', 'number'), name='geodistance_job_chunk_number')],
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.1.4 on 2026-10-17 21:09
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geodistance', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DistanceCalculation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('mode', models.CharField(max_length=16)),
+                ('a_lat', models.FloatField()),
+                ('a_lon', models.FloatField()),
+                ('b_lat', models.FloatField()),
+                ('b_lon', models.FloatField()),
+                ('arc_distance_km', models.FloatField()),
+                ('plane_distance_km', models.FloatField()),
+                ('difference_km', models.FloatField()),
+                ('difference_percentage', models.FloatField()),
+                ('distance_band_km', models.FloatField()),
+                ('latitude_band', models.SmallIntegerField()),
+            ],
+            options={
+                'indexes': [django.contrib.postgres.indexes.BrinIndex(autosummarize=True, fields=['created_at'], name='geodistance_calc_created_brin'), models.Index(fields=['a_lat', 'a_lon'], name='geodistance_calc_a_point'), models.Index(fields=['b_lat', 'b_lon'], name='geodistance_calc_b_point'), models.Index(fields=['distance_band_km', 'latitude_band', 'created_at'], name='geodistance_calc_bands')],
+            },
+        ),
+        migrations.CreateModel(
+            name='DistanceErrorRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('distance_band_km', models.FloatField()),
+                ('latitude_band', models.SmallIntegerField()),
+                ('count', models.PositiveBigIntegerField(default=0)),
+                ('sum_difference_km', models.FloatField(default=0.0)),
+                ('sum_difference_percentage', models.FloatField(default=0.0)),
+                ('max_difference_percentage', models.FloatField(default=0.0)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('date', 'distance_band_km', 'latitude_band'), name='geodistance_error_rollup_key')],
+            },
+        ),
+    ]
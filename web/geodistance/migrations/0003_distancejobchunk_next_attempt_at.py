@@ -0,0 +1,18 @@
+# Generated by Django 5.1.4 on 2026-10-17 21:45
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('geodistance', '0002_distancecalculation_distanceerrorrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='distancejobchunk',
+            name='next_attempt_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
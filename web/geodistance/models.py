@@ -1 +1,159 @@
-# Create your models here.
+import uuid
+from typing import Dict
+
+from django.contrib.postgres.indexes import BrinIndex
+from django.db import models
+
+
+class DistanceJob(models.Model):
+    """
+    地点の組をまとめて計算するバックグラウンドジョブ
+
+    入力はチャンク（DistanceJobChunk）に分けて保存し、run_distance_workersのワーカーが
+    チャンク単位で計算する。計算済みのチャンクはコミット済みのため、ワーカーが停止しても
+    残りのチャンクから再開できる
+    """
+
+    class Status(models.TextChoices):
+        QUEUED = "queued", "待機中"
+        RUNNING = "running", "実行中"
+        SUCCEEDED = "succeeded", "完了"
+        FAILED = "failed", "失敗"
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.QUEUED)
+    total_pairs = models.PositiveBigIntegerField(default=0)
+    processed_pairs = models.PositiveBigIntegerField(default=0)
+    # 範囲外の座標などで計算できなかった行の数
+    error_rows = models.PositiveBigIntegerField(default=0)
+    total_chunks = models.PositiveIntegerField(default=0)
+    completed_chunks = models.PositiveIntegerField(default=0)
+    error_message = models.TextField(blank=True, default="")
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["-created_at"]
+
+    def __str__(self) -> str:
+        return f"{self.id}（{self.status}）"
+
+    @property
+    def progress(self) -> float:
+        """計算済みの割合（0.0〜1.0）"""
+        if not self.total_pairs:
+            return 1.0 if self.status == self.Status.SUCCEEDED else 0.0
+        return self.processed_pairs / self.total_pairs
+
+    def to_dict(self) -> Dict:
+        """進捗APIで返す内容"""
+        return {
+            "id": str(self.id),
+            "status": self.status,
+            "progress": round(self.progress, 4),
+            "total_pairs": self.total_pairs,
+            "processed_pairs": self.processed_pairs,
+            "error_rows": self.error_rows,
+            "total_chunks": self.total_chunks,
+            "completed_chunks": self.completed_chunks,
+            "error_message": self.error_message or None,
+            "created_at": self.created_at.isoformat() if self.created_at else None,
+            "started_at": self.started_at.isoformat() if self.started_at else None,
+            "finished_at": self.finished_at.isoformat() if self.finished_at else None,
+        }
+
+
+class DistanceJobChunk(models.Model):
+    """ジョブの入力と結果の1チャンク。ワーカーはSELECT ... FOR UPDATE SKIP LOCKEDで取り出す"""
+
+    class Status(models.TextChoices):
+        PENDING = "pending", "未計算"
+        DONE = "done", "計算済み"
+        FAILED = "failed", "失敗"
+
+    job = models.ForeignKey(DistanceJob, on_delete=models.CASCADE, related_name="chunks")
+    number = models.PositiveIntegerField()
+    status = models.CharField(max_length=16, choices=Status.choices, default=Status.PENDING)
+    # [[A緯度, A経度, B緯度, B経度], ...]
+    pairs = models.JSONField()
+    # 行ごとの計算結果（BATCH_COLUMNSをキーとする辞書のリスト）
+    rows = models.JSONField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    error_message = models.TextField(blank=True, default="")
+    # 計算に失敗したチャンクを次に取り出せる時刻（失敗するたびに間隔を延ばす）
+    next_attempt_at = models.DateTimeField(null=True, blank=True)
+    completed_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["job", "number"]
+        constraints = [
+            models.UniqueConstraint(fields=["job", "number"], name="geodistance_job_chunk_number"),
+        ]
+        indexes = [
+            # ワーカーが未計算のチャンクを古い順に探すための部分インデックス
+            models.Index(
+                fields=["id"],
+                name="geodistance_pending_chunks",
+                condition=models.Q(status="pending"),
+            ),
+        ]
+
+    def __str__(self) -> str:
+        return f"{self.job_id} #{self.number}（{self.status}）"
+
+
+class DistanceCalculation(models.Model):
+    """
+    GeoDistanceServiceで計算した結果の履歴
+
+    geodistance.historyが計算結果をバッファに溜めてまとめて登録する。
+    追記のみで作成日時と物理的な並びが一致するため、期間の絞り込みにはBRINインデックスを使う
+    """
+
+    created_at = models.DateTimeField()
+    mode = models.CharField(max_length=16)
+    a_lat = models.FloatField()
+    a_lon = models.FloatField()
+    b_lat = models.FloatField()
+    b_lon = models.FloatField()
+    arc_distance_km = models.FloatField()
+    plane_distance_km = models.FloatField()
+    difference_km = models.FloatField()
+    difference_percentage = models.FloatField()
+    # 集計に使う距離帯（arc距離の下限km）と緯度帯（2地点の中間緯度の下限）
+    distance_band_km = models.FloatField()
+    latitude_band = models.SmallIntegerField()
+
+    class Meta:
+        indexes = [
+            BrinIndex(fields=["created_at"], name="geodistance_calc_created_brin", autosummarize=True),
+            models.Index(fields=["a_lat", "a_lon"], name="geodistance_calc_a_point"),
+            models.Index(fields=["b_lat", "b_lon"], name="geodistance_calc_b_point"),
+            models.Index(
+                fields=["distance_band_km", "latitude_band", "created_at"], name="geodistance_calc_bands"
+            ),
+        ]
+
+
+class DistanceErrorRollup(models.Model):
+    """
+    日付・距離帯・緯度帯ごとのplaneのarcに対する誤差の集計
+
+    履歴を登録するたびに同じトランザクションで加算するため、集計APIは履歴を走査しない
+    """
+
+    date = models.DateField()
+    distance_band_km = models.FloatField()
+    latitude_band = models.SmallIntegerField()
+    count = models.PositiveBigIntegerField(default=0)
+    sum_difference_km = models.FloatField(default=0.0)
+    sum_difference_percentage = models.FloatField(default=0.0)
+    max_difference_percentage = models.FloatField(default=0.0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["date", "distance_band_km", "latitude_band"], name="geodistance_error_rollup_key"
+            ),
+        ]
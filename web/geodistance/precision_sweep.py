@@ -0,0 +1,384 @@
+"""
+arc・planeの距離とWGS84楕円体上の測地線距離を比較する精度スイープ
+
+緯度帯と距離帯の組ごとに同じ数の地点の組を生成し、OpenSearchのarc/plane距離（ローカルエンジン、
+またはOpenSearchへの_bulk/_msearch）と、楕円体上の測地線距離（Vincentyの逆解法。収束しない組はKarneyの方法）を比べる。
+地点の組はチャンクごとに乱数のシードから生成し、プロセスプールで並列に計算する。
+各プロセスは地点の組ではなく集計値だけを返すため、件数が増えてもプロセス間の転送量は変わらない
+"""
+
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+from geographiclib.geodesic import Geodesic
+from django.db import connections
+
+from . import engine
+from .clients import client_registry
+from .error_map import DEFAULT_BAND_EDGES_KM, _destination
+
+
+logger = logging.getLogger(__name__)
+
+# WGS84の長半径（メートル）と扁平率
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+_WGS84_GEODESIC = Geodesic(WGS84_A, WGS84_F)
+
+BACKENDS = ("local", "opensearch")
+
+# ローカルエンジンで計算する場合の1チャンク（1タスク）の件数
+DEFAULT_CHUNK_SIZE = 50000
+
+_MODELS = ("arc", "plane")
+
+
+def geodesic_distance(
+    lat1, lon1, lat2, lon2, max_iterations: int = 100, tolerance: float = 1e-12
+) -> np.ndarray:
+    """
+    WGS84楕円体上の測地線距離（メートル）。Vincentyの逆解法を配列に対して計算する
+
+    収束した組は以降の反復から外すため、反復回数が多くなるのは対蹠点に近い組だけになる。
+    max_iterations回で収束しない組（ほぼ対蹠点）は、対蹠点付近でも解けるKarneyの方法
+    （geographiclib）で1組ずつ求める。arc/planeの差が最も大きくなる組を集計から落とさないため
+
+    Returns:
+        np.ndarray: 距離（メートル）
+    """
+    lat1, lon1, lat2, lon2 = np.broadcast_arrays(
+        *(np.asarray(value, dtype=np.float64) for value in (lat1, lon1, lat2, lon2))
+    )
+    shape = lat1.shape
+    b = (1 - WGS84_F) * WGS84_A
+
+    longitude_difference = np.radians((lon2 - lon1 + 180.0) % 360.0 - 180.0).ravel()
+    u1 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat1.ravel())))
+    u2 = np.arctan((1 - WGS84_F) * np.tan(np.radians(lat2.ravel())))
+    sin_u1, cos_u1 = np.sin(u1), np.cos(u1)
+    sin_u2, cos_u2 = np.sin(u2), np.cos(u2)
+
+    distance = np.full(longitude_difference.shape, np.nan)
+    lam = longitude_difference.copy()
+    active = np.arange(longitude_difference.size)
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        for _ in range(max_iterations):
+            if active.size == 0:
+                break
+            lam_diff = longitude_difference[active]
+            s1, c1, s2, c2 = sin_u1[active], cos_u1[active], sin_u2[active], cos_u2[active]
+            sin_lam, cos_lam = np.sin(lam[active]), np.cos(lam[active])
+
+            sin_sigma = np.sqrt((c2 * sin_lam) ** 2 + (c1 * s2 - s1 * c2 * cos_lam) ** 2)
+            cos_sigma = s1 * s2 + c1 * c2 * cos_lam
+            sigma = np.arctan2(sin_sigma, cos_sigma)
+            # 同じ地点（sin_sigma = 0）と赤道上の組（cos²α = 0）は0で割らないようにする
+            sin_alpha = np.where(sin_sigma > 0, c1 * c2 * sin_lam / sin_sigma, 0.0)
+            cos_sq_alpha = 1 - sin_alpha * sin_alpha
+            cos_2sigma_m = np.where(cos_sq_alpha > 0, cos_sigma - 2 * s1 * s2 / cos_sq_alpha, 0.0)
+            c = WGS84_F / 16 * cos_sq_alpha * (4 + WGS84_F * (4 - 3 * cos_sq_alpha))
+            next_lam = lam_diff + (1 - c) * WGS84_F * sin_alpha * (
+                sigma + c * sin_sigma * (cos_2sigma_m + c * cos_sigma * (-1 + 2 * cos_2sigma_m**2))
+            )
+
+            converged = np.abs(next_lam - lam[active]) < tolerance
+            lam[active] = next_lam
+
+            u_sq = cos_sq_alpha * (WGS84_A**2 - b**2) / b**2
+            a_coefficient = 1 + u_sq / 16384 * (4096 + u_sq * (-768 + u_sq * (320 - 175 * u_sq)))
+            b_coefficient = u_sq / 1024 * (256 + u_sq * (-128 + u_sq * (74 - 47 * u_sq)))
+            delta_sigma = b_coefficient * sin_sigma * (
+                cos_2sigma_m
+                + b_coefficient
+                / 4
+                * (
+                    cos_sigma * (-1 + 2 * cos_2sigma_m**2)
+                    - b_coefficient / 6 * cos_2sigma_m * (-3 + 4 * sin_sigma**2) * (-3 + 4 * cos_2sigma_m**2)
+                )
+            )
+            distance[active[converged]] = (b * a_coefficient * (sigma - delta_sigma))[converged]
+            active = active[~converged]
+
+    lat1, lon1, lat2, lon2 = lat1.ravel(), lon1.ravel(), lat2.ravel(), lon2.ravel()
+    for i in active:
+        distance[i] = _WGS84_GEODESIC.Inverse(lat1[i], lon1[i], lat2[i], lon2[i], Geodesic.DISTANCE)["s12"]
+
+    return distance.reshape(shape)
+
+
+class SweepStatistics:
+    """
+    緯度帯×距離帯ごとの誤差の集計値
+
+    平均・RMSを求めるための合計と最大値だけを持つため、チャンクごとの集計をmergeでまとめられる。
+    誤差は測地線距離に対する符号付きの差（メートル）と、絶対値の比率（%）
+    """
+
+    _SUM_FIELDS = ("error_sum", "squared_error_sum", "abs_error_pct_sum")
+    _MAX_FIELDS = ("max_abs_error", "max_abs_error_pct")
+
+    def __init__(self, latitude_edges: Sequence[float], band_edges_km: Sequence[float]):
+        self.latitude_edges = [float(edge) for edge in latitude_edges]
+        self.band_edges_km = [float(edge) for edge in band_edges_km]
+        shape = (len(self.latitude_edges) - 1, len(self.band_edges_km) - 1)
+        self.count = np.zeros(shape, dtype=np.int64)
+        self.failures = np.zeros(shape, dtype=np.int64)
+        self.plane_closer = np.zeros(shape, dtype=np.int64)
+        self.values = {
+            f"{model}_{field}": np.zeros(shape)
+            for model in _MODELS
+            for field in self._SUM_FIELDS + self._MAX_FIELDS
+        }
+
+    def add(
+        self,
+        latitude_index: np.ndarray,
+        band_index: np.ndarray,
+        reference: np.ndarray,
+        arc: np.ndarray,
+        plane: np.ndarray,
+    ) -> None:
+        """組ごとの測地線距離・arc距離・plane距離（メートル）を集計に加える"""
+        shape = self.count.shape
+        cells = np.ravel_multi_index((latitude_index, band_index), shape)
+        size = self.count.size
+
+        failed = np.isnan(reference) | np.isnan(arc) | np.isnan(plane)
+        self.failures += np.bincount(cells[failed], minlength=size).reshape(shape)
+        cells, reference, arc, plane = cells[~failed], reference[~failed], arc[~failed], plane[~failed]
+        self.count += np.bincount(cells, minlength=size).reshape(shape)
+
+        errors = {"arc": arc - reference, "plane": plane - reference}
+        for model, error in errors.items():
+            abs_error = np.abs(error)
+            with np.errstate(invalid="ignore", divide="ignore"):
+                abs_error_pct = np.where(reference > 0, abs_error / reference * 100, 0.0)
+            for field, weights in (
+                ("error_sum", error),
+                ("squared_error_sum", error * error),
+                ("abs_error_pct_sum", abs_error_pct),
+            ):
+                self.values[f"{model}_{field}"] += np.bincount(cells, weights=weights, minlength=size).reshape(shape)
+            np.maximum.at(self.values[f"{model}_max_abs_error"].reshape(-1), cells, abs_error)
+            np.maximum.at(self.values[f"{model}_max_abs_error_pct"].reshape(-1), cells, abs_error_pct)
+
+        closer = np.abs(errors["plane"]) < np.abs(errors["arc"])
+        self.plane_closer += np.bincount(cells[closer], minlength=size).reshape(shape)
+
+    def merge(self, other: "SweepStatistics") -> None:
+        """同じ緯度帯・距離帯の集計を加える"""
+        self.count += other.count
+        self.failures += other.failures
+        self.plane_closer += other.plane_closer
+        for key, value in other.values.items():
+            if key.endswith(self._MAX_FIELDS):
+                np.maximum(self.values[key], value, out=self.values[key])
+            else:
+                self.values[key] += value
+
+    def by_distance_band(self) -> "SweepStatistics":
+        """緯度帯をまとめ、距離帯ごとの集計にする"""
+        collapsed = SweepStatistics(self.latitude_edges[:: len(self.latitude_edges) - 1], self.band_edges_km)
+        collapsed.count[0] = self.count.sum(axis=0)
+        collapsed.failures[0] = self.failures.sum(axis=0)
+        collapsed.plane_closer[0] = self.plane_closer.sum(axis=0)
+        for key, value in self.values.items():
+            collapsed.values[key][0] = value.max(axis=0) if key.endswith(self._MAX_FIELDS) else value.sum(axis=0)
+        return collapsed
+
+    def rows(self) -> List[Dict]:
+        """緯度帯×距離帯ごとの誤差の統計"""
+        rows = []
+        for i, (lat_from, lat_to) in enumerate(zip(self.latitude_edges[:-1], self.latitude_edges[1:])):
+            for j, (from_km, to_km) in enumerate(zip(self.band_edges_km[:-1], self.band_edges_km[1:])):
+                count = int(self.count[i, j])
+                row = {
+                    "lat_from": lat_from,
+                    "lat_to": lat_to,
+                    "from_km": from_km,
+                    "to_km": to_km,
+                    "count": count,
+                    "failures": int(self.failures[i, j]),
+                    "plane_closer_ratio": float(self.plane_closer[i, j] / count) if count else None,
+                }
+                for model in _MODELS:
+                    values = {key: float(value[i, j]) for key, value in self.values.items()}
+                    row.update(
+                        {
+                            f"{model}_mean_error_m": values[f"{model}_error_sum"] / count if count else None,
+                            f"{model}_rms_error_m": (
+                                float(np.sqrt(values[f"{model}_squared_error_sum"] / count)) if count else None
+                            ),
+                            f"{model}_max_abs_error_m": values[f"{model}_max_abs_error"] if count else None,
+                            f"{model}_mean_abs_error_pct": (
+                                values[f"{model}_abs_error_pct_sum"] / count if count else None
+                            ),
+                            f"{model}_max_abs_error_pct": values[f"{model}_max_abs_error_pct"] if count else None,
+                        }
+                    )
+                rows.append(row)
+        return rows
+
+
+def _latitude_edges(latitude_band: float) -> List[float]:
+    if not 0 < latitude_band <= 180 or abs(180.0 / latitude_band - round(180.0 / latitude_band)) > 1e-9:
+        raise ValueError("緯度帯の幅は180を割り切る正の値を指定してください")
+    return [-90.0 + i * latitude_band for i in range(int(round(180.0 / latitude_band)) + 1)]
+
+
+def generate_pairs(
+    start: int,
+    size: int,
+    latitude_edges: Sequence[float],
+    band_edges_km: Sequence[float],
+    seed: int = 0,
+) -> Tuple[np.ndarray, ...]:
+    """
+    通し番号start〜start+size-1の地点の組を生成する
+
+    通し番号を緯度帯×距離帯に順に割り当てるため、件数が多ければどの組み合わせもほぼ同数になる。
+    A地点の緯度は緯度帯の中、経度と方位は一様、距離は距離帯の中で対数一様に選び、
+    B地点は球面上でA地点から方位・距離だけ進んだ地点にする。同じ通し番号は同じ組になる
+
+    Returns:
+        Tuple[np.ndarray, ...]: (緯度帯の番号, 距離帯の番号, A緯度, A経度, B緯度, B経度)
+    """
+    latitude_edges = np.asarray(latitude_edges, dtype=np.float64)
+    band_edges_km = np.asarray(band_edges_km, dtype=np.float64)
+    n_bands = band_edges_km.size - 1
+    cells = (start + np.arange(size)) % ((latitude_edges.size - 1) * n_bands)
+    latitude_index, band_index = np.divmod(cells, n_bands)
+
+    rng = np.random.default_rng([seed, start])
+    a_lat = rng.uniform(latitude_edges[latitude_index], latitude_edges[latitude_index + 1])
+    a_lon = rng.uniform(-180.0, 180.0, size)
+    bearing = rng.uniform(0.0, 360.0, size)
+    upper = band_edges_km[band_index + 1]
+    lower = np.maximum(band_edges_km[band_index], upper / 1000.0)
+    distance_km = np.exp(rng.uniform(np.log(lower), np.log(upper)))
+    b_lat, b_lon = _destination(a_lat, a_lon, bearing, distance_km)
+    return latitude_index, band_index, a_lat, a_lon, b_lat, b_lon
+
+
+def _opensearch_distances(a_lat, a_lon, b_lat, b_lon) -> Tuple[np.ndarray, np.ndarray]:
+    """OpenSearchの_bulk/_msearchでarc/plane距離（メートル）を求める。失敗した組はNaN"""
+    from .services import GeoDistanceService
+
+    service = GeoDistanceService()
+    pairs = list(zip(a_lat.tolist(), a_lon.tolist(), b_lat.tolist(), b_lon.tolist()))
+    arc = np.full(len(pairs), np.nan)
+    plane = np.full(len(pairs), np.nan)
+    chunk_size = settings.GEO_DISTANCE_BATCH_CHUNK_SIZE
+    for offset in range(0, len(pairs), chunk_size):
+        # calculate_distances_batchは1m単位に丸めるため、丸める前の距離を使う
+        try:
+            results = service._msearch_arc_and_plane(pairs[offset : offset + chunk_size])
+        except Exception as e:
+            logger.warning(f"精度スイープの組{offset}〜を計算できませんでした: {e}")
+            continue
+        for i, distances in enumerate(results, start=offset):
+            if isinstance(distances, tuple):
+                arc[i], plane[i] = distances[0] * 1000.0, distances[1] * 1000.0
+            else:
+                logger.warning(f"精度スイープの組{i}を計算できませんでした: {distances}")
+    return arc, plane
+
+
+def sweep_chunk(
+    start: int,
+    size: int,
+    latitude_edges: Sequence[float],
+    band_edges_km: Sequence[float],
+    backend: str = "local",
+    seed: int = 0,
+) -> SweepStatistics:
+    """1チャンク分の地点の組を生成して計算し、集計値を返す（プロセスプールのタスク）"""
+    latitude_index, band_index, a_lat, a_lon, b_lat, b_lon = generate_pairs(
+        start, size, latitude_edges, band_edges_km, seed=seed
+    )
+    if backend == "opensearch":
+        arc, plane = _opensearch_distances(a_lat, a_lon, b_lat, b_lon)
+    else:
+        # A地点はインデックスされたドキュメントと同じく量子化する（測地線距離は量子化前の地点で求める）
+        distances = engine.compare_distances(a_lat, a_lon, b_lat, b_lon, unit="m")
+        arc, plane = distances["arc"], distances["plane"]
+
+    statistics = SweepStatistics(latitude_edges, band_edges_km)
+    statistics.add(latitude_index, band_index, geodesic_distance(a_lat, a_lon, b_lat, b_lon), arc, plane)
+    return statistics
+
+
+def run_sweep(
+    pairs: int,
+    latitude_band: float = 10.0,
+    band_edges_km: Sequence[float] = DEFAULT_BAND_EDGES_KM,
+    backend: str = "local",
+    processes: int = 1,
+    chunk_size: Optional[int] = None,
+    seed: int = 0,
+    on_progress: Optional[Callable[[int, int], None]] = None,
+) -> SweepStatistics:
+    """
+    精度スイープを実行する
+
+    pairs件をchunk_size件ずつのタスクに分け、processesが2以上の場合はforkしたプロセスプールで計算する。
+    結果はタスクの順にまとめるため、同じシードとchunk_sizeであればプロセス数によらず同じ集計になる
+
+    Args:
+        pairs: 地点の組の数
+        latitude_band: 緯度帯の幅（度、180を割り切る値）
+        band_edges_km: 距離帯の境界（km、昇順）
+        backend: arc/planeの計算先。"local"はローカルエンジン、"opensearch"は_bulk/_msearch
+        processes: プロセス数
+        chunk_size: 1タスクの件数（省略時はlocalがDEFAULT_CHUNK_SIZE、opensearchがGEO_DISTANCE_BATCH_CHUNK_SIZE）
+        seed: 地点の組を生成する乱数のシード
+        on_progress: (計算済みの件数, 全件数)を受け取るコールバック
+
+    Returns:
+        SweepStatistics: 緯度帯×距離帯ごとの集計
+    """
+    band_edges_km = [float(edge) for edge in band_edges_km]
+    if len(band_edges_km) < 2 or band_edges_km[0] < 0 or any(b <= a for a, b in zip(band_edges_km, band_edges_km[1:])):
+        raise ValueError("距離帯の境界は0以上の2つ以上の昇順の値を指定してください")
+    if backend not in BACKENDS:
+        raise ValueError(f"未対応の計算先です: {backend}（{', '.join(BACKENDS)}）")
+    if pairs < 1 or processes < 1:
+        raise ValueError("pairsとprocessesは1以上にしてください")
+    latitude_edges = _latitude_edges(latitude_band)
+    if chunk_size is None:
+        chunk_size = DEFAULT_CHUNK_SIZE if backend == "local" else settings.GEO_DISTANCE_BATCH_CHUNK_SIZE
+
+    tasks = [(start, min(chunk_size, pairs - start)) for start in range(0, pairs, chunk_size)]
+    statistics = SweepStatistics(latitude_edges, band_edges_km)
+    done = 0
+
+    def collect(chunk: SweepStatistics, size: int) -> None:
+        nonlocal done
+        statistics.merge(chunk)
+        done += size
+        if on_progress is not None:
+            on_progress(done, pairs)
+
+    if processes == 1:
+        for start, size in tasks:
+            collect(sweep_chunk(start, size, latitude_edges, band_edges_km, backend, seed), size)
+    else:
+        # 子プロセスが親のDB接続・OpenSearchの接続を引き継がないよう、fork前に閉じる
+        connections.close_all()
+        client_registry.close()
+        context = multiprocessing.get_context("fork")
+        with ProcessPoolExecutor(max_workers=processes, mp_context=context) as executor:
+            futures = [
+                executor.submit(sweep_chunk, start, size, latitude_edges, band_edges_km, backend, seed)
+                for start, size in tasks
+            ]
+            for (_, size), future in zip(tasks, futures):
+                collect(future.result(), size)
+
+    logger.info(f"精度スイープを完了しました（{pairs}件、{processes}プロセス、計算先: {backend}）")
+    return statistics
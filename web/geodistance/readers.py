@@ -0,0 +1,303 @@
+import csv
+import io
+import json
+from typing import IO, Iterator, List, Optional, Tuple
+
+
+# 地点の組として受け付ける列名（フォームのフィールド名と短縮名）
+PAIR_FIELDS = (
+    ("a_latitude", "a_lat"),
+    ("a_longitude", "a_lon"),
+    ("b_latitude", "b_lat"),
+    ("b_longitude", "b_lon"),
+)
+
+FORMATS = ("csv", "json", "ndjson")
+
+
+def detect_format(filename: Optional[str] = None, content_type: Optional[str] = None) -> str:
+    """
+    ファイル名の拡張子またはContent-Typeから入力形式を判定する
+
+    Returns:
+        str: "csv"、"json" または "ndjson"
+    """
+    name = (filename or "").lower()
+    content_type = (content_type or "").split(";")[0].strip().lower()
+
+    if name.endswith((".ndjson", ".jsonl")) or content_type in (
+        "application/x-ndjson",
+        "application/jsonl",
+    ):
+        return "ndjson"
+    if name.endswith(".json") or content_type == "application/json":
+        return "json"
+    if name.endswith(".csv") or content_type in ("text/csv", "application/csv"):
+        return "csv"
+    raise ValueError("入力形式を判定できません。CSV、JSONまたはNDJSONを指定してください")
+
+
+def _to_pair(row, line_number: int) -> Tuple[float, float, float, float]:
+    """1行分の値を(A緯度, A経度, B緯度, B経度)に変換する"""
+    try:
+        if isinstance(row, dict):
+            values = []
+            for names in PAIR_FIELDS:
+                key = next((name for name in names if name in row), None)
+                if key is None:
+                    raise ValueError(f"{names[0]}がありません")
+                values.append(row[key])
+        else:
+            values = list(row)
+            if len(values) != 4:
+                raise ValueError("値は4つ（A緯度, A経度, B緯度, B経度）必要です")
+
+        return tuple(float(value) for value in values)
+    except (TypeError, ValueError) as e:
+        raise ValueError(f"{line_number}行目の形式が正しくありません: {e}") from e
+
+
+def parse_points(rows, label: str) -> List[Tuple[float, float]]:
+    """
+    [緯度, 経度] または {"lat": 緯度, "lon": 経度} のリストを検証して(緯度, 経度)のリストにする
+
+    Args:
+        rows: 地点のリスト
+        label: エラーメッセージに使う地点の種類（例: "origins"）
+    """
+    if not isinstance(rows, list) or not rows:
+        raise ValueError(f"{label}は1件以上の地点の配列にしてください")
+
+    points = []
+    for number, row in enumerate(rows, start=1):
+        try:
+            lat, lon = (row["lat"], row["lon"]) if isinstance(row, dict) else row
+            lat, lon = float(lat), float(lon)
+        except (KeyError, TypeError, ValueError) as e:
+            raise ValueError(f"{label}の{number}件目の形式が正しくありません: {e}") from e
+        if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+            raise ValueError(f"{label}の{number}件目の座標が範囲外です: ({lat}, {lon})")
+        points.append((lat, lon))
+    return points
+
+
+def _text_stream(stream: IO) -> IO[str]:
+    """バイナリストリームをテキストとして1行ずつ読めるようにする"""
+    if isinstance(stream, io.TextIOBase):
+        return stream
+    return io.TextIOWrapper(stream, encoding="utf-8-sig", newline="")
+
+
+def iter_coordinate_pairs(stream: IO, fmt: str) -> Iterator[Tuple[float, float, float, float]]:
+    """
+    アップロードされたファイルから地点の組を1件ずつ読み出す
+    CSVとNDJSONは1行ずつ読むため、ファイル全体をメモリに載せない
+
+    Args:
+        stream: 入力ストリーム（バイナリまたはテキスト）
+        fmt: "csv"、"json" または "ndjson"
+
+    Yields:
+        Tuple[float, float, float, float]: (A緯度, A経度, B緯度, B経度)
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"未対応の入力形式です: {fmt}")
+
+    text = _text_stream(stream)
+
+    if fmt == "csv":
+        reader = csv.reader(text)
+        header = None
+        for line_number, row in enumerate(reader, start=1):
+            if not row or not any(cell.strip() for cell in row):
+                continue
+            if line_number == 1 and not _is_number(row[0]):
+                header = [cell.strip() for cell in row]
+                continue
+            yield _to_pair(dict(zip(header, row)) if header else row, line_number)
+
+    elif fmt == "ndjson":
+        for line_number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{line_number}行目のJSONが正しくありません: {e}") from e
+            yield _to_pair(row, line_number)
+
+    else:
+        try:
+            rows = json.load(text)
+        except ValueError as e:
+            raise ValueError(f"JSONが正しくありません: {e}") from e
+        if isinstance(rows, dict):
+            rows = rows.get("pairs")
+        if not isinstance(rows, list):
+            raise ValueError("JSONは地点の組の配列、または pairs キーを持つオブジェクトにしてください")
+        for line_number, row in enumerate(rows, start=1):
+            yield _to_pair(row, line_number)
+
+
+def _is_number(value: str) -> bool:
+    try:
+        float(value)
+        return True
+    except ValueError:
+        return False
+
+
+# 参照地点として受け付ける形式と列名
+POINT_FORMATS = ("csv", "geojson", "ndjson")
+POINT_LAT_FIELDS = ("lat", "latitude")
+POINT_LON_FIELDS = ("lon", "lng", "longitude")
+
+# GeoJSONをストリーミングで読む際に1回に読み込む文字数
+_JSON_READ_SIZE = 1 << 16
+
+
+def detect_point_format(filename: str) -> str:
+    """
+    参照地点ファイルの拡張子から入力形式を判定する
+
+    Returns:
+        str: "csv"、"geojson" または "ndjson"
+    """
+    name = filename.lower()
+    if name.endswith((".ndjson", ".jsonl", ".geojsonl", ".geojsons")):
+        return "ndjson"
+    if name.endswith((".geojson", ".json")):
+        return "geojson"
+    if name.endswith(".csv"):
+        return "csv"
+    raise ValueError("入力形式を判定できません。CSV、GeoJSONまたはNDJSONを指定してください")
+
+
+def _to_reference_point(row: dict, number: int) -> dict:
+    """
+    1件分の値を参照地点に変換する。GeoJSONのPoint Featureと、緯度経度の列を持つ辞書を受け付ける
+
+    Returns:
+        dict: id, name, lat, lon, properties（その他の値）
+    """
+    try:
+        if row.get("type") == "Feature":
+            geometry = row.get("geometry") or {}
+            if geometry.get("type") != "Point":
+                raise ValueError(f"Pointのみ対応しています（{geometry.get('type')}）")
+            lon, lat = geometry["coordinates"][:2]
+            properties = dict(row.get("properties") or {})
+            doc_id = row.get("id", properties.pop("id", None))
+        else:
+            properties = dict(row)
+            lat_key = next((name for name in POINT_LAT_FIELDS if name in properties), None)
+            lon_key = next((name for name in POINT_LON_FIELDS if name in properties), None)
+            if lat_key is None or lon_key is None:
+                raise ValueError("緯度（lat）と経度（lon）の列が必要です")
+            lat, lon = properties.pop(lat_key), properties.pop(lon_key)
+            doc_id = properties.pop("id", None)
+
+        lat, lon = float(lat), float(lon)
+    except (KeyError, TypeError, ValueError) as e:
+        raise ValueError(f"{number}件目の形式が正しくありません: {e}") from e
+
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        raise ValueError(f"{number}件目の座標が範囲外です: ({lat}, {lon})")
+
+    return {
+        "id": None if doc_id in (None, "") else str(doc_id),
+        "name": properties.pop("name", None),
+        "lat": lat,
+        "lon": lon,
+        "properties": properties,
+    }
+
+
+def _iter_json_array(text: IO[str], key: str) -> Iterator:
+    """
+    JSONオブジェクトのkeyの配列の要素を、ファイル全体を読み込まずに1件ずつ読み出す
+    （GeoJSONのFeatureCollectionのfeatures用）
+    """
+    decoder = json.JSONDecoder()
+    buffer = ""
+    eof = False
+
+    def fill() -> bool:
+        nonlocal buffer, eof
+        chunk = text.read(_JSON_READ_SIZE)
+        if not chunk:
+            eof = True
+            return False
+        buffer += chunk
+        return True
+
+    pattern = f'"{key}"'
+    while True:
+        position = buffer.find(pattern)
+        if position >= 0:
+            position = buffer.find("[", position + len(pattern))
+        if position >= 0:
+            buffer = buffer[position + 1:]
+            break
+        if not fill():
+            raise ValueError(f"{key}の配列が見つかりません")
+
+    while True:
+        stripped = buffer.lstrip(" \t\r\n,")
+        if not stripped:
+            buffer = ""
+            if not fill():
+                raise ValueError(f"{key}の配列が閉じられていません")
+            continue
+        buffer = stripped
+        if buffer[0] == "]":
+            return
+
+        try:
+            item, end = decoder.raw_decode(buffer)
+        except ValueError as e:
+            if eof:
+                raise ValueError(f"JSONが正しくありません: {e}") from e
+            fill()
+            continue
+        buffer = buffer[end:]
+        yield item
+
+
+def iter_reference_points(stream: IO, fmt: str) -> Iterator[dict]:
+    """
+    CSV・GeoJSON・NDJSONのファイルから参照地点を1件ずつ読み出す
+    いずれの形式もファイル全体をメモリに載せない
+
+    Args:
+        stream: 入力ストリーム（バイナリまたはテキスト）
+        fmt: "csv"、"geojson" または "ndjson"
+
+    Yields:
+        dict: id, name, lat, lon, properties
+    """
+    if fmt not in POINT_FORMATS:
+        raise ValueError(f"未対応の入力形式です: {fmt}")
+
+    text = _text_stream(stream)
+
+    if fmt == "csv":
+        for number, row in enumerate(csv.DictReader(text), start=1):
+            if not any((value or "").strip() for value in row.values()):
+                continue
+            row = {key.strip(): value for key, value in row.items() if key is not None}
+            yield _to_reference_point(row, number)
+
+    elif fmt == "ndjson":
+        for number, line in enumerate(text, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except ValueError as e:
+                raise ValueError(f"{number}行目のJSONが正しくありません: {e}") from e
+            yield _to_reference_point(row, number)
+
+    else:
+        for number, feature in enumerate(_iter_json_array(text, "features"), start=1):
+            yield _to_reference_point(feature, number)
@@ -0,0 +1,381 @@
+"""
+OpenSearch呼び出しの耐障害性レイヤー
+
+InstrumentedTransportを拡張し、すべての呼び出しに次の処理を加える。
+
+- 期限: APIごとの期限（再試行を含む）を決め、各試行のタイムアウトを残り時間に制限する
+- 再試行: 冪等な呼び出し（検索・参照系）だけを、ジッター付きの指数バックオフで再試行する
+- サーキットブレーカー: 連続した失敗やcluster.healthのred応答で開き、期間中は呼び出さずに失敗させる
+- ヘッジ: 検索が指定時間内に応答しない場合に同じ検索を重複して送り、先に返った応答を使う
+
+opensearch-py自身の再試行はこのレイヤーと重ならないよう、クライアント側で無効にしている
+"""
+
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Callable, Dict, Optional
+
+from django.conf import settings
+from opensearchpy.exceptions import ConnectionError, ConnectionTimeout, TransportError
+
+from .instrumentation import InstrumentedTransport, api_name, instrumentation, instrumented_async_transport_class
+
+
+logger = logging.getLogger(__name__)
+
+# 再試行するHTTPステータス（過負荷・ゲートウェイのエラー）
+RETRYABLE_STATUS = (429, 502, 503, 504)
+
+# POSTでも副作用のない（再試行してよい）API
+IDEMPOTENT_APIS = frozenset({"search", "msearch", "count", "scripts_painless_execute", "mget"})
+
+# 応答が遅い場合に重複して送る検索系のAPI
+HEDGED_APIS = frozenset({"search", "msearch", "scripts_painless_execute"})
+
+# サーキットブレーカーが開いていても呼び出す（状態の確認に使う）API
+_BREAKER_EXEMPT_APIS = frozenset({"cluster.health"})
+
+
+class CircuitOpenError(ConnectionError):
+    """サーキットブレーカーが開いているため呼び出さなかったことを表すエラー"""
+
+    def __init__(self, api: str):
+        super().__init__("N/A", "circuit_open", f"サーキットブレーカーが開いているため '{api}' を遮断しました")
+
+
+class CircuitBreaker:
+    """
+    OpenSearchへの呼び出しの成否からクラスターの状態を判定するサーキットブレーカー
+
+    closed: 通常どおり呼び出す。連続した失敗がfailure_threshold回に達するとopenにする
+    open: reset_timeout秒の間は呼び出さずに失敗させる。経過後は1回だけ試行するhalf_openにする
+    half_open: 試行が成功すればclosed、失敗すれば再びopenにする
+    cluster.healthの応答がredの場合はただちにopen、green/yellowの場合はclosedにする
+    """
+
+    CLOSED = "closed"
+    HALF_OPEN = "half_open"
+    OPEN = "open"
+    _STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+    def __init__(
+        self,
+        name: str = "default",
+        failure_threshold: Optional[int] = None,
+        reset_timeout: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        self.name = name
+        self._failure_threshold = failure_threshold
+        self._reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+
+    @property
+    def failure_threshold(self) -> int:
+        if self._failure_threshold is not None:
+            return self._failure_threshold
+        return settings.GEO_DISTANCE_BREAKER_FAILURE_THRESHOLD
+
+    @property
+    def reset_timeout(self) -> float:
+        if self._reset_timeout is not None:
+            return self._reset_timeout
+        return settings.GEO_DISTANCE_BREAKER_RESET_TIMEOUT
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            return self._state
+
+    def _transition(self, state: str) -> None:
+        """状態を変更する（ロックを保持して呼ぶ）"""
+        if state != self._state:
+            logger.warning(f"サーキットブレーカー '{self.name}' の状態を {self._state} から {state} に変更しました")
+            self._state = state
+        if state == self.OPEN:
+            self._opened_at = self._clock()
+        if state != self.HALF_OPEN:
+            self._probe_in_flight = False
+        instrumentation.set_gauge(
+            "geo_distance_circuit_breaker_state", self._STATE_VALUES[state], cluster=self.name
+        )
+
+    def allow(self) -> bool:
+        """呼び出してよいかどうかを返す"""
+        with self._lock:
+            if self._state == self.OPEN and self._clock() - self._opened_at >= self.reset_timeout:
+                self._transition(self.HALF_OPEN)
+            if self._state == self.CLOSED:
+                return True
+            if self._state == self.HALF_OPEN and not self._probe_in_flight:
+                self._probe_in_flight = True
+                return True
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self._failures = 0
+            if self._state != self.CLOSED:
+                self._transition(self.CLOSED)
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or (
+                self._state == self.CLOSED and self._failures >= self.failure_threshold
+            ):
+                self._transition(self.OPEN)
+
+    def record_health(self, status: Optional[str]) -> None:
+        """cluster.healthの応答（green/yellow/red）から状態を更新する"""
+        if status == "red":
+            with self._lock:
+                self._transition(self.OPEN)
+        elif status in ("green", "yellow"):
+            self.record_success()
+
+    def reset(self) -> None:
+        with self._lock:
+            self._failures = 0
+            self._transition(self.CLOSED)
+
+
+_breakers_lock = threading.Lock()
+_breakers: Dict[str, CircuitBreaker] = {}
+
+
+def cluster_key(hosts) -> str:
+    """接続先のホスト一覧からクラスターの識別名（"host:port"のカンマ区切り）を求める"""
+    return ",".join(sorted(f"{host.get('host')}:{host.get('port')}" for host in hosts or []))
+
+
+def get_circuit_breaker(key: str) -> CircuitBreaker:
+    """クラスターごとのサーキットブレーカーを返す（同じクラスターの同期・非同期クライアントで共有する）"""
+    with _breakers_lock:
+        breaker = _breakers.get(key)
+        if breaker is None:
+            breaker = _breakers[key] = CircuitBreaker(name=key)
+        return breaker
+
+
+def _is_failure(error: Exception) -> bool:
+    """クラスターの異常を表すエラー（接続エラー・タイムアウト・5xx・429）かどうか"""
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, ConnectionError):
+        return True
+    status = getattr(error, "status_code", None)
+    return isinstance(status, int) and (status >= 500 or status == 429)
+
+
+def _is_retryable(error: Exception) -> bool:
+    if isinstance(error, CircuitOpenError):
+        return False
+    if isinstance(error, ConnectionError):
+        return True
+    return getattr(error, "status_code", None) in RETRYABLE_STATUS
+
+
+class _CallPlan:
+    """1回の呼び出し（再試行を含む）の期限と試行回数"""
+
+    def __init__(self, breaker: CircuitBreaker, method: str, url: str, params, timeout):
+        self.breaker = breaker
+        self.api = api_name(method, url)
+        self.params = dict(params or {})
+        # 呼び出し側がrequest_timeoutを指定した場合はそれを期限にする
+        timeout = timeout or self.params.pop("request_timeout", None)
+        if not timeout:
+            timeout = settings.GEO_DISTANCE_OPENSEARCH_DEADLINES.get(
+                self.api, settings.GEO_DISTANCE_OPENSEARCH_DEADLINE
+            )
+        self.deadline = time.monotonic() + float(timeout)
+        idempotent = method in ("GET", "HEAD") or self.api in IDEMPOTENT_APIS
+        self.attempts = max(1, settings.GEO_DISTANCE_RETRY_ATTEMPTS) if idempotent else 1
+        hedge_delay_ms = settings.GEO_DISTANCE_HEDGE_DELAY_MS
+        self.hedge_delay = hedge_delay_ms / 1000.0 if hedge_delay_ms > 0 and self.api in HEDGED_APIS else None
+
+    def before_attempt(self) -> float:
+        """試行できるか確認し、試行のタイムアウト（残り時間）を返す"""
+        if self.api not in _BREAKER_EXEMPT_APIS and not self.breaker.allow():
+            instrumentation.increment(
+                "geo_distance_circuit_breaker_rejections_total", cluster=self.breaker.name, api=self.api
+            )
+            raise CircuitOpenError(self.api)
+        remaining = self.deadline - time.monotonic()
+        if remaining <= 0:
+            raise ConnectionTimeout("TIMEOUT", "deadline_exceeded", f"'{self.api}' の期限を過ぎました")
+        return remaining
+
+    def on_success(self, response) -> None:
+        if self.api == "cluster.health" and isinstance(response, dict):
+            self.breaker.record_health(response.get("status"))
+        else:
+            self.breaker.record_success()
+
+    def on_error(self, attempt: int, error: Exception) -> float:
+        """
+        失敗した試行を記録し、再試行までの待ち時間を返す
+
+        Raises:
+            Exception: 再試行しない場合は元のエラー
+        """
+        if _is_failure(error):
+            self.breaker.record_failure()
+        elif not isinstance(error, CircuitOpenError):
+            # 4xxはクラスターが応答しているため成功として扱う
+            self.breaker.record_success()
+
+        if attempt + 1 >= self.attempts or not _is_retryable(error):
+            raise error
+        # フルジッター: 0から上限までの一様乱数だけ待つ
+        delay = random.uniform(
+            0, min(settings.GEO_DISTANCE_RETRY_MAX_DELAY, settings.GEO_DISTANCE_RETRY_BASE_DELAY * 2 ** attempt)
+        )
+        if time.monotonic() + delay >= self.deadline:
+            raise error
+
+        instrumentation.increment("geo_distance_opensearch_retries_total", api=self.api)
+        logger.warning(f"'{self.api}' を再試行します（{attempt + 1}回目、{delay * 1000:.0f}ms後）: {error}")
+        return delay
+
+
+_hedge_lock = threading.Lock()
+_hedge_executor: Optional[ThreadPoolExecutor] = None
+_hedge_pid: Optional[int] = None
+
+
+def _get_hedge_executor() -> ThreadPoolExecutor:
+    """ヘッジ用のスレッドプール（fork後の子プロセスでは作り直す）"""
+    global _hedge_executor, _hedge_pid
+    with _hedge_lock:
+        if _hedge_executor is None or _hedge_pid != os.getpid():
+            _hedge_executor = ThreadPoolExecutor(
+                max_workers=2 * settings.OPENSEARCH_POOL_MAXSIZE, thread_name_prefix="geodistance-hedge"
+            )
+            _hedge_pid = os.getpid()
+        return _hedge_executor
+
+
+def _hedged_call(call: Callable, delay: float, api: str):
+    """callがdelay秒以内に終わらない場合は同じcallをもう1つ実行し、先に成功した結果を返す"""
+    executor = _get_hedge_executor()
+    primary = executor.submit(call)
+    try:
+        return primary.result(timeout=delay)
+    except TimeoutError:
+        pass
+
+    instrumentation.increment("geo_distance_opensearch_hedged_requests_total", api=api)
+    error = None
+    for future in as_completed([primary, executor.submit(call)]):
+        try:
+            return future.result()
+        except Exception as e:
+            error = e
+    raise error
+
+
+class ResilientTransport(InstrumentedTransport):
+    """期限・再試行・サーキットブレーカー・ヘッジを加えたTransport"""
+
+    def __init__(self, hosts, *args, **kwargs):
+        super().__init__(hosts, *args, **kwargs)
+        self.circuit_breaker = get_circuit_breaker(cluster_key(self.hosts))
+
+    def perform_request(self, method, url, params=None, body=None, timeout=None, ignore=(), headers=None):
+        plan = _CallPlan(self.circuit_breaker, method, url, params, timeout)
+        perform = super().perform_request
+
+        for attempt in range(plan.attempts):
+            remaining = plan.before_attempt()
+
+            def call():
+                return perform(
+                    method, url, params=dict(plan.params), body=body, timeout=remaining,
+                    ignore=ignore, headers=headers,
+                )
+
+            try:
+                if plan.hedge_delay is not None:
+                    response = _hedged_call(call, plan.hedge_delay, plan.api)
+                else:
+                    response = call()
+            except TransportError as e:
+                time.sleep(plan.on_error(attempt, e))
+                continue
+            plan.on_success(response)
+            return response
+
+
+async def _hedged_call_async(call: Callable, delay: float, api: str):
+    """_hedged_callの非同期版。先に成功した方を返し、もう一方はキャンセルする"""
+    primary = asyncio.ensure_future(call())
+    done, _ = await asyncio.wait({primary}, timeout=delay)
+    if done:
+        return primary.result()
+
+    instrumentation.increment("geo_distance_opensearch_hedged_requests_total", api=api)
+    pending = {primary, asyncio.ensure_future(call())}
+    error = None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is None:
+                for other in pending:
+                    other.cancel()
+                return task.result()
+            error = task.exception()
+    raise error
+
+
+_resilient_async_transport_class = None
+
+
+def resilient_async_transport_class():
+    """ResilientTransportの非同期版のクラスを返す（aiohttpを必要とするため初回に生成する）"""
+    global _resilient_async_transport_class
+    if _resilient_async_transport_class is not None:
+        return _resilient_async_transport_class
+
+    class ResilientAsyncTransport(instrumented_async_transport_class()):
+        def __init__(self, hosts, *args, **kwargs):
+            super().__init__(hosts, *args, **kwargs)
+            self.circuit_breaker = get_circuit_breaker(cluster_key(self.hosts))
+
+        async def perform_request(self, method, url, params=None, body=None, timeout=None, ignore=(), headers=None):
+            plan = _CallPlan(self.circuit_breaker, method, url, params, timeout)
+            perform = super().perform_request
+
+            for attempt in range(plan.attempts):
+                remaining = plan.before_attempt()
+
+                def call():
+                    return perform(
+                        method, url, params=dict(plan.params), body=body, timeout=remaining,
+                        ignore=ignore, headers=headers,
+                    )
+
+                try:
+                    if plan.hedge_delay is not None:
+                        response = await _hedged_call_async(call, plan.hedge_delay, plan.api)
+                    else:
+                        response = await call()
+                except TransportError as e:
+                    await asyncio.sleep(plan.on_error(attempt, e))
+                    continue
+                plan.on_success(response)
+                return response
+
+    _resilient_async_transport_class = ResilientAsyncTransport
+    return _resilient_async_transport_class
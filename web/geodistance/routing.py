@@ -0,0 +1,123 @@
+"""
+複数ノードへのリクエストの振り分け
+
+- 接続先: OPENSEARCH_HOSTSのノードに接続し、スニッフィングで見つけたデータノードにも振り分ける
+- 選択: ラウンドロビン、ランダム、または実行中のリクエストが最も少ないノード（least_outstanding）
+- 障害: 失敗したノードはOPENSEARCH_DEAD_TIMEOUT秒（連続した失敗ごとに倍）振り分けから外す
+"""
+
+import itertools
+import logging
+import threading
+from typing import Dict, List, Sequence
+
+from django.conf import settings
+from opensearchpy.connection import Urllib3HttpConnection
+from opensearchpy.connection_pool import ConnectionSelector, RandomSelector, RoundRobinSelector
+
+
+logger = logging.getLogger(__name__)
+
+
+class TrackedHttpConnection(Urllib3HttpConnection):
+    """実行中のリクエスト数（in_flight）を数えるノードへの接続"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._in_flight_lock = threading.Lock()
+        self.in_flight = 0
+
+    def perform_request(self, *args, **kwargs):
+        with self._in_flight_lock:
+            self.in_flight += 1
+        try:
+            return super().perform_request(*args, **kwargs)
+        finally:
+            with self._in_flight_lock:
+                self.in_flight -= 1
+
+
+_tracked_async_connection_class = None
+
+
+def tracked_async_connection_class():
+    """TrackedHttpConnectionの非同期版のクラスを返す（aiohttpを必要とするため初回に生成する）"""
+    global _tracked_async_connection_class
+    if _tracked_async_connection_class is not None:
+        return _tracked_async_connection_class
+
+    from opensearchpy import AIOHttpConnection
+
+    class TrackedAIOHttpConnection(AIOHttpConnection):
+        # 接続はイベントループごとのクライアントが持つため、ロックは不要
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.in_flight = 0
+
+        async def perform_request(self, *args, **kwargs):
+            self.in_flight += 1
+            try:
+                return await super().perform_request(*args, **kwargs)
+            finally:
+                self.in_flight -= 1
+
+    _tracked_async_connection_class = TrackedAIOHttpConnection
+    return _tracked_async_connection_class
+
+
+class LeastOutstandingSelector(ConnectionSelector):
+    """実行中のリクエストが最も少ないノードを選ぶ。同数の場合はラウンドロビンで選ぶ"""
+
+    def __init__(self, opts):
+        super().__init__(opts)
+        self._counter = itertools.count()
+
+    def select(self, connections: Sequence) -> object:
+        start = next(self._counter) % len(connections)
+        rotated = list(connections[start:]) + list(connections[:start])
+        return min(rotated, key=lambda connection: getattr(connection, "in_flight", 0))
+
+
+SELECTORS = {
+    "round_robin": RoundRobinSelector,
+    "random": RandomSelector,
+    "least_outstanding": LeastOutstandingSelector,
+}
+
+
+def seed_hosts() -> List[Dict]:
+    """最初に接続するノード（OPENSEARCH_HOSTSが空の場合はOPENSEARCH_HOST/OPENSEARCH_PORT）"""
+    if settings.OPENSEARCH_HOSTS:
+        return [dict(host) for host in settings.OPENSEARCH_HOSTS]
+    return [{"host": settings.OPENSEARCH_HOST, "port": settings.OPENSEARCH_PORT}]
+
+
+def routing_options() -> Dict:
+    """
+    ノードの選択・障害時の除外・スニッフィングに関するTransportの設定
+    起動時のスニッフィングは失敗してもクライアントを生成できるよう、ここでは指定せずsniff_on_startで行う
+    """
+    selector = settings.OPENSEARCH_NODE_SELECTOR
+    if selector not in SELECTORS:
+        raise ValueError(f"未対応のノードの選択方法です: {selector}（{', '.join(SELECTORS)}）")
+    return {
+        "selector_class": SELECTORS[selector],
+        "dead_timeout": settings.OPENSEARCH_DEAD_TIMEOUT,
+        "timeout_cutoff": settings.OPENSEARCH_DEAD_TIMEOUT_CUTOFF,
+        "sniff_on_connection_fail": settings.OPENSEARCH_SNIFF_ON_CONNECTION_FAIL,
+        "sniffer_timeout": settings.OPENSEARCH_SNIFFER_INTERVAL or None,
+        "sniff_timeout": settings.OPENSEARCH_SNIFF_TIMEOUT,
+    }
+
+
+def sniff_on_start(client) -> None:
+    """設定されていれば、クラスターのノードを取得して接続先に加える（失敗しても最初のノードで続ける）"""
+    if not settings.OPENSEARCH_SNIFF_ON_START:
+        return
+    try:
+        client.transport.sniff_hosts(initial=True)
+        hosts = [connection.host for connection in client.transport.connection_pool.connections]
+        logger.info(f"OpenSearchのノードを{len(hosts)}件見つけました: {', '.join(hosts)}")
+    except Exception as e:
+        logger.warning(f"OpenSearchのノードを取得できませんでした。設定されたノードだけに接続します: {e}")
+
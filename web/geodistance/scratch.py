@@ -0,0 +1,186 @@
+import logging
+import os
+import re
+import socket
+import threading
+import uuid
+from collections import deque
+from typing import Dict, List, Optional, Set, Tuple
+
+from django.conf import settings
+
+
+logger = logging.getLogger(__name__)
+
+# 一時ドキュメントのIDの接頭辞と、IDから書き込んだワーカー（ホスト名とPID）を取り出す正規表現
+SCRATCH_ID_PREFIX = "scratch-"
+_SCRATCH_ID_PATTERN = re.compile(r"^scratch-(?P<host>.+)-(?P<pid>\d+)-(?:\d+|overflow-[0-9a-f]+)$")
+
+
+def scratch_owner(doc_id: str) -> Optional[Tuple[str, int]]:
+    """一時ドキュメントのIDから書き込んだワーカーの（ホスト名, PID）を返す（一時ドキュメントでなければNone）"""
+    match = _SCRATCH_ID_PATTERN.match(doc_id)
+    if not match:
+        return None
+    return match.group("host"), int(match.group("pid"))
+
+
+def _pid_alive(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def is_stale_scratch_id(doc_id: str) -> bool:
+    """
+    このホストで終了したワーカーが残した一時ドキュメントであればTrue
+    他のホストのワーカーは生存を確認できないため対象にしない
+    """
+    owner = scratch_owner(doc_id)
+    if owner is None:
+        return False
+    host, pid = owner
+    return host == socket.gethostname() and pid != os.getpid() and not _pid_alive(pid)
+
+
+class ScratchLease:
+    """
+    indexedモードの1リクエストが専有する一時ドキュメントのID
+    locationは最後に書き込んだA地点（緯度, 経度）で、同じA地点であれば書き込みを省略できる
+    """
+
+    __slots__ = ("doc_id", "overflow", "location")
+
+    def __init__(self, doc_id: str, overflow: bool = False):
+        self.doc_id = doc_id
+        self.overflow = overflow
+        self.location: Optional[Tuple[float, float]] = None
+
+    @property
+    def routing(self) -> str:
+        """_idと同じ値のルーティングキー。検索をドキュメントのあるシャードだけに限定する"""
+        return self.doc_id
+
+
+class ScratchPool:
+    """
+    indexedモードでA地点を書き込むドキュメントIDをリクエストごとに貸し出すプール
+
+    ワーカー（プロセス）ごとに "scratch-<ホスト名>-<PID>-<番号>" のIDをsize個用意し、
+    同時に実行中のリクエストが同じドキュメントを上書きし合わないようにする。
+    返却されたIDは次のリクエストが上書きして使うため、インデックスに残るドキュメントは
+    ワーカーあたりsize件までに抑えられる。
+    プールが空の場合は使い捨てのID（"scratch-<ホスト名>-<PID>-overflow-<UUID>"）を貸し出し、
+    返却されたものをcleanup_batch_size件ごとにまとめて削除する。
+    終了時に残った分はdrain(include_pooled=True)で取り出して削除する
+    """
+
+    def __init__(self, size: Optional[int] = None, cleanup_batch_size: Optional[int] = None):
+        self.size = size if size is not None else settings.GEO_DISTANCE_SCRATCH_POOL_SIZE
+        self.cleanup_batch_size = (
+            cleanup_batch_size
+            if cleanup_batch_size is not None
+            else settings.GEO_DISTANCE_SCRATCH_CLEANUP_BATCH_SIZE
+        )
+        self._lock = threading.Lock()
+        self._pid = None
+        self._prefix = ""
+        self._free: "deque[ScratchLease]" = deque()
+        self._leased: Set[str] = set()
+        self._pending_deletes: List[str] = []
+        self.overflows = 0
+
+    def _ensure_worker(self) -> None:
+        """fork後の子プロセスでは親と重ならないIDでプールを作り直す（ロックを保持して呼ぶ）"""
+        pid = os.getpid()
+        if self._pid == pid:
+            return
+        self._prefix = f"{SCRATCH_ID_PREFIX}{socket.gethostname()}-{pid}"
+        self._free = deque(ScratchLease(f"{self._prefix}-{i}") for i in range(self.size))
+        self._leased = set()
+        self._pending_deletes = []
+        self._pid = pid
+
+    def acquire(self, location: Optional[Tuple[float, float]] = None) -> ScratchLease:
+        """
+        ドキュメントIDを1つ貸し出す（ブロックしない）
+        locationを書き込み済みのIDが空いていればそれを優先して貸し出す
+        """
+        with self._lock:
+            self._ensure_worker()
+            if location is not None:
+                for lease in self._free:
+                    if lease.location == location:
+                        self._free.remove(lease)
+                        return lease
+            if self._free:
+                lease = self._free.popleft()
+                self._leased.add(lease.doc_id)
+                return lease
+            self.overflows += 1
+            prefix = self._prefix
+        logger.debug("一時ドキュメントのプールが空のため、使い捨てのIDを貸し出します")
+        return ScratchLease(f"{prefix}-overflow-{uuid.uuid4().hex}", overflow=True)
+
+    def release(self, lease: ScratchLease) -> List[str]:
+        """
+        ドキュメントIDを返却する
+
+        Returns:
+            List[str]: まとめて削除する使い捨てのドキュメントID（削除するものがなければ空）
+        """
+        with self._lock:
+            self._ensure_worker()
+            if not lease.overflow:
+                self._free.append(lease)
+                return []
+            self._pending_deletes.append(lease.doc_id)
+            if len(self._pending_deletes) < self.cleanup_batch_size:
+                return []
+            doc_ids, self._pending_deletes = self._pending_deletes, []
+            return doc_ids
+
+    def forget_locations(self) -> None:
+        """書き込み済みのA地点の記録を破棄する（インデックスが作り直された可能性がある場合に呼ぶ）"""
+        with self._lock:
+            for lease in self._free:
+                lease.location = None
+
+    def drain(self, include_pooled: bool = False) -> List[str]:
+        """
+        削除待ちの使い捨てのドキュメントIDをすべて取り出す
+
+        Args:
+            include_pooled: 一度でも貸し出したプールのIDも含めるか（ワーカーの終了時に使う）
+        """
+        with self._lock:
+            doc_ids, self._pending_deletes = self._pending_deletes, []
+            if include_pooled:
+                doc_ids.extend(sorted(self._leased))
+                self._leased = set()
+                for lease in self._free:
+                    lease.location = None
+            return doc_ids
+
+    def stats(self) -> Dict[str, int]:
+        """
+        プールの状態を返す
+
+        Returns:
+            Dict[str, int]: size, free, overflows, pending_deletes
+        """
+        with self._lock:
+            self._ensure_worker()
+            return {
+                "size": self.size,
+                "free": len(self._free),
+                "overflows": self.overflows,
+                "pending_deletes": len(self._pending_deletes),
+            }
+
+
+scratch_pool = ScratchPool()
@@ -0,0 +1,53 @@
+"""
+OpenSearchクライアントのJSONのエンコード・デコード
+
+orjsonがインストールされている場合は、標準のjsonより高速なorjsonでリクエストボディをエンコードし、
+レスポンスをデコードする（OPENSEARCH_JSON_SERIALIZERで選択する）
+"""
+
+import logging
+
+from django.conf import settings
+from opensearchpy.serializer import JSONSerializer
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+logger = logging.getLogger(__name__)
+
+SERIALIZERS = ("auto", "json", "orjson")
+
+
+class OrjsonSerializer(JSONSerializer):
+    """orjsonを使うJSONSerializer。orjsonで扱えない型はJSONSerializer.defaultで変換する"""
+
+    def loads(self, s):
+        try:
+            return orjson.loads(s)
+        except orjson.JSONDecodeError as e:
+            # JSONSerializerと同じくSerializationErrorにするため、標準のjsonでデコードし直す
+            logger.debug(f"orjsonでデコードできませんでした: {e}")
+            return super().loads(s)
+
+    def dumps(self, data):
+        if isinstance(data, (str, bytes)):
+            return data
+        # helpers.bulkなどはstrとして扱うため、JSONSerializerと同じくstrで返す
+        return orjson.dumps(
+            data, default=self.default, option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS
+        ).decode("utf-8")
+
+
+def get_serializer() -> JSONSerializer:
+    """OPENSEARCH_JSON_SERIALIZERに応じたシリアライザーを返す（"auto"はorjsonがあればorjson）"""
+    name = settings.OPENSEARCH_JSON_SERIALIZER
+    if name not in SERIALIZERS:
+        raise ValueError(f"未対応のシリアライザーです: {name}（{', '.join(SERIALIZERS)}）")
+    if name == "orjson" and orjson is None:
+        raise ValueError("OPENSEARCH_JSON_SERIALIZER=orjsonにはorjsonのインストールが必要です")
+    if name == "json" or orjson is None:
+        return JSONSerializer()
+    return OrjsonSerializer()
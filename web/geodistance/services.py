@@ -1,11 +1,236 @@
+import atexit
 import logging
-from typing import Dict, Optional, Tuple
-from opensearchpy import OpenSearch
+import os
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
+from typing import Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+import numpy as np
 from django.conf import settings
+from opensearchpy.exceptions import NotFoundError
+from . import engine
+from .cache import distance_result_cache
+from .clients import get_client
+from .error_map import DEFAULT_BAND_EDGES_KM, error_map_store
+from .history import history_recorder
+from .index_management import ensure_index
+from .instrumentation import instrumentation
+from .scratch import SCRATCH_ID_PREFIX, is_stale_scratch_id, scratch_pool
+from .spatial_index import reference_index_store
 
 
 logger = logging.getLogger(__name__)
 
+# 参照地点（駅・店舗など）のインデックス。propertiesは保存のみで検索対象にしない
+REFERENCE_INDEX_MAPPING = {
+    "mappings": {
+        "properties": {
+            "location": {"type": "geo_point"},
+            "name": {"type": "text", "fields": {"keyword": {"type": "keyword", "ignore_above": 256}}},
+            # search_afterのタイブレーカー。_idのfielddataを使わずdoc valuesでソートする
+            "point_id": {"type": "keyword"},
+            "properties": {"type": "object", "enabled": False},
+        }
+    }
+}
+
+# calculate_distances_batchが返す列
+BATCH_COLUMNS = (
+    "arc_distance_km",
+    "plane_distance_km",
+    "difference_km",
+    "difference_percentage",
+    "error_message",
+)
+
+# _geo_distanceソートのunit=kmと同じくメートルを1000.0で割ってkmに変換する
+DISTANCE_SCRIPTS = {
+    "arc": "doc['location'].arcDistance(params.lat, params.lon) / 1000.0",
+    "plane": "doc['location'].planeDistance(params.lat, params.lon) / 1000.0",
+}
+
+# 応答のうち読み取る部分だけを返させるfilter_path（_index/_id/_score/_sourceや_shardsを転送・デコードしない）
+# tookはgeodistance.instrumentationが記録するため残す
+SORT_FILTER_PATH = "took,hits.hits.sort"
+MSEARCH_SORT_FILTER_PATH = "took,responses.status,responses.error,responses.hits.hits.sort"
+REFERENCE_FILTER_PATH = "took,hits.hits._id,hits.hits._source,hits.hits.sort,hits.hits.fields"
+# _bulkの項目はstatusを残して順序を保ち、失敗した項目だけerrorを返させる
+BULK_FILTER_PATH = "took,errors,items.*.status,items.*.error"
+
+
+
+class IndexExistenceCache:
+    """
+    インデックスの存在確認結果をプロセス内でTTL付きで保持するキャッシュ
+    リクエストごとのindices.exists呼び出しを省略するために使用する
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._expires_at: Dict[str, float] = {}
+
+    def is_known(self, index_name: str) -> bool:
+        """TTL内に存在が確認済みであればTrue"""
+        with self._lock:
+            expires_at = self._expires_at.get(index_name)
+            return expires_at is not None and time.monotonic() < expires_at
+
+    def mark_exists(self, index_name: str) -> None:
+        """インデックスの存在を記録する"""
+        with self._lock:
+            self._expires_at[index_name] = (
+                time.monotonic() + settings.GEO_INDEX_EXISTS_CACHE_TTL
+            )
+
+    def invalidate(self, index_name: Optional[str] = None) -> None:
+        """
+        記録を破棄する
+
+        Args:
+            index_name: 破棄するインデックス名。Noneの場合はすべて破棄する
+        """
+        with self._lock:
+            if index_name is None:
+                self._expires_at.clear()
+            else:
+                self._expires_at.pop(index_name, None)
+        # インデックスが作り直されていれば一時ドキュメントも消えているため、書き込み済みの記録も破棄する
+        scratch_pool.forget_locations()
+
+
+index_existence_cache = IndexExistenceCache()
+
+
+_execute_lock = threading.Lock()
+_execute_executor: Optional[ThreadPoolExecutor] = None
+_execute_pid: Optional[int] = None
+
+
+def _get_execute_executor() -> ThreadPoolExecutor:
+    """executeモードでplaneを同時に計算するスレッドプール（fork後の子プロセスでは作り直す）"""
+    global _execute_executor, _execute_pid
+    with _execute_lock:
+        if _execute_executor is None or _execute_pid != os.getpid():
+            _execute_executor = ThreadPoolExecutor(
+                max_workers=settings.OPENSEARCH_POOL_MAXSIZE, thread_name_prefix="geodistance-execute"
+            )
+            _execute_pid = os.getpid()
+        return _execute_executor
+
+
+def _hits(response: Dict) -> List[Dict]:
+    """検索結果のヒット（filter_pathを指定した検索はヒットがないとhitsごと省かれる）"""
+    return response.get("hits", {}).get("hits", [])
+
+
+def _is_index_not_found(error: Exception) -> bool:
+    """index_not_found_exceptionかどうかを判定"""
+    return (
+        isinstance(error, NotFoundError)
+        and error.error == "index_not_found_exception"
+    )
+
+
+def _summarize_distances(arc_distance: float, plane_distance: float) -> Dict:
+    """arc距離とplane距離から、丸め済みの距離・差分・差分率を求める"""
+    difference = abs(arc_distance - plane_distance)
+    difference_percentage = (difference / arc_distance * 100) if arc_distance > 0 else 0
+
+    return {
+        "arc_distance_km": round(arc_distance, 3),
+        "plane_distance_km": round(plane_distance, 3),
+        "difference_km": round(difference, 3),
+        "difference_percentage": round(difference_percentage, 2),
+    }
+
+
+def approximate_distances(a_lat: float, a_lon: float, b_lat: float, b_lon: float) -> Optional[Dict]:
+    """
+    誤差マップからarc距離とplane距離の近似値を求める（OpenSearchに問い合わせない）
+
+    Returns:
+        Optional[Dict]: calculate_distancesと同じ形式に、approximateと
+            max_difference_percentage（セル・距離帯内の最大誤差率）を加えた辞書。
+            誤差マップがない場合や距離帯の範囲外の場合はNone
+    """
+    error_map = error_map_store.get()
+    if error_map is None:
+        return None
+
+    with instrumentation.span("service.error_map_lookup") as span:
+        approximate = error_map.approximate(a_lat, a_lon, b_lat, b_lon)
+        if approximate is None:
+            span.set(error="out_of_range")
+            return None
+
+    arc_distance, plane_distance, max_difference_percentage = approximate
+    result = {"success": True, "error_message": None, "approximate": True}
+    result.update(_summarize_distances(arc_distance, plane_distance))
+    result["max_difference_percentage"] = round(max_difference_percentage, 2)
+    return result
+
+
+def _geo_distance_sort(target_lat: float, target_lon: float, distance_type: str) -> Dict:
+    """指定された距離タイプの_geo_distanceソート句を生成"""
+    return {
+        "_geo_distance": {
+            "location": {"lat": target_lat, "lon": target_lon},
+            "order": "asc",
+            "unit": "km",
+            "distance_type": distance_type,
+        }
+    }
+
+
+def _matrix_row(origin: int, arc: np.ndarray, plane: np.ndarray) -> Dict:
+    """距離行列の1行分（1つの出発地点から全目的地点）の結果を作る"""
+    difference = np.abs(arc - plane)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        difference_percentage = np.where(arc > 0, difference / arc * 100, 0.0)
+
+    return {
+        "origin": origin,
+        "arc_distance_km": np.round(arc, 3).tolist(),
+        "plane_distance_km": np.round(plane, 3).tolist(),
+        "difference_km": np.round(difference, 3).tolist(),
+        "difference_percentage": np.round(difference_percentage, 2).tolist(),
+    }
+
+
+def _differing_cells(arc_buckets: List[Dict], plane_buckets: List[Dict]) -> List[Dict]:
+    """geohash_gridのセルのうち、arcとplaneで件数が異なるものを返す"""
+    arc_counts = {bucket["key"]: bucket["doc_count"] for bucket in arc_buckets}
+    plane_counts = {bucket["key"]: bucket["doc_count"] for bucket in plane_buckets}
+    return [
+        {"geohash": key, "arc_count": arc_counts.get(key, 0), "plane_count": plane_counts.get(key, 0)}
+        for key in sorted(arc_counts.keys() | plane_counts.keys())
+        if arc_counts.get(key, 0) != plane_counts.get(key, 0)
+    ]
+
+
+def _validate_coordinates(a_lat: float, a_lon: float, b_lat: float, b_lon: float) -> Optional[str]:
+    """座標が範囲内であればNone、範囲外であればエラーメッセージを返す"""
+    for lat in (a_lat, b_lat):
+        if not -90 <= lat <= 90:
+            return f"緯度が範囲外です: {lat}"
+    for lon in (a_lon, b_lon):
+        if not -180 <= lon <= 180:
+            return f"経度が範囲外です: {lon}"
+    return None
+
+
+def _chunked(iterable: Iterable, size: int) -> Iterator[List]:
+    """iterableをsize件ずつのリストに分割する"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
 
 class GeoDistanceService:
     """
@@ -14,42 +239,31 @@ class GeoDistanceService:
     """
 
     def __init__(self):
-        """OpenSearchクライアントを初期化"""
+        """プロセス共有のレジストリからOpenSearchクライアントを取得"""
         try:
-            self.client = OpenSearch(
-                hosts=[
-                    {"host": settings.OPENSEARCH_HOST, "port": settings.OPENSEARCH_PORT}
-                ],
-                http_auth=(settings.OPENSEARCH_USERNAME, settings.OPENSEARCH_PASSWORD),
-                use_ssl=True,
-                verify_certs=False,
-                ssl_assert_hostname=False,
-                ssl_show_warn=False,
-                timeout=30,
-            )
-            self.index_name = "geo_distance_test"
+            # インデックスは直接指定せず、バージョンを切り替えられるようエイリアスで読み書きする
+            self.index_name = settings.GEO_DISTANCE_INDEX_ALIAS
+            self.calculation_mode = settings.GEO_DISTANCE_CALCULATION_MODE
+            self.reference_backend = settings.GEO_REFERENCE_BACKEND
+            self.client = get_client()
         except Exception as e:
             logger.error(f"OpenSearchクライアントの初期化に失敗しました: {e}")
             self.client = None
 
     def _ensure_index_exists(self) -> bool:
-        """テスト用のインデックスが存在することを確認し、なければ作成する"""
+        """
+        距離計算用インデックスのエイリアスが存在することを確認し、なければ作成する
+        （geodistance.index_management）。確認結果はTTLの間キャッシュし、その間はOpenSearchに問い合わせない
+        """
         try:
             if not self.client:
                 return False
 
-            if not self.client.indices.exists(index=self.index_name):
-                mapping = {
-                    "mappings": {
-                        "properties": {
-                            "location": {"type": "geo_point"},
-                            "name": {"type": "text"},
-                        }
-                    }
-                }
-                self.client.indices.create(index=self.index_name, body=mapping)
-                logger.info(f"インデックス '{self.index_name}' を作成しました")
+            if index_existence_cache.is_known(self.index_name):
+                return True
 
+            ensure_index(self.client)
+            index_existence_cache.mark_exists(self.index_name)
             return True
         except Exception as e:
             logger.error(f"インデックスの作成に失敗しました: {e}")
@@ -68,11 +282,13 @@ class GeoDistanceService:
             self.client.index(index=self.index_name, id=doc_id, body=doc, refresh=True)
             return True
         except Exception as e:
+            if _is_index_not_found(e):
+                index_existence_cache.invalidate(self.index_name)
             logger.error(f"テストドキュメントの作成に失敗しました: {e}")
             return False
 
     def calculate_distances(
-        self, a_lat: float, a_lon: float, b_lat: float, b_lon: float
+        self, a_lat: float, a_lon: float, b_lat: float, b_lon: float, exact: bool = True
     ) -> Dict:
         """
         A地点とB地点間の距離をarc（球面距離）とplane（平面距離）で計算
@@ -82,6 +298,10 @@ class GeoDistanceService:
             a_lon: A地点の経度
             b_lat: B地点の緯度
             b_lon: B地点の経度
+            exact: Falseの場合は誤差マップ（geodistance.error_map）から推定した近似値を返す。
+                セル・距離帯・方位の区画ごとの平均誤差率による粗い推定で、結果のapproximateがTrueになり、
+                max_difference_percentageにずれの目安を入れる。
+                誤差マップが読み込まれていないか距離帯の範囲外の場合はOpenSearchで計算する
 
         Returns:
             Dict: 計算結果を含む辞書
@@ -95,49 +315,535 @@ class GeoDistanceService:
             "error_message": None,
         }
 
+        if not exact:
+            approximate = approximate_distances(a_lat, a_lon, b_lat, b_lon)
+            if approximate is not None:
+                return approximate
+
+        with instrumentation.span("service.calculate_distances", mode=self.calculation_mode) as span:
+            cache_key = None
+            if distance_result_cache.enabled:
+                cache_key = distance_result_cache.make_key(
+                    self.calculation_mode, a_lat, a_lon, b_lat, b_lon
+                )
+                with instrumentation.span("service.cache_lookup"):
+                    cached = distance_result_cache.get(cache_key)
+                if cached is not None:
+                    span.set(cache_hit=True)
+                    return cached
+
+            try:
+                if self.calculation_mode != "local":
+                    if not self.client:
+                        result["error_message"] = "OpenSearchクライアントが初期化されていません"
+                        span.set(error="client_unavailable")
+                        return result
+
+                    with instrumentation.span("service.ensure_index_exists"):
+                        index_ready = self._ensure_index_exists()
+                    if not index_ready:
+                        result["error_message"] = "インデックスの作成に失敗しました"
+                        span.set(error="index_unavailable")
+                        return result
+
+                distances = self._calculate_arc_and_plane(a_lat, a_lon, b_lat, b_lon)
+                if distances is None:
+                    result["error_message"] = "arc/plane距離の計算に失敗しました"
+                    span.set(error="calculation_failed")
+                    return result
+                arc_distance, plane_distance = distances
+
+                result.update(_summarize_distances(arc_distance, plane_distance))
+                result["success"] = True
+
+                if cache_key is not None:
+                    distance_result_cache.set(cache_key, result)
+                history_recorder.record(self.calculation_mode, a_lat, a_lon, b_lat, b_lon, result)
+
+            except Exception as e:
+                logger.error(f"距離計算中にエラーが発生しました: {e}")
+                result["error_message"] = f"計算エラー: {str(e)}"
+                span.set(error=type(e).__name__)
+
+        return result
+
+    def calculate_distances_batch(
+        self,
+        pairs: Iterable[Tuple[float, float, float, float]],
+        chunk_size: Optional[int] = None,
+    ) -> Dict[str, List]:
+        """
+        複数のA地点・B地点の組についてarc距離とplane距離をまとめて計算
+
+        chunk_size件ごとにA地点を_bulkで一括登録し、_msearchで全件を1往復で検索する。
+        localモードではローカルエンジンでチャンク単位にベクトル計算する
+
+        Args:
+            pairs: (A緯度, A経度, B緯度, B経度) のiterable
+            chunk_size: 1回の_bulk/_msearchで処理する件数（省略時は設定値）
+
+        Returns:
+            Dict[str, List]: BATCH_COLUMNSをキーとする列指向の結果。
+                計算できなかった行は距離がNoneで、error_messageに理由が入る
+        """
+        columns = {column: [] for column in BATCH_COLUMNS}
+
+        for _, rows in self.iter_batch_chunks(pairs, chunk_size=chunk_size, concurrency=1):
+            for row in rows:
+                for column in BATCH_COLUMNS:
+                    columns[column].append(row[column])
+
+        return columns
+
+    def iter_batch_chunks(
+        self,
+        pairs: Iterable[Tuple[float, float, float, float]],
+        chunk_size: Optional[int] = None,
+        concurrency: Optional[int] = None,
+    ) -> Iterator[Tuple[List[Tuple[float, float, float, float]], List[Dict]]]:
+        """
+        地点の組をchunk_size件ずつ計算し、チャンクごとに入力と結果を生成
+
+        pairsは次のチャンクを計算に回すときに必要な分だけ読み進め、計算中のチャンクは
+        concurrency件までに抑える。呼び出し側が結果を取り出さない間は先読みしないため、
+        入力が何件あってもメモリに載るのはchunk_size × (concurrency + 1)件程度になる
+
+        Args:
+            pairs: (A緯度, A経度, B緯度, B経度) のiterable
+            chunk_size: 1回の_bulk/_msearchで処理する件数（省略時は設定値）
+            concurrency: 並行に計算するチャンクの数（省略時は設定値、1の場合は呼び出し元のスレッドで計算）
+
+        Yields:
+            Tuple[List, List[Dict]]: チャンクの地点の組と、BATCH_COLUMNSをキーとする行ごとの結果（入力の順）
+        """
+        chunk_size = chunk_size or settings.GEO_DISTANCE_BATCH_CHUNK_SIZE
+        concurrency = concurrency or settings.GEO_DISTANCE_EXPORT_CONCURRENCY
+        chunks = _chunked(pairs, chunk_size)
+
+        if concurrency <= 1:
+            for chunk in chunks:
+                yield chunk, self._calculate_batch_chunk(chunk)
+            return
+
+        pending = deque()
+        read_error = None
+
+        def submit(executor, count):
+            # 入力の読み込みエラーは、先に読み込んだチャンクの結果を返してから送出する
+            nonlocal read_error
+            try:
+                for chunk in islice(chunks, count):
+                    pending.append((chunk, executor.submit(self._calculate_batch_chunk, chunk)))
+            except Exception as e:
+                read_error = e
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            submit(executor, concurrency)
+            while pending:
+                chunk, future = pending.popleft()
+                rows = future.result()
+                if read_error is None:
+                    submit(executor, 1)
+                yield chunk, rows
+
+        if read_error is not None:
+            raise read_error
+
+    def _calculate_batch_chunk(
+        self, chunk: List[Tuple[float, float, float, float]], raise_on_failure: bool = False
+    ) -> List[Dict]:
+        """
+        1チャンク分の地点の組を計算し、行ごとの結果を返す
+
+        Args:
+            chunk: (A緯度, A経度, B緯度, B経度) のリスト
+            raise_on_failure: チャンク全体の失敗（接続・インデックスのエラー）を例外として送出するか。
+                Falseの場合は計算できた行と同じく行ごとのerror_messageにする
+        """
+        rows = [dict.fromkeys(BATCH_COLUMNS) for _ in chunk]
+        valid = []
+        for i, pair in enumerate(chunk):
+            error_message = _validate_coordinates(*pair)
+            if error_message:
+                rows[i]["error_message"] = error_message
+            else:
+                valid.append(i)
+
+        if not valid:
+            return rows
+
+        if self.calculation_mode == "local":
+            a_lat, a_lon, b_lat, b_lon = (
+                [chunk[i][axis] for i in valid] for axis in range(4)
+            )
+            distances = engine.compare_distances(a_lat, a_lon, b_lat, b_lon)
+            results = list(zip(distances["arc"].tolist(), distances["plane"].tolist()))
+        else:
+            try:
+                results = self._msearch_arc_and_plane([chunk[i] for i in valid])
+            except Exception as e:
+                if raise_on_failure:
+                    raise
+                results = [f"計算エラー: {str(e)}"] * len(valid)
+
+        for i, distances in zip(valid, results):
+            if isinstance(distances, tuple):
+                rows[i].update(_summarize_distances(*distances))
+            else:
+                rows[i]["error_message"] = distances or "arc/plane距離の計算に失敗しました"
+
+        return rows
+
+    def _msearch_arc_and_plane(
+        self, pairs: List[Tuple[float, float, float, float]]
+    ) -> List:
+        """
+        A地点を_bulkで一括登録し、_msearchで全組のarc/plane距離を1往復で取得する
+
+        Returns:
+            List: 組ごとの(arc距離, plane距離)、_bulk/_msearchの項目ごとに失敗した組はエラーメッセージ
+
+        Raises:
+            Exception: クライアント・インデックス・_bulk/_msearchの呼び出しそのものが失敗した場合
+        """
+        if not self.client:
+            raise RuntimeError("OpenSearchクライアントが初期化されていません")
+        if not self._ensure_index_exists():
+            raise RuntimeError("インデックスの作成に失敗しました")
+
+        batch_id = uuid.uuid4().hex
+        doc_ids = [f"batch-{batch_id}-{i}" for i in range(len(pairs))]
+        results: List = [None] * len(pairs)
+
         try:
-            if not self.client:
-                result["error_message"] = "OpenSearchクライアントが初期化されていません"
-                return result
+            operations = []
+            for doc_id, (a_lat, a_lon, _, _) in zip(doc_ids, pairs):
+                operations.append({"index": {"_index": self.index_name, "_id": doc_id}})
+                operations.append({"location": {"lat": a_lat, "lon": a_lon}})
+            # チャンク全体で1回だけrefreshする
+            response = self.client.bulk(body=operations, refresh=True, filter_path=BULK_FILTER_PATH)
+            for i, item in enumerate(response["items"]):
+                error = item["index"].get("error")
+                if error:
+                    results[i] = f"A地点の登録に失敗しました: {error.get('reason', error)}"
 
-            if not self._ensure_index_exists():
-                result["error_message"] = "インデックスの作成に失敗しました"
-                return result
+            searches = []
+            for doc_id, (_, _, b_lat, b_lon) in zip(doc_ids, pairs):
+                searches.append({"index": self.index_name})
+                searches.append(
+                    {
+                        "size": 1,
+                        "_source": False,
+                        "track_total_hits": False,
+                        "query": {"ids": {"values": [doc_id]}},
+                        "sort": [
+                            _geo_distance_sort(b_lat, b_lon, "arc"),
+                            _geo_distance_sort(b_lat, b_lon, "plane"),
+                        ],
+                    }
+                )
+            response = self.client.msearch(body=searches, filter_path=MSEARCH_SORT_FILTER_PATH)
+            for i, item in enumerate(response["responses"]):
+                if results[i] is not None:
+                    continue
+                hits = _hits(item)
+                if "error" in item:
+                    results[i] = f"距離計算クエリでエラーが発生しました: {item['error']}"
+                elif not hits:
+                    results[i] = "arc/plane距離の計算に失敗しました"
+                else:
+                    arc_distance, plane_distance = hits[0]["sort"][:2]
+                    results[i] = (float(arc_distance), float(plane_distance))
 
-            if not self._create_test_document(a_lat, a_lon, "point_a"):
-                result["error_message"] = "テストドキュメントの作成に失敗しました"
-                return result
+        except Exception as e:
+            if _is_index_not_found(e):
+                index_existence_cache.invalidate(self.index_name)
+            logger.error(f"一括距離計算でエラーが発生しました: {e}")
+            raise
 
-            arc_distance = self._calculate_distance_with_type(b_lat, b_lon, "arc")
-            if arc_distance is None:
-                result["error_message"] = "arc距離の計算に失敗しました"
-                return result
+        finally:
+            self._delete_batch_documents(doc_ids)
 
-            plane_distance = self._calculate_distance_with_type(b_lat, b_lon, "plane")
-            if plane_distance is None:
-                result["error_message"] = "plane距離の計算に失敗しました"
-                return result
+        return results
+
+    def _delete_batch_documents(self, doc_ids: List[str]) -> None:
+        """一括計算用に登録したA地点をまとめて削除する"""
+        try:
+            operations = [
+                {"delete": {"_index": self.index_name, "_id": doc_id}} for doc_id in doc_ids
+            ]
+            self.client.bulk(body=operations, filter_path="took,errors")
+        except Exception as e:
+            logger.error(f"一括計算用ドキュメントの削除に失敗しました: {e}")
+
+    def iter_distance_matrix(
+        self,
+        origins: List[Tuple[float, float]],
+        destinations: List[Tuple[float, float]],
+        concurrency: Optional[int] = None,
+    ) -> Iterator[Dict]:
+        """
+        N個の出発地点とM個の目的地点の間のarc/plane距離行列を、出発地点ごとに1行ずつ生成
+
+        目的地点は_bulkで1回だけ登録し、出発地点ごとに全目的地点を返す
+        _geo_distanceソート付きの検索を1回（max_result_windowを超える場合はsearch_after）行う。
+        出発地点の検索はconcurrency件まで並行に実行し、行は出発地点の順に返す。
+        行列全体をメモリに保持しないため、結果はそのままストリーミングできる
+
+        Args:
+            origins: 出発地点の(緯度, 経度)のリスト
+            destinations: 目的地点の(緯度, 経度)のリスト
+            concurrency: 並行に実行する検索の数（省略時は設定値）
+
+        Yields:
+            Dict: origin（出発地点の番号）と、目的地点の順に並んだ距離の列
+        """
+        concurrency = concurrency or settings.GEO_DISTANCE_MATRIX_CONCURRENCY
+
+        if self.calculation_mode == "local":
+            dest_lat = np.array([lat for lat, _ in destinations], dtype=np.float64)
+            dest_lon = np.array([lon for _, lon in destinations], dtype=np.float64)
+            for i, (lat, lon) in enumerate(origins):
+                distances = engine.compare_distances(dest_lat, dest_lon, lat, lon)
+                yield _matrix_row(i, distances["arc"], distances["plane"])
+            return
+
+        if not self.client:
+            raise RuntimeError("OpenSearchクライアントが初期化されていません")
+        if not self._ensure_index_exists():
+            raise RuntimeError("インデックスの作成に失敗しました")
+
+        dataset = uuid.uuid4().hex
+        try:
+            self._index_matrix_destinations(dataset, destinations)
+
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                pending = deque()
+                origin_iter = iter(enumerate(origins))
+                for i, (lat, lon) in islice(origin_iter, concurrency * 2):
+                    pending.append(
+                        executor.submit(self._search_matrix_row, dataset, len(destinations), i, lat, lon)
+                    )
+                while pending:
+                    row = pending.popleft().result()
+                    for i, (lat, lon) in islice(origin_iter, 1):
+                        pending.append(
+                            executor.submit(self._search_matrix_row, dataset, len(destinations), i, lat, lon)
+                        )
+                    yield row
+        finally:
+            self._delete_dataset(dataset)
+
+    def _index_matrix_destinations(
+        self, dataset: str, destinations: List[Tuple[float, float]]
+    ) -> None:
+        """距離行列の目的地点をdatasetとして一括登録する"""
+        for chunk_start in range(0, len(destinations), settings.GEO_DISTANCE_BATCH_CHUNK_SIZE):
+            chunk = destinations[chunk_start:chunk_start + settings.GEO_DISTANCE_BATCH_CHUNK_SIZE]
+            operations = []
+            for ordinal, (lat, lon) in enumerate(chunk, start=chunk_start):
+                operations.append({"index": {"_index": self.index_name, "_id": f"{dataset}-{ordinal}"}})
+                operations.append(
+                    {"location": {"lat": lat, "lon": lon}, "dataset": dataset, "ordinal": ordinal}
+                )
+            response = self.client.bulk(body=operations, filter_path="took,errors")
+            if response.get("errors"):
+                raise RuntimeError("目的地点の登録に失敗しました")
+
+        self.client.indices.refresh(index=self.index_name)
 
-            difference = abs(arc_distance - plane_distance)
-            difference_percentage = (
-                (difference / arc_distance * 100) if arc_distance > 0 else 0
+    def _search_matrix_row(
+        self, dataset: str, size: int, origin: int, lat: float, lon: float
+    ) -> Dict:
+        """1つの出発地点から全目的地点へのarc/plane距離を検索する"""
+        arc = np.empty(size)
+        plane = np.empty(size)
+        page_size = min(size, settings.GEO_DISTANCE_MATRIX_PAGE_SIZE)
+        query = {
+            "size": page_size,
+            "_source": False,
+            "track_total_hits": False,
+            "query": {"term": {"dataset": dataset}},
+            "sort": [
+                _geo_distance_sort(lat, lon, "arc"),
+                _geo_distance_sort(lat, lon, "plane"),
+                {"ordinal": "asc"},
+            ],
+        }
+
+        received = 0
+        while received < size:
+            response = self.client.search(index=self.index_name, body=query, filter_path=SORT_FILTER_PATH)
+            hits = _hits(response)
+            if not hits:
+                break
+            for hit in hits:
+                arc_distance, plane_distance, ordinal = hit["sort"][:3]
+                arc[ordinal] = arc_distance
+                plane[ordinal] = plane_distance
+            received += len(hits)
+            query["search_after"] = hits[-1]["sort"]
+
+        if received < size:
+            raise RuntimeError(f"出発地点{origin}の距離を取得できませんでした（{received}/{size}件）")
+
+        return _matrix_row(origin, arc, plane)
+
+    def _delete_dataset(self, dataset: str) -> None:
+        """一時的に登録したdatasetのドキュメントを削除する"""
+        try:
+            self.client.delete_by_query(
+                index=self.index_name,
+                body={"query": {"term": {"dataset": dataset}}},
+                conflicts="proceed",
+                wait_for_completion=False,
             )
+        except Exception as e:
+            logger.error(f"一時ドキュメントの削除に失敗しました: {e}")
 
-            result.update(
-                {
-                    "success": True,
-                    "arc_distance_km": round(arc_distance, 3),
-                    "plane_distance_km": round(plane_distance, 3),
-                    "difference_km": round(difference, 3),
-                    "difference_percentage": round(difference_percentage, 2),
-                }
+    def _calculate_arc_and_plane(
+        self, a_lat: float, a_lon: float, b_lat: float, b_lon: float
+    ) -> Optional[Tuple[float, float]]:
+        """
+        計算モードに応じてA地点とB地点間のarc距離とplane距離を計算
+
+        "execute"モードはA地点をリクエスト内のドキュメントとして渡すため、
+        インデックスへの書き込みとrefreshが発生しない（arcとplaneの2回の呼び出しを同時に実行する）。
+        "indexed"モードはA地点をプールから借りた一時ドキュメントIDで書き込んでから検索する。
+        書き込み（refresh=True）と検索の2往復が必要で、1往復になるのは直前に同じA地点を
+        書き込んだ一時ドキュメントを借りられた場合だけになる。
+        "local"モードはOpenSearchを使わず、同じ計算式を再現したローカルエンジンで計算する
+
+        Returns:
+            Optional[Tuple[float, float]]: (arc距離, plane距離)（km）、エラーの場合はNone
+        """
+        if self.calculation_mode == "local":
+            with instrumentation.span("service.local_engine"):
+                distances = engine.compare_distances(a_lat, a_lon, b_lat, b_lon)
+            return float(distances["arc"]), float(distances["plane"])
+
+        if self.calculation_mode == "indexed":
+            # 同時に実行中のリクエストと同じドキュメントを上書きし合わないよう、IDを借りて使う。
+            # A地点が借りたドキュメントに書き込み済みであれば、書き込みとrefreshを省いて検索だけを行う
+            location = (a_lat, a_lon)
+            lease = scratch_pool.acquire(location)
+            try:
+                reused = lease.location == location
+                if not reused and not self._write_scratch_document(lease, a_lat, a_lon):
+                    return None
+                with instrumentation.span("service.search_arc_and_plane"):
+                    distances = self._search_arc_and_plane(b_lat, b_lon, lease.doc_id)
+                if distances is None and reused:
+                    # 書き込み済みのドキュメントが削除されていた場合は書き込み直す
+                    if not self._write_scratch_document(lease, a_lat, a_lon):
+                        return None
+                    with instrumentation.span("service.search_arc_and_plane"):
+                        distances = self._search_arc_and_plane(b_lat, b_lon, lease.doc_id)
+                return distances
+            finally:
+                expired = scratch_pool.release(lease)
+                if expired:
+                    self._delete_batch_documents(expired)
+
+        return self._execute_arc_and_plane(a_lat, a_lon, b_lat, b_lon)
+
+    def _write_scratch_document(self, lease, a_lat: float, a_lon: float) -> bool:
+        """借りた一時ドキュメントにA地点を書き込み、書き込んだ地点を記録する"""
+        lease.location = None
+        with instrumentation.span("service.create_test_document"):
+            created = self._create_test_document(a_lat, a_lon, lease.doc_id)
+        if created:
+            lease.location = (a_lat, a_lon)
+        return created
+
+    def _execute_arc_and_plane(
+        self, a_lat: float, a_lon: float, b_lat: float, b_lon: float
+    ) -> Optional[Tuple[float, float]]:
+        """
+        Painless execute APIでA地点をインメモリのドキュメントとして評価し、距離を計算
+        geo_pointのdoc values経由でソートと同じGeoUtilsの計算式が使われる
+
+        scoreコンテキストのスクリプトは1回の呼び出しで1つのdoubleしか返せないため、arcとplaneで
+        2回呼び出す必要がある（1回の検索で両方を求めるにはA地点の書き込みが必要になる）。
+        planeはスレッドプールで、arcは呼び出し元のスレッドで同時に実行し、待ち時間を1往復分に抑える
+
+        Returns:
+            Optional[Tuple[float, float]]: (arc距離, plane距離)（km）、エラーの場合はNone
+        """
+        try:
+            plane_future = _get_execute_executor().submit(
+                self._execute_distance, a_lat, a_lon, b_lat, b_lon, "plane"
             )
+            arc_distance = self._execute_distance(a_lat, a_lon, b_lat, b_lon, "arc")
+            return arc_distance, plane_future.result()
 
         except Exception as e:
-            logger.error(f"距離計算中にエラーが発生しました: {e}")
-            result["error_message"] = f"計算エラー: {str(e)}"
+            if _is_index_not_found(e):
+                index_existence_cache.invalidate(self.index_name)
+            logger.error(f"距離計算スクリプトでエラーが発生しました: {e}")
+            return None
 
-        return result
+    def _execute_distance(
+        self, a_lat: float, a_lon: float, b_lat: float, b_lon: float, distance_type: str
+    ) -> float:
+        """Painless execute APIで1種類の距離を計算する"""
+        body = {
+            "script": {
+                "source": DISTANCE_SCRIPTS[distance_type],
+                "params": {"lat": b_lat, "lon": b_lon},
+            },
+            "context": "score",
+            "context_setup": {
+                "index": self.index_name,
+                "document": {"location": {"lat": a_lat, "lon": a_lon}},
+            },
+        }
+        with instrumentation.span(f"service.execute_{distance_type}"):
+            response = self.client.scripts_painless_execute(body=body)
+        return float(response["result"])
+
+    def _search_arc_and_plane(
+        self, target_lat: float, target_lon: float, doc_id: str
+    ) -> Optional[Tuple[float, float]]:
+        """
+        arcとplaneの2つのソート句を持つ1回の検索で、両方の距離を計算
+
+        Args:
+            target_lat: 目標地点の緯度
+            target_lon: 目標地点の経度
+            doc_id: 基準地点のドキュメントID
+
+        Returns:
+            Optional[Tuple[float, float]]: (arc距離, plane距離)（km）、エラーの場合はNone
+        """
+        try:
+            query = {
+                "_source": False,
+                "track_total_hits": False,
+                "query": {"ids": {"values": [doc_id]}},
+                "sort": [
+                    _geo_distance_sort(target_lat, target_lon, "arc"),
+                    _geo_distance_sort(target_lat, target_lon, "plane"),
+                ],
+            }
+
+            # ルーティングキーを_idと同じにして、ドキュメントのあるシャードだけを検索する
+            response = self.client.search(
+                index=self.index_name, body=query, size=1, routing=doc_id, filter_path=SORT_FILTER_PATH
+            )
+
+            hits = _hits(response)
+            if hits:
+                arc_distance, plane_distance = hits[0]["sort"][:2]
+                return float(arc_distance), float(plane_distance)
+
+            return None
+
+        except Exception as e:
+            if _is_index_not_found(e):
+                index_existence_cache.invalidate(self.index_name)
+            logger.error(f"距離計算クエリでエラーが発生しました: {e}")
+            return None
 
     def _calculate_distance_with_type(
         self, target_lat: float, target_lon: float, distance_type: str
@@ -155,32 +861,246 @@ class GeoDistanceService:
         """
         try:
             query = {
+                "_source": False,
+                "track_total_hits": False,
                 "query": {"match_all": {}},
-                "sort": [
-                    {
-                        "_geo_distance": {
-                            "location": {"lat": target_lat, "lon": target_lon},
-                            "order": "asc",
-                            "unit": "km",
-                            "distance_type": distance_type,
-                        }
-                    }
-                ],
+                "sort": [_geo_distance_sort(target_lat, target_lon, distance_type)],
             }
 
-            response = self.client.search(index=self.index_name, body=query, size=1)
+            response = self.client.search(index=self.index_name, body=query, size=1, filter_path=SORT_FILTER_PATH)
 
-            if response["hits"]["total"]["value"] > 0:
-                hit = response["hits"]["hits"][0]
-                distance = hit["sort"][0]
-                return float(distance)
+            hits = _hits(response)
+            if hits:
+                return float(hits[0]["sort"][0])
 
             return None
 
         except Exception as e:
+            if _is_index_not_found(e):
+                index_existence_cache.invalidate(self.index_name)
             logger.error(f"距離計算クエリでエラーが発生しました: {e}")
             return None
 
+    def find_nearest_reference_points(
+        self,
+        lat: float,
+        lon: float,
+        k: int = 10,
+        radius_km: Optional[float] = None,
+        search_after: Optional[List] = None,
+    ) -> Dict:
+        """
+        基準地点から近い順にK件の参照地点を検索し、それぞれのarc距離とplane距離を1回の検索で求める
+
+        radius_kmを指定した場合はgeo_distanceフィルタで範囲外の参照地点を除外してからソートする。
+        arc距離の_geo_distanceソートとpoint_idのタイブレーカーで並べ、arc/planeの距離はscript_fieldsで
+        doc valuesから計算する。次のページはnext_search_afterをsearch_afterに渡して取得する
+        （from/sizeと違い、深いページでもヒープに全件を保持しない）
+        GEO_REFERENCE_BACKENDが"local"の場合はプロセス内の空間インデックス（geodistance.spatial_index）
+        で検索し、OpenSearchに問い合わせない
+
+        Args:
+            lat: 基準地点の緯度
+            lon: 基準地点の経度
+            k: 取得する件数
+            radius_km: 検索する半径（km）。Noneの場合は制限しない
+            search_after: 前のページのnext_search_after
+
+        Returns:
+            Dict: success, points（参照地点ごとのid・名前・座標・arc/plane距離・差分）,
+                next_search_after（次のページがない場合はNone）, error_message
+        """
+        result = {"success": False, "points": [], "next_search_after": None, "error_message": None}
+        index_name = settings.GEO_REFERENCE_INDEX
+
+        if self.reference_backend == "local":
+            return self._find_nearest_local(lat, lon, k, radius_km, search_after)
+
+        if not self.client:
+            result["error_message"] = "OpenSearchクライアントが初期化されていません"
+            return result
+
+        location = {"lat": lat, "lon": lon}
+        query = {"match_all": {}}
+        if radius_km is not None:
+            query = {
+                "bool": {
+                    "filter": {"geo_distance": {"distance": f"{radius_km}km", "location": location}}
+                }
+            }
+
+        body = {
+            "size": k,
+            "track_total_hits": False,
+            "query": query,
+            "_source": ["name", "location", "point_id"],
+            "sort": [_geo_distance_sort(lat, lon, "arc"), {"point_id": "asc"}],
+            "script_fields": {
+                f"{distance_type}_distance_km": {
+                    "script": {"source": DISTANCE_SCRIPTS[distance_type], "params": location}
+                }
+                for distance_type in ("arc", "plane")
+            },
+        }
+        if search_after:
+            body["search_after"] = search_after
+
+        try:
+            with instrumentation.span("service.find_nearest_reference_points", k=k):
+                response = self.client.search(index=index_name, body=body, filter_path=REFERENCE_FILTER_PATH)
+        except Exception as e:
+            logger.error(f"参照地点の検索でエラーが発生しました: {e}")
+            result["error_message"] = f"検索エラー: {str(e)}"
+            return result
+
+        hits = _hits(response)
+        for hit in hits:
+            source = hit.get("_source", {})
+            fields = hit.get("fields", {})
+            point = {
+                "id": hit["_id"],
+                "name": source.get("name"),
+                "lat": source.get("location", {}).get("lat"),
+                "lon": source.get("location", {}).get("lon"),
+            }
+            point.update(
+                _summarize_distances(
+                    float(fields["arc_distance_km"][0]), float(fields["plane_distance_km"][0])
+                )
+            )
+            result["points"].append(point)
+
+        if len(hits) == k:
+            result["next_search_after"] = hits[-1]["sort"]
+        result["success"] = True
+        return result
+
+    def _find_nearest_local(
+        self,
+        lat: float,
+        lon: float,
+        k: int,
+        radius_km: Optional[float],
+        search_after: Optional[List],
+    ) -> Dict:
+        """find_nearest_reference_pointsをプロセス内の空間インデックスで実行"""
+        result = {"success": False, "points": [], "next_search_after": None, "error_message": None}
+
+        with instrumentation.span("service.find_nearest_reference_points", k=k, backend="local"):
+            index = reference_index_store.get(self.client, settings.GEO_REFERENCE_INDEX)
+            if index is None:
+                result["error_message"] = "参照地点の空間インデックスを構築できませんでした"
+                return result
+            try:
+                points = index.nearest(lat, lon, k, radius_km=radius_km, search_after=search_after)
+            except (TypeError, ValueError, IndexError) as e:
+                result["error_message"] = f"検索エラー: {str(e)}"
+                return result
+
+        if len(points) == k:
+            # OpenSearchのソート値と同じく丸める前のarc距離とpoint_idを次のページの起点にする
+            result["next_search_after"] = [points[-1]["arc_distance_km"], points[-1]["id"]]
+        for point in points:
+            arc_distance = point.pop("arc_distance_km")
+            point.update(_summarize_distances(arc_distance, point.pop("plane_distance_km")))
+            result["points"].append(point)
+        result["success"] = True
+        return result
+
+    def aggregate_distance_distribution(
+        self,
+        lat: float,
+        lon: float,
+        band_edges_km: Optional[Sequence[float]] = None,
+        geohash_precision: Optional[int] = None,
+    ) -> Dict:
+        """
+        基準地点から参照地点までの距離の分布を、arcとplaneのgeo_distance集計で比較する
+
+        参照地点のインデックスにsize: 0の検索を1回だけ送り、同じ距離帯のgeo_distance集計を
+        distance_type: arcとplaneで並べて求める（ドキュメントは取得しない）。planeの誤差で参照地点が
+        隣の距離帯に入ると、その距離帯の件数がarcと異なる。geohash_precisionを指定した場合は
+        各距離帯にgeohash_gridを入れ子にし、件数が異なるセルを返す
+
+        Args:
+            lat: 基準地点の緯度
+            lon: 基準地点の経度
+            band_edges_km: 距離帯の境界（km、昇順）。最初の境界が0より大きい場合は0kmからの距離帯を先頭に加え、
+                最後の境界より遠い参照地点は最後の距離帯に含める
+            geohash_precision: geohash_gridの精度（1〜12）。Noneの場合は入れ子にしない
+
+        Returns:
+            Dict: success, total（参照地点の件数）, bands（距離帯ごとのarc/planeの件数とその差）,
+                differing_bands（件数が異なる距離帯の数）, error_message
+        """
+        result = {"success": False, "total": 0, "bands": [], "differing_bands": 0, "error_message": None}
+
+        if not self.client:
+            result["error_message"] = "OpenSearchクライアントが初期化されていません"
+            return result
+
+        edges = list(band_edges_km or DEFAULT_BAND_EDGES_KM)
+        # 最初の境界より近い参照地点が集計から漏れないよう、0kmからの距離帯を加える
+        if edges[0] > 0:
+            edges.insert(0, 0.0)
+        ranges = [{"from": start, "to": end} for start, end in zip(edges, edges[1:])]
+        ranges.append({"from": edges[-1]})
+        location = {"lat": lat, "lon": lon}
+
+        aggs = {}
+        for distance_type in ("arc", "plane"):
+            aggs[distance_type] = {
+                "geo_distance": {
+                    "field": "location",
+                    "origin": location,
+                    "unit": "km",
+                    "distance_type": distance_type,
+                    "ranges": ranges,
+                }
+            }
+            if geohash_precision is not None:
+                aggs[distance_type]["aggs"] = {
+                    "cells": {
+                        "geohash_grid": {
+                            "field": "location",
+                            "precision": geohash_precision,
+                            "size": settings.GEO_DISTANCE_DISTRIBUTION_MAX_CELLS,
+                        }
+                    }
+                }
+        body = {"size": 0, "track_total_hits": True, "query": {"match_all": {}}, "aggs": aggs}
+
+        try:
+            with instrumentation.span("service.aggregate_distance_distribution"):
+                response = self.client.search(
+                    index=settings.GEO_REFERENCE_INDEX, body=body, filter_path="took,hits.total,aggregations"
+                )
+        except Exception as e:
+            logger.error(f"距離の分布の集計でエラーが発生しました: {e}")
+            result["error_message"] = f"集計エラー: {str(e)}"
+            return result
+
+        aggregations = response["aggregations"]
+        for arc_bucket, plane_bucket in zip(
+            aggregations["arc"]["buckets"], aggregations["plane"]["buckets"]
+        ):
+            band = {
+                "from_km": arc_bucket.get("from"),
+                "to_km": arc_bucket.get("to"),
+                "arc_count": arc_bucket["doc_count"],
+                "plane_count": plane_bucket["doc_count"],
+                "count_difference": plane_bucket["doc_count"] - arc_bucket["doc_count"],
+            }
+            if geohash_precision is not None:
+                band["cells"] = _differing_cells(arc_bucket["cells"]["buckets"], plane_bucket["cells"]["buckets"])
+            if band["count_difference"]:
+                result["differing_bands"] += 1
+            result["bands"].append(band)
+
+        result["total"] = response["hits"]["total"]["value"]
+        result["success"] = True
+        return result
+
     def test_connection(self) -> Tuple[bool, str]:
         """
         OpenSearch接続をテスト
@@ -197,3 +1117,99 @@ class GeoDistanceService:
 
         except Exception as e:
             return False, f"接続エラー: {str(e)}"
+
+
+def bootstrap_index() -> bool:
+    """
+    起動時にインデックスを作成し、存在確認の結果をキャッシュする
+
+    Returns:
+        bool: インデックスが利用可能であればTrue
+    """
+    service = GeoDistanceService()
+    try:
+        if not service.client:
+            raise RuntimeError("OpenSearchクライアントが初期化されていません")
+        ensure_index(service.client)
+    except Exception as e:
+        # OpenSearchを起動していない環境でもログが埋まらないよう、1行だけ出力する
+        logger.warning(
+            f"起動時にインデックス '{service.index_name}' を準備できませんでした（{type(e).__name__}）。"
+            "最初のリクエストで再試行します"
+        )
+        return False
+
+    index_existence_cache.mark_exists(service.index_name)
+    logger.info(f"インデックス '{service.index_name}' の準備が完了しました")
+    try:
+        delete_stale_scratch_documents(service.client, service.index_name)
+    except Exception as e:
+        logger.warning(f"終了したワーカーの一時ドキュメントを削除できませんでした（{type(e).__name__}）")
+    return True
+
+
+# 1回の検索で確認する一時ドキュメントの最大件数（デフォルトのmax_result_window）
+SCRATCH_SCAN_SIZE = 10000
+
+
+def delete_stale_scratch_documents(client, index_name: Optional[str] = None, all_workers: bool = False) -> int:
+    """
+    indexedモードの一時ドキュメントのうち、終了したワーカーが残したものを削除する
+
+    IDの "scratch-<ホスト名>-<PID>-" から書き込んだワーカーを判定し、このホストで終了しているもの
+    だけを削除する。all_workers=Trueの場合はすべての一時ドキュメントを削除する（稼働中のワーカーは
+    消えたドキュメントを書き込み直すため、計算が失敗するのは書き込みから検索までの間に削除された場合だけ）
+
+    Args:
+        client: OpenSearchクライアント
+        index_name: 対象のインデックス（Noneの場合はGEO_DISTANCE_INDEX_ALIAS）
+        all_workers: 稼働中のワーカーの一時ドキュメントも削除するか
+
+    Returns:
+        int: 削除した件数
+    """
+    index_name = index_name or settings.GEO_DISTANCE_INDEX_ALIAS
+    response = client.search(
+        index=index_name,
+        body={"_source": False, "track_total_hits": False, "query": {"prefix": {"_id": SCRATCH_ID_PREFIX}}},
+        size=SCRATCH_SCAN_SIZE,
+        filter_path="hits.hits._id",
+    )
+    doc_ids = [
+        hit["_id"] for hit in _hits(response) if all_workers or is_stale_scratch_id(hit["_id"])
+    ]
+    if not doc_ids:
+        return 0
+    client.bulk(
+        body=[{"delete": {"_index": index_name, "_id": doc_id}} for doc_id in doc_ids],
+        filter_path="took,errors",
+    )
+    logger.info(f"一時ドキュメントを{len(doc_ids)}件削除しました")
+    return len(doc_ids)
+
+
+def flush_scratch_documents() -> int:
+    """
+    このワーカーが書き込んだ一時ドキュメント（削除待ちの使い捨てのものとプールのもの）を削除する
+    ワーカーの終了時にatexitから呼ぶ
+
+    Returns:
+        int: 削除を依頼した件数
+    """
+    doc_ids = scratch_pool.drain(include_pooled=True)
+    if not doc_ids:
+        return 0
+    try:
+        get_client().bulk(
+            body=[
+                {"delete": {"_index": settings.GEO_DISTANCE_INDEX_ALIAS, "_id": doc_id}} for doc_id in doc_ids
+            ],
+            filter_path="took,errors",
+        )
+    except Exception as e:
+        logger.warning(f"終了時に一時ドキュメントを削除できませんでした（{type(e).__name__}）")
+        return 0
+    return len(doc_ids)
+
+
+atexit.register(flush_scratch_documents)
@@ -0,0 +1,398 @@
+"""
+参照地点をプロセス内に保持する空間インデックス（単位球面上のxyz座標のKD木）
+
+OpenSearchに問い合わせずに、半径検索と近傍検索をarc/plane距離付きで返す。
+地点は1件ずつの辞書ではなく連続した配列で保持し、KD木の葉の順に並べ替えるため、
+葉に含まれる地点は常に配列の連続した範囲になる。
+
+1地点あたりのメモリ使用量（インデックス構築後）:
+
+    緯度・経度（float64 x 2）          16バイト
+    単位球面上のxyz（float32 x 3）     12バイト
+    ID・名前のオフセット（int64 x 2）  16バイト
+    ID・名前のUTF-8バイト列           文字列の長さ分
+    KD木のノード（葉ごと、64地点で1葉）約1バイト
+
+IDと名前が合わせて20バイト程度の場合は1地点あたり約65バイトで、1000万地点では約650MBになる。
+構築時はこれに加えて並べ替え用に一時的に1地点あたり約30バイトを使う。
+"""
+
+import heapq
+import logging
+import math
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from django.conf import settings
+
+from . import engine
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_LEAF_SIZE = 64
+
+# xyzをfloat32で保持することによる誤差を吸収するため、弦の長さの閾値に加える余裕（約6m）
+_CHORD_MARGIN = 1e-6
+
+
+def _unit_vectors(lat: np.ndarray, lon: np.ndarray) -> np.ndarray:
+    """緯度経度を単位球面上のxyz座標に変換する"""
+    phi = np.radians(lat)
+    lam = np.radians(lon)
+    cos_phi = np.cos(phi)
+    return np.stack([cos_phi * np.cos(lam), cos_phi * np.sin(lam), np.sin(phi)], axis=-1)
+
+
+def _chord(distance_km: float) -> float:
+    """球面上の距離（km）を単位球面上の弦の長さに変換する"""
+    angle = min(distance_km * 1000.0 / engine.EARTH_MEAN_RADIUS, math.pi)
+    return 2 * math.sin(angle / 2)
+
+
+class _StringColumn:
+    """文字列の列を1つのUTF-8バイト列とオフセットの配列で保持する"""
+
+    def __init__(self, data: np.ndarray, offsets: np.ndarray):
+        self.data = data
+        self.offsets = offsets
+
+    @classmethod
+    def from_strings(cls, values: Iterable[str]) -> "_StringColumn":
+        data = bytearray()
+        offsets = array("q", [0])
+        for value in values:
+            data += (value or "").encode("utf-8")
+            offsets.append(len(data))
+        return cls(np.frombuffer(bytes(data), dtype=np.uint8), np.frombuffer(offsets, dtype=np.int64))
+
+    def __getitem__(self, position: int) -> str:
+        return bytes(self.data[self.offsets[position]:self.offsets[position + 1]]).decode("utf-8")
+
+    def take(self, order: np.ndarray) -> "_StringColumn":
+        """orderの順に並べ替えた列を返す（文字列をPythonオブジェクトに戻さずに並べ替える）"""
+        starts = self.offsets[:-1][order]
+        lengths = self.offsets[1:][order] - starts
+        offsets = np.zeros(len(order) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+        gather = np.repeat(starts - offsets[:-1], lengths) + np.arange(offsets[-1], dtype=np.int64)
+        return _StringColumn(self.data[gather], offsets)
+
+    @property
+    def nbytes(self) -> int:
+        return self.data.nbytes + self.offsets.nbytes
+
+
+class ReferencePointIndex:
+    """
+    参照地点の空間インデックス
+
+    KD木は暗黙の完全二分木（ノードiの子は2i+1と2i+2）で、各ノードは地点の範囲と
+    バウンディングボックスを配列で持つ。距離は球面上の距離と単調な関係にある
+    単位球面上の弦の長さで枝刈りし、結果のarc/plane距離はローカルエンジン
+    （geodistance.engine）でOpenSearchと同じ計算式を使って求める
+    """
+
+    def __init__(
+        self,
+        lat: Sequence[float],
+        lon: Sequence[float],
+        ids: _StringColumn,
+        names: _StringColumn,
+        leaf_size: int = DEFAULT_LEAF_SIZE,
+    ):
+        lat = np.asarray(lat, dtype=np.float64)
+        lon = np.asarray(lon, dtype=np.float64)
+        self.leaf_size = leaf_size
+        xyz = _unit_vectors(lat, lon).astype(np.float32)
+
+        order = self._build_tree(xyz)
+        self.lat = lat[order]
+        self.lon = lon[order]
+        self.xyz = xyz[order]
+        self.ids = ids.take(order)
+        self.names = names.take(order)
+
+    def __len__(self) -> int:
+        return len(self.lat)
+
+    @classmethod
+    def from_points(cls, points: Iterable[Dict], leaf_size: int = DEFAULT_LEAF_SIZE) -> "ReferencePointIndex":
+        """
+        readers.iter_reference_pointsが返す参照地点から構築する
+        地点は順に配列へ追加するため、全件の辞書をメモリに保持することはない
+        """
+        lat = array("d")
+        lon = array("d")
+        ids = []
+        names = []
+        for point in points:
+            lat.append(point["lat"])
+            lon.append(point["lon"])
+            ids.append(str(point.get("id") or len(ids)))
+            names.append(point.get("name"))
+        return cls(
+            np.frombuffer(lat, dtype=np.float64),
+            np.frombuffer(lon, dtype=np.float64),
+            _StringColumn.from_strings(ids),
+            _StringColumn.from_strings(names),
+            leaf_size=leaf_size,
+        )
+
+    @classmethod
+    def from_opensearch(
+        cls, client, index_name: str, page_size: int = 10000, leaf_size: int = DEFAULT_LEAF_SIZE
+    ) -> "ReferencePointIndex":
+        """OpenSearchの参照地点のインデックスをpoint_id順にsearch_afterで読み込んで構築する"""
+
+        def iter_points():
+            search_after = None
+            while True:
+                body = {
+                    "size": page_size,
+                    "track_total_hits": False,
+                    "_source": ["name", "location", "point_id"],
+                    "sort": [{"point_id": "asc"}],
+                }
+                if search_after is not None:
+                    body["search_after"] = search_after
+                response = client.search(
+                    index=index_name, body=body, filter_path="took,hits.hits._id,hits.hits._source,hits.hits.sort"
+                )
+                # filter_pathを指定した検索はヒットがないとhitsごと省かれる
+                hits = response.get("hits", {}).get("hits", [])
+                for hit in hits:
+                    location = hit["_source"]["location"]
+                    yield {
+                        "id": hit["_source"].get("point_id") or hit["_id"],
+                        "name": hit["_source"].get("name"),
+                        "lat": location["lat"],
+                        "lon": location["lon"],
+                    }
+                if len(hits) < page_size:
+                    return
+                search_after = hits[-1]["sort"]
+
+        return cls.from_points(iter_points(), leaf_size=leaf_size)
+
+    def _build_tree(self, xyz: np.ndarray) -> np.ndarray:
+        """KD木を構築し、葉の順に並べた地点の順序を返す"""
+        n = len(xyz)
+        depth = max(0, math.ceil(math.log2(n / self.leaf_size))) if n > self.leaf_size else 0
+        node_count = 2 ** (depth + 1) - 1
+        self._first_leaf = 2 ** depth - 1
+        self._starts = np.zeros(node_count, dtype=np.int64)
+        self._ends = np.zeros(node_count, dtype=np.int64)
+        self._box_min = np.full((node_count, 3), np.inf, dtype=np.float32)
+        self._box_max = np.full((node_count, 3), -np.inf, dtype=np.float32)
+        self._ends[0] = n
+
+        order = np.arange(n, dtype=np.int64)
+        for node in range(node_count):
+            start, end = self._starts[node], self._ends[node]
+            if end <= start:
+                continue
+            points = xyz[order[start:end]]
+            self._box_min[node] = points.min(axis=0)
+            self._box_max[node] = points.max(axis=0)
+            if node >= self._first_leaf:
+                continue
+
+            # 最も広がっている軸の中央値で2分割する
+            dimension = int(np.argmax(self._box_max[node] - self._box_min[node]))
+            middle = (end - start) // 2
+            if end - start > 1:
+                order[start:end] = order[start:end][np.argpartition(points[:, dimension], middle)]
+            self._starts[2 * node + 1], self._ends[2 * node + 1] = start, start + middle
+            self._starts[2 * node + 2], self._ends[2 * node + 2] = start + middle, end
+        return order
+
+    @property
+    def nbytes(self) -> int:
+        """インデックスが保持する配列の合計バイト数"""
+        arrays = (self.lat, self.lon, self.xyz, self._starts, self._ends, self._box_min, self._box_max)
+        return sum(values.nbytes for values in arrays) + self.ids.nbytes + self.names.nbytes
+
+    def _box_distance2(self, node: int, query: np.ndarray) -> float:
+        """ノードのバウンディングボックスまでの弦の長さの2乗"""
+        gap = np.maximum(np.maximum(self._box_min[node] - query, query - self._box_max[node]), 0.0)
+        return float(gap @ gap)
+
+    def _leaf_ranges(self, query: np.ndarray, upper2: float) -> List[Tuple[int, int]]:
+        """弦の長さの2乗がupper2以内の地点を含みうる葉の範囲を返す"""
+        ranges = []
+        stack = [0]
+        while stack:
+            node = stack.pop()
+            if self._ends[node] <= self._starts[node] or self._box_distance2(node, query) > upper2:
+                continue
+            if node >= self._first_leaf:
+                ranges.append((int(self._starts[node]), int(self._ends[node])))
+            else:
+                stack.extend((2 * node + 2, 2 * node + 1))
+        return ranges
+
+    def _nearest_positions(
+        self, query: np.ndarray, k: int, lower2: float, upper2: float
+    ) -> np.ndarray:
+        """弦の長さの2乗がlower2以上upper2以内の地点のうち、近い順にk件の位置を返す"""
+        best_distance2 = np.empty(0)
+        best_positions = np.empty(0, dtype=np.int64)
+        heap = [(0.0, 0)]
+        while heap:
+            distance2, node = heapq.heappop(heap)
+            if distance2 > upper2 or (len(best_positions) >= k and distance2 > best_distance2.max()):
+                break
+            start, end = self._starts[node], self._ends[node]
+            if end <= start:
+                continue
+            if node < self._first_leaf:
+                for child in (2 * node + 1, 2 * node + 2):
+                    heapq.heappush(heap, (self._box_distance2(child, query), child))
+                continue
+
+            leaf_distance2 = ((self.xyz[start:end] - query) ** 2).sum(axis=1)
+            mask = (leaf_distance2 >= lower2) & (leaf_distance2 <= upper2)
+            best_distance2 = np.concatenate([best_distance2, leaf_distance2[mask]])
+            best_positions = np.concatenate([best_positions, np.arange(start, end)[mask]])
+            if len(best_positions) > k:
+                keep = np.argpartition(best_distance2, k - 1)[:k]
+                best_distance2, best_positions = best_distance2[keep], best_positions[keep]
+        return best_positions
+
+    def _points(self, positions: np.ndarray, lat: float, lon: float) -> List[Dict]:
+        """地点の位置から、arc距離・point_id順に並べた結果を作る"""
+        distances = engine.compare_distances(self.lat[positions], self.lon[positions], lat, lon)
+        rows = sorted(
+            (float(arc), self.ids[int(position)], float(plane), int(position))
+            for arc, plane, position in zip(distances["arc"], distances["plane"], positions)
+        )
+        return [
+            {
+                "id": point_id,
+                "name": self.names[position] or None,
+                "lat": float(self.lat[position]),
+                "lon": float(self.lon[position]),
+                "arc_distance_km": arc,
+                "plane_distance_km": plane,
+            }
+            for arc, point_id, plane, position in rows
+        ]
+
+    def within_radius(self, lat: float, lon: float, radius_km: float) -> List[Dict]:
+        """
+        地点からarc距離でradius_km以内の参照地点を近い順に返す
+
+        Returns:
+            List[Dict]: id, name, lat, lon, arc_distance_km, plane_distance_km（km、丸めなし）
+        """
+        query = _unit_vectors(lat, lon)
+        upper2 = (_chord(radius_km) + _CHORD_MARGIN) ** 2
+        ranges = self._leaf_ranges(query, upper2)
+        if not ranges:
+            return []
+
+        positions = np.concatenate([np.arange(start, end) for start, end in ranges])
+        distance2 = ((self.xyz[positions] - query) ** 2).sum(axis=1)
+        points = self._points(positions[distance2 <= upper2], lat, lon)
+        return [point for point in points if point["arc_distance_km"] <= radius_km]
+
+    def nearest(
+        self,
+        lat: float,
+        lon: float,
+        k: int,
+        radius_km: Optional[float] = None,
+        search_after: Optional[Sequence] = None,
+    ) -> List[Dict]:
+        """
+        地点からarc距離が近い順にk件の参照地点を返す
+
+        OpenSearchの検索と同じくarc距離・point_idの順に並べ、search_after（[arc距離, point_id]）
+        より後の地点だけを返す
+
+        Returns:
+            List[Dict]: within_radiusと同じ形式の地点のリスト
+        """
+        query = _unit_vectors(lat, lon)
+        upper2 = (_chord(radius_km) + _CHORD_MARGIN) ** 2 if radius_km is not None else math.inf
+        lower2 = 0.0
+        after = None
+        if search_after is not None:
+            after = (float(search_after[0]), str(search_after[1]))
+            lower2 = max(_chord(after[0]) - _CHORD_MARGIN, 0.0) ** 2
+
+        # 同じ距離の地点やsearch_afterの境界の地点があるため、余分に取得してから絞り込む
+        k_search = k + 16
+        while True:
+            positions = self._nearest_positions(query, k_search, lower2, upper2)
+            points = [
+                point
+                for point in self._points(positions, lat, lon)
+                if (radius_km is None or point["arc_distance_km"] <= radius_km)
+                and (after is None or (point["arc_distance_km"], point["id"]) > after)
+            ]
+            if len(points) >= k or len(positions) < k_search:
+                return points[:k]
+            k_search *= 2
+
+
+class ReferenceIndexStore:
+    """
+    参照地点のインデックスから構築した空間インデックスを共有する
+
+    構築から GEO_REFERENCE_LOCAL_INDEX_TTL 秒を過ぎると、1つのスレッドが構築し直し、その間は他のスレッドに
+    構築済みの空間インデックスを返す（別のプロセスのload_geo_pointsで追加した地点もTTL後に反映される）。
+    構築し直せなかった場合は構築済みのものを使い続け、TTL後に再度試みる。
+    初回の構築に失敗した場合はNoneを返し、次回のget()で再度構築を試みる
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._index: Optional[ReferencePointIndex] = None
+        self._expires_at = math.inf
+
+    def get(self, client, index_name: str) -> Optional[ReferencePointIndex]:
+        if self._index is None:
+            with self._lock:
+                if self._index is None:
+                    self._store(self._build(client, index_name))
+        elif time.monotonic() >= self._expires_at and self._lock.acquire(blocking=False):
+            try:
+                if time.monotonic() >= self._expires_at:
+                    rebuilt = self._build(client, index_name)
+                    self._store(rebuilt if rebuilt is not None else self._index)
+            finally:
+                self._lock.release()
+        return self._index
+
+    def _store(self, index: Optional[ReferencePointIndex]) -> None:
+        ttl = settings.GEO_REFERENCE_LOCAL_INDEX_TTL
+        self._index = index
+        self._expires_at = time.monotonic() + ttl if ttl > 0 else math.inf
+
+    def _build(self, client, index_name: str) -> Optional[ReferencePointIndex]:
+        try:
+            index = ReferencePointIndex.from_opensearch(client, index_name)
+            logger.info(
+                f"参照地点 {len(index)}件の空間インデックスを構築しました（{index.nbytes / 1024 / 1024:.1f}MB）"
+            )
+            return index
+        except Exception as e:
+            logger.error(f"参照地点の空間インデックスの構築に失敗しました: {e}")
+            return None
+
+    def set(self, index: Optional[ReferencePointIndex]) -> None:
+        """構築済みの空間インデックスに差し替える（Noneで次回のget()時に構築し直す）"""
+        with self._lock:
+            self._store(index)
+
+    def invalidate(self) -> None:
+        """次回のget()で構築し直す（参照地点を登録した後に呼ぶ）"""
+        self.set(None)
+
+
+reference_index_store = ReferenceIndexStore()
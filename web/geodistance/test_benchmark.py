@@ -0,0 +1,157 @@
+import json
+
+from django.test import TestCase, override_settings
+from opensearchpy import OpenSearch
+
+from geodistance import engine
+from geodistance.benchmark import compare_results, run_benchmarks, summarize_latencies
+from geodistance.cache import distance_result_cache
+from geodistance.clients import client_registry
+from geodistance.fake_opensearch import FakeOpenSearchServer
+from geodistance.history import history_recorder
+from geodistance.models import DistanceCalculation, DistanceErrorRollup
+from geodistance.scratch import scratch_pool
+from geodistance.services import GeoDistanceService, index_existence_cache
+
+
+class FakeOpenSearchServerTest(TestCase):
+    """ベンチマーク用のOpenSearch代替サーバーのテスト"""
+
+    def setUp(self):
+        self.server = FakeOpenSearchServer().start()
+        self.overrides = override_settings(
+            OPENSEARCH_HOST=self.server.host,
+            OPENSEARCH_PORT=self.server.port,
+            OPENSEARCH_USE_SSL=False,
+        )
+        self.overrides.enable()
+        client_registry.close()
+        index_existence_cache.invalidate()
+        distance_result_cache.clear()
+
+    def tearDown(self):
+        client_registry.close()
+        index_existence_cache.invalidate()
+        scratch_pool.drain(include_pooled=True)
+        distance_result_cache.clear()
+        self.overrides.disable()
+        self.server.stop()
+
+    def test_modes_match_local_engine(self):
+        """executeモードとindexedモードの結果がローカルエンジンと一致すること"""
+        expected = engine.compare_distances(35.6762, 139.6503, 34.6937, 135.5023)
+
+        for mode in ('execute', 'indexed'):
+            with self.subTest(mode=mode):
+                distance_result_cache.clear()
+                service = GeoDistanceService()
+                service.calculation_mode = mode
+
+                result = service.calculate_distances(35.6762, 139.6503, 34.6937, 135.5023)
+
+                self.assertTrue(result['success'], result['error_message'])
+                self.assertEqual(result['arc_distance_km'], round(float(expected['arc']), 3))
+                self.assertEqual(result['plane_distance_km'], round(float(expected['plane']), 3))
+
+    def test_batch_and_matrix(self):
+        """_bulk/_msearchによる一括計算と、search_afterによる距離行列に応答すること"""
+        service = GeoDistanceService()
+        service.calculation_mode = 'execute'
+
+        columns = service.calculate_distances_batch([(35.6762, 139.6503, 34.6937, 135.5023)] * 3)
+        self.assertEqual(columns['arc_distance_km'], [392.442] * 3)
+
+        with self.settings(GEO_DISTANCE_MATRIX_PAGE_SIZE=2):
+            rows = list(service.iter_distance_matrix(
+                [(35.6762, 139.6503)], [(34.6937, 135.5023), (35.6762, 139.6503), (43.0618, 141.3545)]
+            ))
+        self.assertEqual(rows[0]['arc_distance_km'][:2], [392.442, 0.0])
+        self.assertEqual(self.server.calls()['msearch'], 1)
+
+    def test_filter_path_trims_search_response(self):
+        """indexedモードの検索はソート値とtookだけを受け取り、送受信したバイト数を記録すること"""
+        service = GeoDistanceService()
+        service.calculation_mode = 'indexed'
+        service.calculate_distances(35.6762, 139.6503, 34.6937, 135.5023)
+        self.server.reset_calls()
+        distance_result_cache.clear()
+
+        result = service.calculate_distances(35.6762, 139.6503, 34.6937, 136.5023)
+
+        self.assertTrue(result['success'], result['error_message'])
+        search = json.loads(self.server.recent_responses()[-1])
+        self.assertEqual(set(search), {'took', 'hits'})
+        self.assertEqual(set(search['hits']), {'hits'})
+        self.assertEqual([set(hit) for hit in search['hits']['hits']], [{'sort'}])
+        traffic = self.server.traffic()
+        self.assertGreater(traffic['request_bytes'], 0)
+        self.assertEqual(traffic['response_bytes'], sum(len(body) for body in self.server.recent_responses()))
+
+    def test_counts_calls(self):
+        """API別の呼び出し回数を記録すること"""
+        client = OpenSearch(hosts=[self.server.url])
+        client.indices.exists(index='missing')
+        client.indices.create(index='geo')
+
+        self.assertEqual(self.server.calls(), {'indices.exists': 1, 'indices.create': 1})
+        self.assertEqual(self.server.total_calls(), 2)
+
+
+class BenchmarkTest(TestCase):
+    """ベンチマークハーネスのテスト"""
+
+    def tearDown(self):
+        distance_result_cache.clear()
+        index_existence_cache.invalidate()
+
+    def test_run_benchmarks_reports_calls_per_request(self):
+        """シナリオごとのレイテンシ・スループット・OpenSearch呼び出し数をJSONで保存できる形で返すこと"""
+        report = run_benchmarks(requests=10, modes=('execute',), latency_ms=0.0)
+
+        json.dumps(report)
+        self.assertEqual(report['meta']['requests'], 10)
+        self.assertEqual([(r['target'], r['mode']) for r in report['results']],
+                         [('service', 'execute'), ('view', 'execute')])
+        for result in report['results']:
+            self.assertEqual(result['errors'], 0)
+            self.assertEqual(result['opensearch_calls']['scripts_painless_execute'], 20)
+            self.assertGreater(result['requests_per_second'], 0)
+            self.assertGreater(result['response_bytes_per_request'], 0)
+            self.assertGreaterEqual(result['parse_ms_per_request'], 0)
+            self.assertLessEqual(result['latency_ms']['p50'], result['latency_ms']['p99'])
+
+    def test_run_benchmarks_records_no_history(self):
+        """ベンチマークで計算した組を計算履歴・誤差の集計に残さないこと"""
+        history_recorder.flush()
+
+        run_benchmarks(requests=5, modes=('execute',), latency_ms=0.0)
+
+        self.assertEqual(history_recorder.flush(), 0)
+        self.assertFalse(DistanceCalculation.objects.exists())
+        self.assertFalse(DistanceErrorRollup.objects.exists())
+
+    def test_summarize_latencies(self):
+        """パーセンタイルをミリ秒で返すこと"""
+        summary = summarize_latencies([0.001 * i for i in range(1, 101)])
+
+        self.assertAlmostEqual(summary['p50'], 50.5)
+        self.assertAlmostEqual(summary['max'], 100.0)
+
+    def test_compare_results(self):
+        """同じシナリオ同士の変化率を求めること"""
+        def report(p50, rps):
+            return {'results': [{
+                'target': 'service', 'mode': 'execute',
+                'latency_ms': {'p50': p50, 'p95': p50, 'p99': p50},
+                'requests_per_second': rps,
+                'opensearch_calls_per_request': 2.0,
+                'response_bytes_per_request': rps,
+            }]}
+
+        comparison = compare_results(report(5.0, 200.0), report(10.0, 100.0))
+
+        self.assertEqual(comparison[0]['p50_change_pct'], -50.0)
+        self.assertEqual(comparison[0]['requests_per_second_change_pct'], 100.0)
+        self.assertEqual(comparison[0]['opensearch_calls_per_request_change'], 0.0)
+        self.assertEqual(comparison[0]['response_bytes_per_request_change_pct'], 100.0)
+        self.assertIsNone(comparison[0]['parse_ms_per_request_change_pct'])
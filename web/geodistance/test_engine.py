@@ -0,0 +1,129 @@
+import json
+import math
+from pathlib import Path
+
+import numpy as np
+from django.test import TestCase
+from unittest.mock import patch
+
+from geodistance import engine
+from geodistance.cache import distance_result_cache
+from geodistance.services import GeoDistanceService
+
+
+PARITY_FIXTURE = Path(__file__).resolve().parent / "fixtures" / "opensearch_parity.json"
+
+
+class OpenSearchParityTest(TestCase):
+    """記録済みのOpenSearchの出力とのパリティテスト"""
+
+    def test_matches_recorded_sort_values(self):
+        """record_geo_parity_fixtureで記録した値とビット単位で一致すること"""
+        self.assertTrue(
+            PARITY_FIXTURE.exists(), "パリティ用フィクスチャがありません（manage.py record_geo_parity_fixture で作成）"
+        )
+
+        records = np.array(json.loads(PARITY_FIXTURE.read_text())["records"])
+        a_lat, a_lon, b_lat, b_lon, arc, plane = records.T
+
+        result = engine.compare_distances(a_lat, a_lon, b_lat, b_lon)
+
+        np.testing.assert_array_equal(result["arc"], arc)
+        np.testing.assert_array_equal(result["plane"], plane)
+
+    def test_tokyo_osaka_matches_recorded_result(self):
+        """東京-大阪間がOpenSearchの結果（arc 392.442km, plane 392.479km）と一致すること"""
+        result = engine.compare_distances(35.6762, 139.6503, 34.6937, 135.5023)
+
+        self.assertEqual(round(float(result["arc"]), 3), 392.442)
+        self.assertEqual(round(float(result["plane"]), 3), 392.479)
+
+
+class LocalEngineTest(TestCase):
+    """ローカル計算エンジンのテスト"""
+
+    def setUp(self):
+        rng = np.random.default_rng(42)
+        self.a_lat = rng.uniform(-90, 90, 10000)
+        self.a_lon = rng.uniform(-180, 180, 10000)
+        self.b_lat = rng.uniform(-90, 90, 10000)
+        self.b_lon = rng.uniform(-180, 180, 10000)
+
+    def test_same_point_is_zero(self):
+        """量子化後の同一地点間の距離は0であること"""
+        lat, lon = engine.quantize_point(35.6762, 139.6503)
+        result = engine.compare_distances(lat, lon, lat, lon)
+
+        self.assertEqual(float(result["arc"]), 0.0)
+        self.assertEqual(float(result["plane"]), 0.0)
+        self.assertEqual(float(result["difference_percentage"]), 0.0)
+
+    def test_half_circumference(self):
+        """赤道上の対蹠点のarc距離は地球の半周であること"""
+        self.assertEqual(
+            float(engine.arc_distance(0.0, 0.0, 0.0, 180.0)),
+            math.pi * engine.EARTH_MEAN_RADIUS,
+        )
+
+    def test_arc_close_to_exact_haversine(self):
+        """テーブル参照のarcが厳密なhaversineと1e-9以内で一致すること"""
+        lat1, lon1, lat2, lon2 = (
+            np.radians(v) for v in (self.a_lat, self.a_lon, self.b_lat, self.b_lon)
+        )
+        h = np.sin((lat2 - lat1) / 2) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+        exact = 2 * engine.EARTH_MEAN_RADIUS * np.arcsin(np.sqrt(h))
+
+        arc = engine.arc_distance(self.a_lat, self.a_lon, self.b_lat, self.b_lon)
+
+        np.testing.assert_allclose(arc, exact, rtol=1e-9)
+
+    def test_distances_are_symmetric(self):
+        """A/Bを入れ替えてもビット単位で同じ距離になること"""
+        np.testing.assert_array_equal(
+            engine.arc_distance(self.a_lat, self.a_lon, self.b_lat, self.b_lon),
+            engine.arc_distance(self.b_lat, self.b_lon, self.a_lat, self.a_lon),
+        )
+        np.testing.assert_array_equal(
+            engine.plane_distance(self.a_lat, self.a_lon, self.b_lat, self.b_lon),
+            engine.plane_distance(self.b_lat, self.b_lon, self.a_lat, self.a_lon),
+        )
+
+    def test_vectorized_matches_scalar(self):
+        """配列での計算が1件ずつの計算と一致すること"""
+        result = engine.compare_distances(self.a_lat, self.a_lon, self.b_lat, self.b_lon)
+
+        for i in range(0, 10000, 997):
+            single = engine.compare_distances(self.a_lat[i], self.a_lon[i], self.b_lat[i], self.b_lon[i])
+            for column in ("arc", "plane", "difference", "difference_percentage"):
+                self.assertEqual(float(single[column]), result[column][i])
+
+    def test_quantization_matches_doc_values(self):
+        """doc valuesと同じく量子化は切り捨てで、境界値も表現可能な値になること"""
+        lat, lon = engine.quantize_point(np.array([90.0, -90.0, 0.0]), np.array([180.0, -180.0, 0.0]))
+
+        self.assertLess(lat[0], 90.0)
+        self.assertEqual(lat[1], -90.0)
+        self.assertLess(lon[0], 180.0)
+        self.assertEqual(lon[1], -180.0)
+        np.testing.assert_array_equal(engine.quantize_point(lat, lon)[0], lat)
+
+
+class LocalBackendServiceTest(TestCase):
+    """GeoDistanceServiceのローカルバックエンドのテスト"""
+
+    def setUp(self):
+        distance_result_cache.clear()
+
+    @patch('geodistance.services.get_client')
+    def test_local_mode_does_not_call_opensearch(self, mock_get_client):
+        """localモードではOpenSearchを呼ばずに計算すること"""
+        service = GeoDistanceService()
+        service.calculation_mode = 'local'
+
+        result = service.calculate_distances(35.6762, 139.6503, 34.6937, 135.5023)
+
+        self.assertTrue(result['success'])
+        self.assertEqual(result['arc_distance_km'], 392.442)
+        self.assertEqual(result['plane_distance_km'], 392.479)
+        self.assertEqual(result['difference_km'], 0.037)
+        self.assertFalse(mock_get_client.return_value.method_calls)
@@ -0,0 +1,179 @@
+import io
+import tempfile
+from pathlib import Path
+from unittest.mock import MagicMock, patch
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from geodistance import engine
+from geodistance.cache import distance_result_cache
+from geodistance.error_map import MAGIC, ErrorMap, build_error_map, error_map_store
+from geodistance.services import GeoDistanceService
+from geodistance.test_geodistance import painless_results
+
+
+class ErrorMapTestMixin:
+    """一時ディレクトリに小さな誤差マップを作成し、GEO_DISTANCE_ERROR_MAP_PATHに設定する"""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = str(Path(self.directory.name) / 'error_map.bin')
+        self.header = build_error_map(
+            self.path, resolution=10.0, band_edges_km=[0, 10, 100, 1000], bearings=8, samples_per_band=2
+        )
+        self.overrides = override_settings(GEO_DISTANCE_ERROR_MAP_PATH=self.path)
+        self.overrides.enable()
+        error_map_store.reset()
+        distance_result_cache.clear()
+
+    def tearDown(self):
+        error_map_store.reset()
+        self.overrides.disable()
+        self.directory.cleanup()
+
+
+class ErrorMapTest(ErrorMapTestMixin, TestCase):
+    """誤差マップの事前計算と読み込みのテスト"""
+
+    def test_file_layout(self):
+        """ヘッダーの後ろに16バイト境界からfloat32の配列を書き出すこと"""
+        error_map = ErrorMap(self.path)
+
+        self.assertEqual(Path(self.path).read_bytes()[:len(MAGIC)], MAGIC)
+        self.assertEqual(error_map.data.shape, (18, 36, 3, 8, 2))
+        self.assertEqual(error_map.data.offset % 16, 0)
+        self.assertEqual(error_map.header['band_edges_km'], [0.0, 10.0, 100.0, 1000.0])
+
+    def test_error_grows_with_latitude_and_distance(self):
+        """planeの誤差率は高緯度・長距離ほど大きくなること"""
+        error_map = ErrorMap(self.path)
+
+        _, equator_short = error_map.lookup(5.0, 135.0, 50.0)
+        _, equator_long = error_map.lookup(5.0, 135.0, 500.0)
+        _, polar_long = error_map.lookup(75.0, 135.0, 500.0)
+
+        self.assertLess(equator_short, equator_long)
+        self.assertLess(equator_long, polar_long)
+        self.assertIsNone(error_map.lookup(5.0, 135.0, 5000.0))
+
+    def test_approximation_is_close_to_engine(self):
+        """近似値はローカルエンジンの値と最大誤差率の範囲で一致すること"""
+        error_map = ErrorMap(self.path)
+
+        arc_km, plane_km, max_error = error_map.approximate(35.6762, 139.6503, 34.6937, 135.5023)
+        distances = engine.compare_distances(35.6762, 139.6503, 34.6937, 135.5023)
+
+        self.assertAlmostEqual(arc_km, float(distances['arc']), delta=1.0)
+        self.assertLessEqual(abs(plane_km - float(distances['plane'])) / arc_km * 100, max_error * 2)
+
+    def test_error_depends_on_bearing(self):
+        """方位の区画ごとに誤差率を持ち、東西と南北の組をそれぞれの区画の値で近似すること"""
+        error_map = ErrorMap(self.path)
+
+        north, _ = error_map.lookup(65.0, 15.0, 500.0, bearing=0.0)
+        east, _ = error_map.lookup(65.0, 15.0, 500.0, bearing=90.0)
+        mean_error, max_error = error_map.lookup(65.0, 15.0, 500.0)
+
+        self.assertNotAlmostEqual(north, east, places=2)
+        self.assertGreaterEqual(max_error, abs(north))
+        self.assertEqual(error_map.lookup(65.0, 15.0, 500.0, bearing=359.0)[0], north)
+        # すべての方位をまとめた平均誤差率で近似するよりも、実際のplane距離に近いこと
+        for b_lat, b_lon in ((69.0, 15.0), (65.0, 25.0)):
+            arc_km, plane_km, _ = error_map.approximate(65.0, 15.0, b_lat, b_lon)
+            plane = float(engine.compare_distances(65.0, 15.0, b_lat, b_lon)['plane'])
+            all_bearings = arc_km * (1 + error_map.lookup(65.0, 15.0, arc_km)[0] / 100)
+            self.assertLess(abs(plane_km - plane), abs(all_bearings - plane))
+
+    def test_rejects_old_format(self):
+        """方位の次元を持たない古い形式のファイルは読み込まず、OpenSearchで計算させること"""
+        data = Path(self.path).read_bytes().replace(b'"version": 2', b'"version": 1', 1)
+        Path(self.path).write_bytes(data)
+
+        with self.assertRaises(ValueError):
+            ErrorMap(self.path)
+        self.assertIsNone(error_map_store.get())
+
+    def test_invalid_parameters(self):
+        """resolutionや距離帯の境界が不正な場合はエラーになること"""
+        with self.assertRaises(ValueError):
+            build_error_map(self.path, resolution=7.0)
+        with self.assertRaises(ValueError):
+            build_error_map(self.path, band_edges_km=[10, 1])
+
+    def test_command(self):
+        """manage.py build_geo_error_mapで誤差マップを書き出すこと"""
+        output = Path(self.directory.name) / 'command.bin'
+        stdout = io.StringIO()
+
+        call_command(
+            'build_geo_error_map', '--output', str(output), '--resolution', '30', '--bands', '0,100',
+            stdout=stdout,
+        )
+
+        self.assertIn('6x12セル、1距離帯、8方位', stdout.getvalue())
+        self.assertEqual(ErrorMap(str(output)).data.shape, (6, 12, 1, 8, 2))
+
+
+class ApproximateDistanceServiceTest(ErrorMapTestMixin, TestCase):
+    """calculate_distancesの近似モードのテスト"""
+
+    def setUp(self):
+        super().setUp()
+        self.service = GeoDistanceService()
+        self.service.client = MagicMock()
+        self.service.calculation_mode = 'execute'
+
+    def test_approximate_does_not_call_opensearch(self):
+        """exact=Falseの場合は誤差マップから近似値を返し、OpenSearchに問い合わせないこと"""
+        result = self.service.calculate_distances(35.6762, 139.6503, 34.6937, 135.5023, exact=False)
+
+        self.assertTrue(result['success'])
+        self.assertTrue(result['approximate'])
+        self.assertGreater(result['max_difference_percentage'], 0)
+        self.assertAlmostEqual(result['arc_distance_km'], 392.4, delta=1.0)
+        self.assertEqual(self.service.client.mock_calls, [])
+
+    def test_out_of_range_falls_back_to_opensearch(self):
+        """距離帯の範囲外の場合はOpenSearchで計算すること"""
+        self.service.client.scripts_painless_execute.side_effect = painless_results(8000.0, 8100.0)
+        self.service.client.indices.exists.return_value = True
+
+        result = self.service.calculate_distances(35.6762, 139.6503, -33.8688, 151.2093, exact=False)
+
+        self.assertTrue(result['success'])
+        self.assertNotIn('approximate', result)
+        self.assertEqual(self.service.client.scripts_painless_execute.call_count, 2)
+
+    def test_without_error_map(self):
+        """誤差マップが設定されていない場合はOpenSearchで計算すること"""
+        self.service.client.scripts_painless_execute.side_effect = painless_results(392.442, 392.479)
+        self.service.client.indices.exists.return_value = True
+
+        with override_settings(GEO_DISTANCE_ERROR_MAP_PATH=''):
+            error_map_store.reset()
+            result = self.service.calculate_distances(35.6762, 139.6503, 34.6937, 135.5023, exact=False)
+
+        self.assertEqual(result['arc_distance_km'], 392.442)
+        self.assertNotIn('approximate', result)
+
+
+class ApproximateDistanceViewTest(ErrorMapTestMixin, TestCase):
+    """フォームから近似値を選べることのテスト"""
+
+    form_data = {'a_latitude': 35.6762, 'a_longitude': 139.6503, 'b_latitude': 34.6937, 'b_longitude': 135.5023}
+
+    def test_approximate_checkbox(self):
+        """チェックした場合は誤差マップの近似値とずれの目安を表示し、しない場合は正確な値を計算すること"""
+        response = self.client.post(
+            reverse('geodistance:geo_distance'), data={**self.form_data, 'approximate': 'on'}
+        )
+
+        self.assertContains(response, '誤差マップから推定した近似値です')
+
+        with patch.object(
+            GeoDistanceService, 'calculate_distances', return_value={'success': False, 'error_message': 'x'}
+        ) as mock:
+            self.client.post(reverse('geodistance:geo_distance'), data=self.form_data)
+        self.assertTrue(mock.call_args.kwargs['exact'])
@@ -1,9 +1,34 @@
+import asyncio
+import csv
+import gc
+import io
+import json
+import uuid
+import numpy as np
 import pytest
-from django.test import TestCase, Client
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import AsyncClient, TestCase, Client, override_settings
 from django.urls import reverse
-from unittest.mock import patch, MagicMock
+from unittest.mock import patch, AsyncMock, MagicMock
+from geodistance import engine
+from geodistance.apps import bootstrap_enabled
+from geodistance.async_services import AsyncGeoDistanceService
+from geodistance.cache import DistanceResultCache, distance_result_cache
+from geodistance.clients import OpenSearchClientRegistry, async_client_registry, client_registry
+from geodistance.fake_opensearch import FakeOpenSearchServer
 from geodistance.forms import GeoDistanceForm
-from geodistance.services import GeoDistanceService
+from geodistance.models import DistanceJob
+from geodistance.readers import iter_coordinate_pairs
+from geodistance.serializers import get_serializer, orjson
+from geodistance.scratch import ScratchPool, scratch_pool
+from geodistance.services import GeoDistanceService, bootstrap_index, index_existence_cache
+from opensearchpy.exceptions import ConnectionError, NotFoundError, SerializationError
+from opensearchpy.serializer import JSONSerializer
+
+
+def painless_results(arc, plane):
+    """Painless execute APIのモックの応答（arcとplaneは同時に呼び出すため、順番ではなくスクリプトで値を決める）"""
+    return lambda body, **kwargs: {'result': arc if 'arcDistance' in body['script']['source'] else plane}
 
 
 class GeoDistanceFormTest(TestCase):
@@ -74,16 +99,17 @@ class GeoDistanceCalculationTest(TestCase):
     """距離計算の精度テスト"""
     
     def setUp(self):
+        distance_result_cache.clear()
         self.service = GeoDistanceService()
     
-    @patch('geodistance.services.GeoDistanceService._calculate_distance_with_type')
+    @patch('geodistance.services.GeoDistanceService._calculate_arc_and_plane')
     def test_tokyo_osaka_distance(self, mock_calculate):
         """東京-大阪間の距離計算テスト（既知の距離との比較）"""
         
-        mock_calculate.side_effect = [
+        mock_calculate.return_value = (
             392.442,  # arc distance
             392.479   # plane distance
-        ]
+        )
         
         result = self.service.calculate_distances(35.6762, 139.6503, 34.6937, 135.5023)
         
@@ -92,13 +118,13 @@ class GeoDistanceCalculationTest(TestCase):
         self.assertAlmostEqual(result['plane_distance_km'], 392.479, places=1)
         self.assertLess(result['difference_percentage'], 1.0)  # 差異は1%未満であるべき
     
-    @patch.object(GeoDistanceService, '_calculate_distance_with_type')
+    @patch.object(GeoDistanceService, '_calculate_arc_and_plane')
     def test_same_point_distance(self, mock_calculate):
         """同一地点間の距離テスト（距離は0であるべき）"""
-        mock_calculate.side_effect = [
+        mock_calculate.return_value = (
             0.0,  # arc distance
             0.0   # plane distance
-        ]
+        )
         
         result = self.service.calculate_distances(35.6762, 139.6503, 35.6763, 139.6504)
         
@@ -108,13 +134,13 @@ class GeoDistanceCalculationTest(TestCase):
         self.assertEqual(result['difference_km'], 0.0)
         self.assertEqual(result['difference_percentage'], 0.0)
     
-    @patch('geodistance.services.GeoDistanceService._calculate_distance_with_type')
+    @patch('geodistance.services.GeoDistanceService._calculate_arc_and_plane')
     def test_antipodal_points(self, mock_calculate):
         """対蹠点間の距離テスト（地球の半周約20,000km）"""
-        mock_calculate.side_effect = [
+        mock_calculate.return_value = (
             19985.2,  # arc distance (地球半周)
             19985.2   # plane distance
-        ]
+        )
         
         result = self.service.calculate_distances(35.6762, 139.6503, -35.6762, -40.3497)
         
@@ -130,12 +156,12 @@ class GeoDistanceCalculationTest(TestCase):
             (26.2124, 127.6792, 35.6762, 139.6503, 1553, 30), # 沖縄-東京
         ]
         
-        with patch.object(self.service, '_calculate_distance_with_type') as mock_calc:
+        with patch.object(self.service, '_calculate_arc_and_plane') as mock_calc:
             for lat1, lon1, lat2, lon2, expected, tolerance in known_distances:
-                mock_calc.side_effect = [
+                mock_calc.return_value = (
                     expected + 0.1,  # arc
                     expected + 0.2   # plane
-                ]
+                )
                 
                 result = self.service.calculate_distances(lat1, lon1, lat2, lon2)
                 
@@ -152,6 +178,7 @@ class GeoDistanceServiceTest(TestCase):
     """GeoDistanceServiceのテスト"""
     
     def setUp(self):
+        distance_result_cache.clear()
         self.service = GeoDistanceService()
     
     @patch('opensearchpy.OpenSearch')
@@ -180,7 +207,7 @@ class GeoDistanceServiceTest(TestCase):
         except Exception:
             pass
     
-    @patch.object(GeoDistanceService, '_calculate_distance_with_type')
+    @patch.object(GeoDistanceService, '_calculate_arc_and_plane')
     def test_calculate_distances_opensearch_error(self, mock_calculate):
         """OpenSearchエラー時の距離計算テスト"""
         mock_calculate.side_effect = Exception("OpenSearch error")
@@ -312,6 +339,7 @@ class RealDistanceCalculationTest(TestCase):
     """実際のOpenSearchを使用した距離計算テスト"""
     
     def setUp(self):
+        distance_result_cache.clear()
         self.service = GeoDistanceService()
     
     def test_real_tokyo_osaka_calculation(self):
@@ -343,3 +371,1015 @@ class RealDistanceCalculationTest(TestCase):
         self.assertEqual(result['arc_distance_km'], 0.0)
         self.assertEqual(result['plane_distance_km'], 0.0)
         self.assertEqual(result['difference_km'], 0.0)
+
+
+class OpenSearchClientRegistryTest(TestCase):
+    """共有OpenSearchクライアントレジストリのテスト"""
+
+    def setUp(self):
+        self.registry = OpenSearchClientRegistry()
+
+    @patch('geodistance.clients.OpenSearch')
+    def test_client_is_reused_across_services(self, mock_opensearch):
+        """サービスを複数生成してもクライアントは1回だけ生成されること"""
+        client = self.registry.get_client()
+
+        for _ in range(5):
+            self.assertIs(self.registry.get_client(), client)
+
+        self.assertEqual(mock_opensearch.call_count, 1)
+        stats = self.registry.stats()
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['hits'], 5)
+
+    @patch('geodistance.clients.OpenSearch')
+    def test_pool_size_is_configurable(self, mock_opensearch):
+        """pool_maxsizeが設定値でクライアントに渡されること"""
+        with self.settings(OPENSEARCH_POOL_MAXSIZE=32):
+            self.registry.get_client()
+
+        self.assertEqual(mock_opensearch.call_args.kwargs['pool_maxsize'], 32)
+
+    @patch('geodistance.clients.OpenSearch')
+    def test_client_is_recreated_after_fork(self, mock_opensearch):
+        """fork後の子プロセスでは親のクライアントを再利用しないこと"""
+        mock_opensearch.side_effect = [MagicMock(), MagicMock()]
+        parent_client = self.registry.get_client()
+
+        self.registry._pid = -1  # 子プロセスをシミュレート
+        child_client = self.registry.get_client()
+
+        self.assertIsNot(parent_client, child_client)
+        self.assertEqual(self.registry.stats()['misses'], 1)
+
+    @patch('geodistance.clients.OpenSearch')
+    def test_close_releases_clients(self, mock_opensearch):
+        """closeでコネクションプールが閉じられること"""
+        client = self.registry.get_client()
+
+        self.registry.close()
+
+        client.close.assert_called_once()
+        self.registry.get_client()
+        self.assertEqual(mock_opensearch.call_count, 2)
+
+
+class ArcAndPlaneSingleSearchTest(TestCase):
+    """arcとplaneを1回の検索で計算するクエリのテスト"""
+
+    def setUp(self):
+        self.service = GeoDistanceService()
+        self.service.client = MagicMock()
+
+    def test_both_sort_values_from_one_search(self):
+        """1回の検索でarcとplaneのソート値を両方取得すること"""
+        self.service.client.search.return_value = {
+            'hits': {'total': {'value': 1}, 'hits': [{'sort': [392.442, 392.479]}]}
+        }
+
+        distances = self.service._search_arc_and_plane(34.6937, 135.5023, 'point_a')
+
+        self.assertEqual(distances, (392.442, 392.479))
+        self.service.client.search.assert_called_once()
+        body = self.service.client.search.call_args.kwargs['body']
+        self.assertEqual(body['query'], {'ids': {'values': ['point_a']}})
+        self.assertEqual(
+            [clause['_geo_distance']['distance_type'] for clause in body['sort']],
+            ['arc', 'plane'],
+        )
+
+    def test_missing_reference_document(self):
+        """基準地点のドキュメントがない場合はNoneを返すこと"""
+        self.service.client.search.return_value = {
+            'hits': {'total': {'value': 0}, 'hits': []}
+        }
+
+        self.assertIsNone(self.service._search_arc_and_plane(34.6937, 135.5023, 'point_a'))
+
+
+class CalculationModeTest(TestCase):
+    """書き込みなしの計算モードのテスト"""
+
+    def setUp(self):
+        self.service = GeoDistanceService()
+        self.service.client = MagicMock()
+        scratch_pool_patch = patch('geodistance.services.scratch_pool', ScratchPool(size=2))
+        scratch_pool_patch.start()
+        self.addCleanup(scratch_pool_patch.stop)
+
+    def test_execute_mode_does_not_write(self):
+        """executeモードではインデックスへの書き込みもrefreshも行わないこと"""
+        self.service.calculation_mode = 'execute'
+        self.service.client.scripts_painless_execute.side_effect = painless_results(392.442, 392.479)
+
+        distances = self.service._calculate_arc_and_plane(35.6762, 139.6503, 34.6937, 135.5023)
+
+        self.assertEqual(distances, (392.442, 392.479))
+        self.service.client.index.assert_not_called()
+        self.service.client.indices.refresh.assert_not_called()
+        body = self.service.client.scripts_painless_execute.call_args.kwargs['body']
+        self.assertEqual(
+            body['context_setup']['document'],
+            {'location': {'lat': 35.6762, 'lon': 139.6503}},
+        )
+        self.assertEqual(body['script']['params'], {'lat': 34.6937, 'lon': 135.5023})
+
+    def test_indexed_mode_writes_reference_point(self):
+        """indexedモードではプールから借りたIDで書き込み、同じIDとルーティングで検索すること"""
+        self.service.calculation_mode = 'indexed'
+        self.service.client.search.return_value = {
+            'hits': {'total': {'value': 1}, 'hits': [{'sort': [392.442, 392.479]}]}
+        }
+
+        distances = self.service._calculate_arc_and_plane(35.6762, 139.6503, 34.6937, 135.5023)
+
+        self.assertEqual(distances, (392.442, 392.479))
+        doc_id = self.service.client.index.call_args.kwargs['id']
+        self.assertTrue(doc_id.startswith('scratch-'))
+        search = self.service.client.search.call_args.kwargs
+        self.assertEqual(search['body']['query'], {'ids': {'values': [doc_id]}})
+        self.assertEqual(search['routing'], doc_id)
+
+
+class AsyncGeoDistanceServiceTest(TestCase):
+    """AsyncOpenSearchを使った非同期サービスのテスト"""
+
+    def setUp(self):
+        index_existence_cache.invalidate()
+        distance_result_cache.clear()
+        self.service = AsyncGeoDistanceService()
+        self.service.client = MagicMock()
+        self.service.client.indices.exists = AsyncMock(return_value=True)
+        self.service.client.scripts_painless_execute = AsyncMock(
+            side_effect=lambda body: {'result': 392.442 if 'arcDistance' in body['script']['source'] else 392.479}
+        )
+
+    def tearDown(self):
+        index_existence_cache.invalidate()
+        scratch_pool.drain(include_pooled=True)
+
+    def test_execute_mode_runs_arc_and_plane_concurrently(self):
+        """executeモードではarcとplaneをasyncio.gatherで同時に計算し、同期版と同じ形式で返すこと"""
+        self.service.calculation_mode = 'execute'
+
+        with patch('geodistance.async_services.asyncio.gather', wraps=asyncio.gather) as gather:
+            result = asyncio.run(self.service.calculate_distances(35.6762, 139.6503, 34.6937, 135.5023))
+
+        gather.assert_called_once()
+        self.assertEqual(self.service.client.scripts_painless_execute.await_count, 2)
+        self.assertTrue(result['success'])
+        self.assertEqual(result['arc_distance_km'], 392.442)
+        self.assertEqual(result['plane_distance_km'], 392.479)
+        self.assertEqual(result['difference_km'], 0.037)
+
+    def test_indexed_mode_uses_single_search(self):
+        """indexedモードではプールから借りたIDで書き込み、1回の検索でarcとplaneを取得すること"""
+        self.service.calculation_mode = 'indexed'
+        self.service.client.index = AsyncMock()
+        self.service.client.search = AsyncMock(return_value={
+            'hits': {'total': {'value': 1}, 'hits': [{'sort': [392.442, 392.479]}]}
+        })
+
+        result = asyncio.run(self.service.calculate_distances(35.6762, 139.6503, 34.6937, 135.5023))
+
+        self.assertTrue(result['success'])
+        self.service.client.search.assert_awaited_once()
+        self.assertTrue(self.service.client.index.call_args.kwargs['id'].startswith('scratch-'))
+
+    def test_local_mode_does_not_need_client(self):
+        """localモードではクライアントがなくても計算できること"""
+        self.service.calculation_mode = 'local'
+        self.service.client = None
+
+        result = asyncio.run(self.service.calculate_distances(35.6762, 139.6503, 34.6937, 135.5023))
+
+        self.assertTrue(result['success'])
+        self.assertGreater(result['arc_distance_km'], 390)
+
+    def test_script_error_returns_error_result(self):
+        """スクリプトの実行に失敗した場合はエラーメッセージを返すこと"""
+        self.service.calculation_mode = 'execute'
+        self.service.client.scripts_painless_execute = AsyncMock(side_effect=Exception('boom'))
+
+        result = asyncio.run(self.service.calculate_distances(35.6762, 139.6503, 34.6937, 135.5023))
+
+        self.assertFalse(result['success'])
+        self.assertEqual(result['error_message'], 'arc/plane距離の計算に失敗しました')
+
+
+class GeoDistanceAsyncViewTest(TestCase):
+    """非同期ビューのテスト"""
+
+    def setUp(self):
+        self.client = Client()
+        self.async_client = AsyncClient()
+        self.url = reverse('geodistance:geo_distance_async')
+
+    @patch('geodistance.views.AsyncGeoDistanceService')
+    async def test_post_renders_result(self, mock_service_class):
+        """ASGIではPOSTで非同期サービスの計算結果を表示すること"""
+        mock_service_class.return_value.calculate_distances = AsyncMock(return_value={
+            'success': True,
+            'arc_distance_km': 392.442,
+            'plane_distance_km': 392.479,
+            'difference_km': 0.037,
+            'difference_percentage': 0.01,
+            'error_message': None,
+        })
+
+        response = await self.async_client.post(self.url, {
+            'a_latitude': 35.6762,
+            'a_longitude': 139.6503,
+            'b_latitude': 34.6937,
+            'b_longitude': 135.5023,
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'geodistance/result.html')
+        mock_service_class.return_value.calculate_distances.assert_awaited_once()
+
+    def test_wsgi_does_not_accumulate_async_clients(self):
+        """WSGIでは同期サービスで計算し、リクエストごとのAsyncOpenSearchクライアントを残さないこと"""
+        server = FakeOpenSearchServer().start()
+        self.addCleanup(server.stop)
+        self.addCleanup(client_registry.close)
+        self.addCleanup(index_existence_cache.invalidate)
+        client_registry.close()
+        index_existence_cache.invalidate()
+        distance_result_cache.clear()
+        before = async_client_registry.stats()
+
+        with self.settings(
+            OPENSEARCH_HOST=server.host, OPENSEARCH_PORT=server.port, OPENSEARCH_USE_SSL=False,
+            GEO_DISTANCE_CALCULATION_MODE='execute',
+        ):
+            for b_lat in (34.6937, 34.7937, 34.8937):
+                response = self.client.post(self.url, {
+                    'a_latitude': 35.6762,
+                    'a_longitude': 139.6503,
+                    'b_latitude': b_lat,
+                    'b_longitude': 135.5023,
+                })
+                self.assertTemplateUsed(response, 'geodistance/result.html')
+        gc.collect()
+
+        self.assertEqual(async_client_registry.stats(), before)
+        self.assertEqual(len(async_client_registry._clients), 0)
+        self.assertEqual(server.calls()['scripts_painless_execute'], 6)
+
+    def test_get_renders_form(self):
+        """GETでフォームを表示すること"""
+        response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTemplateUsed(response, 'geodistance/form.html')
+
+
+class DistanceResultCacheTest(TestCase):
+    """計算結果キャッシュのテスト"""
+
+    RESULT = {
+        'success': True,
+        'arc_distance_km': 392.442,
+        'plane_distance_km': 392.479,
+        'difference_km': 0.037,
+        'difference_percentage': 0.01,
+        'error_message': None,
+    }
+
+    def setUp(self):
+        distance_result_cache.clear()
+
+    def tearDown(self):
+        distance_result_cache.clear()
+
+    def test_key_is_quantized(self):
+        """precision未満の差は同じキーになり、距離タイプと計算モードはキーに含まれること"""
+        cache = DistanceResultCache(max_entries=10, ttl=60, precision=0.0001, backend_alias='')
+
+        key = cache.make_key('execute', 35.6762, 139.6503, 34.6937, 135.5023)
+
+        self.assertEqual(key, 'geo_distance:execute:arc,plane:356762:1396503:346937:1355023')
+        self.assertEqual(key, cache.make_key('execute', 35.67622, 139.65028, 34.6937, 135.5023))
+        self.assertNotEqual(key, cache.make_key('execute', 35.6763, 139.6503, 34.6937, 135.5023))
+        self.assertNotEqual(key, cache.make_key('local', 35.6762, 139.6503, 34.6937, 135.5023))
+        self.assertNotEqual(key, cache.make_key('execute', 35.6762, 139.6503, 34.6937, 135.5023, ('arc',)))
+
+    def test_lru_eviction(self):
+        """上限を超えると最も使われていないエントリから削除すること"""
+        cache = DistanceResultCache(max_entries=2, ttl=60, precision=0.0001, backend_alias='')
+        cache.set('a', self.RESULT)
+        cache.set('b', self.RESULT)
+        cache.get('a')
+        cache.set('c', self.RESULT)
+
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(cache.get('a'), self.RESULT)
+        self.assertEqual(cache.get('c'), self.RESULT)
+        stats = cache.stats()
+        self.assertEqual(stats['evictions'], 1)
+        self.assertEqual(stats['size'], 2)
+        self.assertEqual((stats['hits'], stats['misses']), (3, 1))
+
+    def test_ttl_expiry(self):
+        """有効期間を過ぎたエントリは返さないこと"""
+        cache = DistanceResultCache(max_entries=10, ttl=60, precision=0.0001, backend_alias='')
+        with patch('geodistance.cache.time.monotonic', return_value=1000.0):
+            cache.set('a', self.RESULT)
+        with patch('geodistance.cache.time.monotonic', return_value=1061.0):
+            self.assertIsNone(cache.get('a'))
+
+        self.assertEqual(cache.stats()['expirations'], 1)
+
+    @override_settings(CACHES={'shared': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+    def test_backend_is_second_level(self):
+        """プロセス内にない場合はDjangoのキャッシュバックエンドから取得すること"""
+        writer = DistanceResultCache(max_entries=10, ttl=60, precision=0.0001, backend_alias='shared')
+        reader = DistanceResultCache(max_entries=10, ttl=60, precision=0.0001, backend_alias='shared')
+        writer.set('a', self.RESULT)
+
+        self.assertEqual(reader.get('a'), self.RESULT)
+        self.assertEqual(reader.stats()['backend_hits'], 1)
+        self.assertEqual(reader.stats()['size'], 1)
+
+    @patch('geodistance.services.GeoDistanceService._calculate_arc_and_plane')
+    def test_cached_hit_skips_opensearch(self, mock_calculate):
+        """同じ地点の組の2回目の計算ではOpenSearchを呼ばないこと"""
+        mock_calculate.return_value = (392.442, 392.479)
+        service = GeoDistanceService()
+        service.client = MagicMock()
+
+        with patch.object(service, '_ensure_index_exists', return_value=True) as mock_ensure:
+            first = service.calculate_distances(35.6762, 139.6503, 34.6937, 135.5023)
+            second = service.calculate_distances(35.67621, 139.6503, 34.6937, 135.5023)
+
+        self.assertEqual(first, second)
+        mock_calculate.assert_called_once()
+        mock_ensure.assert_called_once()
+        self.assertEqual(distance_result_cache.stats()['hits'], 1)
+
+    @patch('geodistance.services.GeoDistanceService._calculate_arc_and_plane')
+    def test_failures_are_not_cached(self, mock_calculate):
+        """計算に失敗した結果はキャッシュしないこと"""
+        mock_calculate.side_effect = [None, (392.442, 392.479)]
+        service = GeoDistanceService()
+        service.client = MagicMock()
+
+        with patch.object(service, '_ensure_index_exists', return_value=True):
+            self.assertFalse(service.calculate_distances(35.6762, 139.6503, 34.6937, 135.5023)['success'])
+            self.assertTrue(service.calculate_distances(35.6762, 139.6503, 34.6937, 135.5023)['success'])
+
+
+class IndexExistenceCacheTest(TestCase):
+    """インデックス存在確認のキャッシュのテスト"""
+
+    def setUp(self):
+        index_existence_cache.invalidate()
+        self.service = GeoDistanceService()
+        self.service.client = MagicMock()
+        self.service.client.indices.exists.return_value = True
+
+    def tearDown(self):
+        index_existence_cache.invalidate()
+
+    def test_exists_is_called_once_within_ttl(self):
+        """TTL内は2回目以降のindices.existsを省略すること"""
+        for _ in range(3):
+            self.assertTrue(self.service._ensure_index_exists())
+
+        self.service.client.indices.exists.assert_called_once()
+
+    def test_exists_is_called_again_after_ttl(self):
+        """TTL経過後は再度確認すること"""
+        with self.settings(GEO_INDEX_EXISTS_CACHE_TTL=0):
+            self.service._ensure_index_exists()
+            self.service._ensure_index_exists()
+
+        self.assertEqual(self.service.client.indices.exists.call_count, 2)
+
+    def test_index_not_found_invalidates_cache(self):
+        """index_not_found_exceptionでキャッシュが破棄されること"""
+        self.service._ensure_index_exists()
+        self.service.client.scripts_painless_execute.side_effect = NotFoundError(
+            404, 'index_not_found_exception', {}
+        )
+
+        self.assertIsNone(self.service._execute_arc_and_plane(35.6762, 139.6503, 34.6937, 135.5023))
+        self.assertFalse(index_existence_cache.is_known(self.service.index_name))
+
+    def test_bootstrap_creates_index_and_caches(self):
+        """起動時フックでインデックスを作成し、結果をキャッシュすること"""
+        self.service.client.indices.exists.return_value = False
+
+        with patch('geodistance.services.get_client', return_value=self.service.client):
+            self.assertTrue(bootstrap_index())
+
+        self.service.client.indices.create.assert_called_once()
+        self.assertTrue(index_existence_cache.is_known(self.service.index_name))
+
+    def test_bootstrap_failure_logs_once(self):
+        """起動時にインデックスを準備できない場合は警告を1行だけ出力すること"""
+        self.service.client.indices.exists.side_effect = ConnectionError('N/A', 'refused', None)
+
+        with patch('geodistance.services.get_client', return_value=self.service.client):
+            with self.assertLogs('geodistance.services', level='WARNING') as logs:
+                self.assertFalse(bootstrap_index())
+
+        self.assertEqual(len(logs.output), 1)
+        self.assertFalse(index_existence_cache.is_known(self.service.index_name))
+
+    def test_bootstrap_only_for_servers(self):
+        """起動時のインデックス作成は有効にした場合だけ、管理コマンドではrunserverのときだけ行うこと"""
+        self.assertFalse(bootstrap_enabled(['gunicorn', 'config.wsgi']))
+        with self.settings(GEO_DISTANCE_BOOTSTRAP_INDEX=True):
+            self.assertTrue(bootstrap_enabled(['gunicorn', 'config.wsgi']))
+            self.assertTrue(bootstrap_enabled(['manage.py', 'runserver']))
+            for command in ('migrate', 'test', 'load_geo_points', 'run_distance_workers'):
+                self.assertFalse(bootstrap_enabled(['manage.py', command]))
+
+
+class GeoDistanceBatchTest(TestCase):
+    """一括距離計算のテスト"""
+
+    def setUp(self):
+        index_existence_cache.invalidate()
+        self.service = GeoDistanceService()
+        self.service.client = MagicMock()
+        self.service.calculation_mode = 'execute'
+
+    def tearDown(self):
+        index_existence_cache.invalidate()
+
+    def _msearch_response(self, body):
+        return {
+            'responses': [
+                {'hits': {'hits': [{'sort': [100.0 + i, 100.5 + i]}]}}
+                for i in range(len(body) // 2)
+            ]
+        }
+
+    def test_bulk_and_msearch_per_chunk(self):
+        """チャンクごとに_bulkと_msearchを1回ずつ実行し、列指向の結果を返すこと"""
+        self.service.client.bulk.return_value = {'items': [{'index': {}}] * 2}
+        self.service.client.msearch.side_effect = lambda body, **kwargs: self._msearch_response(body)
+        pairs = [(35.0, 139.0, 34.0, 135.0)] * 5
+
+        columns = self.service.calculate_distances_batch(pairs, chunk_size=2)
+
+        self.assertEqual(self.service.client.msearch.call_count, 3)
+        self.assertEqual(columns['arc_distance_km'], [100.0, 101.0, 100.0, 101.0, 100.0])
+        self.assertEqual(columns['plane_distance_km'], [100.5, 101.5, 100.5, 101.5, 100.5])
+        self.assertEqual(columns['error_message'], [None] * 5)
+        # 登録(refreshあり)と削除でチャンクごとに2回の_bulk
+        self.assertEqual(self.service.client.bulk.call_count, 6)
+        self.assertTrue(self.service.client.bulk.call_args_list[0].kwargs['refresh'])
+
+    def test_per_row_errors(self):
+        """範囲外の座標や検索エラーは行ごとのエラーになること"""
+        self.service.client.bulk.return_value = {'items': [{'index': {}}] * 2}
+        self.service.client.msearch.return_value = {
+            'responses': [
+                {'hits': {'hits': [{'sort': [10.0, 10.5]}]}},
+                {'error': {'type': 'search_phase_execution_exception'}},
+            ]
+        }
+        pairs = [(35.0, 139.0, 34.0, 135.0), (91.0, 0.0, 0.0, 0.0), (35.0, 139.0, 34.0, 136.0)]
+
+        columns = self.service.calculate_distances_batch(pairs)
+
+        self.assertEqual(columns['arc_distance_km'], [10.0, None, None])
+        self.assertIsNone(columns['error_message'][0])
+        self.assertIn('緯度が範囲外です', columns['error_message'][1])
+        self.assertIn('search_phase_execution_exception', columns['error_message'][2])
+
+    def test_local_mode_batch(self):
+        """localモードではOpenSearchを呼ばずに計算すること"""
+        self.service.calculation_mode = 'local'
+
+        columns = self.service.calculate_distances_batch([(35.6762, 139.6503, 34.6937, 135.5023)] * 3)
+
+        self.assertEqual(columns['arc_distance_km'], [392.442] * 3)
+        self.assertEqual(columns['plane_distance_km'], [392.479] * 3)
+        self.assertFalse(self.service.client.method_calls)
+
+    def test_iter_batch_chunks_reads_ahead_bounded(self):
+        """計算中のチャンクをconcurrency件までに抑え、取り出された分だけ入力を読み進めること"""
+        self.service.calculation_mode = 'local'
+        consumed = []
+
+        def pairs():
+            for i in range(100):
+                consumed.append(i)
+                yield (35.0, 139.0, 34.0, 135.0)
+
+        chunks = self.service.iter_batch_chunks(pairs(), chunk_size=10, concurrency=2)
+        first_pairs, first_rows = next(chunks)
+
+        self.assertEqual(len(first_pairs), 10)
+        self.assertEqual(len(first_rows), 10)
+        self.assertLessEqual(len(consumed), 31)
+        self.assertEqual(sum(len(rows) for _, rows in chunks), 90)
+
+
+class CoordinateReaderTest(TestCase):
+    """アップロードされた地点の組の読み込みのテスト"""
+
+    def test_csv_with_header(self):
+        """ヘッダー付きCSVを読み込めること"""
+        stream = io.BytesIO(b'a_lat,a_lon,b_lat,b_lon\n35.6762,139.6503,34.6937,135.5023\n')
+
+        pairs = list(iter_coordinate_pairs(stream, 'csv'))
+
+        self.assertEqual(pairs, [(35.6762, 139.6503, 34.6937, 135.5023)])
+
+    def test_json_objects_with_form_field_names(self):
+        """フォームと同じフィールド名のJSONを読み込めること"""
+        body = json.dumps([
+            {'a_latitude': 35.6762, 'a_longitude': 139.6503, 'b_latitude': 34.6937, 'b_longitude': 135.5023}
+        ]).encode()
+
+        pairs = list(iter_coordinate_pairs(io.BytesIO(body), 'json'))
+
+        self.assertEqual(pairs, [(35.6762, 139.6503, 34.6937, 135.5023)])
+
+    def test_malformed_row(self):
+        """形式が正しくない行は行番号付きのエラーになること"""
+        stream = io.BytesIO(b'35.6762,139.6503,34.6937\n')
+
+        with self.assertRaisesMessage(ValueError, '1行目'):
+            list(iter_coordinate_pairs(stream, 'csv'))
+
+
+class GeoDistanceBatchViewTest(TestCase):
+    """一括計算エンドポイントのテスト"""
+
+    def setUp(self):
+        self.url = reverse('geodistance:geo_distance_batch')
+
+    @patch.object(GeoDistanceService, 'calculate_distances_batch')
+    def test_csv_upload(self, mock_batch):
+        """CSVファイルのアップロードで計算できること"""
+        mock_batch.return_value = {'arc_distance_km': [392.442]}
+        upload = SimpleUploadedFile(
+            'pairs.csv', b'a_lat,a_lon,b_lat,b_lon\n35.6762,139.6503,34.6937,135.5023\n', 'text/csv'
+        )
+
+        response = self.client.post(self.url, {'file': upload})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['count'], 1)
+        self.assertEqual(mock_batch.call_args.args[0], [(35.6762, 139.6503, 34.6937, 135.5023)])
+
+    @patch.object(GeoDistanceService, 'calculate_distances_batch')
+    def test_json_body(self, mock_batch):
+        """JSONのリクエストボディで計算できること"""
+        mock_batch.return_value = {'arc_distance_km': [392.442]}
+
+        response = self.client.post(
+            self.url + '?chunk_size=10',
+            data=json.dumps([[35.6762, 139.6503, 34.6937, 135.5023]]),
+            content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(mock_batch.call_args.kwargs['chunk_size'], 10)
+
+    def test_invalid_upload(self):
+        """不正な入力は400を返すこと"""
+        response = self.client.post(self.url, data='not json', content_type='application/json')
+
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(GEO_DISTANCE_BATCH_MAX_CHUNK_SIZE=100)
+    def test_invalid_chunk_size(self):
+        """一括計算・エクスポート・ジョブの登録は、chunk_sizeが1から上限までの範囲外であれば400を返すこと"""
+        body = json.dumps([[35.6762, 139.6503, 34.6937, 135.5023]])
+        urls = [
+            reverse(f'geodistance:{name}')
+            for name in ('geo_distance_batch', 'geo_distance_export', 'distance_job_create')
+        ]
+
+        for url in urls:
+            for chunk_size in ('0', '-1', '101', 'abc'):
+                response = self.client.post(
+                    f'{url}?chunk_size={chunk_size}', data=body, content_type='application/json'
+                )
+                self.assertEqual(response.status_code, 400, (url, chunk_size))
+                if chunk_size != 'abc':
+                    self.assertIn('1から100まで', response.json()['error'])
+        self.assertFalse(DistanceJob.objects.exists())
+
+
+@override_settings(GEO_DISTANCE_CALCULATION_MODE='local')
+class ApiEndpointAuthTest(TestCase):
+    """POSTのAPIのトークン認証とCSRFのテスト"""
+
+    def setUp(self):
+        self.client = Client(enforce_csrf_checks=True)
+        self.body = json.dumps([[35.6762, 139.6503, 34.6937, 135.5023]])
+        self.urls = [
+            reverse(f'geodistance:{name}')
+            for name in ('geo_distance_batch', 'geo_distance_export', 'distance_job_create')
+        ]
+
+    def post(self, url, **extra):
+        return self.client.post(url, data=self.body, content_type='application/json', **extra)
+
+    def test_requires_csrf_without_tokens(self):
+        """トークンを設定していない場合はフォームと同じくCSRFトークンのないリクエストを拒否すること"""
+        for url in self.urls:
+            self.assertEqual(self.post(url).status_code, 403, url)
+
+    @override_settings(GEO_DISTANCE_API_TOKENS=['secret', 'rotated'])
+    def test_bearer_token(self):
+        """トークンを設定した場合は一致するBearerトークンのリクエストだけを受け付けること"""
+        response = self.post(self.urls[0], HTTP_AUTHORIZATION='Bearer wrong')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Bearer')
+        self.assertEqual(self.post(self.urls[1]).status_code, 401)
+
+        self.assertEqual(self.post(self.urls[0], HTTP_AUTHORIZATION='Bearer rotated').json()['count'], 1)
+        self.assertEqual(self.post(self.urls[2], HTTP_AUTHORIZATION='Bearer secret').status_code, 202)
+        matrix = self.client.post(
+            reverse('geodistance:geo_distance_matrix'),
+            data=json.dumps({'origins': [[35.6762, 139.6503]], 'destinations': [[34.6937, 135.5023]]}),
+            content_type='application/json',
+            HTTP_AUTHORIZATION='Bearer secret',
+        )
+        self.assertEqual(matrix.status_code, 200)
+
+
+@override_settings(GEO_DISTANCE_CALCULATION_MODE='local')
+class GeoDistanceExportViewTest(TestCase):
+    """エクスポートエンドポイントのテスト"""
+
+    def setUp(self):
+        self.url = reverse('geodistance:geo_distance_export')
+
+    def test_streams_csv(self):
+        """リクエストボディのCSVを計算し、入力の列と結果をCSVでストリーミングで返すこと"""
+        body = 'a_lat,a_lon,b_lat,b_lon\n' + '35.6762,139.6503,34.6937,135.5023\n' * 3 + '91,0,0,0\n'
+
+        response = self.client.post(self.url + '?chunk_size=2', data=body, content_type='text/csv')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        self.assertIn('attachment', response['Content-Disposition'])
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0]['a_latitude'], '35.6762')
+        self.assertEqual(rows[0]['arc_distance_km'], '392.442')
+        self.assertEqual(rows[3]['arc_distance_km'], '')
+        self.assertIn('緯度が範囲外です', rows[3]['error_message'])
+
+    def test_streams_ndjson_upload(self):
+        """NDJSONファイルのアップロードを計算し、1行ずつNDJSONで返すこと"""
+        upload = SimpleUploadedFile(
+            'pairs.ndjson', b'[35.6762, 139.6503, 34.6937, 135.5023]\n' * 5, 'application/x-ndjson'
+        )
+
+        response = self.client.post(self.url + '?output=ndjson', {'file': upload})
+
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(len(lines), 5)
+        self.assertEqual(json.loads(lines[0])['plane_distance_km'], 392.479)
+
+    def test_invalid_row_ends_stream_with_error(self):
+        """途中の行が不正な場合は、それまでの結果に続けてエラー行を返すこと"""
+        body = '[35.6762, 139.6503, 34.6937, 135.5023]\nnot json\n'
+
+        response = self.client.post(
+            self.url + '?output=ndjson&chunk_size=1', data=body, content_type='application/x-ndjson'
+        )
+
+        lines = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual(lines[0]['arc_distance_km'], 392.442)
+        self.assertIn('2行目', lines[1]['error'])
+
+    def test_invalid_output(self):
+        """未対応の出力形式は400を返すこと"""
+        response = self.client.post(self.url + '?output=xml', data='', content_type='text/csv')
+
+        self.assertEqual(response.status_code, 400)
+
+
+class DistanceMatrixTest(TestCase):
+    """距離行列のテスト"""
+
+    def setUp(self):
+        index_existence_cache.invalidate()
+        self.service = GeoDistanceService()
+        self.service.client = MagicMock()
+        self.service.client.bulk.return_value = {'errors': False}
+        self.service.calculation_mode = 'execute'
+
+    def tearDown(self):
+        index_existence_cache.invalidate()
+
+    def test_one_paginated_search_per_origin(self):
+        """出発地点ごとに検索し、search_afterで全目的地点を取得すること"""
+        pages = {}
+
+        def search(index, body, **kwargs):
+            origin = body['sort'][0]['_geo_distance']['location']['lat']
+            page = pages.get(origin, 0)
+            pages[origin] = page + 1
+            ordinals = [[2, 0], [1]][page]
+            return {'hits': {'hits': [
+                {'sort': [origin + ordinal, origin + ordinal + 0.5, ordinal]} for ordinal in ordinals
+            ]}}
+
+        self.service.client.search.side_effect = search
+        origins = [(10.0, 0.0), (20.0, 0.0)]
+        destinations = [(0.0, 1.0), (0.0, 2.0), (0.0, 3.0)]
+
+        with self.settings(GEO_DISTANCE_MATRIX_PAGE_SIZE=2):
+            rows = list(self.service.iter_distance_matrix(origins, destinations, concurrency=2))
+
+        self.assertEqual([row['origin'] for row in rows], [0, 1])
+        self.assertEqual(rows[0]['arc_distance_km'], [10.0, 11.0, 12.0])
+        self.assertEqual(rows[1]['plane_distance_km'], [20.5, 21.5, 22.5])
+        self.assertEqual(self.service.client.search.call_count, 4)
+        self.service.client.bulk.assert_called_once()
+        self.service.client.delete_by_query.assert_called_once()
+
+    def test_local_mode_matrix(self):
+        """localモードではローカルエンジンで行列を計算すること"""
+        self.service.calculation_mode = 'local'
+
+        rows = list(self.service.iter_distance_matrix([(35.6762, 139.6503)], [(34.6937, 135.5023)] * 2))
+
+        self.assertEqual(rows[0]['arc_distance_km'], [392.442, 392.442])
+        self.assertFalse(self.service.client.method_calls)
+
+
+class DistanceMatrixViewTest(TestCase):
+    """距離行列エンドポイントのテスト"""
+
+    def setUp(self):
+        self.url = reverse('geodistance:geo_distance_matrix')
+
+    @patch.object(GeoDistanceService, 'iter_distance_matrix')
+    def test_streams_ndjson(self, mock_matrix):
+        """出発地点ごとに1行のNDJSONをストリーミングで返すこと"""
+        mock_matrix.return_value = iter([
+            {'origin': 0, 'arc_distance_km': [1.0]},
+            {'origin': 1, 'arc_distance_km': [2.0]},
+        ])
+
+        response = self.client.post(
+            self.url,
+            data=json.dumps({'origins': [[35.0, 139.0], [34.0, 135.0]], 'destinations': [{'lat': 0, 'lon': 0}]}),
+            content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = b''.join(response.streaming_content).decode().splitlines()
+        self.assertEqual([json.loads(line)['origin'] for line in lines], [0, 1])
+
+    def test_invalid_points(self):
+        """範囲外の座標は400を返すこと"""
+        response = self.client.post(
+            self.url,
+            data=json.dumps({'origins': [[95.0, 139.0]], 'destinations': [[0, 0]]}),
+            content_type='application/json',
+        )
+
+        self.assertEqual(response.status_code, 400)
+
+
+class NearestReferencePointsTest(TestCase):
+    """近傍の参照地点検索のテスト"""
+
+    def setUp(self):
+        self.service = GeoDistanceService()
+        self.service.client = MagicMock()
+        self.service.client.search.return_value = {
+            'hits': {'total': {'value': 2}, 'hits': [
+                {
+                    '_id': 'tokyo',
+                    '_source': {'name': '東京駅', 'location': {'lat': 35.6812, 'lon': 139.7671}},
+                    'sort': [10.0, 'tokyo'],
+                    'fields': {'arc_distance_km': [10.0], 'plane_distance_km': [10.001]},
+                },
+                {
+                    '_id': 'shinagawa',
+                    '_source': {'name': '品川駅', 'location': {'lat': 35.6285, 'lon': 139.7388}},
+                    'sort': [12.5, 'shinagawa'],
+                    'fields': {'arc_distance_km': [12.5], 'plane_distance_km': [12.502]},
+                },
+            ]}
+        }
+
+    def test_single_query_with_filter_sort_and_script_fields(self):
+        """geo_distanceフィルタ・arcソート・script_fieldsを持つ1回の検索で取得すること"""
+        result = self.service.find_nearest_reference_points(35.6762, 139.6503, k=2, radius_km=50)
+
+        self.service.client.search.assert_called_once()
+        body = self.service.client.search.call_args.kwargs['body']
+        self.assertEqual(body['size'], 2)
+        self.assertEqual(body['query']['bool']['filter']['geo_distance']['distance'], '50km')
+        self.assertEqual(body['sort'][0]['_geo_distance']['distance_type'], 'arc')
+        self.assertEqual(body['sort'][1], {'point_id': 'asc'})
+        self.assertEqual(set(body['script_fields']), {'arc_distance_km', 'plane_distance_km'})
+        self.assertNotIn('search_after', body)
+
+        self.assertTrue(result['success'])
+        self.assertEqual([point['id'] for point in result['points']], ['tokyo', 'shinagawa'])
+        self.assertEqual(result['points'][0]['difference_km'], 0.001)
+        self.assertEqual(result['next_search_after'], [12.5, 'shinagawa'])
+
+    def test_search_after(self):
+        """search_afterを検索に渡し、最後のページではnext_search_afterがNoneになること"""
+        result = self.service.find_nearest_reference_points(
+            35.6762, 139.6503, k=3, search_after=[12.5, 'shinagawa']
+        )
+
+        body = self.service.client.search.call_args.kwargs['body']
+        self.assertEqual(body['search_after'], [12.5, 'shinagawa'])
+        self.assertEqual(body['query'], {'match_all': {}})
+        self.assertIsNone(result['next_search_after'])
+
+    def test_search_error(self):
+        """検索に失敗した場合はエラーメッセージを返すこと"""
+        self.service.client.search.side_effect = Exception('OpenSearch error')
+
+        result = self.service.find_nearest_reference_points(35.6762, 139.6503)
+
+        self.assertFalse(result['success'])
+        self.assertIn('OpenSearch error', result['error_message'])
+
+
+class NearestReferencePointsViewTest(TestCase):
+    """近傍の参照地点検索ビューのテスト"""
+
+    def setUp(self):
+        self.client = Client()
+        self.url = reverse('geodistance:nearest_reference_points')
+
+    @patch('geodistance.views.GeoDistanceService')
+    def test_returns_points(self, mock_service_class):
+        """パラメータをサービスに渡し、結果をJSONで返すこと"""
+        mock_service_class.return_value.find_nearest_reference_points.return_value = {
+            'success': True, 'points': [{'id': 'tokyo'}], 'next_search_after': [10.0, 'tokyo'],
+            'error_message': None,
+        }
+
+        response = self.client.get(self.url, {
+            'lat': 35.6762, 'lon': 139.6503, 'k': 1, 'radius_km': 5, 'search_after': '[1.0, "a"]',
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['next_search_after'], [10.0, 'tokyo'])
+        mock_service_class.return_value.find_nearest_reference_points.assert_called_once_with(
+            35.6762, 139.6503, 1, 5.0, [1.0, 'a']
+        )
+
+    def test_invalid_parameters(self):
+        """パラメータが不正な場合は400を返すこと"""
+        for params in ({'lon': 139.6503}, {'lat': 91, 'lon': 0}, {'lat': 35, 'lon': 139, 'k': 0},
+                       {'lat': 35, 'lon': 139, 'search_after': '{"a": 1}'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(self.url, params).status_code, 400)
+
+
+@override_settings(OPENSEARCH_USE_SSL=False, GEO_REFERENCE_INDEX='distribution_points')
+class DistanceDistributionTest(TestCase):
+    """geo_distance集計による距離の分布の比較のテスト（ローカルのOpenSearch互換サーバーを使う）"""
+
+    ORIGIN = (35.6762, 139.6503)
+    POINTS = {
+        'sapporo': (43.0618, 141.3545),
+        'naha': (26.2124, 127.6809),
+        'yokohama': (35.4437, 139.6380),
+    }
+
+    def setUp(self):
+        self.server = FakeOpenSearchServer().start()
+        self.overrides = override_settings(OPENSEARCH_HOST=self.server.host, OPENSEARCH_PORT=self.server.port)
+        self.overrides.enable()
+        client_registry.close()
+        self.service = GeoDistanceService()
+        self.service.client.indices.create(index='distribution_points')
+        for point_id, (lat, lon) in self.POINTS.items():
+            self.service.client.index(
+                index='distribution_points', id=point_id, body={'location': {'lat': lat, 'lon': lon}}
+            )
+
+        # 札幌がarcとplaneで別の距離帯に入るよう、2つの距離の中間を境界にする
+        lat, lon = engine.quantize_point(*self.POINTS['sapporo'])
+        arc = float(engine.arc_distance(*self.ORIGIN, lat, lon)) / 1000.0
+        plane = float(engine.plane_distance(*self.ORIGIN, lat, lon)) / 1000.0
+        self.assertNotEqual(arc, plane)
+        self.edge = (arc + plane) / 2
+        self.plane_is_longer = plane > arc
+
+    def tearDown(self):
+        client_registry.close()
+        self.overrides.disable()
+        self.server.stop()
+
+    def test_bands_differ_between_models(self):
+        """1回のsize: 0の検索で、arcとplaneで件数が異なる距離帯を返すこと"""
+        self.server.reset_calls()
+
+        result = self.service.aggregate_distance_distribution(*self.ORIGIN, band_edges_km=[0.0, 100.0, self.edge])
+
+        self.assertTrue(result['success'])
+        self.assertEqual(self.server.calls(), {'search': 1})
+        self.assertEqual(result['total'], 3)
+        self.assertEqual([band['from_km'] for band in result['bands']], [0.0, 100.0, self.edge])
+        self.assertEqual(result['bands'][0]['arc_count'], 1)
+        self.assertEqual(result['differing_bands'], 2)
+        shift = 1 if self.plane_is_longer else -1
+        self.assertEqual([band['count_difference'] for band in result['bands']], [0, -shift, shift])
+
+    def test_bands_start_at_zero(self):
+        """最初の境界が0より大きい場合も、それより近い参照地点を0kmからの距離帯に数えること"""
+        result = self.service.aggregate_distance_distribution(*self.ORIGIN, band_edges_km=[100.0, 1000.0])
+
+        self.assertEqual([band['from_km'] for band in result['bands']], [0.0, 100.0, 1000.0])
+        self.assertEqual(result['bands'][0]['arc_count'], 1)
+        self.assertEqual(sum(band['arc_count'] for band in result['bands']), result['total'])
+
+    def test_geohash_cells(self):
+        """geohash_gridを入れ子にした場合は、件数が異なるセルを返すこと"""
+        result = self.service.aggregate_distance_distribution(
+            *self.ORIGIN, band_edges_km=[0.0, self.edge], geohash_precision=3
+        )
+
+        cells = [cell['geohash'] for band in result['bands'] for cell in band['cells']]
+        self.assertEqual(len(cells), 2)
+        self.assertEqual(set(cells), {cells[0]})
+
+    def test_search_error(self):
+        """検索に失敗した場合はエラーメッセージを返すこと"""
+        self.server.inject_fault(api='search', status=400)
+
+        result = self.service.aggregate_distance_distribution(*self.ORIGIN)
+
+        self.assertFalse(result['success'])
+        self.assertIn('集計エラー', result['error_message'])
+
+
+class DistanceDistributionViewTest(TestCase):
+    """距離の分布の比較ビューのテスト"""
+
+    def setUp(self):
+        self.client = Client()
+        self.url = reverse('geodistance:distance_distribution')
+
+    @patch('geodistance.views.GeoDistanceService')
+    def test_returns_bands(self, mock_service_class):
+        """パラメータをサービスに渡し、結果をJSONで返すこと"""
+        mock_service_class.return_value.aggregate_distance_distribution.return_value = {
+            'success': True, 'total': 3, 'bands': [{'from_km': 0.0}], 'differing_bands': 0, 'error_message': None,
+        }
+
+        response = self.client.get(self.url, {
+            'lat': 35.6762, 'lon': 139.6503, 'band_edges_km': '0,10,100', 'geohash_precision': 4,
+        })
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['total'], 3)
+        mock_service_class.return_value.aggregate_distance_distribution.assert_called_once_with(
+            35.6762, 139.6503, [0.0, 10.0, 100.0], 4
+        )
+
+    def test_invalid_parameters(self):
+        """パラメータが不正な場合は400を返すこと"""
+        for params in ({'lon': 139.6503}, {'lat': 35, 'lon': 181},
+                       {'lat': 35, 'lon': 139, 'band_edges_km': '10,0'},
+                       {'lat': 35, 'lon': 139, 'geohash_precision': 13}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get(self.url, params).status_code, 400)
+
+
+class JsonSerializerTest(TestCase):
+    """OpenSearchクライアントのシリアライザーの選択のテスト"""
+
+    def test_selects_serializer(self):
+        """OPENSEARCH_JSON_SERIALIZERに応じてシリアライザーを選び、未対応の値はValueErrorにすること"""
+        with self.settings(OPENSEARCH_JSON_SERIALIZER='json'):
+            self.assertIs(type(get_serializer()), JSONSerializer)
+        with self.settings(OPENSEARCH_JSON_SERIALIZER='yaml'):
+            with self.assertRaises(ValueError):
+                get_serializer()
+
+    def test_orjson_round_trip(self):
+        """orjsonでJSONSerializerと同じ値にエンコード・デコードすること"""
+        if orjson is None:
+            self.skipTest('orjsonがインストールされていません')
+        with self.settings(OPENSEARCH_JSON_SERIALIZER='orjson'):
+            serializer = get_serializer()
+        data = {'location': {'lat': np.float64(35.6762), 'lon': 139.6503}, 'id': uuid.UUID(int=1), 'name': '東京'}
+
+        encoded = serializer.dumps(data)
+
+        self.assertIsInstance(encoded, str)
+        self.assertEqual(json.loads(encoded), json.loads(JSONSerializer().dumps(data)))
+        self.assertEqual(serializer.loads('{"hits": {"hits": []}}'), {'hits': {'hits': []}})
+        with self.assertRaises(SerializationError):
+            serializer.loads('{')
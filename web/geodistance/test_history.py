@@ -0,0 +1,119 @@
+from datetime import date, datetime, timezone as dt_timezone
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from geodistance.history import HistoryRecorder, distance_band, error_report, latitude_band
+from geodistance.models import DistanceCalculation, DistanceErrorRollup
+from geodistance.services import GeoDistanceService, _summarize_distances
+
+
+# 他のテストの記録と混ざらないよう、過去の日付で記録する
+RECORDED_AT = datetime(2001, 2, 3, 12, 0, tzinfo=dt_timezone.utc)
+
+
+@override_settings(GEO_DISTANCE_HISTORY_ENABLED=True)
+class HistoryRecorderTest(TestCase):
+    """計算結果の履歴と集計のテスト"""
+
+    def setUp(self):
+        self.recorder = HistoryRecorder(batch_size=2, max_buffer=3, background=False)
+
+    def record(self, a_lat, a_lon, b_lat, b_lon, arc, plane):
+        with patch('geodistance.history.timezone.now', return_value=RECORDED_AT):
+            self.recorder.record('local', a_lat, a_lon, b_lat, b_lon, _summarize_distances(arc, plane))
+
+    def test_bands(self):
+        """arc距離の距離帯と、中間緯度の緯度帯を求めること"""
+        self.assertEqual(distance_band(0.5), 0.0)
+        self.assertEqual(distance_band(392.4), 100.0)
+        self.assertEqual(distance_band(25000.0), 20000.0)
+        self.assertEqual(latitude_band(35.6, 34.6), 30)
+        self.assertEqual(latitude_band(-5.0, -5.0), -10)
+        self.assertEqual(latitude_band(90.0, 90.0), 80)
+
+    def test_buffers_until_flush(self):
+        """記録はバッファに溜めるだけで、flushでまとめて登録すること"""
+        self.record(35.0, 139.0, 34.0, 135.0, 392.442, 392.479)
+
+        self.assertEqual(self.recorder.pending(), 1)
+        self.assertFalse(DistanceCalculation.objects.filter(created_at=RECORDED_AT).exists())
+
+        self.assertEqual(self.recorder.flush(), 1)
+        entry = DistanceCalculation.objects.get(created_at=RECORDED_AT)
+        self.assertEqual(entry.arc_distance_km, 392.442)
+        self.assertEqual(entry.distance_band_km, 100.0)
+        self.assertEqual(entry.latitude_band, 30)
+        self.assertEqual(self.recorder.pending(), 0)
+
+    def test_drops_oldest_when_buffer_is_full(self):
+        """登録待ちが上限を超えた場合は古いものから破棄すること"""
+        for i in range(5):
+            self.record(float(i), 0.0, 0.0, 1.0, 111.0, 111.1)
+
+        self.assertEqual(self.recorder.pending(), 3)
+        self.assertEqual(self.recorder.dropped, 2)
+
+    def test_rollups_are_incremental(self):
+        """flushのたびに日付・距離帯・緯度帯ごとの集計に加算すること"""
+        self.record(35.0, 139.0, 34.0, 135.0, 100.0, 101.0)
+        self.record(35.0, 139.0, 34.0, 136.0, 200.0, 198.0)
+        self.recorder.flush()
+        self.record(35.0, 139.0, 34.0, 137.0, 300.0, 306.0)
+        self.record(0.0, 0.0, 0.0, 0.1, 5.0, 5.0)
+        self.recorder.flush()
+
+        rollup = DistanceErrorRollup.objects.get(date=date(2001, 2, 3), distance_band_km=100.0, latitude_band=30)
+        self.assertEqual(rollup.count, 3)
+        self.assertAlmostEqual(rollup.max_difference_percentage, 2.0)
+
+        report = error_report(since=date(2001, 2, 3), until=date(2001, 2, 3))
+        self.assertEqual(
+            [(row['distance_band_km'], row['latitude_band'], row['count']) for row in report],
+            [(1.0, 0, 1), (100.0, 30, 3)],
+        )
+        self.assertAlmostEqual(report[1]['mean_difference_percentage'], (1.0 + 1.0 + 2.0) / 3, places=5)
+        self.assertAlmostEqual(report[1]['mean_difference_km'], (1.0 + 2.0 + 6.0) / 3, places=5)
+        self.assertEqual(error_report(since=date(2001, 2, 4), until=date(2001, 2, 4)), [])
+
+    @override_settings(GEO_DISTANCE_HISTORY_ENABLED=False)
+    def test_disabled(self):
+        """無効の場合は記録しないこと"""
+        self.record(35.0, 139.0, 34.0, 135.0, 392.442, 392.479)
+
+        self.assertEqual(self.recorder.pending(), 0)
+
+    @override_settings(GEO_DISTANCE_CALCULATION_MODE='local')
+    def test_service_records_results(self):
+        """GeoDistanceServiceが計算した結果を記録すること"""
+        with patch('geodistance.services.history_recorder') as recorder:
+            GeoDistanceService().calculate_distances(35.6762, 139.6503, 34.6937, 135.5023)
+
+        mode, a_lat, a_lon, b_lat, b_lon, result = recorder.record.call_args.args
+        self.assertEqual((mode, a_lat, b_lon), ('local', 35.6762, 135.5023))
+        self.assertEqual(result['arc_distance_km'], 392.442)
+
+
+class DistanceErrorReportViewTest(TestCase):
+    """誤差の集計エンドポイントのテスト"""
+
+    def test_report(self):
+        """集計テーブルから距離帯・緯度帯ごとの誤差を返すこと"""
+        DistanceErrorRollup.objects.create(
+            date=date(2001, 2, 3), distance_band_km=100.0, latitude_band=30, count=2,
+            sum_difference_km=1.0, sum_difference_percentage=0.5, max_difference_percentage=0.4,
+        )
+
+        response = self.client.get(reverse('geodistance:distance_error_report') + '?since=2001-02-03&until=2001-02-03')
+
+        self.assertEqual(response.status_code, 200)
+        band = response.json()['bands'][0]
+        self.assertEqual(band['count'], 2)
+        self.assertEqual(band['mean_difference_percentage'], 0.25)
+
+    def test_invalid_date(self):
+        """不正な日付は400を返すこと"""
+        response = self.client.get(reverse('geodistance:distance_error_report') + '?since=yesterday')
+
+        self.assertEqual(response.status_code, 400)
@@ -0,0 +1,116 @@
+from io import StringIO
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from geodistance.cache import distance_result_cache
+from geodistance.clients import client_registry, get_client
+from geodistance.fake_opensearch import FakeOpenSearchServer
+from geodistance.index_management import ensure_index, index_definition, migrate_index
+from geodistance.scratch import scratch_pool
+from geodistance.services import GeoDistanceService, index_existence_cache
+
+
+@override_settings(GEO_DISTANCE_INDEX_ALIAS='geo_points', GEO_DISTANCE_INDEX_VERSION=2)
+class IndexManagementTest(TestCase):
+    """距離計算用インデックスのバージョン管理とエイリアスの切り替えのテスト"""
+
+    def setUp(self):
+        self.server = FakeOpenSearchServer().start()
+        self.overrides = override_settings(
+            OPENSEARCH_HOST=self.server.host,
+            OPENSEARCH_PORT=self.server.port,
+            OPENSEARCH_USE_SSL=False,
+            GEO_DISTANCE_CALCULATION_MODE='indexed',
+        )
+        self.overrides.enable()
+        client_registry.close()
+        index_existence_cache.invalidate()
+        distance_result_cache.clear()
+        self.client = get_client()
+
+    def tearDown(self):
+        client_registry.close()
+        index_existence_cache.invalidate()
+        scratch_pool.drain(include_pooled=True)
+        distance_result_cache.clear()
+        self.overrides.disable()
+        self.server.stop()
+
+    def calculate(self):
+        distance_result_cache.clear()
+        return GeoDistanceService().calculate_distances(35.6762, 139.6503, 34.6937, 135.5023)
+
+    def test_creates_versioned_index_behind_alias(self):
+        """エイリアスがなければテンプレートを登録し、バージョン付きのインデックスをエイリアス付きで作成すること"""
+        result = self.calculate()
+
+        self.assertTrue(result['success'], result['error_message'])
+        self.assertEqual(self.server.aliases(), {'geo_points': ['geo_points_v2']})
+        index_settings = self.server.index_settings('geo_points_v2')
+        self.assertEqual(index_settings['refresh_interval'], '30s')
+        self.assertEqual(index_settings['number_of_shards'], '1')
+        mappings = self.server.index_mappings('geo_points_v2')
+        self.assertEqual(mappings['properties']['name'], {'type': 'keyword', 'index': False, 'doc_values': False})
+        self.assertEqual(mappings['dynamic'], 'strict')
+
+    def test_unknown_version(self):
+        """未定義のバージョンはValueErrorにすること"""
+        with self.assertRaises(ValueError):
+            index_definition(99)
+
+    def test_migrates_legacy_index(self):
+        """エイリアスと同じ名前のインデックスからreindexし、削除とエイリアスの追加を1回で行うこと"""
+        self.client.indices.create(index='geo_points', body=index_definition(1))
+        self.client.index(index='geo_points', id='a', body={'location': {'lat': 35.0, 'lon': 139.0}}, refresh=True)
+        self.server.reset_calls()
+
+        out = StringIO()
+        call_command('migrate_geo_index', stdout=out)
+
+        self.assertIn("'geo_points' から 'geo_points_v2' に切り替えました（1件", out.getvalue())
+        self.assertEqual(self.server.calls()['indices.update_aliases'], 1)
+        self.assertEqual(self.server.aliases(), {'geo_points': ['geo_points_v2']})
+        self.assertEqual(list(self.server.documents('geo_points')), ['a'])
+        # reindexの間に無効にしたrefreshとレプリカを定義の設定に戻すこと
+        index_settings = self.server.index_settings('geo_points_v2')
+        self.assertEqual((index_settings['refresh_interval'], index_settings['number_of_replicas']), ('30s', '1'))
+        self.assertTrue(self.calculate()['success'])
+
+    def test_swaps_alias_between_versions(self):
+        """エイリアスを別のバージョンに付け替え、切り替え済みの場合は何もしないこと"""
+        ensure_index(self.client)
+        self.client.index(index='geo_points', id='a', body={'location': {'lat': 35.0, 'lon': 139.0}}, refresh=True)
+
+        result = migrate_index(self.client, version=1)
+
+        self.assertTrue(result.migrated)
+        self.assertEqual((result.source, result.target, result.copied), ('geo_points_v2', 'geo_points_v1', 1))
+        self.assertEqual(self.server.aliases(), {'geo_points': ['geo_points_v1']})
+        self.assertEqual(self.client.indices.exists(index='geo_points_v2'), True)
+        self.assertFalse(migrate_index(self.client, version=1).migrated)
+
+        migrate_index(self.client, version=2, delete_old=True)
+
+        self.assertEqual(self.server.aliases(), {'geo_points': ['geo_points_v2']})
+        self.assertFalse(self.client.indices.exists(index='geo_points_v1'))
+
+    def test_purge_scratch(self):
+        """--purge-scratchはreindexでコピーされた一時ドキュメントを削除し、他のドキュメントは残すこと"""
+        ensure_index(self.client)
+        for doc_id in ('a', 'scratch-otherhost-1-0'):
+            self.client.index(index='geo_points', id=doc_id, body={'location': {'lat': 35.0, 'lon': 139.0}})
+
+        out = StringIO()
+        call_command('migrate_geo_index', '--to-version', '1', '--purge-scratch', stdout=out)
+
+        self.assertIn('一時ドキュメントを1件削除しました', out.getvalue())
+        self.assertEqual(list(self.server.documents('geo_points_v1')), ['a'])
+
+    def test_dry_run(self):
+        """--dry-runは現在の状態を表示するだけで変更しないこと"""
+        out = StringIO()
+        call_command('migrate_geo_index', '--dry-run', stdout=out)
+
+        self.assertIn('geo_points_v2', out.getvalue())
+        self.assertEqual(self.server.aliases(), {})
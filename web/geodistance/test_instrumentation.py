@@ -0,0 +1,207 @@
+import asyncio
+from unittest.mock import AsyncMock, MagicMock, patch
+
+from django.test import Client, TestCase, override_settings
+from django.urls import reverse
+
+from geodistance.async_services import AsyncGeoDistanceService
+from geodistance.cache import distance_result_cache
+from geodistance.clients import client_registry
+from geodistance.fake_opensearch import FakeOpenSearchServer
+from geodistance.instrumentation import (
+    PrometheusSink,
+    RingBufferSink,
+    api_name,
+    instrumentation,
+)
+from geodistance.scratch import scratch_pool
+from geodistance.services import GeoDistanceService, index_existence_cache
+from geodistance.test_geodistance import painless_results
+
+
+class InstrumentationTestMixin:
+    """テスト中はリングバッファとPrometheusのシンクに差し替える"""
+
+    def setUp(self):
+        self.ring_buffer = RingBufferSink(size=100)
+        self.prometheus = PrometheusSink()
+        instrumentation.configure([self.ring_buffer, self.prometheus])
+        distance_result_cache.clear()
+        index_existence_cache.invalidate()
+
+    def tearDown(self):
+        instrumentation._sinks = None
+        distance_result_cache.clear()
+        index_existence_cache.invalidate()
+        scratch_pool.drain(include_pooled=True)
+
+    def span_names(self):
+        return [record['name'] for record in self.ring_buffer.records() if record['type'] == 'span']
+
+
+class InstrumentationTest(InstrumentationTestMixin, TestCase):
+    """計測レイヤーのテスト"""
+
+    def test_span_records_duration_and_error(self):
+        """区間の所要時間と、例外の種別をエラーとして記録すること"""
+        with instrumentation.span('stage', mode='execute'):
+            pass
+        with self.assertRaises(ValueError):
+            with instrumentation.span('failing'):
+                raise ValueError('boom')
+
+        records = self.ring_buffer.records()
+        self.assertEqual(records[0]['name'], 'stage')
+        self.assertEqual(records[0]['mode'], 'execute')
+        self.assertIsNone(records[0]['error'])
+        self.assertGreaterEqual(records[0]['duration_ms'], 0)
+        self.assertEqual(records[1]['error'], 'ValueError')
+
+    def test_no_sinks_is_noop(self):
+        """シンクがない場合は何も記録しないこと"""
+        instrumentation.configure([])
+
+        with instrumentation.span('stage') as span:
+            span.set(error='ignored')
+
+        self.assertEqual(self.ring_buffer.records(), [])
+
+    def test_prometheus_exposition(self):
+        """ヒストグラムとエラー数をPrometheusのテキスト形式で出力すること"""
+        with instrumentation.span('stage') as span:
+            span.set(error='calculation_failed')
+
+        text = self.prometheus.render()
+
+        self.assertIn('# TYPE geo_distance_span_duration_seconds histogram', text)
+        self.assertIn('geo_distance_span_duration_seconds_bucket{span="stage",le="+Inf"} 1', text)
+        self.assertIn('geo_distance_span_duration_seconds_count{span="stage"} 1', text)
+        self.assertIn(
+            'geo_distance_span_errors_total{span="stage",error="calculation_failed"} 1', text
+        )
+
+    def test_api_name(self):
+        """HTTPメソッドとURLからAPI名を求めること"""
+        self.assertEqual(api_name('POST', '/geo_distance_test/_search'), 'search')
+        self.assertEqual(api_name('POST', '/_msearch'), 'msearch')
+        self.assertEqual(api_name('POST', '/_scripts/painless/_execute'), 'scripts_painless_execute')
+        self.assertEqual(api_name('HEAD', '/geo_distance_test'), 'indices.exists')
+        self.assertEqual(api_name('PUT', '/geo_distance_test/_doc/point_a'), 'index')
+        self.assertEqual(api_name('GET', '/_cluster/health'), 'cluster.health')
+
+    def test_service_stages(self):
+        """calculate_distancesの各段階を区間として記録すること"""
+        service = GeoDistanceService()
+        service.client = MagicMock()
+        service.client.scripts_painless_execute.side_effect = painless_results(392.442, 392.479)
+        service.calculation_mode = 'execute'
+
+        with patch.object(service, '_ensure_index_exists', return_value=True):
+            service.calculate_distances(35.6762, 139.6503, 34.6937, 135.5023)
+
+        names = self.span_names()
+        self.assertEqual(names[:2], ['service.cache_lookup', 'service.ensure_index_exists'])
+        self.assertCountEqual(names[2:4], ['service.execute_arc', 'service.execute_plane'])
+        self.assertEqual(names[4:], ['service.calculate_distances'])
+
+    def test_async_service_stages(self):
+        """非同期サービスも同期サービスと同じ名前の区間を記録すること"""
+        service = AsyncGeoDistanceService()
+        service.client = MagicMock()
+        service.client.scripts_painless_execute = AsyncMock(side_effect=[{'result': 392.442}, {'result': 392.479}])
+        service.calculation_mode = 'execute'
+
+        with patch.object(service, '_ensure_index_exists', AsyncMock(return_value=True)):
+            result = asyncio.run(service.calculate_distances(35.6762, 139.6503, 34.6937, 135.5023))
+
+        self.assertTrue(result['success'])
+        names = self.span_names()
+        self.assertEqual(names[:2], ['service.cache_lookup', 'service.ensure_index_exists'])
+        self.assertCountEqual(names[2:4], ['service.execute_arc', 'service.execute_plane'])
+        self.assertEqual(names[4:], ['service.calculate_distances'])
+
+    def test_service_failure_is_categorized(self):
+        """計算に失敗した場合はエラーの種別を記録すること"""
+        service = GeoDistanceService()
+        service.client = MagicMock()
+        service.calculation_mode = 'indexed'
+
+        with patch.object(service, '_ensure_index_exists', return_value=False):
+            service.calculate_distances(35.6762, 139.6503, 34.6937, 135.5023)
+
+        records = self.ring_buffer.records()
+        self.assertEqual(records[-1]['name'], 'service.calculate_distances')
+        self.assertEqual(records[-1]['error'], 'index_unavailable')
+
+
+class OpenSearchCallAccountingTest(InstrumentationTestMixin, TestCase):
+    """OpenSearch呼び出しの計測のテスト"""
+
+    def setUp(self):
+        super().setUp()
+        self.server = FakeOpenSearchServer(latency_ms=5.0).start()
+        self.overrides = override_settings(
+            OPENSEARCH_HOST=self.server.host,
+            OPENSEARCH_PORT=self.server.port,
+            OPENSEARCH_USE_SSL=False,
+        )
+        self.overrides.enable()
+        client_registry.close()
+
+    def tearDown(self):
+        client_registry.close()
+        self.overrides.disable()
+        self.server.stop()
+        super().tearDown()
+
+    def test_records_took_and_client_latency(self):
+        """呼び出しごとにtookとクライアント側の所要時間を記録すること"""
+        service = GeoDistanceService()
+        service.calculation_mode = 'indexed'
+
+        result = service.calculate_distances(35.6762, 139.6503, 34.6937, 135.5023)
+
+        self.assertTrue(result['success'])
+        calls = [record for record in self.ring_buffer.records() if record['type'] == 'opensearch_call']
+        self.assertEqual(
+            [call['api'] for call in calls],
+            ['indices.exists', 'indices.put_index_template', 'indices.create', 'index', 'search'],
+        )
+        search = calls[-1]
+        self.assertIsNotNone(search['took_ms'])
+        self.assertGreaterEqual(search['duration_ms'], search['took_ms'])
+        self.assertIn('geo_distance_opensearch_took_seconds_count{api="search"} 1', self.prometheus.render())
+
+    def test_records_errors(self):
+        """OpenSearchのエラーを種別ごとに記録すること"""
+        service = GeoDistanceService()
+        index_existence_cache.mark_exists(service.index_name)
+
+        service._search_arc_and_plane(34.6937, 135.5023, 'point_a')
+
+        calls = [record for record in self.ring_buffer.records() if record['type'] == 'opensearch_call']
+        self.assertEqual(calls[-1]['error'], 'index_not_found_exception')
+        self.assertEqual(calls[-1]['status'], 404)
+
+
+class MetricsViewTest(InstrumentationTestMixin, TestCase):
+    """Prometheusのエンドポイントのテスト"""
+
+    def test_metrics_endpoint(self):
+        """計測結果をPrometheusのテキスト形式で返すこと"""
+        Client().get(reverse('geodistance:geo_distance'))
+
+        response = Client().get(reverse('geodistance:metrics'))
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        self.assertIn('span="view.geo_distance"', response.content.decode())
+        self.assertIn('span="view.render"', response.content.decode())
+
+    def test_metrics_endpoint_without_prometheus_sink(self):
+        """Prometheusのシンクがない場合は404を返すこと"""
+        instrumentation.configure([self.ring_buffer])
+
+        response = Client().get(reverse('geodistance:metrics'))
+
+        self.assertEqual(response.status_code, 404)
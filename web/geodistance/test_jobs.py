@@ -0,0 +1,211 @@
+import csv
+import io
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+
+from geodistance.cache import distance_result_cache
+from geodistance.clients import client_registry
+from geodistance.fake_opensearch import FakeOpenSearchServer
+from geodistance.jobs import retry_delay, run_next_chunk, run_worker, submit_job
+from geodistance.models import DistanceJob, DistanceJobChunk
+from geodistance.services import GeoDistanceService, index_existence_cache
+
+
+TOKYO_OSAKA = (35.6762, 139.6503, 34.6937, 135.5023)
+
+
+@override_settings(GEO_DISTANCE_CALCULATION_MODE='local')
+class DistanceJobTest(TestCase):
+    """バックグラウンドジョブのテスト"""
+
+    def test_submit_splits_into_chunks(self):
+        """地点の組をチャンクに分けて保存すること"""
+        job = submit_job([TOKYO_OSAKA] * 5, chunk_size=2)
+
+        self.assertEqual(job.status, DistanceJob.Status.QUEUED)
+        self.assertEqual(job.total_pairs, 5)
+        self.assertEqual(job.total_chunks, 3)
+        self.assertEqual(
+            [len(chunk.pairs) for chunk in job.chunks.order_by('number')], [2, 2, 1]
+        )
+
+    def test_submit_rolls_back_invalid_input(self):
+        """入力の途中でエラーになった場合はジョブを登録しないこと"""
+        def pairs():
+            yield TOKYO_OSAKA
+            raise ValueError('2行目の形式が正しくありません')
+
+        with self.assertRaises(ValueError):
+            submit_job(pairs(), chunk_size=1)
+
+        self.assertFalse(DistanceJob.objects.exists())
+        self.assertFalse(DistanceJobChunk.objects.exists())
+
+    def test_chunks_are_checkpointed(self):
+        """チャンクごとに進捗を記録し、すべて計算し終えたらジョブを完了にすること"""
+        job = submit_job([TOKYO_OSAKA, (91.0, 0.0, 0.0, 0.0), TOKYO_OSAKA], chunk_size=2)
+
+        self.assertTrue(run_next_chunk())
+        job.refresh_from_db()
+        self.assertEqual(job.status, DistanceJob.Status.RUNNING)
+        self.assertEqual(job.processed_pairs, 2)
+        self.assertEqual(job.progress, 2 / 3)
+        self.assertIsNotNone(job.started_at)
+
+        self.assertEqual(run_worker(burst=True), 1)
+        job.refresh_from_db()
+        self.assertEqual(job.status, DistanceJob.Status.SUCCEEDED)
+        self.assertEqual(job.error_rows, 1)
+        first = job.chunks.get(number=0)
+        self.assertEqual(first.rows[0]['arc_distance_km'], 392.442)
+        self.assertIn('緯度が範囲外です', first.rows[1]['error_message'])
+        self.assertFalse(run_next_chunk())
+
+    def test_failed_chunk_is_retried_then_fails_job(self):
+        """計算に失敗したチャンクは再試行し、上限に達したらジョブを失敗にすること"""
+        job = submit_job([TOKYO_OSAKA] * 2, chunk_size=1)
+
+        with self.settings(GEO_DISTANCE_JOB_MAX_ATTEMPTS=2, GEO_DISTANCE_JOB_RETRY_BACKOFF=0):
+            with patch.object(GeoDistanceService, '_calculate_batch_chunk', side_effect=RuntimeError('boom')):
+                self.assertTrue(run_next_chunk())
+                chunk = job.chunks.get(number=0)
+                self.assertEqual(chunk.status, DistanceJobChunk.Status.PENDING)
+                self.assertEqual(chunk.attempts, 1)
+
+                self.assertTrue(run_next_chunk())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, DistanceJob.Status.FAILED)
+        self.assertIn('boom', job.error_message)
+        # 失敗したジョブの残りのチャンクは取り出さない
+        self.assertFalse(run_next_chunk())
+
+    def test_failed_chunk_waits_before_retry(self):
+        """失敗したチャンクはnext_attempt_atまで取り出さず、再試行の間隔を倍ずつ延ばすこと"""
+        job = submit_job([TOKYO_OSAKA], chunk_size=1)
+
+        with self.settings(GEO_DISTANCE_JOB_RETRY_BACKOFF=60, GEO_DISTANCE_JOB_RETRY_BACKOFF_MAX=100):
+            with patch.object(GeoDistanceService, '_calculate_batch_chunk', side_effect=RuntimeError('boom')):
+                self.assertTrue(run_next_chunk())
+                self.assertFalse(run_next_chunk())
+            self.assertEqual([retry_delay(n) for n in (1, 2, 3)], [60, 100, 100])
+
+        chunk = job.chunks.get()
+        self.assertEqual(chunk.attempts, 1)
+        self.assertGreater(chunk.next_attempt_at, chunk.job.created_at)
+        DistanceJobChunk.objects.filter(pk=chunk.pk).update(next_attempt_at=None)
+        self.assertTrue(run_next_chunk())
+        job.refresh_from_db()
+        self.assertEqual(job.status, DistanceJob.Status.SUCCEEDED)
+
+    def test_run_distance_workers_command(self):
+        """run_distance_workersが未計算のチャンクを処理して終了すること"""
+        job = submit_job([TOKYO_OSAKA] * 3, chunk_size=1)
+        out = io.StringIO()
+
+        call_command('run_distance_workers', processes=1, burst=True, stdout=out)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, DistanceJob.Status.SUCCEEDED)
+        self.assertIn('3チャンクを処理しました', out.getvalue())
+
+
+@override_settings(
+    GEO_DISTANCE_CALCULATION_MODE='execute', GEO_DISTANCE_JOB_MAX_ATTEMPTS=3, GEO_DISTANCE_JOB_RETRY_BACKOFF=0
+)
+class OpenSearchDistanceJobTest(TestCase):
+    """OpenSearchで計算するジョブのテスト（ローカルのOpenSearch互換サーバーを使う）"""
+
+    def setUp(self):
+        self.server = FakeOpenSearchServer().start()
+        self.overrides = override_settings(
+            OPENSEARCH_HOST=self.server.host, OPENSEARCH_PORT=self.server.port, OPENSEARCH_USE_SSL=False
+        )
+        self.overrides.enable()
+        client_registry.close()
+        distance_result_cache.clear()
+        index_existence_cache.invalidate()
+
+    def tearDown(self):
+        client_registry.close()
+        distance_result_cache.clear()
+        index_existence_cache.invalidate()
+        self.overrides.disable()
+        self.server.stop()
+
+    def test_msearch_failure_fails_job(self):
+        """_msearchそのものが失敗したチャンクは完了にせず、上限まで再試行してからジョブを失敗にすること"""
+        job = submit_job([TOKYO_OSAKA] * 2, chunk_size=2)
+        self.server.inject_fault(api='msearch', status=400, count=3)
+
+        for attempts in (1, 2):
+            self.assertTrue(run_next_chunk())
+            chunk = job.chunks.get()
+            self.assertEqual((chunk.status, chunk.attempts), (DistanceJobChunk.Status.PENDING, attempts))
+            job.refresh_from_db()
+            self.assertEqual((job.status, job.processed_pairs), (DistanceJob.Status.RUNNING, 0))
+
+        self.assertTrue(run_next_chunk())
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, DistanceJob.Status.FAILED)
+        self.assertEqual(job.chunks.get().attempts, 3)
+        self.assertEqual(self.server.calls()['msearch'], 3)
+        self.assertFalse(run_next_chunk())
+
+    def test_recovers_after_transient_failure(self):
+        """一度失敗したチャンクも再試行で計算できればジョブを完了にすること"""
+        job = submit_job([TOKYO_OSAKA] * 2, chunk_size=2)
+        self.server.inject_fault(api='msearch', status=400)
+
+        self.assertEqual(run_worker(burst=True), 2)
+
+        job.refresh_from_db()
+        self.assertEqual((job.status, job.error_rows), (DistanceJob.Status.SUCCEEDED, 0))
+        self.assertEqual(job.chunks.get().rows[0]['arc_distance_km'], 392.442)
+
+
+@override_settings(GEO_DISTANCE_CALCULATION_MODE='local')
+class DistanceJobViewTest(TestCase):
+    """ジョブの登録・進捗・結果のエンドポイントのテスト"""
+
+    def test_submit_poll_and_download(self):
+        """ジョブを登録し、進捗を確認して、完了後に結果をCSVで取得できること"""
+        body = 'a_lat,a_lon,b_lat,b_lon\n' + '35.6762,139.6503,34.6937,135.5023\n' * 3
+
+        response = self.client.post(
+            reverse('geodistance:distance_job_create') + '?chunk_size=2', data=body, content_type='text/csv'
+        )
+
+        self.assertEqual(response.status_code, 202)
+        created = response.json()
+        self.assertEqual(created['total_pairs'], 3)
+        self.assertEqual(self.client.get(created['results_url']).status_code, 409)
+
+        run_worker(burst=True)
+
+        status = self.client.get(created['status_url']).json()
+        self.assertEqual(status['status'], 'succeeded')
+        self.assertEqual(status['progress'], 1.0)
+        response = self.client.get(created['results_url'])
+        rows = list(csv.DictReader(io.StringIO(b''.join(response.streaming_content).decode())))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual(rows[2]['plane_distance_km'], '392.479')
+
+    def test_invalid_input(self):
+        """不正な入力は400を返し、ジョブを登録しないこと"""
+        response = self.client.post(
+            reverse('geodistance:distance_job_create'), data='not json\n', content_type='application/x-ndjson'
+        )
+
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(DistanceJob.objects.exists())
+
+    def test_unknown_job(self):
+        """存在しないジョブは404を返すこと"""
+        url = reverse('geodistance:distance_job', args=['00000000-0000-0000-0000-000000000000'])
+
+        self.assertEqual(self.client.get(url).status_code, 404)
@@ -0,0 +1,202 @@
+import io
+import json
+import tempfile
+from pathlib import Path
+from unittest.mock import patch
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from geodistance.clients import client_registry, get_client
+from geodistance.fake_opensearch import FakeOpenSearchServer
+from geodistance.loader import _BulkLoadSettings, load_reference_points
+from geodistance.readers import detect_point_format, iter_reference_points
+from geodistance.services import GeoDistanceService
+
+
+GEOJSON = {
+    "type": "FeatureCollection",
+    "features": [
+        {
+            "type": "Feature",
+            "id": "tokyo",
+            "geometry": {"type": "Point", "coordinates": [139.7671, 35.6812]},
+            "properties": {"name": "東京駅", "line": "山手線"},
+        },
+        {
+            "type": "Feature",
+            "geometry": {"type": "Point", "coordinates": [135.4959, 34.7025]},
+            "properties": {"id": "osaka", "name": "大阪駅"},
+        },
+    ],
+}
+
+
+class ReferencePointReaderTest(TestCase):
+    """参照地点ファイルの読み込みのテスト"""
+
+    def test_csv(self):
+        """ヘッダーの緯度経度列とid・name以外をpropertiesとして読み込むこと"""
+        stream = io.BytesIO('id,name,latitude,lng,kind\n1,東京駅,35.6812,139.7671,station\n'.encode())
+
+        points = list(iter_reference_points(stream, 'csv'))
+
+        self.assertEqual(points, [{
+            'id': '1', 'name': '東京駅', 'lat': 35.6812, 'lon': 139.7671, 'properties': {'kind': 'station'},
+        }])
+
+    def test_geojson_is_streamed(self):
+        """FeatureCollectionのfeaturesを少しずつ読み込みながら1件ずつ返すこと"""
+        stream = io.StringIO(json.dumps(GEOJSON, ensure_ascii=False))
+
+        with patch('geodistance.readers._JSON_READ_SIZE', 16):
+            points = list(iter_reference_points(stream, 'geojson'))
+
+        self.assertEqual([point['id'] for point in points], ['tokyo', 'osaka'])
+        self.assertEqual(points[0]['lat'], 35.6812)
+        self.assertEqual(points[0]['properties'], {'line': '山手線'})
+        self.assertEqual(points[1]['name'], '大阪駅')
+
+    def test_ndjson_accepts_features_and_flat_rows(self):
+        """NDJSONはFeatureと緯度経度を持つ辞書のどちらも受け付けること"""
+        lines = [json.dumps(GEOJSON['features'][0]), json.dumps({'lat': 34.7025, 'lon': 135.4959})]
+
+        points = list(iter_reference_points(io.StringIO('\n'.join(lines)), 'ndjson'))
+
+        self.assertEqual([(point['lat'], point['lon']) for point in points], [(35.6812, 139.7671), (34.7025, 135.4959)])
+
+    def test_invalid_points(self):
+        """座標の範囲外やPoint以外のジオメトリはエラーになること"""
+        with self.assertRaises(ValueError):
+            list(iter_reference_points(io.StringIO('lat,lon\n91,0\n'), 'csv'))
+        line = json.dumps({'type': 'Feature', 'geometry': {'type': 'LineString', 'coordinates': []}})
+        with self.assertRaises(ValueError):
+            list(iter_reference_points(io.StringIO(line), 'ndjson'))
+
+    def test_detect_point_format(self):
+        """拡張子から入力形式を判定すること"""
+        self.assertEqual(detect_point_format('stations.geojson'), 'geojson')
+        self.assertEqual(detect_point_format('stations.jsonl'), 'ndjson')
+        self.assertEqual(detect_point_format('stations.csv'), 'csv')
+        with self.assertRaises(ValueError):
+            detect_point_format('stations.txt')
+
+
+class ReferencePointLoaderTest(TestCase):
+    """参照地点の並列登録のテスト"""
+
+    def setUp(self):
+        self.server = FakeOpenSearchServer().start()
+        self.overrides = override_settings(
+            OPENSEARCH_HOST=self.server.host,
+            OPENSEARCH_PORT=self.server.port,
+            OPENSEARCH_USE_SSL=False,
+        )
+        self.overrides.enable()
+        client_registry.close()
+
+    def tearDown(self):
+        client_registry.close()
+        self.overrides.disable()
+        self.server.stop()
+
+    def test_parallel_bulk_restores_settings(self):
+        """チャンクごとに_bulkで登録し、refreshとレプリカの設定を元に戻すこと"""
+        points = ({'id': str(i), 'lat': 35.0, 'lon': 135.0 + i / 1000} for i in range(250))
+        progress = []
+
+        result = load_reference_points(
+            get_client(), 'stations', points, chunk_size=100, thread_count=2,
+            progress_every=100, on_progress=lambda processed, elapsed: progress.append(processed),
+        )
+
+        self.assertEqual((result.indexed, result.failed), (250, 0))
+        self.assertEqual(progress, [100, 200])
+        self.assertEqual(len(self.server.documents('stations')), 250)
+        self.assertEqual(self.server.calls()['bulk'], 3)
+        self.assertEqual(self.server.calls()['indices.put_settings'], 2)
+        self.assertEqual(self.server.index_settings('stations'), {'number_of_replicas': '1'})
+
+    def test_settings_are_restored_on_error(self):
+        """読み込み中にエラーが発生しても設定を元に戻すこと"""
+        def points():
+            yield {'id': '1', 'lat': 35.0, 'lon': 135.0}
+            raise ValueError('broken input')
+
+        with self.assertRaises(ValueError):
+            load_reference_points(get_client(), 'stations', points())
+
+        self.assertEqual(self.server.index_settings('stations'), {'number_of_replicas': '1'})
+
+    def test_overlapping_loads_restore_settings(self):
+        """登録が重なっても、後から始めた登録が無効にした設定に戻さないこと"""
+        client = get_client()
+        load_reference_points(client, 'stations', iter([]))
+        first = _BulkLoadSettings(client, 'stations').__enter__()
+        second = _BulkLoadSettings(client, 'stations').__enter__()
+        first.__exit__(None, None, None)
+        second.__exit__(None, None, None)
+
+        self.assertEqual(self.server.index_settings('stations'), {'number_of_replicas': '1'})
+
+        # 中断された登録が無効にしたまま残した設定も、次の登録の後は元に戻る
+        client.indices.put_settings(
+            index='stations', body={'index': {'refresh_interval': '-1', 'number_of_replicas': 0}}
+        )
+        load_reference_points(client, 'stations', iter([{'id': '1', 'lat': 35.0, 'lon': 135.0}]))
+
+        self.assertEqual(self.server.index_settings('stations'), {'number_of_replicas': '1'})
+
+    def test_reload_without_ids_does_not_duplicate(self):
+        """IDがない地点は座標と名称からIDを決め、同じファイルを登録し直しても重複しないこと"""
+        points = [
+            {'id': None, 'name': '東京駅', 'lat': 35.6812, 'lon': 139.7671},
+            {'id': None, 'name': '大阪駅', 'lat': 34.7025, 'lon': 135.4959},
+        ]
+
+        load_reference_points(get_client(), 'stations', iter(points))
+        load_reference_points(get_client(), 'stations', iter(points))
+
+        documents = self.server.documents('stations')
+        self.assertEqual(len(documents), 2)
+        self.assertTrue(all(doc_id == source['point_id'] for doc_id, source in documents.items()))
+
+    def test_command(self):
+        """manage.py load_geo_pointsでファイルを登録し、docs/secを表示すること"""
+        with tempfile.TemporaryDirectory() as directory:
+            path = Path(directory) / 'stations.geojson'
+            path.write_text(json.dumps(GEOJSON), encoding='utf-8')
+            stdout = io.StringIO()
+
+            call_command('load_geo_points', str(path), '--index', 'stations', stdout=stdout)
+
+        self.assertIn('2件を登録しました', stdout.getvalue())
+        self.assertIn('docs/sec', stdout.getvalue())
+        self.assertEqual(sorted(self.server.documents('stations')), ['osaka', 'tokyo'])
+        self.assertEqual(
+            self.server.documents('stations')['tokyo']['location'], {'lat': 35.6812, 'lon': 139.7671}
+        )
+
+    def test_nearest_reference_points_pagination(self):
+        """登録した参照地点を近い順に取得し、search_afterで続きのページを取得できること"""
+        points = [
+            {'id': 'tokyo', 'name': '東京駅', 'lat': 35.6812, 'lon': 139.7671},
+            {'id': 'shinagawa', 'name': '品川駅', 'lat': 35.6285, 'lon': 139.7388},
+            {'id': 'yokohama', 'name': '横浜駅', 'lat': 35.4658, 'lon': 139.6223},
+            {'id': 'osaka', 'name': '大阪駅', 'lat': 34.7025, 'lon': 135.4959},
+        ]
+        with self.settings(GEO_REFERENCE_INDEX='stations'):
+            load_reference_points(get_client(), 'stations', iter(points))
+            service = GeoDistanceService()
+
+            first = service.find_nearest_reference_points(35.6762, 139.6503, k=2, radius_km=100)
+            second = service.find_nearest_reference_points(
+                35.6762, 139.6503, k=2, radius_km=100, search_after=first['next_search_after']
+            )
+
+        self.assertEqual([point['id'] for point in first['points']], ['shinagawa', 'tokyo'])
+        self.assertEqual([point['id'] for point in second['points']], ['yokohama'])
+        self.assertIsNone(second['next_search_after'])
+        tokyo = first['points'][1]
+        self.assertGreater(tokyo['plane_distance_km'], tokyo['arc_distance_km'] - 0.01)
+        self.assertEqual(tokyo['name'], '東京駅')
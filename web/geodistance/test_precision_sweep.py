@@ -0,0 +1,143 @@
+import io
+import json
+import tempfile
+from pathlib import Path
+
+import numpy as np
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+
+from geodistance.clients import client_registry
+from geodistance.fake_opensearch import FakeOpenSearchServer
+from geodistance.precision_sweep import generate_pairs, geodesic_distance, run_sweep
+from geodistance.services import index_existence_cache
+
+
+class GeodesicDistanceTest(TestCase):
+    """Vincentyの逆解法による測地線距離のテスト"""
+
+    def test_known_distance(self):
+        """Vincentyの論文の例（Flinders Peak〜Buninyong）と一致すること"""
+        distance = geodesic_distance(
+            -(37 + 57 / 60 + 3.72030 / 3600),
+            144 + 25 / 60 + 29.52440 / 3600,
+            -(37 + 39 / 60 + 10.15610 / 3600),
+            143 + 55 / 60 + 35.38390 / 3600,
+        )
+
+        self.assertAlmostEqual(float(distance), 54972.271, places=3)
+
+    def test_edge_cases(self):
+        """同じ地点は0、赤道上の組は長半径の弧、Vincentyが収束しない対蹠点付近はKarneyの方法で求めること"""
+        distances = geodesic_distance(
+            [35.0, 0.0, 0.0, 0.0], [139.0, 0.0, 0.0, 0.0], [35.0, 0.0, 0.5, 0.0], [139.0, 90.0, 179.7, 180.0]
+        )
+
+        self.assertEqual(distances[0], 0.0)
+        self.assertAlmostEqual(distances[1], 6378137.0 * np.pi / 2, places=3)
+        # 赤道上の対蹠点は極を通る子午線の半周（Karneyの論文の値）
+        self.assertAlmostEqual(distances[3], 20003931.4586, places=3)
+        self.assertTrue(19900000 < distances[2] < distances[3])
+
+
+class PrecisionSweepTest(TestCase):
+    """精度スイープのテスト"""
+
+    def test_pairs_are_stratified(self):
+        """緯度帯×距離帯に同じ数の組を割り当て、帯の範囲内の地点を生成すること"""
+        latitude_index, band_index, a_lat, a_lon, b_lat, b_lon = generate_pairs(
+            0, 600, [-90, 0, 90], [0, 10, 100, 1000]
+        )
+
+        self.assertEqual(np.bincount(latitude_index * 3 + band_index).tolist(), [100] * 6)
+        lower = np.where(latitude_index == 0, -90, 0)
+        self.assertTrue(np.all((a_lat >= lower) & (a_lat < lower + 90)))
+        distances = geodesic_distance(a_lat, a_lon, b_lat, b_lon) / 1000
+        self.assertTrue(np.all(distances[band_index == 0] < 10.1))
+        self.assertTrue(np.all(distances[band_index == 2] > 0.99))
+
+    def test_statistics(self):
+        """arcの誤差は楕円体との差（0.6%未満）に収まり、距離帯ごとにまとめられること"""
+        statistics = run_sweep(7000, latitude_band=30, band_edges_km=[0, 10, 1000], chunk_size=1000)
+        bands = statistics.by_distance_band().rows()
+        cells = statistics.rows()
+
+        self.assertEqual(len(cells), 12)
+        self.assertEqual(sum(row['count'] + row['failures'] for row in cells), 7000)
+        self.assertEqual([row['count'] for row in bands], [3500, 3500])
+        for row in bands:
+            self.assertLess(row['arc_max_abs_error_pct'], 0.6)
+            self.assertGreater(row['arc_rms_error_m'], abs(row['arc_mean_error_m']))
+            self.assertLessEqual(0, row['plane_closer_ratio'])
+        self.assertEqual(
+            bands[1]['arc_max_abs_error_m'], max(row['arc_max_abs_error_m'] for row in cells[1::2])
+        )
+
+    def test_near_antipodal_pairs_are_counted(self):
+        """対蹠点に近い組も測地線距離を求めて集計に含めること"""
+        statistics = run_sweep(20000, latitude_band=90, band_edges_km=[0, 19900, 20100], chunk_size=5000)
+
+        self.assertEqual(statistics.failures.sum(), 0)
+        self.assertEqual(statistics.count.sum(), 20000)
+
+    def test_processes_give_same_statistics(self):
+        """プロセス数によらず同じ集計になること"""
+        single = run_sweep(4000, latitude_band=45, band_edges_km=[0, 100, 1000], chunk_size=500).rows()
+        parallel = run_sweep(
+            4000, latitude_band=45, band_edges_km=[0, 100, 1000], chunk_size=500, processes=2
+        ).rows()
+
+        for expected, actual in zip(single, parallel):
+            self.assertEqual(expected['count'], actual['count'])
+            self.assertAlmostEqual(expected['plane_rms_error_m'], actual['plane_rms_error_m'])
+
+    def test_invalid_parameters(self):
+        """緯度帯の幅・距離帯の境界・計算先が不正な場合はエラーになること"""
+        for options in ({'latitude_band': 7}, {'band_edges_km': [10, 1]}, {'backend': 'remote'}):
+            with self.assertRaises(ValueError):
+                run_sweep(10, **options)
+
+    def test_command(self):
+        """manage.py sweep_geo_precisionで距離帯ごとの統計を出力し、JSONに保存すること"""
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / 'sweep.json'
+            stdout = io.StringIO()
+
+            call_command(
+                'sweep_geo_precision', '--pairs', '2000', '--bands', '0,100,1000', '--processes', '1',
+                '--output', str(output), stdout=stdout,
+            )
+
+            report = json.loads(output.read_text())
+        self.assertIn('0-100km  1000', stdout.getvalue())
+        self.assertEqual(len(report['bands']), 2)
+        self.assertEqual(len(report['cells']), 36)
+
+
+@override_settings(OPENSEARCH_USE_SSL=False, GEO_DISTANCE_BATCH_CHUNK_SIZE=100)
+class OpenSearchPrecisionSweepTest(TestCase):
+    """OpenSearchで計算する精度スイープのテスト（ローカルのOpenSearch互換サーバーを使う）"""
+
+    def setUp(self):
+        self.server = FakeOpenSearchServer().start()
+        client_registry.close()
+        index_existence_cache.invalidate()
+
+    def tearDown(self):
+        client_registry.close()
+        index_existence_cache.invalidate()
+        self.server.stop()
+
+    def test_matches_local_engine(self):
+        """_bulk/_msearchで計算した統計がローカルエンジンの統計と一致すること"""
+        options = {'latitude_band': 90, 'band_edges_km': [0, 10, 1000], 'chunk_size': 200}
+        local = run_sweep(400, **options).rows()
+
+        with self.settings(OPENSEARCH_HOST=self.server.host, OPENSEARCH_PORT=self.server.port):
+            remote = run_sweep(400, backend='opensearch', **options).rows()
+
+        self.assertEqual(self.server.calls()['msearch'], 4)
+        for expected, actual in zip(local, remote):
+            self.assertEqual(expected['count'], actual['count'])
+            self.assertAlmostEqual(expected['arc_rms_error_m'], actual['arc_rms_error_m'], places=6)
+            self.assertAlmostEqual(expected['plane_max_abs_error_m'], actual['plane_max_abs_error_m'], places=6)
@@ -0,0 +1,185 @@
+import time
+
+from django.test import TestCase, override_settings
+from opensearchpy.exceptions import ConnectionTimeout, TransportError
+
+from geodistance.clients import client_registry, get_client
+from geodistance.fake_opensearch import FakeOpenSearchServer
+from geodistance.instrumentation import PrometheusSink, instrumentation
+from geodistance.resilience import CircuitBreaker, CircuitOpenError
+from geodistance.services import GeoDistanceService
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+class CircuitBreakerTest(TestCase):
+    """サーキットブレーカーの状態遷移のテスト"""
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.breaker = CircuitBreaker(name='test', failure_threshold=3, reset_timeout=10.0, clock=self.clock)
+
+    def test_opens_after_consecutive_failures(self):
+        """連続した失敗がしきい値に達するとopenになり、成功で失敗数がリセットされること"""
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.breaker.record_success()
+        self.breaker.record_failure()
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+        self.breaker.record_failure()
+
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+        self.assertFalse(self.breaker.allow())
+
+    def test_half_open_allows_single_probe(self):
+        """期間の経過後は1回だけ試行を許し、結果に応じてclosedかopenに戻ること"""
+        for _ in range(3):
+            self.breaker.record_failure()
+        self.clock.now = 10.0
+
+        self.assertTrue(self.breaker.allow())
+        self.assertEqual(self.breaker.state, CircuitBreaker.HALF_OPEN)
+        self.assertFalse(self.breaker.allow())
+
+        self.breaker.record_failure()
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        self.clock.now = 20.0
+        self.assertTrue(self.breaker.allow())
+        self.breaker.record_success()
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+    def test_cluster_health(self):
+        """cluster.healthがredならopen、green/yellowならclosedにすること"""
+        self.breaker.record_health('red')
+        self.assertEqual(self.breaker.state, CircuitBreaker.OPEN)
+
+        self.breaker.record_health('yellow')
+        self.assertEqual(self.breaker.state, CircuitBreaker.CLOSED)
+
+
+@override_settings(GEO_DISTANCE_RETRY_BASE_DELAY=0.001, GEO_DISTANCE_RETRY_MAX_DELAY=0.001)
+class ResilientTransportTest(TestCase):
+    """期限・再試行・サーキットブレーカー・ヘッジを加えたTransportのテスト"""
+
+    def setUp(self):
+        self.server = FakeOpenSearchServer().start()
+        self.overrides = override_settings(
+            OPENSEARCH_HOST=self.server.host,
+            OPENSEARCH_PORT=self.server.port,
+            OPENSEARCH_USE_SSL=False,
+        )
+        self.overrides.enable()
+        client_registry.close()
+        self.prometheus = PrometheusSink()
+        instrumentation.configure([self.prometheus])
+        self.client = get_client()
+        self.client.indices.create(index='points')
+        self.client.index(index='points', id='1', body={'name': '東京'}, refresh=True)
+        self.server.reset_calls()
+
+    def tearDown(self):
+        self.client.transport.circuit_breaker.reset()
+        instrumentation._sinks = None
+        client_registry.close()
+        self.overrides.disable()
+        self.server.stop()
+
+    def search(self, **kwargs):
+        return self.client.search(index='points', body={'query': {'match_all': {}}}, **kwargs)
+
+    def test_retries_idempotent_search(self):
+        """検索が503で失敗した場合は再試行して成功し、再試行回数を記録すること"""
+        self.server.inject_fault(api='search', status=503, count=2)
+
+        response = self.search()
+
+        self.assertEqual(response['hits']['total']['value'], 1)
+        self.assertEqual(self.server.calls()['search'], 3)
+        self.assertIn('geo_distance_opensearch_retries_total{api="search"} 2', self.prometheus.render())
+
+    def test_does_not_retry_writes(self):
+        """冪等でない書き込みは再試行しないこと"""
+        self.server.inject_fault(api='index', status=503)
+
+        with self.assertRaises(TransportError):
+            self.client.index(index='points', id='2', body={'name': '大阪'})
+
+        self.assertEqual(self.server.calls()['index'], 1)
+
+    def test_gives_up_after_attempts(self):
+        """試行回数を使い切った場合は最後のエラーを返すこと"""
+        self.server.inject_fault(api='search', status=503, count=10)
+
+        with self.settings(GEO_DISTANCE_RETRY_ATTEMPTS=2):
+            with self.assertRaises(TransportError) as context:
+                self.search()
+
+        self.assertEqual(context.exception.status_code, 503)
+        self.assertEqual(self.server.calls()['search'], 2)
+
+    def test_deadline(self):
+        """応答が期限を過ぎた場合はタイムアウトにすること"""
+        self.server.inject_fault(api='search', status=None, delay_ms=500)
+
+        started = time.perf_counter()
+        with self.settings(GEO_DISTANCE_OPENSEARCH_DEADLINE=0.1, GEO_DISTANCE_RETRY_ATTEMPTS=1):
+            with self.assertRaises(ConnectionTimeout):
+                self.search()
+
+        self.assertLess(time.perf_counter() - started, 0.4)
+
+    def test_breaker_fails_fast_and_recovers_with_health(self):
+        """ブレーカーが開いている間は呼び出さずに失敗し、cluster.healthのgreenで閉じること"""
+        self.server.inject_fault(api='search', status=503, count=3)
+
+        with self.settings(GEO_DISTANCE_BREAKER_FAILURE_THRESHOLD=3, GEO_DISTANCE_BREAKER_RESET_TIMEOUT=60.0):
+            with self.assertRaises(TransportError):
+                self.search()
+            with self.assertRaises(CircuitOpenError):
+                self.search()
+            self.assertEqual(self.server.calls()['search'], 3)
+
+            success, message = GeoDistanceService().test_connection()
+            response = self.search(request_timeout=5)
+
+        self.assertTrue(success)
+        self.assertIn('green', message)
+        self.assertEqual(response['hits']['total']['value'], 1)
+        cluster = self.client.transport.circuit_breaker.name
+        text = self.prometheus.render()
+        self.assertIn('# TYPE geo_distance_circuit_breaker_state gauge', text)
+        self.assertIn(f'geo_distance_circuit_breaker_state{{cluster="{cluster}"}} 0', text)
+        self.assertIn(
+            f'geo_distance_circuit_breaker_rejections_total{{cluster="{cluster}",api="search"}} 1', text
+        )
+
+    def test_red_health_opens_breaker(self):
+        """cluster.healthがredの場合はブレーカーを開くこと"""
+        self.server.health_status = 'red'
+
+        GeoDistanceService().test_connection()
+
+        with self.assertRaises(CircuitOpenError):
+            self.search()
+        self.assertNotIn('search', self.server.calls())
+
+    def test_hedged_search(self):
+        """検索が遅い場合は重複して送り、先に返った応答を使うこと"""
+        self.server.inject_fault(api='search', status=None, delay_ms=1000)
+
+        started = time.perf_counter()
+        with self.settings(GEO_DISTANCE_HEDGE_DELAY_MS=50):
+            response = self.search()
+
+        self.assertLess(time.perf_counter() - started, 0.8)
+        self.assertEqual(response['hits']['total']['value'], 1)
+        self.assertIn('geo_distance_opensearch_hedged_requests_total{api="search"} 1', self.prometheus.render())
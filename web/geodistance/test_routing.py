@@ -0,0 +1,99 @@
+from types import SimpleNamespace
+
+from django.test import TestCase, override_settings
+
+from geodistance.clients import client_registry, get_client
+from geodistance.fake_opensearch import FakeOpenSearchServer
+from geodistance.routing import LeastOutstandingSelector, routing_options
+
+
+class LeastOutstandingSelectorTest(TestCase):
+    """実行中のリクエスト数によるノードの選択のテスト"""
+
+    def test_selects_least_outstanding(self):
+        """実行中のリクエストが最も少ないノードを選び、同数の場合は順に選ぶこと"""
+        nodes = [SimpleNamespace(name=name, in_flight=0) for name in ('a', 'b', 'c')]
+        selector = LeastOutstandingSelector({})
+
+        self.assertEqual([selector.select(nodes).name for _ in range(3)], ['a', 'b', 'c'])
+
+        nodes[0].in_flight = 2
+        nodes[2].in_flight = 1
+        self.assertEqual([selector.select(nodes).name for _ in range(3)], ['b', 'b', 'b'])
+
+    @override_settings(OPENSEARCH_NODE_SELECTOR='fastest')
+    def test_unknown_selector(self):
+        """未対応の選択方法はValueErrorにすること"""
+        with self.assertRaises(ValueError):
+            routing_options()
+
+
+@override_settings(
+    OPENSEARCH_USE_SSL=False,
+    OPENSEARCH_NODE_SELECTOR='round_robin',
+    GEO_DISTANCE_RETRY_BASE_DELAY=0.001,
+    GEO_DISTANCE_RETRY_MAX_DELAY=0.001,
+)
+class MultiNodeRoutingTest(TestCase):
+    """複数のノードへの振り分けのテスト（ローカルのOpenSearch互換サーバーを3台使う）"""
+
+    def setUp(self):
+        self.servers = [FakeOpenSearchServer().start() for _ in range(3)]
+        self.addresses = [f'{server.host}:{server.port}' for server in self.servers]
+        client_registry.close()
+
+    def tearDown(self):
+        for client in client_registry._clients.values():
+            client.transport.circuit_breaker.reset()
+        client_registry.close()
+        for server in self.servers:
+            if server._thread is not None:
+                server.stop()
+
+    def hosts(self, servers):
+        return [{'host': server.host, 'port': server.port} for server in servers]
+
+    def call(self, times):
+        client = get_client()
+        for _ in range(times):
+            client.cluster.health()
+        return [server.calls().get('cluster.health', 0) for server in self.servers]
+
+    def test_spreads_requests_across_hosts(self):
+        """OPENSEARCH_HOSTSのすべてのノードに均等に振り分けること"""
+        with self.settings(OPENSEARCH_HOSTS=self.hosts(self.servers)):
+            self.assertEqual(self.call(30), [10, 10, 10])
+
+    def test_sniff_on_start(self):
+        """起動時のスニッフィングで見つけたノードにも振り分けること"""
+        self.servers[0].cluster_nodes = self.addresses
+
+        with self.settings(OPENSEARCH_HOSTS=self.hosts(self.servers[:1]), OPENSEARCH_SNIFF_ON_START=True):
+            counts = self.call(30)
+
+        self.assertEqual(self.servers[0].calls()['nodes.info'], 1)
+        self.assertEqual(counts, [10, 10, 10])
+
+    def test_sniff_failure_keeps_seed_hosts(self):
+        """スニッフィングに失敗しても設定されたノードで続けること"""
+        self.servers[0].inject_fault(api='nodes.info', status=500)
+
+        with self.settings(OPENSEARCH_HOSTS=self.hosts(self.servers[:1]), OPENSEARCH_SNIFF_ON_START=True):
+            counts = self.call(3)
+
+        self.assertEqual(counts, [3, 0, 0])
+
+    def test_dead_node_cooldown(self):
+        """停止したノードは振り分けから外し、他のノードへの再試行で成功すること"""
+        self.servers[2].stop()
+        self.servers[2]._thread = None
+
+        with self.settings(OPENSEARCH_HOSTS=self.hosts(self.servers), OPENSEARCH_DEAD_TIMEOUT=60):
+            counts = self.call(12)
+            pool = get_client().transport.connection_pool
+
+        self.assertEqual(sum(counts), 12)
+        self.assertEqual(len(pool.connections), 2)
+        self.assertEqual(
+            [connection.port for connection in pool.dead_count], [self.servers[2].port]
+        )
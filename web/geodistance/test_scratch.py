@@ -0,0 +1,224 @@
+import os
+import socket
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch
+
+from django.test import TestCase, override_settings
+
+from geodistance import engine
+from geodistance.benchmark import random_pairs
+from geodistance.cache import distance_result_cache
+from geodistance.clients import client_registry
+from geodistance.fake_opensearch import FakeOpenSearchServer
+from geodistance.index_management import ensure_index
+from geodistance.scratch import ScratchPool, is_stale_scratch_id, scratch_owner
+from geodistance.services import (
+    GeoDistanceService,
+    _summarize_distances,
+    delete_stale_scratch_documents,
+    flush_scratch_documents,
+    index_existence_cache,
+)
+
+
+class ScratchPoolTest(TestCase):
+    """一時ドキュメントIDのプールのテスト"""
+
+    def test_leases_are_exclusive_and_reused(self):
+        """貸し出し中のIDは重複せず、返却されたIDは再利用されること"""
+        pool = ScratchPool(size=2, cleanup_batch_size=10)
+
+        first, second = pool.acquire(), pool.acquire()
+        self.assertNotEqual(first.doc_id, second.doc_id)
+        self.assertEqual(first.routing, first.doc_id)
+        pool.release(first)
+
+        self.assertEqual(pool.acquire().doc_id, first.doc_id)
+
+    def test_overflow_is_deleted_in_batches(self):
+        """プールが空の場合は使い捨てのIDを貸し出し、返却されたものをまとめて削除対象にすること"""
+        pool = ScratchPool(size=0, cleanup_batch_size=3)
+        leases = [pool.acquire() for _ in range(4)]
+
+        released = [pool.release(lease) for lease in leases]
+
+        self.assertTrue(all(lease.overflow for lease in leases))
+        self.assertEqual(released[:2], [[], []])
+        self.assertEqual(released[2], [lease.doc_id for lease in leases[:3]])
+        self.assertEqual(pool.drain(), [leases[3].doc_id])
+        self.assertEqual(pool.stats()['overflows'], 4)
+
+    def test_acquire_prefers_written_location(self):
+        """同じA地点を書き込み済みのIDが空いていれば、それを優先して貸し出すこと"""
+        pool = ScratchPool(size=3)
+        first, second = pool.acquire(), pool.acquire()
+        second.location = (35.0, 139.0)
+        pool.release(first)
+        pool.release(second)
+
+        self.assertEqual(pool.acquire((35.0, 139.0)).doc_id, second.doc_id)
+        self.assertNotEqual(pool.acquire((36.0, 140.0)).doc_id, first.doc_id)
+
+    def test_drain_at_exit_includes_pooled_ids(self):
+        """終了時は削除待ちの使い捨てのIDに加えて、貸し出したことのあるプールのIDも取り出すこと"""
+        pool = ScratchPool(size=1, cleanup_batch_size=10)
+        pooled, overflow = pool.acquire(), pool.acquire()
+        pool.release(pooled)
+        pool.release(overflow)
+
+        self.assertEqual(pool.drain(include_pooled=True), [overflow.doc_id, pooled.doc_id])
+        self.assertEqual(pool.drain(include_pooled=True), [])
+        self.assertEqual(scratch_owner(overflow.doc_id), (socket.gethostname(), os.getpid()))
+
+    def test_stale_ids(self):
+        """このホストで終了したワーカーのIDだけを終了済みと判定すること"""
+        host = socket.gethostname()
+
+        with patch('geodistance.scratch._pid_alive', return_value=False):
+            self.assertTrue(is_stale_scratch_id(f'scratch-{host}-1-0'))
+            self.assertTrue(is_stale_scratch_id(f'scratch-{host}-1-overflow-0a1b'))
+            self.assertFalse(is_stale_scratch_id(f'scratch-{host}-{os.getpid()}-0'))
+            self.assertFalse(is_stale_scratch_id('scratch-otherhost-1-0'))
+            self.assertFalse(is_stale_scratch_id('a'))
+        self.assertFalse(is_stale_scratch_id(f'scratch-{host}-{os.getppid()}-0'))
+
+    def test_ids_are_per_worker(self):
+        """fork後の子プロセスでは親と異なるIDでプールを作り直すこと"""
+        pool = ScratchPool(size=1)
+        parent = pool.acquire()
+
+        with patch('geodistance.scratch.os.getpid', return_value=-1):
+            child = pool.acquire()
+
+        self.assertFalse(child.overflow)
+        self.assertNotEqual(parent.doc_id, child.doc_id)
+
+
+class ConcurrentIndexedModeTest(TestCase):
+    """indexedモードを並行に実行しても結果が混ざらないことのテスト"""
+
+    def setUp(self):
+        self.server = FakeOpenSearchServer().start()
+        self.overrides = override_settings(
+            OPENSEARCH_HOST=self.server.host,
+            OPENSEARCH_PORT=self.server.port,
+            OPENSEARCH_USE_SSL=False,
+            GEO_DISTANCE_CALCULATION_MODE='indexed',
+        )
+        self.overrides.enable()
+        client_registry.close()
+        distance_result_cache.clear()
+        index_existence_cache.invalidate()
+        self.pool = ScratchPool(size=4, cleanup_batch_size=5)
+
+    def tearDown(self):
+        client_registry.close()
+        distance_result_cache.clear()
+        index_existence_cache.invalidate()
+        self.overrides.disable()
+        self.server.stop()
+
+    def test_concurrent_requests_get_their_own_results(self):
+        """同時に実行したリクエストがそれぞれ自分のA地点の距離を返し、一時ドキュメントが増え続けないこと"""
+        pairs = random_pairs(60, seed=3)
+
+        def calculate(pair):
+            return GeoDistanceService().calculate_distances(*pair)
+
+        with patch('geodistance.services.scratch_pool', self.pool):
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                results = list(executor.map(calculate, pairs))
+
+        for pair, result in zip(pairs, results):
+            distances = engine.compare_distances(*pair)
+            expected = _summarize_distances(float(distances['arc']), float(distances['plane']))
+            self.assertEqual(result['arc_distance_km'], expected['arc_distance_km'])
+            self.assertEqual(result['plane_distance_km'], expected['plane_distance_km'])
+        documents = self.server.documents('geo_distance_test')
+        self.assertLessEqual(len(documents), 4 + self.pool.cleanup_batch_size)
+
+    def test_same_a_point_skips_write(self):
+        """同じA地点への2回目以降のリクエストは書き込みを省き、検索の1往復で計算すること"""
+        pairs = [(35.0, 139.0, 36.0 + i / 10, 140.0) for i in range(3)]
+
+        with patch('geodistance.services.scratch_pool', self.pool):
+            results = [GeoDistanceService().calculate_distances(*pair) for pair in pairs[:1]]
+            self.server.reset_calls()
+            results += [GeoDistanceService().calculate_distances(*pair) for pair in pairs[1:]]
+
+        calls = self.server.calls()
+        self.assertEqual(calls.get('index', 0), 0)
+        self.assertEqual(calls['search'], 2)
+        for pair, result in zip(pairs, results):
+            distances = engine.compare_distances(*pair)
+            expected = _summarize_distances(float(distances['arc']), float(distances['plane']))
+            self.assertEqual(result['arc_distance_km'], expected['arc_distance_km'])
+
+    def test_deleted_scratch_document_is_rewritten(self):
+        """書き込み済みの一時ドキュメントが削除されていた場合は書き込み直して計算すること"""
+        with patch('geodistance.services.scratch_pool', self.pool):
+            GeoDistanceService().calculate_distances(35.0, 139.0, 36.0, 140.0)
+            client_registry.get_client().delete_by_query(
+                index='geo_distance_test', body={'query': {'match_all': {}}}, refresh=True
+            )
+            result = GeoDistanceService().calculate_distances(35.0, 139.0, 37.0, 140.0)
+
+        distances = engine.compare_distances(35.0, 139.0, 37.0, 140.0)
+        expected = _summarize_distances(float(distances['arc']), float(distances['plane']))
+        self.assertEqual(result['arc_distance_km'], expected['arc_distance_km'])
+
+
+class ScratchCleanupTest(TestCase):
+    """残った一時ドキュメントの削除のテスト（ローカルのOpenSearch互換サーバーを使う）"""
+
+    def setUp(self):
+        self.server = FakeOpenSearchServer().start()
+        self.overrides = override_settings(
+            OPENSEARCH_HOST=self.server.host,
+            OPENSEARCH_PORT=self.server.port,
+            OPENSEARCH_USE_SSL=False,
+            GEO_DISTANCE_CALCULATION_MODE='indexed',
+        )
+        self.overrides.enable()
+        client_registry.close()
+        distance_result_cache.clear()
+        index_existence_cache.invalidate()
+        self.client = client_registry.get_client()
+        ensure_index(self.client)
+        host = socket.gethostname()
+        self.dead = f'scratch-{host}-1-0'
+        self.live = f'scratch-{host}-{os.getpid()}-5'
+        self.other = 'scratch-otherhost-1-0'
+        for doc_id in ('a', self.dead, self.live, self.other):
+            self.client.index(
+                index='geo_distance_test', id=doc_id, body={'location': {'lat': 35.0, 'lon': 139.0}}, refresh=True
+            )
+
+    def tearDown(self):
+        client_registry.close()
+        distance_result_cache.clear()
+        index_existence_cache.invalidate()
+        self.overrides.disable()
+        self.server.stop()
+
+    def test_deletes_documents_of_dead_workers(self):
+        """このホストで終了したワーカーの一時ドキュメントだけを削除し、all_workersではすべて削除すること"""
+        with patch('geodistance.scratch._pid_alive', return_value=False):
+            self.assertEqual(delete_stale_scratch_documents(self.client), 1)
+        self.assertCountEqual(self.server.documents('geo_distance_test'), ['a', self.live, self.other])
+
+        self.assertEqual(delete_stale_scratch_documents(self.client, all_workers=True), 2)
+        self.assertEqual(list(self.server.documents('geo_distance_test')), ['a'])
+
+    def test_flush_deletes_worker_documents(self):
+        """終了時にこのワーカーが書き込んだ一時ドキュメントを削除すること"""
+        pool = ScratchPool(size=1, cleanup_batch_size=10)
+
+        with patch('geodistance.services.scratch_pool', pool):
+            GeoDistanceService().calculate_distances(35.0, 139.0, 36.0, 140.0)
+            self.assertEqual(len(self.server.documents('geo_distance_test')), 5)
+            self.assertEqual(flush_scratch_documents(), 1)
+
+        self.assertCountEqual(
+            self.server.documents('geo_distance_test'), ['a', self.dead, self.live, self.other]
+        )
@@ -0,0 +1,165 @@
+import time
+from unittest.mock import patch
+
+import numpy as np
+from django.test import TestCase, override_settings
+
+from geodistance import engine
+from geodistance.clients import client_registry, get_client
+from geodistance.fake_opensearch import FakeOpenSearchServer
+from geodistance.loader import load_reference_points
+from geodistance.services import GeoDistanceService
+from geodistance.spatial_index import ReferencePointIndex, reference_index_store
+
+
+def random_points(count, seed=0):
+    rng = np.random.default_rng(seed)
+    lat = np.degrees(np.arcsin(rng.uniform(-1, 1, count)))
+    lon = rng.uniform(-180, 180, count)
+    return [
+        {'id': f'p{i:05d}', 'name': f'地点{i}', 'lat': float(lat[i]), 'lon': float(lon[i])}
+        for i in range(count)
+    ]
+
+
+class ReferencePointIndexTest(TestCase):
+    """プロセス内の空間インデックスのテスト"""
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.points = random_points(5000)
+        cls.index = ReferencePointIndex.from_points(cls.points, leaf_size=16)
+        lat = np.array([point['lat'] for point in cls.points])
+        lon = np.array([point['lon'] for point in cls.points])
+        cls.brute_force = lambda self, q_lat, q_lon: engine.compare_distances(lat, lon, q_lat, q_lon)['arc']
+
+    def test_within_radius_matches_brute_force(self):
+        """半径検索の結果が全件のarc距離を計算した結果と一致すること"""
+        for q_lat, q_lon, radius_km in [(35.68, 139.77, 800), (89.9, 0.0, 1500), (0.0, 179.9, 600)]:
+            with self.subTest(lat=q_lat, lon=q_lon):
+                arc = self.brute_force(q_lat, q_lon)
+                expected = sorted(f'p{i:05d}' for i in np.flatnonzero(arc <= radius_km))
+
+                points = self.index.within_radius(q_lat, q_lon, radius_km)
+
+                self.assertEqual(sorted(point['id'] for point in points), expected)
+                self.assertEqual(
+                    [point['arc_distance_km'] for point in points],
+                    sorted(point['arc_distance_km'] for point in points),
+                )
+
+    def test_nearest_matches_brute_force(self):
+        """近傍検索の結果がarc距離の近い順のK件と一致し、plane距離も返すこと"""
+        arc = self.brute_force(-33.87, 151.21)
+
+        points = self.index.nearest(-33.87, 151.21, k=10)
+
+        self.assertEqual([point['id'] for point in points], [f'p{i:05d}' for i in np.argsort(arc)[:10]])
+        self.assertEqual(points[0]['arc_distance_km'], float(np.sort(arc)[0]))
+        self.assertIn('plane_distance_km', points[0])
+        self.assertEqual(points[0]['name'], f'地点{int(points[0]["id"][1:])}')
+
+    def test_nearest_pagination(self):
+        """search_afterで全件を重複なく近い順にたどれること"""
+        seen = []
+        search_after = None
+        while True:
+            points = self.index.nearest(10.0, 20.0, k=7, radius_km=1000, search_after=search_after)
+            seen.extend(points)
+            if len(points) < 7:
+                break
+            search_after = [points[-1]['arc_distance_km'], points[-1]['id']]
+
+        expected = self.index.within_radius(10.0, 20.0, 1000)
+        self.assertEqual([point['id'] for point in seen], [point['id'] for point in expected])
+
+    def test_memory_per_point(self):
+        """1地点あたりのメモリ使用量がモジュールの説明の範囲に収まること"""
+        index = ReferencePointIndex.from_points(self.points)
+        string_bytes = index.ids.data.nbytes + index.names.data.nbytes
+
+        per_point = (index.nbytes - string_bytes) / len(index)
+
+        # 緯度経度16 + xyz 12 + オフセット16 + KD木のノード
+        self.assertLess(per_point, 47)
+
+    def test_empty_index(self):
+        """地点がない場合は空の結果を返すこと"""
+        index = ReferencePointIndex.from_points([])
+
+        self.assertEqual(index.nearest(0.0, 0.0, k=3), [])
+        self.assertEqual(index.within_radius(0.0, 0.0, 100), [])
+
+
+class LocalReferenceBackendTest(TestCase):
+    """GEO_REFERENCE_BACKEND="local"の近傍検索のテスト"""
+
+    def setUp(self):
+        self.server = FakeOpenSearchServer().start()
+        self.overrides = override_settings(
+            OPENSEARCH_HOST=self.server.host,
+            OPENSEARCH_PORT=self.server.port,
+            OPENSEARCH_USE_SSL=False,
+            GEO_REFERENCE_INDEX='stations',
+        )
+        self.overrides.enable()
+        client_registry.close()
+        reference_index_store.set(None)
+        load_reference_points(get_client(), 'stations', random_points(300, seed=1))
+
+    def tearDown(self):
+        reference_index_store.set(None)
+        client_registry.close()
+        self.overrides.disable()
+        self.server.stop()
+
+    def test_local_backend_matches_opensearch(self):
+        """OpenSearchから構築した空間インデックスがOpenSearchの検索と同じ結果を返すこと"""
+        expected = GeoDistanceService().find_nearest_reference_points(35.0, 135.0, k=5, radius_km=5000)
+
+        with self.settings(GEO_REFERENCE_BACKEND='local'):
+            service = GeoDistanceService()
+            first = service.find_nearest_reference_points(35.0, 135.0, k=5, radius_km=5000)
+            self.server.reset_calls()
+            second = service.find_nearest_reference_points(
+                35.0, 135.0, k=5, radius_km=5000, search_after=first['next_search_after']
+            )
+
+        self.assertTrue(first['success'])
+        self.assertEqual(first['points'], expected['points'])
+        self.assertEqual(self.server.total_calls(), 0)
+        self.assertTrue(set(point['id'] for point in second['points']).isdisjoint(
+            point['id'] for point in first['points']
+        ))
+
+    def test_rebuilds_after_load_and_ttl(self):
+        """参照地点を登録した後と、TTLを過ぎた後は空間インデックスを構築し直すこと"""
+        client = get_client()
+        first = reference_index_store.get(client, 'stations')
+        self.assertEqual(len(first), 300)
+
+        added = [dict(point, id=f'added-{point["id"]}') for point in random_points(10, seed=2)]
+        load_reference_points(client, 'stations', added)
+        self.assertEqual(len(reference_index_store.get(client, 'stations')), 310)
+
+        # 別のプロセスで登録された地点はTTLを過ぎてから反映する
+        point = {'point_id': 'added', 'location': {'lat': 1.0, 'lon': 2.0}}
+        client.index(index='stations', id='added', body=point, refresh=True)
+        with self.settings(GEO_REFERENCE_LOCAL_INDEX_TTL=60):
+            reference_index_store.set(reference_index_store.get(client, 'stations'))
+            self.assertEqual(len(reference_index_store.get(client, 'stations')), 310)
+            with patch('geodistance.spatial_index.time.monotonic', return_value=time.monotonic() + 61):
+                self.assertEqual(len(reference_index_store.get(client, 'stations')), 311)
+
+    def test_rebuilds_to_empty_index(self):
+        """参照地点がすべて削除された場合は、TTL後に空の空間インデックスへ構築し直すこと"""
+        client = get_client()
+        with self.settings(GEO_REFERENCE_LOCAL_INDEX_TTL=60):
+            self.assertEqual(len(reference_index_store.get(client, 'stations')), 300)
+            client.bulk(
+                body=[{'delete': {'_index': 'stations', '_id': point['id']}} for point in random_points(300, seed=1)],
+                refresh=True,
+            )
+            with patch('geodistance.spatial_index.time.monotonic', return_value=time.monotonic() + 61):
+                self.assertEqual(len(reference_index_store.get(client, 'stations')), 0)
@@ -5,4 +5,15 @@ app_name = 'geodistance'
 
 urlpatterns = [
     path('', views.geo_distance_view, name='geo_distance'),
+    path('async/', views.geo_distance_async_view, name='geo_distance_async'),
+    path('batch/', views.geo_distance_batch_view, name='geo_distance_batch'),
+    path('export/', views.geo_distance_export_view, name='geo_distance_export'),
+    path('jobs/', views.distance_job_create_view, name='distance_job_create'),
+    path('jobs/<uuid:job_id>/', views.distance_job_view, name='distance_job'),
+    path('jobs/<uuid:job_id>/results/', views.distance_job_results_view, name='distance_job_results'),
+    path('matrix/', views.geo_distance_matrix_view, name='geo_distance_matrix'),
+    path('nearest/', views.nearest_reference_points_view, name='nearest_reference_points'),
+    path('distribution/', views.distance_distribution_view, name='distance_distribution'),
+    path('history/errors/', views.distance_error_report_view, name='distance_error_report'),
+    path('metrics/', views.metrics_view, name='metrics'),
 ]
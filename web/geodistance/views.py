@@ -1,23 +1,53 @@
+import csv
+import hmac
+import io
+import json
+import logging
+from datetime import date
+from functools import wraps
+from itertools import islice
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import Http404, HttpResponse, JsonResponse, StreamingHttpResponse
 from django.shortcuts import render
+from django.urls import reverse
 from django.contrib import messages
+from django.views.decorators.csrf import csrf_exempt, csrf_protect
+from django.views.decorators.http import require_GET, require_POST
 from .forms import GeoDistanceForm
-from .services import GeoDistanceService
+from .history import error_report
+from .instrumentation import PrometheusSink, instrumentation
+from .jobs import submit_job
+from .models import DistanceJob, DistanceJobChunk
+from .readers import detect_format, iter_coordinate_pairs, parse_points
+from .async_services import AsyncGeoDistanceService
+from .services import BATCH_COLUMNS, GeoDistanceService
+
 
+logger = logging.getLogger(__name__)
 
+
+@instrumentation.timed('view.geo_distance')
 def geo_distance_view(request):
     """
     緯度経度入力フォームを表示し、OpenSearchでgeo distance計算を実行するビュー
     """
     if request.method == 'POST':
         form = GeoDistanceForm(request.POST)
-        if form.is_valid():
+        with instrumentation.span('view.form_validation'):
+            is_valid = form.is_valid()
+        if is_valid:
             a_lat = form.cleaned_data['a_latitude']
             a_lon = form.cleaned_data['a_longitude']
             b_lat = form.cleaned_data['b_latitude']
             b_lon = form.cleaned_data['b_longitude']
             
             service = GeoDistanceService()
-            distances = service.calculate_distances(a_lat, a_lon, b_lat, b_lon)
+            distances = service.calculate_distances(
+                a_lat, a_lon, b_lat, b_lon, exact=not form.cleaned_data['approximate']
+            )
             
             if distances['success']:
                 context = {
@@ -26,7 +56,8 @@ def geo_distance_view(request):
                     'a_point': {'lat': a_lat, 'lon': a_lon},
                     'b_point': {'lat': b_lat, 'lon': b_lon}
                 }
-                return render(request, 'geodistance/result.html', context)
+                with instrumentation.span('view.render', template='result'):
+                    return render(request, 'geodistance/result.html', context)
             else:
                 messages.error(request, f'距離計算でエラーが発生しました: {distances["error_message"]}')
         else:
@@ -34,4 +65,408 @@ def geo_distance_view(request):
     else:
         form = GeoDistanceForm()
     
+    with instrumentation.span('view.render', template='form'):
+        return render(request, 'geodistance/form.html', {'form': form})
+
+
+async def geo_distance_async_view(request):
+    """
+    geo_distance_viewの非同期版。AsyncOpenSearchでarc/planeを同時に計算し、
+    OpenSearchの応答を待つ間もワーカーのスレッドを占有しない（ASGIでの利用を想定）
+
+    WSGI（runserverなど）ではリクエストごとに新しいイベントループで実行されるため、ループごとの
+    AsyncOpenSearchクライアントを使い回せず、リクエストのたびに生成されて閉じられないまま残る。
+    そのためASGI以外では、共有のコネクションプールを使う同期サービスで計算する
+    """
+    if request.method == 'POST':
+        form = GeoDistanceForm(request.POST)
+        if form.is_valid():
+            a_lat = form.cleaned_data['a_latitude']
+            a_lon = form.cleaned_data['a_longitude']
+            b_lat = form.cleaned_data['b_latitude']
+            b_lon = form.cleaned_data['b_longitude']
+
+            exact = not form.cleaned_data['approximate']
+            if isinstance(request, ASGIRequest):
+                service = AsyncGeoDistanceService()
+                distances = await service.calculate_distances(a_lat, a_lon, b_lat, b_lon, exact=exact)
+            else:
+                service = GeoDistanceService()
+                distances = await sync_to_async(service.calculate_distances)(
+                    a_lat, a_lon, b_lat, b_lon, exact=exact
+                )
+
+            if distances['success']:
+                context = {
+                    'form': form,
+                    'distances': distances,
+                    'a_point': {'lat': a_lat, 'lon': a_lon},
+                    'b_point': {'lat': b_lat, 'lon': b_lon}
+                }
+                return render(request, 'geodistance/result.html', context)
+            else:
+                messages.error(request, f'距離計算でエラーが発生しました: {distances["error_message"]}')
+        else:
+            messages.error(request, 'フォームの入力内容に問題があります。正しい値を入力してください。')
+    else:
+        form = GeoDistanceForm()
+
     return render(request, 'geodistance/form.html', {'form': form})
+
+
+def api_endpoint(view):
+    """
+    地点の組を受け取って計算・登録するPOSTのAPIを保護するデコレーター
+
+    GEO_DISTANCE_API_TOKENSを設定した場合は "Authorization: Bearer <トークン>" を要求し、
+    トークンで認証したリクエストにはCSRFトークンを求めない。設定していない場合は
+    フォームのビューと同じくCSRFトークンを要求する（外部からはAPIとして呼び出せない）
+    """
+    protected = csrf_protect(view)
+
+    @wraps(view)
+    def wrapped(request, *args, **kwargs):
+        tokens = settings.GEO_DISTANCE_API_TOKENS
+        if not tokens:
+            return protected(request, *args, **kwargs)
+
+        scheme, _, token = request.headers.get('Authorization', '').partition(' ')
+        if scheme.lower() != 'bearer' or not any(
+            hmac.compare_digest(token.encode(), expected.encode()) for expected in tokens
+        ):
+            response = JsonResponse({'error': 'APIトークンが正しくありません'}, status=401)
+            response['WWW-Authenticate'] = 'Bearer'
+            return response
+        return view(request, *args, **kwargs)
+
+    return csrf_exempt(wrapped)
+
+
+class _RequestBodyStream(io.RawIOBase):
+    """request.bodyに読み込まずに、リクエストボディを少しずつ読み出すストリーム"""
+
+    def __init__(self, request):
+        self._request = request
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        data = self._request.read(len(buffer))
+        buffer[:len(data)] = data
+        return len(data)
+
+
+def _open_upload(request, stream_body=False):
+    """
+    アップロードされたファイル（multipartのfile）またはリクエストボディを、
+    入力ストリームと入力形式の組として返す
+    stream_bodyがTrueの場合はリクエストボディをメモリに読み込まず、ストリームとして読み出す
+    """
+    upload = request.FILES.get('file')
+    if upload is not None:
+        stream, filename, content_type = upload.file, upload.name, upload.content_type
+    elif stream_body:
+        stream, filename, content_type = io.BufferedReader(_RequestBodyStream(request)), None, request.content_type
+    else:
+        stream, filename, content_type = io.BytesIO(request.body), None, request.content_type
+
+    fmt = request.GET.get('format') or detect_format(filename, content_type)
+    return stream, fmt
+
+
+def _chunk_size(request):
+    """
+    chunk_sizeパラメータを読み取る（省略時はNone）
+
+    Raises:
+        ValueError: 整数でない場合、または1からGEO_DISTANCE_BATCH_MAX_CHUNK_SIZEまでの範囲外の場合
+    """
+    if 'chunk_size' not in request.GET:
+        return None
+    chunk_size = int(request.GET['chunk_size'])
+    max_chunk_size = settings.GEO_DISTANCE_BATCH_MAX_CHUNK_SIZE
+    if not 1 <= chunk_size <= max_chunk_size:
+        raise ValueError(f'chunk_sizeは1から{max_chunk_size}までの値にしてください')
+    return chunk_size
+
+
+@api_endpoint
+@require_POST
+def geo_distance_batch_view(request):
+    """
+    CSVまたはJSONでアップロードされた地点の組をまとめて計算し、列指向のJSONで返すビュー
+    """
+    max_pairs = settings.GEO_DISTANCE_BATCH_MAX_PAIRS
+    try:
+        stream, fmt = _open_upload(request)
+        pairs = list(islice(iter_coordinate_pairs(stream, fmt), max_pairs + 1))
+        chunk_size = _chunk_size(request)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    if len(pairs) > max_pairs:
+        return JsonResponse(
+            {'error': f'一度に計算できる地点の組は{max_pairs}件までです'}, status=400
+        )
+
+    service = GeoDistanceService()
+    columns = service.calculate_distances_batch(pairs, chunk_size=chunk_size)
+
+    return JsonResponse({'count': len(pairs), 'columns': columns})
+
+
+# エクスポートの出力形式と、1行に出力する入力の列
+EXPORT_CONTENT_TYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'ndjson': 'application/x-ndjson',
+}
+EXPORT_INPUT_COLUMNS = ('a_latitude', 'a_longitude', 'b_latitude', 'b_longitude')
+
+
+def _export_csv(chunks):
+    """チャンクごとの結果をCSVのテキストに変換する（ヘッダー行を含む）"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_INPUT_COLUMNS + BATCH_COLUMNS)
+    for pairs, rows in chunks:
+        for pair, row in zip(pairs, rows):
+            writer.writerow(list(pair) + ['' if row[column] is None else row[column] for column in BATCH_COLUMNS])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+
+def _export_ndjson(chunks):
+    """チャンクごとの結果をNDJSONのテキストに変換する"""
+    for pairs, rows in chunks:
+        yield ''.join(
+            json.dumps({**dict(zip(EXPORT_INPUT_COLUMNS, pair)), **row}, ensure_ascii=False) + '\n'
+            for pair, row in zip(pairs, rows)
+        )
+
+
+@api_endpoint
+@require_POST
+def geo_distance_export_view(request):
+    """
+    アップロードされた地点の組を少しずつ読み込んでチャンクごとに計算し、
+    arc/plane距離と差分をCSVまたはNDJSON（outputパラメータ）でストリーミングで返すビュー
+
+    チャンクの計算は出力を書き出せた分だけ進めるため、件数によらずメモリ使用量は一定に保たれる。
+    CSVとNDJSONの入力は1行ずつ読み込む（JSON配列の入力は全体を読み込む）
+    """
+    output = request.GET.get('output', 'csv')
+    if output not in EXPORT_CONTENT_TYPES:
+        return JsonResponse({'error': f'未対応の出力形式です: {output}'}, status=400)
+    try:
+        stream, fmt = _open_upload(request, stream_body=True)
+        pairs = iter_coordinate_pairs(stream, fmt)
+        chunk_size = _chunk_size(request)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    service = GeoDistanceService()
+    encode = _export_csv if output == 'csv' else _export_ndjson
+
+    def lines():
+        try:
+            yield from encode(service.iter_batch_chunks(pairs, chunk_size=chunk_size))
+        except Exception as e:
+            # ストリーミング開始後はステータスを変更できないため、エラー行として返す
+            logger.error(f"距離のエクスポート中にエラーが発生しました: {e}")
+            if output == 'csv':
+                buffer = io.StringIO()
+                csv.writer(buffer).writerow(
+                    [''] * (len(EXPORT_INPUT_COLUMNS) + len(BATCH_COLUMNS) - 1) + [f'計算エラー: {str(e)}']
+                )
+                yield buffer.getvalue()
+            else:
+                yield json.dumps({'error': f'計算エラー: {str(e)}'}, ensure_ascii=False) + '\n'
+
+    response = StreamingHttpResponse(lines(), content_type=EXPORT_CONTENT_TYPES[output])
+    response['Content-Disposition'] = f'attachment; filename="geo_distance.{output}"'
+    return response
+
+
+@api_endpoint
+@require_POST
+def distance_job_create_view(request):
+    """
+    アップロードされた地点の組をバックグラウンドジョブとして登録し、ジョブのIDと進捗APIのURLを返すビュー
+    計算はrun_distance_workersのワーカーが行う
+    """
+    try:
+        stream, fmt = _open_upload(request, stream_body=True)
+        chunk_size = _chunk_size(request)
+        job = submit_job(iter_coordinate_pairs(stream, fmt), chunk_size=chunk_size)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    result = job.to_dict()
+    result['status_url'] = reverse('geodistance:distance_job', args=[job.id])
+    result['results_url'] = reverse('geodistance:distance_job_results', args=[job.id])
+    return JsonResponse(result, status=202)
+
+
+@require_GET
+def distance_job_view(request, job_id):
+    """ジョブの状態と進捗をJSONで返すビュー"""
+    job = DistanceJob.objects.filter(pk=job_id).first()
+    if job is None:
+        return JsonResponse({'error': f'ジョブが見つかりません: {job_id}'}, status=404)
+    return JsonResponse(job.to_dict())
+
+
+@require_GET
+def distance_job_results_view(request, job_id):
+    """完了したジョブの結果を、チャンクの順にCSVまたはNDJSON（outputパラメータ）でストリーミングで返すビュー"""
+    output = request.GET.get('output', 'csv')
+    if output not in EXPORT_CONTENT_TYPES:
+        return JsonResponse({'error': f'未対応の出力形式です: {output}'}, status=400)
+    job = DistanceJob.objects.filter(pk=job_id).first()
+    if job is None:
+        return JsonResponse({'error': f'ジョブが見つかりません: {job_id}'}, status=404)
+    if job.status != DistanceJob.Status.SUCCEEDED:
+        return JsonResponse(job.to_dict(), status=409)
+
+    chunks = (
+        DistanceJobChunk.objects.filter(job=job)
+        .order_by('number')
+        .values_list('pairs', 'rows')
+        .iterator(chunk_size=10)
+    )
+    encode = _export_csv if output == 'csv' else _export_ndjson
+    response = StreamingHttpResponse(encode(chunks), content_type=EXPORT_CONTENT_TYPES[output])
+    response['Content-Disposition'] = f'attachment; filename="geo_distance_{job.id}.{output}"'
+    return response
+
+
+@api_endpoint
+@require_POST
+def geo_distance_matrix_view(request):
+    """
+    出発地点（origins）と目的地点（destinations）のJSONを受け取り、
+    arc/plane距離行列を出発地点ごとに1行のNDJSONとしてストリーミングで返すビュー
+    """
+    try:
+        body = json.loads(request.body)
+        origins = parse_points(body.get('origins'), 'origins')
+        destinations = parse_points(body.get('destinations'), 'destinations')
+    except (AttributeError, ValueError) as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    max_cells = settings.GEO_DISTANCE_MATRIX_MAX_CELLS
+    if len(origins) * len(destinations) > max_cells:
+        return JsonResponse(
+            {'error': f'距離行列の要素数は{max_cells}件までです'}, status=400
+        )
+
+    service = GeoDistanceService()
+
+    def rows():
+        try:
+            for row in service.iter_distance_matrix(origins, destinations):
+                yield json.dumps(row) + '\n'
+        except Exception as e:
+            # ストリーミング開始後はステータスを変更できないため、エラー行として返す
+            logger.error(f"距離行列の計算中にエラーが発生しました: {e}")
+            yield json.dumps({'error': f'計算エラー: {str(e)}'}) + '\n'
+
+    return StreamingHttpResponse(rows(), content_type='application/x-ndjson')
+
+
+def nearest_reference_points_view(request):
+    """
+    基準地点（lat, lon）から近い順にK件の参照地点を、arc/plane距離とその差分付きでJSONで返すビュー
+    次のページはレスポンスのnext_search_afterをsearch_afterパラメータ（JSON）に渡して取得する
+    """
+    max_k = settings.GEO_DISTANCE_KNN_MAX_K
+    try:
+        lat = float(request.GET['lat'])
+        lon = float(request.GET['lon'])
+        k = int(request.GET.get('k', 10))
+        radius_km = float(request.GET['radius_km']) if request.GET.get('radius_km') else None
+        search_after = json.loads(request.GET['search_after']) if request.GET.get('search_after') else None
+    except (KeyError, ValueError) as e:
+        return JsonResponse({'error': f'パラメータが正しくありません: {e}'}, status=400)
+
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return JsonResponse({'error': f'座標が範囲外です: ({lat}, {lon})'}, status=400)
+    if not 1 <= k <= max_k:
+        return JsonResponse({'error': f'kは1から{max_k}までの値にしてください'}, status=400)
+    if search_after is not None and not isinstance(search_after, list):
+        return JsonResponse({'error': 'search_afterは配列にしてください'}, status=400)
+
+    service = GeoDistanceService()
+    result = service.find_nearest_reference_points(lat, lon, k, radius_km, search_after)
+    if not result['success']:
+        return JsonResponse({'error': result['error_message']}, status=502)
+
+    return JsonResponse({
+        'points': result['points'],
+        'next_search_after': result['next_search_after'],
+    })
+
+
+@require_GET
+def distance_distribution_view(request):
+    """
+    基準地点（lat, lon）から参照地点までの距離の分布を、arcとplaneのgeo_distance集計で比較してJSONで返すビュー
+    band_edges_km（カンマ区切りの昇順の境界）で距離帯を、geohash_precisionでセルごとの比較を指定する
+    """
+    try:
+        lat = float(request.GET['lat'])
+        lon = float(request.GET['lon'])
+        band_edges_km = (
+            [float(edge) for edge in request.GET['band_edges_km'].split(',')]
+            if request.GET.get('band_edges_km') else None
+        )
+        geohash_precision = int(request.GET['geohash_precision']) if request.GET.get('geohash_precision') else None
+    except (KeyError, ValueError) as e:
+        return JsonResponse({'error': f'パラメータが正しくありません: {e}'}, status=400)
+
+    if not (-90 <= lat <= 90 and -180 <= lon <= 180):
+        return JsonResponse({'error': f'座標が範囲外です: ({lat}, {lon})'}, status=400)
+    if band_edges_km is not None and (band_edges_km[0] < 0 or band_edges_km != sorted(set(band_edges_km))):
+        return JsonResponse({'error': 'band_edges_kmは0以上の昇順の値にしてください'}, status=400)
+    if geohash_precision is not None and not 1 <= geohash_precision <= 12:
+        return JsonResponse({'error': 'geohash_precisionは1から12までの値にしてください'}, status=400)
+
+    service = GeoDistanceService()
+    result = service.aggregate_distance_distribution(lat, lon, band_edges_km, geohash_precision)
+    if not result['success']:
+        return JsonResponse({'error': result['error_message']}, status=502)
+
+    return JsonResponse({
+        'total': result['total'],
+        'differing_bands': result['differing_bands'],
+        'bands': result['bands'],
+    })
+
+
+@require_GET
+def distance_error_report_view(request):
+    """
+    距離帯・緯度帯ごとのplaneのarcに対する誤差を、計算結果の履歴の集計テーブルからJSONで返すビュー
+    since/until（YYYY-MM-DD）で期間を絞り込む
+    """
+    try:
+        since = date.fromisoformat(request.GET['since']) if request.GET.get('since') else None
+        until = date.fromisoformat(request.GET['until']) if request.GET.get('until') else None
+    except ValueError as e:
+        return JsonResponse({'error': f'日付が正しくありません: {e}'}, status=400)
+
+    return JsonResponse({'bands': error_report(since, until)})
+
+
+def metrics_view(request):
+    """
+    計測結果をPrometheusのテキスト形式で返すビュー
+    GEO_DISTANCE_INSTRUMENTATION_SINKSにprometheusが含まれない場合は404を返す
+    """
+    sink = instrumentation.get_sink(PrometheusSink)
+    if sink is None:
+        raise Http404('Prometheusのシンクが設定されていません')
+
+    return HttpResponse(sink.render(), content_type='text/plain; version=0.0.4; charset=utf-8')